@@ -0,0 +1,15 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+A client for the Flocker REST API.
+"""
+
+from ._client import (
+    FlockerClient, authenticated_client, Dataset, DatasetState, Container,
+    ContainerState, Node, ResponseError, WaitTimeout,
+)
+
+__all__ = [
+    "FlockerClient", "authenticated_client", "Dataset", "DatasetState",
+    "Container", "ContainerState", "Node", "ResponseError", "WaitTimeout",
+]
@@ -0,0 +1,736 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.apiclient.test.test_client -*-
+
+"""
+A client for the Flocker REST API which keeps its connections open,
+batches concurrent changes to datasets and waits for the cluster state to
+change using conditional requests.
+"""
+
+from json import dumps, loads
+from uuid import UUID
+
+from zope.interface import implementer
+
+from pyrsistent import PRecord, field, pmap, pvector, freeze, PMap
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import deferLater
+from twisted.internet.ssl import Certificate
+from twisted.python.filepath import FilePath
+from twisted.web.client import Agent, HTTPConnectionPool
+from twisted.web.http import BAD_REQUEST, OK, CREATED, NOT_MODIFIED
+from twisted.web.iweb import IPolicyForHTTPS
+
+from treq import json_content, content
+from treq.client import HTTPClient
+
+from ..ca import ControlServicePolicy, UserCredential
+from ..control.httpapi import REST_API_PORT
+
+# The most connections to the control service kept open for later requests:
+MAXIMUM_PERSISTENT_CONNECTIONS = 10
+
+# The most dataset changes sent in one request, as limited by the API:
+MAXIMUM_BATCH = 1000
+
+# The longest the control service lets a request wait for a change, in
+# seconds:
+MAXIMUM_WAIT = 60
+
+# How long to wait before asking again if a response can't be waited on:
+POLL_INTERVAL = 1
+
+# How long to wait for the cluster state to match by default, in seconds:
+DEFAULT_TIMEOUT = 300
+
+
+class ResponseError(Exception):
+    """
+    The control service responded with an unexpected response code.
+
+    :ivar int code: The response code.
+    :ivar body: The decoded JSON body of the response, usually a ``dict``
+        with a ``description``, or the ``bytes`` of a body which isn't
+        JSON.
+    """
+    def __init__(self, code, body):
+        Exception.__init__(self, code, body)
+        self.code = code
+        self.body = body
+
+
+class WaitTimeout(Exception):
+    """
+    The cluster did not reach the expected state in time.
+
+    :ivar last: The last value which didn't match.
+    """
+    def __init__(self, last):
+        Exception.__init__(self, last)
+        self.last = last
+
+
+_SIZE = (int, long, type(None))
+
+
+class Dataset(PRecord):
+    """
+    The configuration of a dataset.
+
+    :ivar UUID dataset_id: The dataset's identifier.
+    :ivar UUID primary: The node the dataset should be on.
+    :ivar maximum_size: The most bytes the dataset may hold, or ``None``
+        for no limit.
+    :ivar bool deleted: Whether the dataset is deleted.
+    :ivar PMap metadata: The dataset's metadata, ``unicode`` to ``unicode``.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    primary = field(type=UUID, mandatory=True)
+    maximum_size = field(type=_SIZE, mandatory=True, initial=None)
+    deleted = field(type=bool, mandatory=True, initial=False)
+    metadata = field(type=PMap, mandatory=True, initial=pmap(), factory=pmap)
+
+
+class DatasetState(PRecord):
+    """
+    The state of a dataset in the cluster.
+
+    :ivar UUID dataset_id: The dataset's identifier.
+    :ivar primary: The ``UUID`` of the node the dataset is on, or ``None``
+        if it isn't on any node.
+    :ivar maximum_size: The most bytes the dataset may hold, or ``None``
+        for no limit.
+    :ivar path: The ``FilePath`` the dataset is mounted at on its node, or
+        ``None``.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    primary = field(type=(UUID, type(None)), mandatory=True, initial=None)
+    maximum_size = field(type=_SIZE, mandatory=True, initial=None)
+    path = field(type=(FilePath, type(None)), mandatory=True, initial=None)
+
+
+class Container(PRecord):
+    """
+    The configuration of a container.
+
+    :ivar UUID node_uuid: The node the container should run on.
+    :ivar unicode name: The container's name.
+    :ivar unicode image: The container's Docker image.
+    :ivar PMap attributes: Any other items of the container's configuration
+        (e.g. ``ports``, ``volumes``), as in the API but immutable.
+    """
+    node_uuid = field(type=UUID, mandatory=True)
+    name = field(type=unicode, mandatory=True)
+    image = field(type=unicode, mandatory=True)
+    attributes = field(type=PMap, mandatory=True, initial=pmap(),
+                       factory=freeze)
+
+
+class ContainerState(PRecord):
+    """
+    The state of a container in the cluster.
+
+    :ivar bool running: Whether the container is running.
+
+    The other fields are those of ``Container``.
+    """
+    node_uuid = field(type=UUID, mandatory=True)
+    name = field(type=unicode, mandatory=True)
+    image = field(type=unicode, mandatory=True)
+    running = field(type=bool, mandatory=True)
+    attributes = field(type=PMap, mandatory=True, initial=pmap(),
+                       factory=freeze)
+
+
+class Node(PRecord):
+    """
+    A node in the cluster.
+
+    :ivar UUID uuid: The node's identifier.
+    :ivar unicode host: The node's IP address.
+    """
+    uuid = field(type=UUID, mandatory=True)
+    host = field(type=unicode, mandatory=True)
+
+
+def _dataset(item):
+    """
+    :param dict item: A dataset configuration from the API.
+    :return Dataset: The same configuration.
+    """
+    return Dataset(
+        dataset_id=UUID(item[u"dataset_id"]),
+        primary=UUID(item[u"primary"]),
+        maximum_size=item.get(u"maximum_size"),
+        deleted=item.get(u"deleted", False),
+        metadata=item.get(u"metadata", {}),
+    )
+
+
+def _dataset_state(item):
+    """
+    :param dict item: A dataset state from the API.
+    :return DatasetState: The same state.
+    """
+    primary = item.get(u"primary")
+    path = item.get(u"path")
+    return DatasetState(
+        dataset_id=UUID(item[u"dataset_id"]),
+        primary=None if primary is None else UUID(primary),
+        maximum_size=item.get(u"maximum_size"),
+        path=None if path is None else FilePath(path.encode("utf-8")),
+    )
+
+
+def _container(item, record=Container):
+    """
+    :param dict item: A container configuration or state from the API.
+    :param record: ``Container`` or ``ContainerState``.
+    :return: A ``record`` of the same configuration or state.
+    """
+    attributes = dict(item)
+    fields = {
+        name: attributes.pop(name)
+        for name in record._precord_fields if name in attributes
+    }
+    fields[u"node_uuid"] = UUID(fields[u"node_uuid"])
+    return record(attributes=attributes, **fields)
+
+
+def _container_state(item):
+    return _container(item, ContainerState)
+
+
+def _node(item):
+    return Node(uuid=UUID(item[u"uuid"]), host=item[u"host"])
+
+
+def _error(response):
+    """
+    :param response: A response with an unexpected response code.
+
+    :return: A ``Deferred`` failing with ``ResponseError`` once the body is
+        read.  Its ``body`` is the decoded JSON body, or the raw ``bytes``
+        of a body which isn't JSON, e.g. from a proxy.
+    """
+    reading = content(response)
+
+    def read(body):
+        try:
+            body = loads(body)
+        except ValueError:
+            pass
+        raise ResponseError(response.code, body)
+    reading.addCallback(read)
+    return reading
+
+
+def _each(convert):
+    """
+    :param convert: A function converting an item of a list from the API.
+    :return: A function converting the whole list to a ``PVector``.
+    """
+    return lambda items: pvector(convert(item) for item in items)
+
+
+@implementer(IPolicyForHTTPS)
+class _ReusedTLSPolicy(object):
+    """
+    Set up TLS for each host once, rather than for every connection, so that
+    the credentials are loaded and the OpenSSL context created just once.
+    """
+    def __init__(self, policy):
+        """
+        :param policy: The ``IPolicyForHTTPS`` provider to set TLS up with.
+        """
+        self._policy = policy
+        self._creators = {}
+
+    def creatorForNetloc(self, hostname, port):
+        creator = self._creators.get((hostname, port))
+        if creator is None:
+            creator = self._policy.creatorForNetloc(hostname, port)
+            self._creators[(hostname, port)] = creator
+        return creator
+
+
+class FlockerClient(object):
+    """
+    A client for version 1 of the Flocker REST API.
+
+    Connections to the control service are kept open and reused.  Changes
+    to datasets made while a change is being sent are sent together in one
+    request, and so are changes made in the same reactor iteration.
+    Identical requests made while one is in progress share its response.
+    Responses are remembered along with their entity tags, so requesting
+    the same thing again only transfers and decodes it if it changed.
+
+    :ivar dict _responses: Map the URL of each listing to its last entity tag
+        and converted response.
+    :ivar dict _getting: Map ``(url, wait)`` of each request in progress to
+        the ``Deferred`` of each caller waiting for its result.
+    :ivar list _changes: ``(operation, Deferred)`` for each dataset change
+        not sent yet.
+    :ivar bool _sending: Whether a batch of dataset changes is being sent.
+    :ivar int _isolated: The number of pending dataset changes to send one
+        per request, because a batch including them was rejected as a whole.
+    :ivar _send_call: The ``IDelayedCall`` which will send the pending
+        dataset changes, or ``None``.
+    """
+    def __init__(self, reactor, base_url, treq_client):
+        """
+        :param reactor: An ``IReactorTime`` provider.
+        :param bytes base_url: The URL of the API, e.g.
+            ``b"https://192.0.2.1:4523/v1"``.
+        :param treq_client: The ``treq``-API object to make requests with.
+        """
+        self._reactor = reactor
+        self._base_url = base_url
+        self._treq = treq_client
+        self._responses = {}
+        self._getting = {}
+        self._changes = []
+        self._sending = False
+        self._isolated = 0
+        self._send_call = None
+
+    def _url(self, path, query=()):
+        """
+        :param bytes path: The path of an endpoint, e.g.
+            ``b"/state/datasets"``.
+        :param query: A sequence of ``(name, value)`` ``bytes`` query
+            arguments.
+
+        :return bytes: The endpoint's URL.
+        """
+        url = self._base_url + path
+        if query:
+            url += b"?" + b"&".join(
+                name + b"=" + value for (name, value) in query)
+        return url
+
+    def _request(self, method, path, body, success):
+        """
+        Make a request with a JSON body.
+
+        :param bytes method: The HTTP method.
+        :param bytes path: The path of the endpoint.
+        :param body: The JSON-encodable body, or ``None`` for none.
+        :param int success: The expected response code.
+
+        :return: A ``Deferred`` firing with the decoded JSON response, or
+            failing with ``ResponseError`` if the response code is not
+            ``success``.
+        """
+        headers = {}
+        data = None
+        if body is not None:
+            headers[b"content-type"] = b"application/json"
+            data = dumps(body)
+        requesting = self._treq.request(
+            method, self._url(path), headers=headers, data=data)
+
+        def got_response(response):
+            if response.code != success:
+                return _error(response)
+            return json_content(response)
+        requesting.addCallback(got_response)
+        return requesting
+
+    def _get(self, path, convert, query=(), wait=None):
+        """
+        Get a listing, sharing the response with identical requests in
+        progress and reusing the last response if it didn't change.
+
+        :param bytes path: The path of the endpoint.
+        :param convert: A function converting the decoded JSON response.
+        :param query: See ``_url``.
+        :param wait: ``None``, or the number of seconds for the control
+            service to wait for the response to change before answering.
+            Only used if a response was remembered.
+
+        :return: A ``Deferred`` firing with the converted response.
+        """
+        url = self._url(path, query)
+        result = Deferred()
+        key = (url, wait)
+        waiting = self._getting.get(key)
+        if waiting is not None:
+            waiting.append(result)
+            return result
+        waiting = self._getting[key] = [result]
+
+        getting = self._conditional_get(url, convert, wait)
+
+        def got(value):
+            del self._getting[key]
+            for d in waiting:
+                d.callback(value)
+        getting.addBoth(got)
+        return result
+
+    def _conditional_get(self, url, convert, wait):
+        """
+        See ``_get``.
+        """
+        headers = {b"accept": b"application/json"}
+        etag, value = self._responses.get(url, (None, None))
+        request_url = url
+        if etag is not None:
+            headers[b"if-none-match"] = etag
+            if wait is not None:
+                request_url += (
+                    (b"&" if b"?" in url else b"?") + b"wait=%d" % (wait,))
+        requesting = self._treq.get(request_url, headers=headers)
+
+        def got_response(response):
+            if response.code == NOT_MODIFIED:
+                # Read the (empty) body so the connection can be reused:
+                reading = content(response)
+                reading.addCallback(lambda _: value)
+                return reading
+            if response.code != OK:
+                return _error(response)
+
+            def decoded(body):
+                result = convert(body)
+                tag = response.headers.getRawHeaders(b"etag", [None])[0]
+                if tag is not None:
+                    self._responses[url] = (tag, result)
+                return result
+            decoding = json_content(response)
+            decoding.addCallback(decoded)
+            return decoding
+        requesting.addCallback(got_response)
+        return requesting
+
+    def _wait_for(self, path, convert, predicate, timeout):
+        """
+        Wait for a listing to match, asking the control service to answer
+        only once it changed.
+
+        :param bytes path: The path of the endpoint.
+        :param convert: A function converting the decoded JSON response.
+        :param predicate: A function which is passed the converted response
+            and returns whether it matches.
+        :param float timeout: The longest to wait, in seconds.
+
+        :return: A ``Deferred`` firing with the first matching response, or
+            failing with ``WaitTimeout``.
+        """
+        deadline = self._reactor.seconds() + timeout
+
+        def check(value):
+            if predicate(value):
+                return value
+            remaining = deadline - self._reactor.seconds()
+            if remaining <= 0:
+                raise WaitTimeout(value)
+            url = self._url(path)
+            if url in self._responses:
+                getting = self._get(
+                    path, convert, wait=int(min(remaining, MAXIMUM_WAIT)) or 1)
+            else:
+                # Without an entity tag the response can't be waited on.
+                getting = deferLater(
+                    self._reactor, min(remaining, POLL_INTERVAL),
+                    self._get, path, convert)
+            getting.addCallback(check)
+            return getting
+        getting = self._get(path, convert)
+        getting.addCallback(check)
+        return getting
+
+    def _change_dataset(self, operation):
+        """
+        Send a dataset change along with any others made meanwhile.
+
+        :param dict operation: An operation of the bulk dataset endpoint.
+
+        :return: A ``Deferred`` firing with the resulting ``Dataset``, or
+            failing with ``ResponseError``.
+        """
+        changing = Deferred()
+        self._changes.append((operation, changing))
+        self._schedule_changes()
+        changing.addCallback(_dataset)
+        return changing
+
+    def _schedule_changes(self):
+        if self._changes and not self._sending and self._send_call is None:
+            self._send_call = self._reactor.callLater(0, self._send_changes)
+
+    def _send_changes(self):
+        """
+        Send the pending dataset changes, or as many as fit in one request.
+        Changes are sent one batch at a time, so they are made in order.
+        """
+        self._send_call = None
+        size = MAXIMUM_BATCH
+        if self._isolated:
+            size = 1
+            self._isolated -= 1
+        batch = self._changes[:size]
+        self._changes = self._changes[size:]
+        self._sending = True
+        sending = self._request(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [operation for (operation, _) in batch]}, OK)
+
+        def sent(results):
+            for (_, changing), result in zip(batch, results):
+                if result[u"code"] in (OK, CREATED):
+                    changing.callback(result[u"result"])
+                else:
+                    changing.errback(
+                        ResponseError(result[u"code"], result[u"result"]))
+
+        def failed(reason):
+            if (len(batch) > 1 and reason.check(ResponseError) and
+                    reason.value.code == BAD_REQUEST):
+                # A single invalid operation makes the whole request fail.
+                # Send them again one at a time, so only its change fails.
+                self._changes[:0] = batch
+                self._isolated = len(batch)
+                return
+            for (_, changing) in batch:
+                changing.errback(reason)
+
+        def finished(result):
+            self._sending = False
+            self._schedule_changes()
+            return result
+        sending.addCallbacks(sent, failed)
+        sending.addBoth(finished)
+
+    def version(self):
+        """
+        :return: A ``Deferred`` firing with the control service's version, a
+            ``unicode`` string.
+        """
+        getting = self._request(b"GET", b"/version", None, OK)
+        getting.addCallback(lambda result: result[u"flocker"])
+        return getting
+
+    def create_dataset(self, primary, maximum_size=None, dataset_id=None,
+                       metadata=None):
+        """
+        Configure a new dataset.
+
+        :param UUID primary: The node to put it on.
+        :param maximum_size: The most bytes it may hold, or ``None`` for no
+            limit.
+        :param dataset_id: Its ``UUID``, or ``None`` for a new one.
+        :param metadata: A ``dict`` of its ``unicode`` metadata, or
+            ``None``.
+
+        :return: A ``Deferred`` firing with the new ``Dataset``.
+        """
+        operation = {u"action": u"create", u"primary": unicode(primary)}
+        if maximum_size is not None:
+            operation[u"maximum_size"] = maximum_size
+        if dataset_id is not None:
+            operation[u"dataset_id"] = unicode(dataset_id)
+        if metadata is not None:
+            operation[u"metadata"] = dict(metadata)
+        return self._change_dataset(operation)
+
+    def move_dataset(self, primary, dataset_id):
+        """
+        Configure a dataset to move to another node.
+
+        :param UUID primary: The node to move it to.
+        :param UUID dataset_id: The dataset.
+
+        :return: A ``Deferred`` firing with the updated ``Dataset``.
+        """
+        return self._change_dataset({
+            u"action": u"update", u"dataset_id": unicode(dataset_id),
+            u"primary": unicode(primary)})
+
+    def delete_dataset(self, dataset_id):
+        """
+        Configure a dataset to be deleted.
+
+        :param UUID dataset_id: The dataset.
+
+        :return: A ``Deferred`` firing with the deleted ``Dataset``.
+        """
+        return self._change_dataset({
+            u"action": u"delete", u"dataset_id": unicode(dataset_id)})
+
+    def list_datasets_configuration(self, primary=None):
+        """
+        :param primary: ``None``, or the ``UUID`` of the node to list the
+            datasets of.
+
+        :return: A ``Deferred`` firing with a ``PVector`` of the configured
+            ``Dataset``.
+        """
+        query = ()
+        if primary is not None:
+            query = [(b"primary", bytes(primary))]
+        return self._get(
+            b"/configuration/datasets", _each(_dataset), query=query)
+
+    def list_datasets_state(self):
+        """
+        :return: A ``Deferred`` firing with a ``PVector`` of the
+            ``DatasetState`` of each dataset in the cluster.
+        """
+        return self._get(b"/state/datasets", _each(_dataset_state))
+
+    def wait_for_datasets_state(self, predicate, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for the datasets in the cluster to match.
+
+        :param predicate: A function which is passed the result of
+            ``list_datasets_state`` and returns whether it matches.
+        :param float timeout: The longest to wait, in seconds.
+
+        :return: A ``Deferred`` firing with the matching ``PVector`` of
+            ``DatasetState``, or failing with ``WaitTimeout``.
+        """
+        return self._wait_for(
+            b"/state/datasets", _each(_dataset_state), predicate, timeout)
+
+    def wait_for_dataset(self, dataset, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for a dataset's state to match its configuration: for it to be
+        on its primary node, or to be gone if it is deleted.
+
+        :param Dataset dataset: The dataset's configuration.
+        :param float timeout: The longest to wait, in seconds.
+
+        :return: A ``Deferred`` firing with the dataset's ``DatasetState``,
+            or ``None`` if it was deleted, or failing with ``WaitTimeout``.
+        """
+        def find(states):
+            for state in states:
+                if state.dataset_id == dataset.dataset_id:
+                    return state
+            return None
+
+        def matches(states):
+            state = find(states)
+            if dataset.deleted:
+                return state is None
+            return (state is not None and
+                    state.primary == dataset.primary and
+                    state.maximum_size == dataset.maximum_size)
+        waiting = self.wait_for_datasets_state(matches, timeout)
+        waiting.addCallback(find)
+        return waiting
+
+    def create_container(self, node_uuid, name, image, **attributes):
+        """
+        Configure a new container.
+
+        :param UUID node_uuid: The node to run it on.
+        :param unicode name: Its name.
+        :param unicode image: Its Docker image.
+        :param attributes: Any other items of its configuration, as in the
+            API, e.g. ``ports``.
+
+        :return: A ``Deferred`` firing with the new ``Container``.
+        """
+        body = dict(attributes, node_uuid=unicode(node_uuid), name=name,
+                    image=image)
+        creating = self._request(
+            b"POST", b"/configuration/containers", body, CREATED)
+        creating.addCallback(_container)
+        return creating
+
+    def move_container(self, name, node_uuid):
+        """
+        Configure a container to move to another node.
+
+        :param unicode name: The container's name.
+        :param UUID node_uuid: The node to move it to.
+
+        :return: A ``Deferred`` firing with the updated ``Container``.
+        """
+        moving = self._request(
+            b"POST", b"/configuration/containers/" + name.encode("utf-8"),
+            {u"node_uuid": unicode(node_uuid)}, OK)
+        moving.addCallback(_container)
+        return moving
+
+    def delete_container(self, name):
+        """
+        Configure a container to be removed.
+
+        :param unicode name: The container's name.
+
+        :return: A ``Deferred`` firing with ``None`` once it is.
+        """
+        deleting = self._request(
+            b"DELETE", b"/configuration/containers/" + name.encode("utf-8"),
+            None, OK)
+        deleting.addCallback(lambda _: None)
+        return deleting
+
+    def list_containers_configuration(self):
+        """
+        :return: A ``Deferred`` firing with a ``PVector`` of the configured
+            ``Container``.
+        """
+        return self._get(b"/configuration/containers", _each(_container))
+
+    def list_containers_state(self):
+        """
+        :return: A ``Deferred`` firing with a ``PVector`` of the
+            ``ContainerState`` of each container in the cluster.
+        """
+        return self._get(b"/state/containers", _each(_container_state))
+
+    def wait_for_containers_state(self, predicate, timeout=DEFAULT_TIMEOUT):
+        """
+        Wait for the containers in the cluster to match.
+
+        :param predicate: A function which is passed the result of
+            ``list_containers_state`` and returns whether it matches.
+        :param float timeout: The longest to wait, in seconds.
+
+        :return: A ``Deferred`` firing with the matching ``PVector`` of
+            ``ContainerState``, or failing with ``WaitTimeout``.
+        """
+        return self._wait_for(
+            b"/state/containers", _each(_container_state), predicate,
+            timeout)
+
+    def list_nodes(self):
+        """
+        :return: A ``Deferred`` firing with a ``PVector`` of the ``Node`` in
+            the cluster.
+        """
+        return self._get(b"/state/nodes", _each(_node))
+
+
+def authenticated_client(reactor, host, certificates_path,
+                         port=REST_API_PORT):
+    """
+    Create a client for the control service's REST API which authenticates
+    both ways using the cluster's certificates, and keeps its connections
+    open for later requests.
+
+    :param reactor: The reactor to use.
+    :param bytes host: The control service's address.
+    :param FilePath certificates_path: Directory where the cluster's
+        certificate and the user's certificate and private key can be
+        found.
+    :param int port: The REST API's port.
+
+    :return FlockerClient: The client.
+    """
+    ca = Certificate.loadPEM(
+        certificates_path.child(b"cluster.crt").getContent())
+    user_credential = UserCredential.from_path(certificates_path, u"user")
+    policy = _ReusedTLSPolicy(ControlServicePolicy(
+        ca_certificate=ca, client_credential=user_credential.credential))
+    pool = HTTPConnectionPool(reactor)
+    pool.maxPersistentPerHost = MAXIMUM_PERSISTENT_CONNECTIONS
+    agent = Agent(reactor, contextFactory=policy, pool=pool)
+    return FlockerClient(
+        reactor, b"https://%s:%d/v1" % (host, port), HTTPClient(agent))
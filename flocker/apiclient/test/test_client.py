@@ -0,0 +1,487 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.apiclient._client``.
+"""
+
+from gc import collect
+from io import BytesIO
+from uuid import UUID, uuid4
+
+from pyrsistent import pmap, pvector
+
+from zope.interface.verify import verifyObject
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock, Cooperator
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.client import FileBodyProducer
+from twisted.web.iweb import IPolicyForHTTPS
+from twisted.web.resource import Resource
+
+from treq.client import HTTPClient
+
+from ...ca.testtools import get_credential_sets
+from ...control import (
+    Application, DockerImage, Manifestation, NodeState,
+    Dataset as ModelDataset,
+)
+from ...control.httpapi import ConfigurationAPIUserV1, REST_API_PORT
+from ...control._persistence import ConfigurationPersistenceService
+from ...control._clusterstate import ClusterStateService
+from ...control._model import ChangeSource
+from ...restapi.testtools import MemoryAgent
+from ... import __version__
+from .. import (
+    FlockerClient, authenticated_client, Dataset, DatasetState, Container,
+    ContainerState, Node, ResponseError, WaitTimeout,
+)
+from .._client import _ReusedTLSPolicy, MAXIMUM_WAIT, POLL_INTERVAL
+
+
+class CountingAgent(object):
+    """
+    An agent which records the requests made through it before passing them
+    on to another.
+
+    ``treq`` sends request bodies using the global reactor, so they are read
+    here instead, for the requests to be made synchronously.
+
+    :ivar list requests: ``(method, url, headers)`` of each request.
+    """
+    def __init__(self, agent):
+        self._agent = agent
+        self.requests = []
+
+    def request(self, method, url, headers=None, bodyProducer=None):
+        self.requests.append((method, url, headers))
+        if bodyProducer is not None:
+            bodyProducer = FileBodyProducer(
+                BytesIO(bodyProducer._inputFile.read()),
+                cooperator=Cooperator(scheduler=lambda work: work()))
+        return self._agent.request(method, url, headers, bodyProducer)
+
+
+class FlockerClientTests(SynchronousTestCase):
+    """
+    Tests for ``FlockerClient``, talking to an in-memory control service.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.persistence_service = ConfigurationPersistenceService(
+            reactor, FilePath(self.mktemp()))
+        self.persistence_service.startService()
+        self.addCleanup(self.persistence_service.stopService)
+        self.cluster_state_service = ClusterStateService(self.clock)
+        self.cluster_state_service.startService()
+        self.addCleanup(self.cluster_state_service.stopService)
+        api = ConfigurationAPIUserV1(
+            self.persistence_service, self.cluster_state_service, self.clock)
+        root = Resource()
+        root.putChild(b"v1", api.app.resource())
+        self.agent = CountingAgent(MemoryAgent(root))
+        self.client = FlockerClient(
+            self.clock, b"http://127.0.0.1/v1", HTTPClient(self.agent))
+        self.node_uuid = uuid4()
+
+    def sent(self, method=None):
+        """
+        :param method: ``None``, or only count requests with this method.
+        :return int: The number of requests made.
+        """
+        return len([
+            request for request in self.agent.requests
+            if method in (None, request[0])])
+
+    def set_state(self, datasets=(), applications=()):
+        """
+        Set the state of the only node in the cluster, waking any requests
+        waiting for it to change.
+
+        :param datasets: ``(ModelDataset, FilePath)`` of each dataset on the
+            node.
+        :param applications: The ``Application`` running on the node.
+        """
+        source = ChangeSource()
+        source.set_last_activity(self.clock.seconds())
+        self.cluster_state_service.apply_changes_from_source(source, [
+            NodeState(
+                hostname=u"192.0.2.1", uuid=self.node_uuid,
+                manifestations={
+                    dataset.dataset_id: Manifestation(
+                        dataset=dataset, primary=True)
+                    for (dataset, _) in datasets},
+                paths={
+                    dataset.dataset_id: path for (dataset, path) in datasets},
+                devices={},
+                applications=applications,
+                used_ports=[],
+            )])
+        self.clock.advance(0)
+
+    def create(self, **kwargs):
+        """
+        Create a dataset on the node, sending the request.
+
+        :return Dataset: The created dataset.
+        """
+        creating = self.client.create_dataset(self.node_uuid, **kwargs)
+        self.clock.advance(0)
+        return self.successResultOf(creating)
+
+    def test_version(self):
+        """
+        ``FlockerClient.version`` returns the control service's version.
+        """
+        self.assertEqual(
+            self.successResultOf(self.client.version()), __version__)
+
+    def test_create_dataset(self):
+        """
+        ``FlockerClient.create_dataset`` returns the configured ``Dataset``,
+        which ``FlockerClient.list_datasets_configuration`` then lists.
+        """
+        dataset_id = uuid4()
+        dataset = self.create(
+            maximum_size=1024 * 1024 * 64, dataset_id=dataset_id,
+            metadata={u"name": u"db"})
+        listing = self.client.list_datasets_configuration()
+        self.assertEqual(
+            (dataset, list(self.successResultOf(listing))),
+            (Dataset(dataset_id=dataset_id, primary=self.node_uuid,
+                     maximum_size=1024 * 1024 * 64,
+                     metadata=pmap({u"name": u"db"})),
+             [dataset]))
+
+    def test_list_by_primary(self):
+        """
+        ``FlockerClient.list_datasets_configuration`` only lists the datasets
+        on a node if given its ``UUID``.
+        """
+        dataset = self.create()
+        self.client.create_dataset(uuid4())
+        self.clock.advance(0)
+        listing = self.client.list_datasets_configuration(
+            primary=self.node_uuid)
+        self.assertEqual(list(self.successResultOf(listing)), [dataset])
+
+    def test_changes_batched(self):
+        """
+        Dataset changes made in the same reactor iteration are sent in one
+        request, and each gets its own result.
+        """
+        dataset = self.create()
+        other = uuid4()
+        creating = self.client.create_dataset(self.node_uuid)
+        moving = self.client.move_dataset(other, dataset.dataset_id)
+        posted = self.sent(b"POST")
+        self.clock.advance(0)
+        self.assertEqual(
+            (self.sent(b"POST") - posted,
+             self.successResultOf(creating).primary,
+             self.successResultOf(moving)),
+            (1, self.node_uuid, dataset.set(primary=other)))
+
+    def test_changes_while_sending_batched(self):
+        """
+        Dataset changes made while others are being sent are sent together
+        once those have been.
+        """
+        original_request = self.agent.request
+        paused = []
+
+        def request(*args):
+            if not paused:
+                paused.append(args)
+                waiting = Deferred()
+                paused.append(waiting)
+                return waiting
+            return original_request(*args)
+        self.agent.request = request
+        first = self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        second = self.client.create_dataset(self.node_uuid)
+        third = self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        # Nothing more is sent until the first batch is done:
+        self.assertEqual(len(paused), 2)
+        original_request(*paused[0]).chainDeferred(paused[1])
+        self.clock.advance(0)
+        ids = set(
+            self.successResultOf(d).dataset_id for d in (first, second, third))
+        self.assertEqual((len(ids), self.sent(b"POST")), (3, 2))
+
+    def test_change_failed(self):
+        """
+        A dataset change which fails fails with ``ResponseError``, without
+        stopping the others sent with it.
+        """
+        deleting = self.client.delete_dataset(uuid4())
+        creating = self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        self.successResultOf(creating)
+        error = self.failureResultOf(deleting, ResponseError).value
+        self.assertEqual(error.code, 404)
+
+    def test_invalid_change(self):
+        """
+        If the control service rejects a whole batch of dataset changes
+        because one of them is invalid, they are sent again one at a time,
+        so only the invalid change fails.
+        """
+        creating = self.client.create_dataset(self.node_uuid)
+        invalid = self.client.create_dataset(
+            self.node_uuid, metadata={u"name": 123})
+        other = self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        error = self.failureResultOf(invalid, ResponseError).value
+        self.assertEqual(
+            (400, self.node_uuid, self.node_uuid, 4),
+            (error.code, self.successResultOf(creating).primary,
+             self.successResultOf(other).primary, self.sent(b"POST")))
+
+    def test_unexpected_results(self):
+        """
+        Dataset changes are still sent after the results of an earlier batch
+        couldn't be handled.
+        """
+        original_request = self.client._request
+        self.client._request = lambda *args: succeed([None])
+        self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        collect()
+        self.flushLoggedErrors(TypeError)
+        self.client._request = original_request
+        creating = self.client.create_dataset(self.node_uuid)
+        self.clock.advance(0)
+        self.assertEqual(
+            self.node_uuid, self.successResultOf(creating).primary)
+
+    def test_delete_dataset(self):
+        """
+        ``FlockerClient.delete_dataset`` returns the deleted ``Dataset``.
+        """
+        dataset = self.create()
+        deleting = self.client.delete_dataset(dataset.dataset_id)
+        self.clock.advance(0)
+        self.assertEqual(
+            self.successResultOf(deleting), dataset.set(deleted=True))
+
+    def test_datasets_state(self):
+        """
+        ``FlockerClient.list_datasets_state`` returns the ``DatasetState`` of
+        each dataset in the cluster.
+        """
+        dataset = ModelDataset(dataset_id=unicode(uuid4()))
+        self.set_state(datasets=[(dataset, FilePath(b"/flocker/a"))])
+        listing = self.client.list_datasets_state()
+        self.assertEqual(
+            list(self.successResultOf(listing)),
+            [DatasetState(dataset_id=UUID(dataset.dataset_id),
+                          primary=self.node_uuid,
+                          path=FilePath(b"/flocker/a"))])
+
+    def test_same_get_shared(self):
+        """
+        Identical requests made while one is in progress share its response.
+        """
+        original_request = self.agent.request
+        paused = []
+
+        def request(*args):
+            waiting = Deferred()
+            paused.append((args, waiting))
+            return waiting
+        self.agent.request = request
+        first = self.client.list_nodes()
+        second = self.client.list_nodes()
+        self.agent.request = original_request
+        args, waiting = paused[0]
+        original_request(*args).chainDeferred(waiting)
+        self.assertEqual(
+            (len(paused), self.successResultOf(first),
+             self.successResultOf(second)),
+            (1,) + (self.successResultOf(self.client.list_nodes()),) * 2)
+
+    def test_not_modified_reused(self):
+        """
+        A listing which didn't change is not decoded again: the same object
+        is returned.
+        """
+        self.set_state()
+        first = self.successResultOf(self.client.list_nodes())
+        second = self.successResultOf(self.client.list_nodes())
+        headers = self.agent.requests[-1][2]
+        self.assertEqual(
+            (first, second is first,
+             headers.getRawHeaders(b"if-none-match") is not None),
+            (pvector([Node(uuid=self.node_uuid, host=u"192.0.2.1")]),
+             True, True))
+
+    def test_error(self):
+        """
+        A listing which fails fails with ``ResponseError``.
+        """
+        client = FlockerClient(
+            self.clock, b"http://127.0.0.1/v2", HTTPClient(self.agent))
+        error = self.failureResultOf(client.list_nodes(), ResponseError)
+        self.assertEqual(error.value.code, 404)
+
+    def test_containers(self):
+        """
+        ``FlockerClient.create_container`` returns the configured
+        ``Container``; it can be moved and deleted.
+        """
+        other = uuid4()
+        container = self.successResultOf(self.client.create_container(
+            self.node_uuid, u"web", u"nginx:latest",
+            ports=[{u"internal": 80, u"external": 8080}]))
+        moved = self.successResultOf(
+            self.client.move_container(u"web", other))
+        listed = list(self.successResultOf(
+            self.client.list_containers_configuration()))
+        deleted = self.successResultOf(self.client.delete_container(u"web"))
+        self.assertIsInstance(container, Container)
+        self.assertEqual(
+            (container.node_uuid, container.image,
+             container.attributes[u"ports"][0][u"external"],
+             moved, listed, deleted),
+            (self.node_uuid, u"nginx:latest", 8080,
+             container.set(node_uuid=other), [moved], None))
+
+    def test_containers_state(self):
+        """
+        ``FlockerClient.list_containers_state`` returns the
+        ``ContainerState`` of each container in the cluster.
+        """
+        self.set_state(applications=[Application(
+            name=u"web", image=DockerImage.from_string(u"nginx"),
+            running=True)])
+        listing = self.successResultOf(self.client.list_containers_state())
+        self.assertEqual(
+            [(state.name, state.node_uuid, state.running)
+             for state in listing],
+            [(u"web", self.node_uuid, True)])
+        self.assertIsInstance(listing[0], ContainerState)
+
+    def test_wait_for_dataset(self):
+        """
+        ``FlockerClient.wait_for_dataset`` waits for the control service to
+        report a change, rather than polling, and fires with the dataset's
+        state once it matches the configuration.
+        """
+        dataset = self.create()
+        waiting = self.client.wait_for_dataset(dataset)
+        self.assertNoResult(waiting)
+        url = self.agent.requests[-1][1]
+        self.set_state(datasets=[(
+            ModelDataset(dataset_id=unicode(dataset.dataset_id)),
+            FilePath(b"/flocker/a"))])
+        self.assertEqual(
+            (url.endswith(b"?wait=%d" % (MAXIMUM_WAIT,)),
+             self.successResultOf(waiting)),
+            (True, DatasetState(dataset_id=dataset.dataset_id,
+                                primary=self.node_uuid,
+                                path=FilePath(b"/flocker/a"))))
+
+    def test_wait_for_deleted_dataset(self):
+        """
+        ``FlockerClient.wait_for_dataset`` fires with ``None`` once a deleted
+        dataset is gone from the cluster.
+        """
+        dataset = self.create()
+        self.set_state(datasets=[(
+            ModelDataset(dataset_id=unicode(dataset.dataset_id)),
+            FilePath(b"/flocker/a"))])
+        waiting = self.client.wait_for_dataset(dataset.set(deleted=True))
+        self.set_state()
+        self.assertIs(self.successResultOf(waiting), None)
+
+    def test_wait_timeout(self):
+        """
+        ``FlockerClient.wait_for_containers_state`` fails with
+        ``WaitTimeout`` if the state doesn't match in time.
+        """
+        self.set_state()
+        waiting = self.client.wait_for_containers_state(
+            lambda states: False, timeout=90)
+        self.clock.advance(MAXIMUM_WAIT)
+        self.clock.advance(MAXIMUM_WAIT)
+        error = self.failureResultOf(waiting, WaitTimeout)
+        self.assertEqual(list(error.value.last), [])
+
+    def test_wait_without_entity_tag(self):
+        """
+        If a listing has no entity tag to wait on, it is polled.
+        """
+        self.agent.request = self._strip_etags(self.agent.request)
+        waiting = self.client.wait_for_containers_state(bool)
+        sent = self.sent()
+        self.set_state(applications=[Application(
+            name=u"web", image=DockerImage.from_string(u"nginx"))])
+        self.clock.advance(POLL_INTERVAL)
+        self.assertEqual(
+            (self.sent() - sent,
+             [state.name for state in self.successResultOf(waiting)]),
+            (1, [u"web"]))
+
+    def _strip_etags(self, request):
+        def stripped(*args):
+            requesting = request(*args)
+
+            def got(response):
+                response.headers.removeHeader(b"etag")
+                return response
+            return requesting.addCallback(got)
+        return stripped
+
+
+class ReusedTLSPolicyTests(SynchronousTestCase):
+    """
+    Tests for ``_ReusedTLSPolicy``.
+    """
+    def test_interface(self):
+        """
+        ``_ReusedTLSPolicy`` provides ``IPolicyForHTTPS``.
+        """
+        self.assertTrue(
+            verifyObject(IPolicyForHTTPS, _ReusedTLSPolicy(None)))
+
+    def test_created_once(self):
+        """
+        The wrapped policy is only asked for the TLS options of each host
+        once.
+        """
+        asked = []
+
+        class Policy(object):
+            def creatorForNetloc(self, hostname, port):
+                asked.append((hostname, port))
+                return object()
+        policy = _ReusedTLSPolicy(Policy())
+        first = policy.creatorForNetloc(b"a", 1)
+        again = policy.creatorForNetloc(b"a", 1)
+        other = policy.creatorForNetloc(b"b", 1)
+        self.assertEqual(
+            (again is first, other is first, asked),
+            (True, False, [(b"a", 1), (b"b", 1)]))
+
+
+class AuthenticatedClientTests(SynchronousTestCase):
+    """
+    Tests for ``authenticated_client``.
+    """
+    def test_client(self):
+        """
+        ``authenticated_client`` returns a ``FlockerClient`` for the API on the
+        given host whose connections are kept open.
+        """
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        get_credential_sets()[0].copy_to(path, user=True)
+        client = authenticated_client(reactor, b"192.0.2.1", path)
+        self.assertEqual(
+            (client._base_url, client._treq._agent._pool.persistent),
+            (b"https://192.0.2.1:%d/v1" % (REST_API_PORT,), True))
@@ -11,6 +11,7 @@ __all__ = [
     "AUTHORITY_CERTIFICATE_FILENAME", "AUTHORITY_KEY_FILENAME",
     "amp_server_context_factory", "rest_api_context_factory",
     "ControlServicePolicy", "treq_with_authentication",
+    "replication_context_factory",
 ]
 
 from ._ca import (
@@ -22,5 +23,5 @@ from ._ca import (
 
 from ._validation import (
     amp_server_context_factory, rest_api_context_factory, ControlServicePolicy,
-    treq_with_authentication,
+    treq_with_authentication, replication_context_factory,
 )
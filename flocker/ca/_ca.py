@@ -318,6 +318,21 @@ class FlockerCredential(PRecord):
         return PrivateCertificate.fromCertificateAndKeyPair(
             self.certificate, self.keypair.keypair)
 
+    def _default_options(self, trust_root):
+        """
+        Construct a ``CertificateOptions`` that exposes this credential's
+        certificate and keypair.
+
+        :param trust_root: Trust root to pass to ``CertificateOptions``.
+
+        :return: ``CertificateOptions`` instance with CA validation
+            configured.
+        """
+        key = self.keypair.keypair.original
+        certificate = self.certificate.original
+        return CertificateOptions(
+            privateKey=key, certificate=certificate, trustRoot=trust_root)
+
 
 class UserCredential(PRecord):
     """
@@ -568,10 +583,7 @@ class ControlCredential(PRecord):
         :return: ``CertificateOptions`` instance with CA validation
             configured.
         """
-        key = self.credential.keypair.keypair.original
-        certificate = self.credential.certificate.original
-        return CertificateOptions(
-            privateKey=key, certificate=certificate, trustRoot=trust_root)
+        return self.credential._default_options(trust_root)
 
 
 class RootCredential(PRecord):
@@ -16,8 +16,6 @@ from twisted.web.iweb import IPolicyForHTTPS
 from twisted.internet.ssl import optionsForClientTLS, Certificate
 from twisted.web.client import Agent
 
-from treq.client import HTTPClient
-
 from pyrsistent import PRecord, field
 
 from ._ca import UserCredential
@@ -55,8 +53,8 @@ class _ControlServiceContextFactory(object):
         :param Certificate ca_certificate: The certificate authority's
             certificate.
 
-        :param ControlCredential control_credential: The control service's
-            credentials.
+        :param control_credential: The credentials presented to peers, a
+            ``ControlCredential`` or ``FlockerCredential``.
 
         :param bytes prefix: The required prefix on certificate common names.
         """
@@ -118,6 +116,34 @@ def rest_api_context_factory(ca_certificate, control_credential):
         ca_certificate, control_credential, b"user-")
 
 
+def replication_context_factory(ca_certificate, node_credential):
+    """
+    Create a context factory that validates another node agent and presents
+    this node's certificate, for either end of a dataset replication
+    connection.
+
+    :param Certificate ca_certificate: The certificate authority's
+        certificate.
+
+    :param NodeCredential node_credential: This node's credentials.
+
+    Clients only check that the server has a node certificate signed by
+    the cluster's certificate authority, not which node it belongs to:
+    they are only ever told the destination's hostname, never its node
+    UUID.  This is acceptable because every node certified by the cluster
+    is trusted to hold any dataset, and which node a dataset is pushed to
+    is decided by the control service rather than by the peer.  A node
+    answering on the wrong address can therefore at worst receive a copy
+    of a dataset the cluster would have let it host anyway; it can't
+    impersonate a user or the control service.
+
+    :return: TLS context factory suitable for use by both the replication
+        server and its clients.
+    """
+    return _ControlServiceContextFactory(
+        ca_certificate, node_credential.credential, b"node-")
+
+
 def treq_with_authentication(reactor, certificates_path):
     """
     Create a ``treq``-API object that implements the REST API TLS
@@ -132,6 +158,9 @@ def treq_with_authentication(reactor, certificates_path):
 
     :return: ``treq`` compatible object.
     """
+    # Imported here since it pulls in ``requests``, which only the command
+    # line tools talking to the REST API need:
+    from treq.client import HTTPClient
     ca = Certificate.loadPEM(
         certificates_path.child(b"cluster.crt").getContent())
     # This is a hack; from_path should be more
@@ -19,6 +19,7 @@ from twisted.internet.protocol import Protocol, ServerFactory
 from ...testtools import find_free_port
 from .._validation import (
     ControlServicePolicy, amp_server_context_factory, rest_api_context_factory,
+    replication_context_factory,
     )
 from ..testtools import get_credential_sets
 
@@ -330,3 +331,31 @@ class RESTAPIContextFactoryValidationTests(
     """
     Tests for the context factory that validates REST API clients.
     """
+
+
+class ReplicationServerValidationTests(
+        make_validation_tests(
+            lambda port, good_ca: replication_context_factory(
+                ca_certificate=good_ca.root.credential.certificate,
+                # The exposed node credential isn't covered by these tests,
+                # but is required for the tests to run:
+                node_credential=good_ca.node),
+            # We are testing a server validating node certificates:
+            "node", validator_is_client=False)):
+    """
+    Tests for validation of node agents pushing datasets to the
+    replication server.
+    """
+
+
+class ReplicationClientValidationTests(
+        make_validation_tests(
+            lambda port, good_ca: replication_context_factory(
+                ca_certificate=good_ca.root.credential.certificate,
+                node_credential=good_ca.node),
+            # We are testing a client validating the node it pushes to:
+            "node", validator_is_client=True)):
+    """
+    Tests for validation of the replication server by node agents pushing
+    datasets to it.
+    """
@@ -6,7 +6,10 @@ Test validation of keys generated by flocker-ca.
 
 from twisted.trial.unittest import SynchronousTestCase
 
-from .. import amp_server_context_factory, rest_api_context_factory
+from .. import (
+    amp_server_context_factory, rest_api_context_factory,
+    replication_context_factory,
+)
 from ..testtools import get_credential_sets
 
 
@@ -37,3 +40,14 @@ class ClientValidationContextFactoryTests(SynchronousTestCase):
             ca_set.root.credential.certificate, ca_set.control)
         self.assertIsNot(context_factory.getContext(),
                          context_factory.getContext())
+
+    def test_replication_new_context_each_time(self):
+        """
+        Each call to the replication context factory's ``getContext`` returns
+        a new instance, to prevent issues with global shared state.
+        """
+        ca_set, _ = get_credential_sets()
+        context_factory = replication_context_factory(
+            ca_set.root.credential.certificate, ca_set.node)
+        self.assertIsNot(context_factory.getContext(),
+                         context_factory.getContext())
@@ -0,0 +1,148 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_importtime -*-
+
+"""
+Measure what importing the module of each ``flocker-*`` command line tool
+costs.
+
+Every run of a tool imports its module before doing anything else, so
+``flocker-volume --version`` waits for everything that module imports.
+Each module is imported in a new interpreter, since this one may already
+have imported some of its dependencies.
+
+Run ``python -m flocker.common._importtime`` for a report.
+"""
+
+import json
+from subprocess import check_output
+from sys import executable
+from time import time
+
+from pyrsistent import PRecord, field, pmap, pset
+
+from twisted.python.filepath import FilePath
+
+import flocker
+
+# The modules implementing the tools, as named by the ``console_scripts`` in
+# ``setup.py``.
+ENTRY_POINTS = pmap({
+    u"flocker-volume": b"flocker.volume.script",
+    u"flocker-deploy": b"flocker.cli.script",
+    u"flocker-container-agent": b"flocker.node.script",
+    u"flocker-dataset-agent": b"flocker.node.script",
+    u"flocker-control": b"flocker.control.script",
+    u"flocker-ca": b"flocker.ca._script",
+    u"flocker": b"flocker.cli.script",
+})
+
+# The clients of the cloud storage backends, which only dataset agents
+# configured to use those backends need.
+_BACKEND_CLIENTS = pset([
+    b"boto", b"keystoneclient", b"novaclient", b"cinderclient",
+])
+
+# The agents' dependencies: Docker, and the system information used with
+# block devices.
+_AGENT_DEPENDENCIES = pset([b"docker", b"psutil", b"flocker.node"])
+
+# The REST API's dependencies: the server and its clients.
+_REST_API_DEPENDENCIES = pset([b"klein", b"treq", b"requests"])
+
+# Packages each tool must not import when it starts.  Importing any module
+# of one counts.
+IMPORT_BUDGETS = pmap({
+    u"flocker-volume": (
+        _BACKEND_CLIENTS | _AGENT_DEPENDENCIES | _REST_API_DEPENDENCIES
+        | [b"flocker.control"]),
+    u"flocker-deploy": _BACKEND_CLIENTS | _AGENT_DEPENDENCIES,
+    u"flocker-container-agent": _BACKEND_CLIENTS | [b"klein", b"treq"],
+    u"flocker-dataset-agent": _BACKEND_CLIENTS | [b"klein", b"treq"],
+    u"flocker-control": _BACKEND_CLIENTS | _AGENT_DEPENDENCIES | [b"treq"],
+    u"flocker-ca": (
+        _BACKEND_CLIENTS | _AGENT_DEPENDENCIES | _REST_API_DEPENDENCIES
+        | [b"flocker.control"]),
+    u"flocker": _BACKEND_CLIENTS | _AGENT_DEPENDENCIES,
+})
+
+_MEASURE = b"""\
+import json, sys, time
+start = time.time()
+import %s
+seconds = time.time() - start
+json.dump({
+    "seconds": seconds,
+    "modules": [name for (name, module) in sys.modules.items()
+                if module is not None],
+}, sys.stdout)
+"""
+
+
+class ImportReport(PRecord):
+    """
+    What importing a module in a new interpreter cost.
+
+    :ivar bytes module: The name of the module imported.
+    :ivar float seconds: How long the import took.
+    :ivar float process_seconds: How long the whole interpreter ran,
+        including its own start up.
+    :ivar modules: The names of all modules loaded afterwards.
+    """
+    module = field(type=bytes, mandatory=True)
+    seconds = field(type=float, mandatory=True)
+    process_seconds = field(type=float, mandatory=True)
+    modules = field(mandatory=True)
+
+    def over_budget(self, forbidden):
+        """
+        :param forbidden: The names of packages which should not have been
+            imported.
+
+        :return: A sorted ``list`` of the forbidden packages which were
+            imported, directly or by importing one of their modules.
+        """
+        return sorted(
+            package for package in forbidden
+            if any(name == package or name.startswith(package + b".")
+                   for name in self.modules)
+        )
+
+
+def measure_import(module):
+    """
+    Import a module in a new interpreter.
+
+    :param bytes module: The name of the module to import.
+
+    :return: An ``ImportReport``.
+    """
+    start = time()
+    output = check_output(
+        [executable, b"-c", _MEASURE % (module,)],
+        # Make sure the flocker package being measured is the one imported:
+        cwd=FilePath(flocker.__file__).parent().parent().path)
+    process_seconds = time() - start
+    result = json.loads(output)
+    return ImportReport(
+        module=module, seconds=result[u"seconds"],
+        process_seconds=process_seconds,
+        modules=pset(name.encode("ascii") for name in result[u"modules"]))
+
+
+def main():
+    """
+    Print the import cost of each tool and anything it imports despite its
+    budget.
+    """
+    print(b"%-25s %10s %10s %8s  %s" % (
+        b"tool", b"import", b"process", b"modules", b"over budget"))
+    for name, module in sorted(ENTRY_POINTS.items()):
+        report = measure_import(module)
+        print(b"%-25s %9.3fs %9.3fs %8d  %s" % (
+            name.encode("ascii"), report.seconds, report.process_seconds,
+            len(report.modules),
+            b", ".join(report.over_budget(IMPORT_BUDGETS[name])) or b"-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@
 Inter-process communication for flocker.
 """
 
+import os
 from subprocess import Popen, PIPE, check_output, CalledProcessError
 from contextlib import contextmanager
 from io import BytesIO
@@ -14,6 +15,9 @@ from zope.interface import Interface, implementer
 
 from characteristic import with_cmp, with_repr
 
+from twisted.internet.error import ProcessDone
+from twisted.python.failure import Failure
+
 
 class INode(Interface):
     """
@@ -42,6 +46,21 @@ class INode(Interface):
         :return: ``bytes`` of stdout from the remote command.
         """
 
+    def spawn(reactor, protocol, remote_command):
+        """Start a remote command without blocking.
+
+        :param IReactorProcess reactor: The reactor to start the command
+            with.
+
+        :param IProcessProtocol protocol: The protocol to connect to the
+            command's standard input and output.
+
+        :param remote_command: ``list`` of ``bytes``, the command to run
+            remotely along with its arguments.
+
+        :return: The ``IProcessTransport`` of the command.
+        """
+
 
 @with_cmp(["initial_command_arguments"])
 @with_repr(["initial_command_arguments"])
@@ -89,6 +108,12 @@ class ProcessNode(object):
             # https://clusterhq.atlassian.net/browse/FLOC-155
             raise IOError("Bad exit", remote_command, e.returncode, e.output)
 
+    def spawn(self, reactor, protocol, remote_command):
+        arguments = (self.initial_command_arguments +
+                     tuple(map(self._quote, remote_command)))
+        return reactor.spawnProcess(
+            protocol, arguments[0], arguments, env=os.environ)
+
     @classmethod
     def using_ssh(cls, host, port, username, private_key):
         """Create a ``ProcessNode`` that communicate over SSH.
@@ -132,13 +157,14 @@ class FakeNode(object):
 
     This is useful for testing.
 
-    :ivar remote_command: The arguments to the last call to ``run()`` or
-        ``get_output()``.
+    :ivar remote_command: The arguments to the last call to ``run()``,
+        ``get_output()`` or ``spawn()``.
 
-    :ivar stdin: `BytesIO` returned from last call to ``run()``.
+    :ivar stdin: `BytesIO` returned from last call to ``run()``, or written
+        to through the transport of the last call to ``spawn()``.
 
-    :ivar thread_id: The ID of the thread ``run()`` or ``get_output()``
-        ran in.
+    :ivar thread_id: The ID of the thread ``run()``, ``get_output()`` or
+        ``spawn()`` ran in.
     """
     def __init__(self, outputs=()):
         """
@@ -171,3 +197,49 @@ class FakeNode(object):
             raise result
         else:
             return result
+
+    def spawn(self, reactor, protocol, remote_command):
+        """
+        Store arguments and connect the protocol to a transport which writes
+        to an in-memory "stdin".  The pretend command exits successfully
+        once its standard input is closed.
+        """
+        self.thread_id = current_thread().ident
+        self.stdin = BytesIO()
+        self.remote_command = remote_command
+        transport = _FakeNodeTransport(self.stdin, protocol)
+        protocol.makeConnection(transport)
+        return transport
+
+
+class _FakeNodeTransport(object):
+    """
+    The process transport of a command pretended to run by ``FakeNode``.
+
+    :ivar _stdin: `BytesIO` to which writes go.
+    :ivar _protocol: The process protocol connected to this transport.
+    :ivar producer: The producer registered with this transport, or ``None``.
+    """
+    def __init__(self, stdin, protocol):
+        self._stdin = stdin
+        self._protocol = protocol
+        self.producer = None
+
+    def write(self, data):
+        self._stdin.write(data)
+
+    def writeSequence(self, data):
+        self._stdin.write(b"".join(data))
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def closeStdin(self):
+        self._stdin.seek(0, 0)
+        self._protocol.processEnded(Failure(ProcessDone(0)))
+
+    def signalProcess(self, signal):
+        pass
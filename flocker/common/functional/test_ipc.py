@@ -4,6 +4,10 @@
 Functional tests for IPC.
 """
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import ProcessProtocol
 from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
@@ -93,6 +97,35 @@ class ProcessNodeTests(TestCase):
         nonexistent = self.mktemp()
         self.assertRaises(IOError, node.get_output, [b"ls", nonexistent])
 
+    def test_spawn_stdin(self):
+        """
+        ``ProcessNode.spawn()`` starts a command that is the combination of
+        the initial arguments and the ones given to ``spawn()``, connected to
+        the given protocol.
+        """
+        class Writer(ProcessProtocol):
+            def __init__(self):
+                self.ended = Deferred()
+
+            def connectionMade(self):
+                self.transport.write(b"hello world")
+                self.transport.closeStdin()
+
+            def processEnded(self, reason):
+                self.ended.callback(reason.check(ProcessDone) is not None)
+
+        node = ProcessNode(initial_command_arguments=[b"sh", b"-c"])
+        temp_file = self.mktemp()
+        protocol = Writer()
+        node.spawn(reactor, protocol, [b"cat > " + temp_file])
+
+        def ended(exited_successfully):
+            self.assertEqual(
+                (True, b"hello world"),
+                (exited_successfully, FilePath(temp_file).getContent()))
+        protocol.ended.addCallback(ended)
+        return protocol.ended
+
 
 def make_sshnode(test_case):
     """
@@ -0,0 +1,57 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._importtime``.
+"""
+
+from pyrsistent import pset
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._importtime import (
+    ENTRY_POINTS, IMPORT_BUDGETS, ImportReport, measure_import,
+)
+
+
+class ImportReportTests(SynchronousTestCase):
+    """
+    Tests for ``ImportReport.over_budget``.
+    """
+    def test_over_budget(self):
+        """
+        A forbidden package counts as imported if it or any of its modules
+        was, but not if only a package with a similar name was.
+        """
+        report = ImportReport(
+            module=b"example", seconds=0.0, process_seconds=0.0,
+            modules=pset([b"example", b"boto", b"docker.client",
+                          b"treqlike"]))
+        self.assertEqual(
+            [b"boto", b"docker"],
+            report.over_budget([b"docker", b"boto", b"treq", b"klein"]))
+
+
+class ImportBudgetTests(SynchronousTestCase):
+    """
+    Tests for the start up cost of the command line tools.
+    """
+    def test_budgets(self):
+        """
+        Every tool has a budget.
+        """
+        self.assertEqual(set(ENTRY_POINTS), set(IMPORT_BUDGETS))
+
+    def test_within_budget(self):
+        """
+        No tool imports any of the packages its budget forbids when it
+        starts.
+        """
+        reports = {}
+        for name, module in ENTRY_POINTS.items():
+            if module not in reports:
+                reports[module] = measure_import(module)
+        self.assertEqual(
+            {},
+            {name: reports[module].over_budget(IMPORT_BUDGETS[name])
+             for name, module in ENTRY_POINTS.items()
+             if reports[module].over_budget(IMPORT_BUDGETS[name])})
@@ -10,6 +10,9 @@ from unittest import TestCase as PyTestCase
 
 from zope.interface.verify import verifyObject
 
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import ProcessProtocol
+
 from .. import INode, FakeNode
 from ...testtools import assertNoFDsLeaked
 
@@ -95,3 +98,32 @@ def make_inode_tests(fixture):
 
 class FakeINodeTests(make_inode_tests(lambda t: FakeNode([b"hello"]))):
     """``INode`` tests for ``FakeNode``."""
+
+
+class FakeNodeTests(PyTestCase):
+    """
+    Tests for ``FakeNode``.
+    """
+    def test_spawn(self):
+        """
+        ``FakeNode.spawn()`` records the command and what is written to its
+        standard input, and pretends it exits successfully once its standard
+        input is closed.
+        """
+        class Writer(ProcessProtocol):
+            reason = None
+
+            def connectionMade(self):
+                self.transport.write(b"hello")
+                self.transport.closeStdin()
+
+            def processEnded(self, reason):
+                self.reason = reason
+
+        node = FakeNode()
+        protocol = Writer()
+        node.spawn(None, protocol, [b"cat"])
+        self.assertEqual(
+            ([b"cat"], b"hello", True),
+            (node.remote_command, node.stdin.read(),
+             protocol.reason.check(ProcessDone) is not None))
@@ -13,6 +13,8 @@ from twisted.application.internet import TimerService
 
 from pyrsistent import PRecord, field, pmap
 
+from eliot import Logger, write_traceback
+
 from ._model import DeploymentState, ChangeSource
 
 
@@ -56,7 +58,12 @@ class ClusterStateService(MultiService):
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
     :ivar _clock: ``IReactorTime`` provider.
+    :ivar int _generation: The number of times the known state changed.
+    :ivar list _change_callbacks: Functions to call whenever the known state
+        changes.
     """
+    logger = Logger()
+
     def __init__(self, reactor):
         MultiService.__init__(self)
         self._deployment_state = DeploymentState()
@@ -65,6 +72,33 @@ class ClusterStateService(MultiService):
         timer.setServiceParent(self)
         self._information_wipers = pmap()
         self._clock = reactor
+        self._generation = 0
+        self._change_callbacks = []
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the known state changes.
+
+        :param change_callback: Callable that takes no arguments, will be
+            called when the known state changes.
+        """
+        self._change_callbacks.append(change_callback)
+
+    def _set_deployment_state(self, deployment_state):
+        """
+        Replace the known cluster state, noting whether it changed.
+
+        :param DeploymentState deployment_state: The new state.
+        """
+        if deployment_state == self._deployment_state:
+            return
+        self._generation += 1
+        self._deployment_state = deployment_state
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except:
+                write_traceback(self.logger, u"")
 
     def _wipe_expired(self):
         """
@@ -75,9 +109,8 @@ class ClusterStateService(MultiService):
         for key, wipe in self._information_wipers.items():
             last_activity = wipe.last_activity()
             if current_time - last_activity >= EXPIRATION_TIME:
-                self._deployment_state = wipe.update_cluster_state(
-                    self._deployment_state
-                )
+                self._set_deployment_state(
+                    wipe.update_cluster_state(self._deployment_state))
                 evolver.remove(key)
         self._information_wipers = evolver.persistent()
 
@@ -101,6 +134,16 @@ class ClusterStateService(MultiService):
         """
         return self._deployment_state
 
+    def generation(self):
+        """
+        Identify the current cluster state cheaply, e.g. to tell whether
+        anything derived from it is still up to date.
+
+        :return int: A number which changes whenever the state changes.  It
+            is only meaningful for the lifetime of this service.
+        """
+        return self._generation
+
     def apply_changes_from_source(self, source, changes):
         """
         Apply some changes to the cluster state.
@@ -114,10 +157,10 @@ class ClusterStateService(MultiService):
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
+        deployment_state = self._deployment_state
         for change in changes:
-            self._deployment_state = change.update_cluster_state(
-                self._deployment_state
-            )
+            deployment_state = change.update_cluster_state(deployment_state)
+        self._set_deployment_state(deployment_state)
         for change in changes:
             wiper = change.get_information_wipe()
             key = (wiper.__class__, wiper.key())
@@ -0,0 +1,110 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_index -*-
+
+"""
+Indexes of the cluster configuration, kept up to date as it changes.
+"""
+
+from ._model import Deployment
+
+
+class MetadataIndex(object):
+    """
+    Find the configured datasets with a particular metadata item without
+    looking at any others.
+
+    The index is updated incrementally: nodes and manifestations are
+    immutable, so only the nodes and manifestations which are not the same
+    objects as last time need to be indexed again.
+
+    :ivar Deployment _deployment: The configuration last indexed.
+    :ivar dict _nodes: Map the UUID of each node last indexed to the node.
+    :ivar dict _index: Map each ``(key, value)`` metadata item to a ``set``
+        of ``(dataset_id, node_uuid)`` pairs identifying the primary
+        manifestations of the datasets with that item.
+    """
+    def __init__(self):
+        self._deployment = Deployment()
+        self._nodes = {}
+        self._index = {}
+
+    def _primaries(self, node):
+        """
+        :param Node node: A configured node.
+
+        :return: A ``dict`` mapping the ID of each dataset whose primary
+            manifestation is on the node to that ``Manifestation``.
+        """
+        if node is None or node.manifestations is None:
+            return {}
+        return {
+            dataset_id: manifestation
+            for (dataset_id, manifestation) in node.manifestations.items()
+            if manifestation.primary
+        }
+
+    def _change(self, operation, node_uuid, dataset_id, manifestation):
+        """
+        Add or remove the entries of a manifestation.
+
+        :param operation: ``set.add`` or ``set.discard``.
+        :param UUID node_uuid: The node the manifestation is on.
+        :param unicode dataset_id: The ID of the manifestation's dataset.
+        :param Manifestation manifestation: The manifestation.
+        """
+        for item in manifestation.dataset.metadata.items():
+            entries = self._index.setdefault(item, set())
+            operation(entries, (dataset_id, node_uuid))
+            if not entries:
+                del self._index[item]
+
+    def _update_node(self, uuid, old, new):
+        """
+        Index the changes of one node.
+
+        :param UUID uuid: The node's UUID.
+        :param old: The ``Node`` as last indexed, or ``None``.
+        :param new: The ``Node`` now, or ``None`` if it was removed.
+        """
+        old = self._primaries(old)
+        new = self._primaries(new)
+        for dataset_id, manifestation in old.items():
+            if new.get(dataset_id) is not manifestation:
+                self._change(set.discard, uuid, dataset_id, manifestation)
+        for dataset_id, manifestation in new.items():
+            if old.get(dataset_id) is not manifestation:
+                self._change(set.add, uuid, dataset_id, manifestation)
+
+    def update(self, deployment):
+        """
+        Index a new configuration.
+
+        :param Deployment deployment: The configuration.
+        """
+        if deployment is self._deployment:
+            return
+        nodes = {node.uuid: node for node in deployment.nodes}
+        for uuid in set(self._nodes) | set(nodes):
+            old = self._nodes.get(uuid)
+            new = nodes.get(uuid)
+            if old is not new:
+                self._update_node(uuid, old, new)
+        self._nodes = nodes
+        self._deployment = deployment
+
+    def lookup(self, key, value):
+        """
+        Find the datasets with a metadata item.
+
+        :param unicode key: The item's key.
+        :param unicode value: The item's value.
+
+        :return: A ``list`` of ``(Dataset, node_uuid)`` pairs, giving each
+            matching dataset and the UUID of the node its primary
+            manifestation is on.
+        """
+        return [
+            (self._nodes[node_uuid].manifestations[dataset_id].dataset,
+             node_uuid)
+            for (dataset_id, node_uuid) in self._index.get((key, value), ())
+        ]
@@ -92,6 +92,7 @@ class ConfigurationPersistenceService(Service):
     Persist configuration to disk, and load it back.
 
     :ivar Deployment _deployment: The current desired deployment configuration.
+    :ivar int _generation: The number of times the configuration was saved.
     """
     logger = Logger()
 
@@ -103,6 +104,7 @@ class ConfigurationPersistenceService(Service):
         """
         self._path = path
         self._change_callbacks = []
+        self._generation = 0
 
     def startService(self):
         if not self._path.exists():
@@ -140,6 +142,7 @@ class ConfigurationPersistenceService(Service):
         with _LOG_SAVE(self.logger, configuration=deployment):
             self._sync_save(deployment)
             self._deployment = deployment
+            self._generation += 1
             # At some future point this will likely involve talking to a
             # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
             # guarantee immediate saving of the data.
@@ -161,3 +164,14 @@ class ConfigurationPersistenceService(Service):
         :return Deployment: The current desired configuration.
         """
         return self._deployment
+
+    def generation(self):
+        """
+        Identify the current configuration cheaply, e.g. to tell whether
+        anything derived from it is still up to date.
+
+        :return int: A number which changes whenever the configuration
+            may have changed.  It is only meaningful for the lifetime of
+            this service.
+        """
+        return self._generation
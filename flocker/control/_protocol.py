@@ -35,6 +35,8 @@ from eliot.twisted import DeferredContext
 
 from characteristic import with_cmp
 
+from pyrsistent import PRecord
+
 from zope.interface import Interface, Attribute
 
 from twisted.application.service import Service
@@ -59,6 +61,15 @@ class SerializableArgument(Argument):
     """
     AMP argument that takes an object that can be serialized by the
     configuration persistence layer.
+
+    The same configuration or cluster state is sent to every agent, and
+    usually received again unchanged, so the argument remembers the last
+    immutable (``PRecord``) object it encoded and the last one it decoded.
+    Sending that object again, or receiving the same bytes again, costs
+    nothing.
+
+    :ivar _encoded: The last ``(object, bytes)`` encoded, or ``None``.
+    :ivar _decoded: The last ``(bytes, object)`` decoded, or ``None``.
     """
     def __init__(self, *classes):
         """
@@ -67,21 +78,32 @@ class SerializableArgument(Argument):
         """
         Argument.__init__(self)
         self._expected_classes = classes
+        self._encoded = None
+        self._decoded = None
 
     def fromString(self, in_bytes):
+        if self._decoded is not None and self._decoded[0] == in_bytes:
+            return self._decoded[1]
         obj = wire_decode(in_bytes)
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
+        if isinstance(obj, PRecord):
+            self._decoded = (in_bytes, obj)
         return obj
 
     def toString(self, obj):
+        if self._encoded is not None and self._encoded[0] is obj:
+            return self._encoded[1]
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
-        return wire_encode(obj)
+        encoded = wire_encode(obj)
+        if isinstance(obj, PRecord):
+            self._encoded = (obj, encoded)
+        return encoded
 
 
 class _EliotActionArgument(Unicode):
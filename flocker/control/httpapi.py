@@ -4,6 +4,8 @@ A HTTP REST API for controlling the Dataset Manager.
 """
 
 import yaml
+from bisect import bisect_right
+from itertools import islice
 from uuid import uuid4, UUID
 
 from pyrsistent import pmap, thaw
@@ -25,12 +27,14 @@ from pyrsistent import discard
 
 from ..restapi import (
     EndpointResponse, structured, user_documentation, make_bad_request,
-    private_api
+    private_api, ChangeWatchers, BadRequest, OutputValidation,
+    StreamingResponse,
 )
 from . import (
     Dataset, Manifestation, Application, DockerImage, Port,
-    AttachedVolume, Link
+    AttachedVolume, Link, Node,
 )
+from ._index import MetadataIndex
 from ._config import (
     ApplicationMarshaller, FLOCKER_RESTART_POLICY_NAME_TO_POLICY,
     model_from_configuration, FigConfiguration, FlockerConfiguration,
@@ -43,6 +47,11 @@ from .. import __version__
 # Default port for REST API:
 REST_API_PORT = 4523
 
+# The number of items of each listing the control service validates against
+# the output schema.  Validating all of them costs more than building the
+# listing once there are thousands; the tests validate everything.
+OUTPUT_VALIDATION_ITEMS = 100
+
 
 SCHEMA_BASE = FilePath(__file__).parent().child(b'schema')
 SCHEMAS = {
@@ -85,6 +94,227 @@ DATASET_IN_USE = make_bad_request(
 _UNDEFINED_MAXIMUM_SIZE = object()
 
 
+def _configuration_etag(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return bytes: An entity tag for responses derived only from the
+        configuration.
+    """
+    return b"%s-configuration-%d" % (
+        api.incarnation, api.persistence_service.generation())
+
+
+def _state_etag(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return bytes: An entity tag for responses derived only from the cluster
+        state.
+    """
+    return b"%s-state-%d" % (
+        api.incarnation, api.cluster_state_service.generation())
+
+
+def _configuration_watchers(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return ChangeWatchers: The requests waiting for the configuration to
+        change.
+    """
+    return api._configuration_watchers
+
+
+def _state_watchers(api):
+    """
+    :param ConfigurationAPIUserV1 api: The API.
+
+    :return ChangeWatchers: The requests waiting for the cluster state to
+        change.
+    """
+    return api._state_watchers
+
+
+class _NodeRenderCache(object):
+    """
+    Render the nodes of a deployment or cluster state into response items,
+    only rendering the nodes which changed since the last time.
+
+    Nodes are immutable and updating a deployment leaves the other nodes in
+    it as they were, so a node which is the same object as last time renders
+    the same as last time.
+
+    :ivar _render: The function rendering a node.
+    :ivar dict _rendered: Map the ``id`` of each node rendered last time to
+        the node and what it rendered to.  Keeping the node makes sure its
+        ``id`` is not reused meanwhile.
+    """
+    def __init__(self, render):
+        """
+        :param render: A function which is passed a node and returns a
+            ``list`` of response items.  They must not be modified later.
+        """
+        self._render = render
+        self._rendered = {}
+
+    def render(self, nodes):
+        """
+        :param nodes: The nodes to render.
+
+        :return: A ``list`` of the response items of all the nodes.
+        """
+        return list(self.iterate(nodes))
+
+    def iterate(self, nodes):
+        """
+        Render nodes one at a time, as their items are needed.
+
+        :param nodes: The nodes to render.
+
+        :return: An iterator of the response items of all the nodes.
+        """
+        rendered = {}
+        for node in nodes:
+            node_and_items = self._rendered.get(id(node))
+            if node_and_items is None or node_and_items[0] is not node:
+                node_and_items = (node, self._render(node))
+            rendered[id(node)] = node_and_items
+            for item in node_and_items[1]:
+                yield item
+        self._rendered = rendered
+
+
+def _page_after(after):
+    """
+    :param after: The ``after`` query argument of a dataset listing, or
+        ``None``.
+
+    :return: The dataset ID to list datasets after, or ``None``.
+    """
+    if after is None:
+        return None
+    return after.lower()
+
+
+def _page_limit(limit):
+    """
+    :param limit: The ``limit`` query argument of a dataset listing, or
+        ``None``.
+
+    :return: The most datasets to list as an ``int``, or ``None``.
+    """
+    if limit is None:
+        return None
+    return int(limit)
+
+
+def _select_datasets(datasets, filters, after=None, limit=None):
+    """
+    Find a page of the datasets matching some filters by looking at each of
+    them, for when there are few.
+
+    :param datasets: The rendered datasets, in any order.
+    :param filters: A ``list`` of ``(field, value)`` pairs, all of which the
+        datasets found must have.
+    :param unicode after: Only find datasets with greater IDs than this, or
+        ``None`` to start from the first.
+    :param int limit: The most datasets to find, or ``None`` for all of
+        them.
+
+    :return: A ``list`` of matching datasets, sorted by ID.
+    """
+    result = sorted(
+        (dataset for dataset in datasets
+         if all(dataset.get(field) == value for (field, value) in filters)
+         and (after is None or dataset[u"dataset_id"] > after)),
+        key=lambda dataset: dataset[u"dataset_id"])
+    return result[:limit]
+
+
+class _DatasetIndex(object):
+    """
+    Rendered datasets, sorted by ID and indexed by their primary node and
+    whether they are deleted, so that a page of a listing is found without
+    looking at every dataset.  Listings filtered by metadata use the
+    ``MetadataIndex`` instead.
+
+    The index is rebuilt whenever it is queried with a new version of the
+    datasets, which is cheap compared to validating and encoding all of
+    them for a single response.
+
+    :ivar _version: Identifies the datasets indexed.
+    :ivar list _ids: The IDs of all the datasets, sorted.
+    :ivar dict _datasets: Map the ID of each dataset to the dataset.
+    :ivar dict _index: Map ``(u"primary", primary)`` and ``(u"deleted",
+        deleted)`` to the sorted IDs of the datasets with those values.
+    :ivar dict _members: Map the same keys to ``frozenset`` of the same IDs.
+    """
+    def __init__(self):
+        self._version = None
+        self._ids = []
+        self._datasets = {}
+        self._index = {}
+        self._members = {}
+
+    def _update(self, version, datasets):
+        """
+        Index new datasets, unless they were indexed already.
+
+        :param version: Changes whenever the datasets do.
+        :param datasets: A function returning the rendered datasets.
+        """
+        if version == self._version:
+            return
+        self._datasets = {
+            dataset[u"dataset_id"]: dataset for dataset in datasets()}
+        self._ids = sorted(self._datasets)
+        index = {}
+        for dataset_id in self._ids:
+            dataset = self._datasets[dataset_id]
+            keys = [(u"primary", dataset.get(u"primary"))]
+            if u"deleted" in dataset:
+                keys.append((u"deleted", dataset[u"deleted"]))
+            for key in keys:
+                index.setdefault(key, []).append(dataset_id)
+        self._index = index
+        self._members = {
+            key: frozenset(ids) for (key, ids) in index.items()}
+        self._version = version
+
+    def query(self, version, datasets, filters, after=None, limit=None):
+        """
+        Find a page of the datasets matching some filters.
+
+        :param version: Changes whenever the datasets do.
+        :param datasets: A function returning the rendered datasets, called
+            only if they were not indexed already.
+        :param filters: A ``list`` of keys of ``_index``, all of which the
+            datasets found must match.
+        :param unicode after: Only find datasets with greater IDs than this,
+            or ``None`` to start from the first.
+        :param int limit: The most datasets to find, or ``None`` for all of
+            them.
+
+        :return: A ``list`` of matching datasets, sorted by ID.
+        """
+        self._update(version, datasets)
+        ids = self._ids
+        for key in filters:
+            candidates = self._index.get(key, [])
+            if len(candidates) < len(ids):
+                ids = candidates
+        others = [self._members.get(key, frozenset()) for key in filters]
+        start = 0 if after is None else bisect_right(ids, after)
+        result = []
+        for dataset_id in islice(ids, start, None):
+            if limit is not None and len(result) == limit:
+                break
+            if all(dataset_id in other for other in others):
+                result.append(self._datasets[dataset_id])
+        return result
+
+
 class ConfigurationAPIUserV1(object):
     """
     A user accessing the API.
@@ -92,19 +322,59 @@ class ConfigurationAPIUserV1(object):
     The APIs exposed here typically operate on cluster configuration.  They
     frequently return success results when a configuration change has been made
     durable but has not yet been deployed onto the cluster.
+
+    :ivar bytes incarnation: Identifies this object, so that entity tags from
+        before the control service was restarted don't match.
+    :ivar _NodeRenderCache _configured_datasets: Renders the configured
+        datasets of nodes; likewise ``_configured_containers``,
+        ``_state_datasets``, ``_state_containers`` and ``_state_nodes``.
+    :ivar _DatasetIndex _configured_dataset_index: Indexes the configured
+        datasets for filtered and paged listings; likewise
+        ``_state_dataset_index`` for the datasets in the cluster state.
+    :ivar MetadataIndex _metadata_index: Finds the configured datasets with
+        a particular metadata item.
+    :ivar OutputValidation output_validation: How responses are validated,
+        or ``None`` to validate them in full.
+    :ivar ChangeWatchers _configuration_watchers: Requests waiting for the
+        configuration to change; likewise ``_state_watchers`` for the cluster
+        state.
     """
     app = Klein()
+    output_validation = None
 
-    def __init__(self, persistence_service, cluster_state_service):
+    def __init__(self, persistence_service, cluster_state_service,
+                 reactor=None):
         """
         :param ConfigurationPersistenceService persistence_service: Service
             for retrieving and setting desired configuration.
 
         :param ClusterStateService cluster_state_service: Service that
             knows about the current state of the cluster.
+
+        :param reactor: The ``IReactorTime`` provider timing requests which
+            wait for changes, or ``None`` to use the global reactor.
         """
+        if reactor is None:
+            from twisted.internet import reactor
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
+        self._configuration_watchers = ChangeWatchers(reactor)
+        persistence_service.register(self._configuration_watchers.changed)
+        self._state_watchers = ChangeWatchers(reactor)
+        cluster_state_service.register(self._state_watchers.changed)
+        self.incarnation = uuid4().hex
+        self._configured_datasets = _NodeRenderCache(
+            _configured_datasets_from_node)
+        self._configured_containers = _NodeRenderCache(
+            _configured_containers_from_node)
+        self._state_datasets = _NodeRenderCache(_state_datasets_from_node)
+        self._state_containers = _NodeRenderCache(_state_containers_from_node)
+        self._state_nodes = _NodeRenderCache(_state_node)
+        self._configured_dataset_index = _DatasetIndex()
+        self._state_dataset_index = _DatasetIndex()
+        self._metadata_index = MetadataIndex()
+        persistence_service.register(
+            lambda: self._metadata_index.update(persistence_service.get()))
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -129,9 +399,19 @@ class ConfigurationAPIUserV1(object):
     @user_documentation(
         u"""
         Get the cluster's dataset configuration.
+
+        The ``primary``, ``deleted``, and ``metadata_key`` and
+        ``metadata_value`` query arguments list only the datasets on a
+        particular node, which are or aren't deleted, or which have a
+        particular metadata item.  The ``limit`` query argument lists at
+        most that many datasets, sorted by ID; pass the ID of the last one
+        as the ``after`` query argument to get the next page.
         """,
         header=u"Get the cluster's dataset configuration",
-        examples=[u"get configured datasets"],
+        examples=[
+            u"get configured datasets",
+            u"get a page of configured datasets",
+        ],
         section=u"dataset",
     )
     @structured(
@@ -141,15 +421,59 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/configuration_datasets_list',
         },
         schema_store=SCHEMAS,
+        etag=_configuration_etag,
+        watch=_configuration_watchers,
+        query_schema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_query',
+        },
     )
-    def get_dataset_configuration(self):
+    def get_dataset_configuration(self, primary=None, deleted=None,
+                                  metadata_key=None, metadata_value=None,
+                                  after=None, limit=None):
         """
         Get the configured datasets.
 
-        :return: A ``list`` of ``dict`` representing each of dataset
-            that is configured to exist anywhere on the cluster.
+        :param unicode primary: Only get the datasets whose primary is the
+            node with this UUID, unless ``None``.
+        :param unicode deleted: Only get the datasets which are deleted if
+            ``u"true"``, or which aren't if ``u"false"``, unless ``None``.
+        :param unicode metadata_key: Only get the datasets with this
+            metadata item, whose value is ``metadata_value``, unless
+            ``None``.
+        :param unicode metadata_value: See ``metadata_key``.
+        :param unicode after: Only get the datasets with greater IDs than
+            this, unless ``None``.
+        :param unicode limit: The most datasets to get, or ``None`` for all
+            of them.
+
+        :return: A ``StreamingResponse`` of ``dict`` representing each
+            dataset that is configured to exist anywhere on the cluster.
         """
-        return list(datasets_from_deployment(self.persistence_service.get()))
+        deployment = self.persistence_service.get()
+        nodes = deployment.nodes
+        filters = []
+        if primary is not None:
+            filters.append((u"primary", primary.lower()))
+        if deleted is not None:
+            filters.append((u"deleted", deleted == u"true"))
+        if metadata_key is not None:
+            # Usually a no-op, since the index is updated on every save:
+            self._metadata_index.update(deployment)
+            matches = [
+                api_dataset_from_dataset_and_node(dataset, node_uuid)
+                for (dataset, node_uuid)
+                in self._metadata_index.lookup(metadata_key, metadata_value)
+            ]
+            return StreamingResponse(_select_datasets(
+                matches, filters, after=_page_after(after),
+                limit=_page_limit(limit)))
+        if not filters and after is None and limit is None:
+            return StreamingResponse(self._configured_datasets.iterate(nodes))
+        return StreamingResponse(self._configured_dataset_index.query(
+            self.persistence_service.generation(),
+            lambda: self._configured_datasets.iterate(nodes),
+            filters, after=_page_after(after), limit=_page_limit(limit)))
 
     @app.route("/configuration/datasets", methods=['POST'])
     @user_documentation(
@@ -205,45 +529,12 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        if dataset_id is None:
-            dataset_id = unicode(uuid4())
-        dataset_id = dataset_id.lower()
-
-        if metadata is None:
-            metadata = {}
-
-        primary = UUID(hex=primary)
-
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes:
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
-
-        # XXX Check cluster state to determine if the given primary node
-        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
-        # See FLOC-1278
-
-        dataset = Dataset(
-            dataset_id=dataset_id,
-            maximum_size=maximum_size,
-            metadata=pmap(metadata)
-        )
-        manifestation = Manifestation(dataset=dataset, primary=True)
-
-        primary_node = deployment.get_node(primary)
-
-        new_node_config = primary_node.transform(
-            ("manifestations", manifestation.dataset_id), manifestation)
-        new_deployment = deployment.update_node(new_node_config)
-        saving = self.persistence_service.save(new_deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(dataset, primary)
-            return EndpointResponse(CREATED, result)
-        saving.addCallback(saved)
+        changes = _DatasetChanges(self.persistence_service.get())
+        result = changes.create(
+            primary, dataset_id=dataset_id, maximum_size=maximum_size,
+            metadata=metadata)
+        saving = self.persistence_service.save(changes.deployment())
+        saving.addCallback(lambda _: EndpointResponse(CREATED, result))
         return saving
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['DELETE'])
@@ -277,26 +568,10 @@ class ConfigurationAPIUserV1(object):
             as deleted in the cluster configuration or giving error
             information if this is not possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # XXX this doesn't handle replicas
-        # https://clusterhq.atlassian.net/browse/FLOC-1240
-        old_manifestation, origin_node = _find_manifestation_and_node(
-            deployment, dataset_id)
-
-        new_node = origin_node.transform(
-            ("manifestations", dataset_id, "dataset", "deleted"), True)
-        deployment = deployment.update_node(new_node)
-
-        saving = self.persistence_service.save(deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                new_node.manifestations[dataset_id].dataset, new_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        changes = _DatasetChanges(self.persistence_service.get())
+        result = changes.delete(dataset_id)
+        saving = self.persistence_service.save(changes.deployment())
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
         return saving
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['POST'])
@@ -339,37 +614,71 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
-
-        if primary_manifestation.dataset.deleted:
-            raise DATASET_DELETED
-
-        if primary is not None:
-            deployment = _update_dataset_primary(
-                deployment, dataset_id, UUID(hex=primary)
-            )
+        changes = _DatasetChanges(self.persistence_service.get())
+        result = changes.update(dataset_id, primary=primary)
+        saving = self.persistence_service.save(changes.deployment())
+        saving.addCallback(lambda _: EndpointResponse(OK, result))
+        return saving
 
-        saving = self.persistence_service.save(deployment)
+    @app.route("/configuration/datasets/_bulk", methods=['POST'])
+    @user_documentation(
+        u"""
+        Create, update and delete many datasets with one request.
+
+        The operations are carried out in order, each as the corresponding
+        single dataset endpoint would, and the configuration is then saved
+        once.  An operation which fails does not prevent later ones from
+        being carried out.  The response has the response code and body
+        the corresponding endpoint would have responded with for each
+        operation.
+        """,
+        header=u"Change many datasets",
+        examples=[
+            u"bulk change datasets",
+        ],
+        section=u"dataset",
+    )
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_bulk_results'},
+        schema_store=SCHEMAS
+    )
+    def bulk_datasets(self, operations):
+        """
+        Change many datasets in the cluster configuration at once.
 
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
+        :param list operations: A ``dict`` for each change.  Its ``action``
+            is ``u"create"``, ``u"update"`` or ``u"delete"``, and its other
+            items are the arguments of the corresponding endpoint.
 
-        # Return an API response dictionary containing the dataset with updated
-        # primary address.
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                primary_manifestation.dataset,
-                current_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
+        :return: A ``list`` of ``dict``, the response code and body for each
+            operation.
+        """
+        changes = _DatasetChanges(self.persistence_service.get())
+        results = []
+        changed = False
+        for operation in operations:
+            arguments = operation.copy()
+            action = arguments.pop(u"action")
+            try:
+                result = getattr(changes, action)(**arguments)
+            except BadRequest as e:
+                results.append({u"code": e.code, u"result": e.result})
+            else:
+                changed = True
+                results.append({
+                    u"code": CREATED if action == u"create" else OK,
+                    u"result": result,
+                })
+        if not changed:
+            return results
+        saving = self.persistence_service.save(changes.deployment())
+        saving.addCallback(lambda _: results)
         return saving
 
     @app.route("/state/datasets", methods=['GET'])
@@ -388,42 +697,43 @@ class ConfigurationAPIUserV1(object):
         outputSchema={
             '$ref': '/v1/endpoints.json#/definitions/state_datasets_array'
             },
-        schema_store=SCHEMAS
+        schema_store=SCHEMAS,
+        etag=_state_etag,
+        watch=_state_watchers,
+        query_schema={
+            '$ref': '/v1/endpoints.json#/definitions/state_datasets_query',
+        },
     )
-    def state_datasets(self):
+    def state_datasets(self, primary=None, after=None, limit=None):
         """
         Return all primary manifest datasets and all non-manifest datasets in
         the cluster.
 
-        :return: A ``list`` containing all datasets in the cluster.
+        :param unicode primary: Only return the datasets whose primary is the
+            node with this UUID, unless ``None``.
+        :param unicode after: Only return the datasets with greater IDs than
+            this, unless ``None``.
+        :param unicode limit: The most datasets to return, or ``None`` for
+            all of them.
+
+        :return: A ``StreamingResponse`` of all datasets in the cluster.
         """
-        # XXX This duplicates code in datasets_from_deployment, but that
-        # function is designed to operate on a Deployment rather than a
-        # DeploymentState instance and the dataset configuration result
-        # includes metadata and deleted flags which should not be part of the
-        # dataset state response.
-        # Refactor. See FLOC-2207.
-        response = []
         deployment_state = self.cluster_state_service.as_deployment()
-        get_manifestation_path = self.cluster_state_service.manifestation_path
-
-        for dataset, node in deployment_state.all_datasets():
-            response_dataset = dict(
-                dataset_id=dataset.dataset_id,
-            )
 
-            if node is not None:
-                response_dataset[u"primary"] = unicode(node.uuid)
-                response_dataset[u"path"] = get_manifestation_path(
-                    node.uuid,
-                    dataset[u"dataset_id"]
-                ).path.decode("utf-8")
-
-            if dataset.maximum_size is not None:
-                response_dataset[u"maximum_size"] = dataset.maximum_size
-
-            response.append(response_dataset)
-        return response
+        def datasets():
+            for dataset in self._state_datasets.iterate(
+                    deployment_state.nodes):
+                yield dataset
+            for dataset in deployment_state.nonmanifest_datasets.values():
+                yield _state_dataset(dataset)
+        if primary is None and after is None and limit is None:
+            return StreamingResponse(datasets())
+        filters = []
+        if primary is not None:
+            filters.append((u"primary", primary.lower()))
+        return StreamingResponse(self._state_dataset_index.query(
+            self.cluster_state_service.generation(), datasets,
+            filters, after=_page_after(after), limit=_page_limit(limit)))
 
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
@@ -442,15 +752,19 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/configuration_containers_array',
         },
         schema_store=SCHEMAS,
+        etag=_configuration_etag,
+        watch=_configuration_watchers,
     )
     def get_containers_configuration(self):
         """
         Get the configured containers.
 
-        :return: A ``list`` of ``dict`` representing each of the containers
-            that are configured to exist anywhere on the cluster.
+        :return: A ``StreamingResponse`` of ``dict`` representing each of
+            the containers that are configured to exist anywhere on the
+            cluster.
         """
-        return list(containers_from_deployment(self.persistence_service.get()))
+        return StreamingResponse(self._configured_containers.iterate(
+            self.persistence_service.get().nodes))
 
     @app.route("/state/containers", methods=['GET'])
     @user_documentation(
@@ -470,25 +784,18 @@ class ConfigurationAPIUserV1(object):
             '/v1/endpoints.json#/definitions/state_containers_array',
         },
         schema_store=SCHEMAS,
+        etag=_state_etag,
+        watch=_state_watchers,
     )
     def get_containers_state(self):
         """
         Get the containers present in the cluster.
 
-        :return: A ``list`` of ``dict`` representing each of the containers
-            that are configured to exist anywhere on the cluster.
+        :return: A ``StreamingResponse`` of ``dict`` representing each of
+            the containers present in the cluster.
         """
-        result = []
-        deployment_state = self.cluster_state_service.as_deployment()
-        for node in deployment_state.nodes:
-            if node.applications is None:
-                continue
-            for application in node.applications:
-                container = container_configuration_response(
-                    application, node.uuid)
-                container[u"running"] = application.running
-                result.append(container)
-        return result
+        return StreamingResponse(self._state_containers.iterate(
+            self.cluster_state_service.as_deployment().nodes))
 
     def _get_attached_volume(self, node_uuid, volume):
         """
@@ -812,12 +1119,13 @@ class ConfigurationAPIUserV1(object):
         inputSchema={},
         outputSchema={"$ref":
                       '/v1/endpoints.json#/definitions/nodes_array'},
-        schema_store=SCHEMAS
+        schema_store=SCHEMAS,
+        etag=_state_etag,
+        watch=_state_watchers,
     )
     def list_current_nodes(self):
-        return [{u"host": node.hostname, u"uuid": unicode(node.uuid)}
-                for node in
-                self.cluster_state_service.as_deployment().nodes]
+        return StreamingResponse(self._state_nodes.iterate(
+            self.cluster_state_service.as_deployment().nodes))
 
     @app.route("/configuration/_compose", methods=['POST'])
     @private_api
@@ -886,37 +1194,6 @@ def _find_manifestation_and_node(deployment, dataset_id):
     return primary_manifestation, origin_node
 
 
-def _update_dataset_primary(deployment, dataset_id, primary):
-    """
-    Update the ``deployment`` so that the ``Dataset`` with the supplied
-    ``dataset_id`` is on the ``Node`` with the supplied ``primary`` address.
-
-    :param Deployment deployment: The deployment containing the dataset to be
-        updated.
-    :param unicode dataset_id: The ID of the dataset to be updated.
-    :param UUID primary: The UUID of the new primary node of the
-        supplied ``dataset_id``.
-    :returns: An updated ``Deployment``.
-    """
-    primary_manifestation, old_primary_node = _find_manifestation_and_node(
-        deployment, dataset_id
-    )
-    # Now construct a new_deployment where the primary manifestation of the
-    # dataset is on the requested primary node.
-    old_primary_node = old_primary_node.transform(
-        ("manifestations", primary_manifestation.dataset_id), discard
-    )
-    deployment = deployment.update_node(old_primary_node)
-
-    new_primary_node = deployment.get_node(primary)
-    new_primary_node = new_primary_node.transform(
-        ("manifestations", dataset_id), primary_manifestation
-    )
-
-    deployment = deployment.update_node(new_primary_node)
-    return deployment
-
-
 def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     """
     Update the ``deployment`` so that the ``Dataset`` with the supplied
@@ -938,6 +1215,151 @@ def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     return deployment.set(nodes=deployment.nodes.add(node))
 
 
+class _DatasetChanges(object):
+    """
+    Changes to the configured datasets, made one after another and then
+    saved together.
+
+    The methods check and make one change each, as the corresponding dataset
+    endpoint describes, returning the dataset as that endpoint would respond.
+    A change which is not possible raises ``BadRequest`` without any effect.
+
+    :ivar Deployment _deployment: The configuration before the changes.
+    :ivar dict _nodes: Map the UUID of each configured node to its ``Node``,
+        as changed so far.
+    :ivar dict _locations: Map the ID of each configured dataset to a
+        ``list`` of the UUIDs of the nodes with manifestations of it.
+    """
+    def __init__(self, deployment):
+        """
+        :param Deployment deployment: The configuration to change.
+        """
+        self._deployment = deployment
+        self._nodes = {}
+        self._locations = {}
+        for node in deployment.nodes:
+            self._nodes[node.uuid] = node
+            for dataset_id in node.manifestations:
+                self._locations.setdefault(dataset_id, []).append(node.uuid)
+
+    def deployment(self):
+        """
+        :return Deployment: The configuration with all the changes made.
+        """
+        return self._deployment.set(nodes=frozenset(self._nodes.values()))
+
+    def _node(self, uuid):
+        """
+        :param UUID uuid: The UUID of a node.
+
+        :return Node: The node with that UUID, as changed so far, or a new
+            one if it is not configured.
+        """
+        node = self._nodes.get(uuid)
+        if node is None:
+            node = Node(uuid=uuid)
+        return node
+
+    def _find(self, dataset_id):
+        """
+        Find the primary manifestation of a dataset and the node it's on.
+
+        :param unicode dataset_id: The unique identifier of the dataset.
+
+        :raise BadRequest: ``DATASET_NOT_FOUND`` if there is no such dataset.
+
+        :return: Tuple containing the primary ``Manifestation`` and the
+            ``Node`` it is on.
+        """
+        uuids = self._locations.get(dataset_id)
+        if not uuids:
+            raise DATASET_NOT_FOUND
+        for uuid in uuids:
+            node = self._nodes[uuid]
+            manifestation = node.manifestations[dataset_id]
+            if manifestation.primary:
+                return manifestation, node
+        raise IndexError(
+            'No primary manifestations for dataset: {!r}. See '
+            'https://clusterhq.atlassian.net/browse/FLOC-1403'.format(
+                dataset_id)
+        )
+
+    def create(self, primary, dataset_id=None, maximum_size=None,
+               metadata=None):
+        """
+        Create a new dataset.  See
+        ``ConfigurationAPIUserV1.create_dataset_configuration``.
+        """
+        if dataset_id is None:
+            dataset_id = unicode(uuid4())
+        dataset_id = dataset_id.lower()
+
+        if metadata is None:
+            metadata = {}
+
+        primary = UUID(hex=primary)
+
+        if dataset_id in self._locations:
+            raise DATASET_ID_COLLISION
+
+        # XXX Check cluster state to determine if the given primary node
+        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
+        # See FLOC-1278
+
+        dataset = Dataset(
+            dataset_id=dataset_id,
+            maximum_size=maximum_size,
+            metadata=pmap(metadata)
+        )
+        manifestation = Manifestation(dataset=dataset, primary=True)
+        self._nodes[primary] = self._node(primary).transform(
+            ("manifestations", dataset_id), manifestation)
+        self._locations[dataset_id] = [primary]
+        return api_dataset_from_dataset_and_node(dataset, primary)
+
+    def update(self, dataset_id, primary=None):
+        """
+        Update an existing dataset.  See
+        ``ConfigurationAPIUserV1.update_dataset``.
+        """
+        manifestation, node = self._find(dataset_id)
+
+        if manifestation.dataset.deleted:
+            raise DATASET_DELETED
+
+        if primary is not None:
+            # Move the primary manifestation of the dataset to the requested
+            # primary node.
+            primary = UUID(hex=primary)
+            locations = self._locations[dataset_id]
+            self._nodes[node.uuid] = node.transform(
+                ("manifestations", dataset_id), discard)
+            locations.remove(node.uuid)
+            node = self._node(primary).transform(
+                ("manifestations", dataset_id), manifestation)
+            self._nodes[primary] = node
+            if primary not in locations:
+                locations.append(primary)
+
+        return api_dataset_from_dataset_and_node(
+            manifestation.dataset, node.uuid)
+
+    def delete(self, dataset_id):
+        """
+        Mark an existing dataset as deleted.  See
+        ``ConfigurationAPIUserV1.delete_dataset``.
+        """
+        # XXX this doesn't handle replicas
+        # https://clusterhq.atlassian.net/browse/FLOC-1240
+        manifestation, node = self._find(dataset_id)
+        node = node.transform(
+            ("manifestations", dataset_id, "dataset", "deleted"), True)
+        self._nodes[node.uuid] = node
+        return api_dataset_from_dataset_and_node(
+            node.manifestations[dataset_id].dataset, node.uuid)
+
+
 def manifestations_from_deployment(deployment, dataset_id):
     """
     Extract all other manifestations of the supplied dataset_id from the
@@ -969,17 +1391,28 @@ def datasets_from_deployment(deployment):
     :return: Iterable returning all datasets.
     """
     for node in deployment.nodes:
-        if node.manifestations is None:
-            continue
-        for manifestation in node.manifestations.values():
-            if manifestation.primary:
-                # There may be multiple datasets marked as primary until we
-                # implement consistency checking when state is reported by each
-                # node.
-                # See https://clusterhq.atlassian.net/browse/FLOC-1303
-                yield api_dataset_from_dataset_and_node(
-                    manifestation.dataset, node.uuid
-                )
+        for dataset in _configured_datasets_from_node(node):
+            yield dataset
+
+
+def _configured_datasets_from_node(node):
+    """
+    :param Node node: A node of a ``Deployment``.
+
+    :return: A ``list`` of the node's primary datasets, as returned by
+        ``datasets_from_deployment``.
+    """
+    if node.manifestations is None:
+        return []
+    # There may be multiple datasets marked as primary until we
+    # implement consistency checking when state is reported by each
+    # node.
+    # See https://clusterhq.atlassian.net/browse/FLOC-1303
+    return [
+        api_dataset_from_dataset_and_node(manifestation.dataset, node.uuid)
+        for manifestation in node.manifestations.values()
+        if manifestation.primary
+    ]
 
 
 def containers_from_deployment(deployment):
@@ -992,8 +1425,84 @@ def containers_from_deployment(deployment):
     :return: Iterable returning all containers.
     """
     for node in deployment.nodes:
-        for application in node.applications:
-            yield container_configuration_response(application, node.uuid)
+        for container in _configured_containers_from_node(node):
+            yield container
+
+
+def _configured_containers_from_node(node):
+    """
+    :param Node node: A node of a ``Deployment``.
+
+    :return: A ``list`` of the node's containers, as returned by
+        ``containers_from_deployment``.
+    """
+    return [container_configuration_response(application, node.uuid)
+            for application in node.applications]
+
+
+def _state_dataset(dataset, node=None):
+    """
+    :param Dataset dataset: A dataset of a ``DeploymentState``.
+    :param NodeState node: The node which has the dataset's primary
+        manifestation, or ``None`` if it has none.
+
+    :return: A ``dict`` describing the dataset, as an item of
+        ``/v1/endpoints.json#/definitions/state_datasets_array``.
+    """
+    # XXX This duplicates code in api_dataset_from_dataset_and_node, but
+    # that function is designed to operate on a Deployment rather than a
+    # DeploymentState instance and the dataset configuration result
+    # includes metadata and deleted flags which should not be part of the
+    # dataset state response.
+    # Refactor. See FLOC-2207.
+    result = dict(dataset_id=dataset.dataset_id)
+    if node is not None:
+        result[u"primary"] = unicode(node.uuid)
+        result[u"path"] = node.paths[dataset.dataset_id].path.decode("utf-8")
+    if dataset.maximum_size is not None:
+        result[u"maximum_size"] = dataset.maximum_size
+    return result
+
+
+def _state_datasets_from_node(node):
+    """
+    :param NodeState node: A node of a ``DeploymentState``.
+
+    :return: A ``list`` of the datasets the node has the primary
+        manifestations of, as returned by ``_state_dataset``.
+    """
+    if node.manifestations is None:
+        return []
+    return [_state_dataset(manifestation.dataset, node)
+            for manifestation in node.manifestations.values()
+            if manifestation.primary]
+
+
+def _state_containers_from_node(node):
+    """
+    :param NodeState node: A node of a ``DeploymentState``.
+
+    :return: A ``list`` of the containers on the node, conforming to
+        ``/v1/endpoints.json#/definitions/state_container``.
+    """
+    if node.applications is None:
+        return []
+    result = []
+    for application in node.applications:
+        container = container_configuration_response(application, node.uuid)
+        container[u"running"] = application.running
+        result.append(container)
+    return result
+
+
+def _state_node(node):
+    """
+    :param NodeState node: A node of a ``DeploymentState``.
+
+    :return: A one item ``list`` describing the node, as an item of
+        ``/v1/endpoints.json#/definitions/nodes_array``.
+    """
+    return [{u"host": node.hostname, u"uuid": unicode(node.uuid)}]
 
 
 def container_configuration_response(application, node):
@@ -1066,6 +1575,7 @@ def create_api_service(persistence_service, cluster_state_service, endpoint,
     """
     api_root = Resource()
     user = ConfigurationAPIUserV1(persistence_service, cluster_state_service)
+    user.output_validation = OutputValidation(items=OUTPUT_VALIDATION_ITEMS)
     api_root.putChild('v1', user.app.resource())
     api_root._v1_user = user  # For unit testing purposes, alas
 
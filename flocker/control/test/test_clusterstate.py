@@ -6,6 +6,8 @@ Tests for ``flocker.control._clusterstate``.
 
 from uuid import uuid4
 
+from eliot.testing import validate_logging
+
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
@@ -170,6 +172,60 @@ class ClusterStateServiceTests(SynchronousTestCase):
             [DeploymentState(nodes=[self.WITH_APPS]), DeploymentState()],
         )
 
+    def test_generation_changes(self):
+        """
+        ``ClusterStateService.generation`` changes when changes are applied
+        and when information is wiped.
+        """
+        service = self.service()
+        generations = [service.generation()]
+        service.apply_changes([self.WITH_APPS])
+        generations.append(service.generation())
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        generations.append(service.generation())
+        self.assertEqual(3, len(set(generations)))
+
+    def test_generation_unchanged(self):
+        """
+        ``ClusterStateService.generation`` doesn't change when changes are
+        applied which leave the state as it was.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        before = service.generation()
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual(before, service.generation())
+
+    def test_register_for_callback(self):
+        """
+        Callbacks can be registered that are called every time the known
+        state changes, but not when changes leave the state as it was.
+        """
+        service = self.service()
+        callbacks = []
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS])
+        service.apply_changes([self.WITH_APPS])
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual([1, 1], callbacks)
+
+    @validate_logging(
+        lambda test, logger:
+        test.assertEqual(len(logger.flush_tracebacks(ZeroDivisionError)), 1))
+    def test_register_for_callback_failure(self, logger):
+        """
+        Failed callbacks don't prevent later callbacks from being called.
+        """
+        service = self.service()
+        service.logger = logger
+        callbacks = []
+        service.register(lambda: 1/0)
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual([1], callbacks)
+
     def test_expiration_from_inactivity(self):
         """
         Information updates from a source with no activity for more than the
@@ -4,7 +4,7 @@ Tests for ``flocker.control.httpapi``.
 """
 
 from io import BytesIO
-from uuid import uuid4
+from uuid import UUID, uuid4
 from copy import deepcopy
 
 from pyrsistent import pmap, thaw
@@ -18,7 +18,7 @@ from twisted.trial.unittest import SynchronousTestCase
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND, INTERNAL_SERVER_ERROR,
-    NOT_ALLOWED as METHOD_NOT_ALLOWED
+    NOT_ALLOWED as METHOD_NOT_ALLOWED, NOT_MODIFIED
 )
 from twisted.web.http_headers import Headers
 from twisted.web.client import FileBodyProducer, readBody
@@ -28,7 +28,7 @@ from twisted.internet.ssl import ClientContextFactory
 from twisted.internet.task import Clock
 
 from ...restapi.testtools import (
-    buildIntegrationTests, dumps, loads)
+    MemoryAgent, buildIntegrationTests, dumps, loads)
 
 from .. import (
     Application, Dataset, Manifestation, Node, NodeState,
@@ -38,7 +38,8 @@ from .. import (
 )
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
-    api_dataset_from_dataset_and_node, container_configuration_response
+    api_dataset_from_dataset_and_node, container_configuration_response,
+    _NodeRenderCache, _DatasetIndex, OUTPUT_VALIDATION_ITEMS,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
@@ -67,7 +68,8 @@ class APITestsMixin(object):
         self.persistence_service = ConfigurationPersistenceService(
             reactor, FilePath(self.mktemp()))
         self.persistence_service.startService()
-        self.cluster_state_service = ClusterStateService(Clock())
+        self.clock = Clock()
+        self.cluster_state_service = ClusterStateService(self.clock)
         self.cluster_state_service.startService()
         self.addCleanup(self.cluster_state_service.stopService)
         self.addCleanup(self.persistence_service.stopService)
@@ -179,7 +181,8 @@ class VersionTestsMixin(APITestsMixin):
 def _build_app(test):
     test.initialize()
     return ConfigurationAPIUserV1(test.persistence_service,
-                                  test.cluster_state_service).app
+                                  test.cluster_state_service,
+                                  test.clock).app
 RealTestsAPI, MemoryTestsAPI = buildIntegrationTests(
     VersionTestsMixin, "API", _build_app)
 
@@ -2429,6 +2432,147 @@ RealTestsDeleteDataset, MemoryTestsDeleteDataset = (
 )
 
 
+class BulkDatasetsTestsMixin(APITestsMixin):
+    """
+    Tests for the bulk dataset endpoint at ``/configuration/datasets/_bulk``.
+    """
+    def setup_dataset(self):
+        """
+        Configure a dataset on node A.
+
+        :return: A ``Deferred`` that fires with the ``Dataset`` once the
+            configuration is saved.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        saving = self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID, manifestations={
+                dataset.dataset_id: Manifestation(
+                    dataset=dataset, primary=True)})}))
+        return saving.addCallback(lambda _: dataset)
+
+    def count_saves(self):
+        """
+        :return: A ``list`` which grows by one item each time the
+            configuration is saved.
+        """
+        saves = []
+        self.persistence_service.register(lambda: saves.append(None))
+        return saves
+
+    def test_operations(self):
+        """
+        Datasets are created, updated and deleted in order, with a response
+        for each operation like the corresponding endpoint's, and the
+        configuration is saved once.
+        """
+        created_id = unicode(uuid4())
+        setting_up = self.setup_dataset()
+
+        def set_up(dataset):
+            saves = self.count_saves()
+            requesting = self.assertResult(
+                b"POST", b"/configuration/datasets/_bulk",
+                {u"operations": [
+                    {u"action": u"create", u"primary": self.NODE_A,
+                     u"dataset_id": created_id},
+                    {u"action": u"update", u"primary": self.NODE_B,
+                     u"dataset_id": dataset.dataset_id},
+                    {u"action": u"delete", u"dataset_id": created_id},
+                ]},
+                OK,
+                [{u"code": CREATED,
+                  u"result": {u"dataset_id": created_id,
+                              u"primary": self.NODE_A,
+                              u"metadata": {}, u"deleted": False}},
+                 {u"code": OK,
+                  u"result": {u"dataset_id": dataset.dataset_id,
+                              u"primary": self.NODE_B,
+                              u"metadata": {}, u"deleted": False}},
+                 {u"code": OK,
+                  u"result": {u"dataset_id": created_id,
+                              u"primary": self.NODE_A,
+                              u"metadata": {}, u"deleted": True}}])
+            requesting.addCallback(lambda _: self.assertEqual(
+                ({(self.NODE_A_UUID, created_id, True),
+                  (self.NODE_B_UUID, dataset.dataset_id, False)},
+                 1),
+                ({(node.uuid, dataset_id, manifestation.dataset.deleted)
+                  for node in self.persistence_service.get().nodes
+                  for (dataset_id, manifestation)
+                  in node.manifestations.items()},
+                 len(saves))))
+            return requesting
+        return setting_up.addCallback(set_up)
+
+    def test_failed_operations(self):
+        """
+        An operation which fails gets the error response of the
+        corresponding endpoint, and doesn't stop later operations.
+        """
+        created_id = unicode(uuid4())
+        setting_up = self.setup_dataset()
+
+        def set_up(dataset):
+            requesting = self.assertResult(
+                b"POST", b"/configuration/datasets/_bulk",
+                {u"operations": [
+                    {u"action": u"create", u"primary": self.NODE_A,
+                     u"dataset_id": dataset.dataset_id},
+                    {u"action": u"delete", u"dataset_id": created_id},
+                    {u"action": u"create", u"primary": self.NODE_A,
+                     u"dataset_id": created_id},
+                ]},
+                OK,
+                [{u"code": CONFLICT,
+                  u"result": {u"description":
+                              u"The provided dataset_id is already in use."}},
+                 {u"code": NOT_FOUND,
+                  u"result": {u"description": u"Dataset not found."}},
+                 {u"code": CREATED,
+                  u"result": {u"dataset_id": created_id,
+                              u"primary": self.NODE_A,
+                              u"metadata": {}, u"deleted": False}}])
+            requesting.addCallback(lambda _: self.assertEqual(
+                {dataset.dataset_id, created_id},
+                set(get_dataset_ids(self.persistence_service.get()))))
+            return requesting
+        return setting_up.addCallback(set_up)
+
+    def test_nothing_changed(self):
+        """
+        If every operation fails the configuration isn't saved.
+        """
+        saves = self.count_saves()
+        requesting = self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"action": u"delete", u"dataset_id": unicode(uuid4())}]},
+            OK)
+        requesting.addCallback(lambda _: self.assertEqual([], saves))
+        return requesting
+
+    def test_invalid_operation(self):
+        """
+        If any operation doesn't match the schema, the request fails and
+        nothing is changed.
+        """
+        saves = self.count_saves()
+        requesting = self.assertResponseCode(
+            b"POST", b"/configuration/datasets/_bulk",
+            {u"operations": [
+                {u"action": u"create", u"primary": self.NODE_A},
+                {u"action": u"resize", u"dataset_id": unicode(uuid4())}]},
+            BAD_REQUEST)
+        requesting.addCallback(lambda _: self.assertEqual([], saves))
+        return requesting
+
+
+RealTestsBulkDatasets, MemoryTestsBulkDatasets = (
+    buildIntegrationTests(
+        BulkDatasetsTestsMixin, "BulkDatasets", _build_app)
+)
+
+
 def get_dataset_ids(deployment):
     """
     Get an iterator of all of the ``dataset_id`` values on all nodes in the
@@ -2620,6 +2764,198 @@ RealTestsGetDatasetConfiguration, MemoryTestsGetDatasetConfiguration = (
 )
 
 
+def _dataset_id(n):
+    """
+    :param int n: A small number.
+
+    :return unicode: A dataset ID which sorts in the same order as ``n``.
+    """
+    return unicode(UUID(int=n))
+
+
+class DatasetListingTestsMixin(APITestsMixin):
+    """
+    Tests for the filtering and paging query arguments of the dataset
+    listings at ``/configuration/datasets`` and ``/state/datasets``.
+    """
+    def list_ids(self, path):
+        """
+        Get a dataset listing.
+
+        :param path: The path and query to request, ASCII ``bytes`` or
+            ``unicode``.
+
+        :return: A ``Deferred`` that fires with the IDs of the datasets
+            listed, in the order listed.
+        """
+        requesting = self.assertResponseCode(b"GET", bytes(path), None, OK)
+        requesting.addCallback(readBody)
+        requesting.addCallback(lambda body: [
+            dataset[u"dataset_id"] for dataset in loads(body)])
+        return requesting
+
+    def configure(self):
+        """
+        Configure datasets 1 to 3 on node A, dataset 2 being deleted and
+        dataset 3 having some metadata, and datasets 4 and 5 on node B,
+        dataset 4 having the same metadata.
+
+        :return: A ``Deferred`` that fires when the configuration is saved.
+        """
+        def node(uuid, datasets):
+            return Node(uuid=uuid, manifestations={
+                dataset.dataset_id: Manifestation(
+                    dataset=dataset, primary=True)
+                for dataset in datasets})
+        return self.persistence_service.save(Deployment(nodes={
+            node(self.NODE_A_UUID, [
+                Dataset(dataset_id=_dataset_id(1)),
+                Dataset(dataset_id=_dataset_id(2), deleted=True),
+                Dataset(dataset_id=_dataset_id(3),
+                        metadata={u"name": u"x"})]),
+            node(self.NODE_B_UUID, [
+                Dataset(dataset_id=_dataset_id(4),
+                        metadata={u"name": u"x"}),
+                Dataset(dataset_id=_dataset_id(5))])}))
+
+    def assert_listings(self, listings):
+        """
+        Get several dataset listings.
+
+        :param listings: A ``list`` of pairs of a path and query to request
+            and the numbers of the datasets it should list, in order.
+
+        :return: A ``Deferred`` that fires once the listings were checked.
+        """
+        getting = gatherResults(
+            [self.list_ids(path) for (path, _) in listings])
+        getting.addCallback(lambda ids: self.assertEqual(
+            [[_dataset_id(n) for n in expected] for (_, expected) in listings],
+            ids))
+        return getting
+
+    def test_configuration_filters(self):
+        """
+        Configured datasets can be filtered by primary node, whether they are
+        deleted and a metadata item, alone or together.
+        """
+        configuring = self.configure()
+        configuring.addCallback(lambda _: self.assert_listings([
+            (b"/configuration/datasets?primary=" + self.NODE_A.upper(),
+             [1, 2, 3]),
+            (b"/configuration/datasets?deleted=true", [2]),
+            (b"/configuration/datasets?deleted=false", [1, 3, 4, 5]),
+            (b"/configuration/datasets?metadata_key=name&metadata_value=x",
+             [3, 4]),
+            (b"/configuration/datasets?metadata_key=name&metadata_value=y",
+             []),
+            (b"/configuration/datasets?metadata_key=name&metadata_value=x"
+             b"&primary=" + self.NODE_B + b"&deleted=false", [4]),
+        ]))
+        return configuring
+
+    def test_configuration_pages(self):
+        """
+        Configured datasets can be listed a page at a time, in order of their
+        IDs.
+        """
+        configuring = self.configure()
+        configuring.addCallback(lambda _: self.assert_listings([
+            (b"/configuration/datasets?limit=2", [1, 2]),
+            (b"/configuration/datasets?limit=2&after=" + _dataset_id(2),
+             [3, 4]),
+            (b"/configuration/datasets?limit=2&after=" + _dataset_id(4),
+             [5]),
+            (b"/configuration/datasets?after=" + _dataset_id(5), []),
+            (b"/configuration/datasets?limit=1&deleted=false&after=" +
+             _dataset_id(1), [3]),
+        ]))
+        return configuring
+
+    def test_configuration_changed(self):
+        """
+        Filtered listings of the configuration reflect changes to it.
+        """
+        configuring = self.configure()
+        configuring.addCallback(
+            lambda _: self.list_ids(b"/configuration/datasets?deleted=true"))
+        configuring.addCallback(lambda _: self.assertResponseCode(
+            b"DELETE", bytes(b"/configuration/datasets/" + _dataset_id(1)),
+            None, OK))
+        configuring.addCallback(lambda _: self.assert_listings([
+            (b"/configuration/datasets?deleted=true", [1, 2])]))
+        return configuring
+
+    def test_metadata_changed(self):
+        """
+        Listings filtered by metadata reflect changes to the configuration.
+        """
+        configuring = self.configure()
+        configuring.addCallback(lambda _: self.list_ids(
+            b"/configuration/datasets?metadata_key=name&metadata_value=x"))
+        configuring.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/configuration/datasets",
+            {u"primary": self.NODE_B, u"dataset_id": _dataset_id(6),
+             u"metadata": {u"name": u"x"}}, CREATED))
+        configuring.addCallback(lambda _: self.assertResponseCode(
+            b"POST", bytes(b"/configuration/datasets/" + _dataset_id(3)),
+            {u"primary": self.NODE_B}, OK))
+        configuring.addCallback(lambda _: self.assert_listings([
+            (b"/configuration/datasets?metadata_key=name&metadata_value=x",
+             [3, 4, 6]),
+            (b"/configuration/datasets?metadata_key=name&metadata_value=x"
+             b"&primary=" + self.NODE_A, []),
+        ]))
+        return configuring
+
+    def test_invalid_query(self):
+        """
+        Invalid query arguments result in a ``BAD REQUEST`` response.
+        """
+        return gatherResults([
+            self.assertResponseCode(b"GET", path, None, BAD_REQUEST)
+            for path in [
+                b"/configuration/datasets?limit=0",
+                b"/configuration/datasets?limit=x",
+                b"/configuration/datasets?deleted=maybe",
+                b"/configuration/datasets?metadata_key=name",
+                b"/configuration/datasets?unknown=1",
+                b"/state/datasets?deleted=true",
+            ]])
+
+    def test_state(self):
+        """
+        Datasets in the cluster state can be filtered by primary node and
+        listed a page at a time.
+        """
+        def node_state(uuid, hostname, numbers):
+            datasets = [Dataset(dataset_id=_dataset_id(n)) for n in numbers]
+            return NodeState(
+                uuid=uuid, hostname=hostname, devices={},
+                manifestations={
+                    dataset.dataset_id: Manifestation(
+                        dataset=dataset, primary=True)
+                    for dataset in datasets},
+                paths={dataset.dataset_id: FilePath(b"/" + dataset.dataset_id)
+                       for dataset in datasets})
+        self.cluster_state_service.apply_changes([
+            node_state(self.NODE_A_UUID, self.NODE_A_IP, [1, 3]),
+            node_state(self.NODE_B_UUID, self.NODE_B_IP, [2]),
+            NonManifestDatasets(datasets={
+                _dataset_id(4): Dataset(dataset_id=_dataset_id(4))}),
+        ])
+        return self.assert_listings([
+            (b"/state/datasets?primary=" + self.NODE_A, [1, 3]),
+            (b"/state/datasets?limit=3", [1, 2, 3]),
+            (b"/state/datasets?after=" + _dataset_id(3), [4]),
+        ])
+
+
+RealTestsDatasetListing, MemoryTestsDatasetListing = (
+    buildIntegrationTests(
+        DatasetListingTestsMixin, "DatasetListing", _build_app))
+
+
 class CreateAPIServiceTests(SynchronousTestCase):
     """
     Tests for ``create_api_service``.
@@ -2634,6 +2970,21 @@ class CreateAPIServiceTests(SynchronousTestCase):
             ConfigurationPersistenceService(reactor, FilePath(self.mktemp())),
             ClusterStateService(reactor), endpoint, ClientContextFactory()))
 
+    def test_output_validation(self):
+        """
+        The API created by ``create_api_service`` validates only the first
+        ``OUTPUT_VALIDATION_ITEMS`` items of each response.
+        """
+        reactor = MemoryReactor()
+        endpoint = TCP4ServerEndpoint(reactor, 6789)
+        service = create_api_service(
+            ConfigurationPersistenceService(reactor, FilePath(self.mktemp())),
+            ClusterStateService(reactor), endpoint, ClientContextFactory())
+        user = service.factory.wrappedFactory.resource._v1_user
+        self.assertEqual(
+            (user.output_validation.items, user.output_validation.every),
+            (OUTPUT_VALIDATION_ITEMS, 1))
+
 
 class DatasetsStateTestsMixin(APITestsMixin):
     """
@@ -3300,6 +3651,362 @@ RealTestsNodesStateAPI, MemoryTestsNodesStateAPI = (
                           _build_app))
 
 
+class ConditionalGetTestsMixin(APITestsMixin):
+    """
+    Tests for conditional ``GET`` requests of the configuration and state
+    endpoints.
+    """
+    CONFIGURATION_PATHS = [
+        b"/configuration/datasets", b"/configuration/containers"]
+    STATE_PATHS = [b"/state/datasets", b"/state/containers", b"/state/nodes"]
+
+    def get(self, path, etag=None):
+        """
+        Issue a ``GET`` request.
+
+        :param bytes path: The path to request.
+        :param bytes etag: A tag for the ``If-None-Match`` header, or
+            ``None`` to omit it.
+
+        :return: A ``Deferred`` that fires with the response code and the
+            response's tag.
+        """
+        headers = Headers()
+        if etag is not None:
+            headers.setRawHeaders(b"if-none-match", [etag])
+        requesting = self.agent.request(b"GET", path, headers, None)
+
+        def got_response(response):
+            reading = readBody(response)
+            reading.addCallback(lambda _: (
+                response.code,
+                response.headers.getRawHeaders(b"etag", [None])[0]))
+            return reading
+        return requesting.addCallback(got_response)
+
+    def assert_tags(self, paths, change, changes_tag):
+        """
+        Get each path, make a change, then get the path again with the tag
+        from the first response.
+
+        :param list paths: The paths to get.
+        :param change: A callable making the change.
+        :param bool changes_tag: Whether the change should invalidate the
+            tag of each path.
+
+        :return: A ``Deferred`` that fires when the assertions were made.
+        """
+        getting = gatherResults([self.get(path) for path in paths])
+
+        def got_tags(responses):
+            change()
+            return gatherResults([
+                self.get(path, tag)
+                for (path, (code, tag)) in zip(paths, responses)])
+        getting.addCallback(got_tags)
+        getting.addCallback(lambda responses: self.assertEqual(
+            [OK if changes_tag else NOT_MODIFIED] * len(paths),
+            [code for (code, tag) in responses]))
+        return getting
+
+    def test_tagged(self):
+        """
+        The responses to the configuration and state endpoints have tags,
+        which are not shared between configuration and state.
+        """
+        paths = self.CONFIGURATION_PATHS + self.STATE_PATHS
+        getting = gatherResults([self.get(path) for path in paths])
+
+        def got_responses(responses):
+            tags = [tag for (code, tag) in responses]
+            self.assertEqual(
+                ([OK] * len(paths), 2),
+                ([code for (code, tag) in responses], len(set(tags))))
+        return getting.addCallback(got_responses)
+
+    def test_configuration_unchanged(self):
+        """
+        The configuration endpoints respond with ``NOT MODIFIED`` to requests
+        with the tag of the current configuration, even if the cluster state
+        changed.
+        """
+        return self.assert_tags(
+            self.CONFIGURATION_PATHS,
+            lambda: self.cluster_state_service.apply_changes([
+                NodeState(uuid=self.NODE_A_UUID, hostname=u"192.0.2.1")]),
+            False)
+
+    def test_configuration_changed(self):
+        """
+        The configuration endpoints respond in full to requests with a tag
+        from before the configuration was saved.
+        """
+        return self.assert_tags(
+            self.CONFIGURATION_PATHS,
+            lambda: self.persistence_service.save(Deployment(
+                nodes={Node(uuid=self.NODE_A_UUID)})),
+            True)
+
+    def test_state_unchanged(self):
+        """
+        The state endpoints respond with ``NOT MODIFIED`` to requests with
+        the tag of the current state, even if agents reported the same state
+        again meanwhile.
+        """
+        node_state = NodeState(uuid=self.NODE_A_UUID, hostname=u"192.0.2.1")
+        self.cluster_state_service.apply_changes([node_state])
+        return self.assert_tags(
+            self.STATE_PATHS,
+            lambda: self.cluster_state_service.apply_changes([node_state]),
+            False)
+
+    def test_state_changed(self):
+        """
+        The state endpoints respond in full to requests with a tag from
+        before the cluster state changed.
+        """
+        return self.assert_tags(
+            self.STATE_PATHS,
+            lambda: self.cluster_state_service.apply_changes([
+                NodeState(uuid=self.NODE_A_UUID, hostname=u"192.0.2.1")]),
+            True)
+
+    def test_other_api(self):
+        """
+        Tags from another instance of the API, e.g. before the control
+        service restarted, don't match.
+        """
+        getting = self.get(b"/configuration/datasets")
+
+        def got_response((code, tag)):
+            self.agent = MemoryAgent(_build_app(self).resource())
+            return self.get(b"/configuration/datasets", tag)
+        getting.addCallback(got_response)
+        getting.addCallback(lambda (code, tag): self.assertEqual(OK, code))
+        return getting
+
+
+RealTestsConditionalGetAPI, MemoryTestsConditionalGetAPI = (
+    buildIntegrationTests(ConditionalGetTestsMixin, "ConditionalGetAPI",
+                          _build_app))
+
+
+class LongPollTests(APITestsMixin, SynchronousTestCase):
+    """
+    Tests for ``GET`` requests of the configuration and state endpoints which
+    wait for changes.
+    """
+    def setUp(self):
+        self.agent = MemoryAgent(_build_app(self).resource())
+
+    def wait(self, path):
+        """
+        Get a path, then get it again with the tag from the first response,
+        waiting up to 30 seconds for a change.
+
+        :param bytes path: The path to request.
+
+        :return: A ``Deferred`` that fires with the response code and body
+            of the second request once it is answered.
+        """
+        getting = self.agent.request(b"GET", path, Headers(), None)
+
+        def got_response(response):
+            tag = response.headers.getRawHeaders(b"etag")[0]
+            readBody(response)
+            return self.agent.request(
+                b"GET", path + b"?wait=30",
+                Headers({b"if-none-match": [tag]}), None)
+        getting.addCallback(got_response)
+
+        def waited(response):
+            reading = readBody(response)
+            reading.addCallback(lambda body: (response.code, body))
+            return reading
+        return getting.addCallback(waited)
+
+    def test_configuration_changed(self):
+        """
+        A request waiting for the configuration to change receives the new
+        configuration once it is saved.
+        """
+        waiting = self.wait(b"/configuration/datasets")
+        self.assertNoResult(waiting)
+        dataset_id = unicode(uuid4())
+        self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID, manifestations={
+                dataset_id: Manifestation(
+                    dataset=Dataset(dataset_id=dataset_id), primary=True)})}))
+        self.clock.advance(0)
+        code, body = self.successResultOf(waiting)
+        self.assertEqual(
+            (OK, [dataset_id]),
+            (code, [dataset[u"dataset_id"] for dataset in loads(body)]))
+
+    def test_state_changed(self):
+        """
+        A request waiting for the cluster state to change receives the new
+        state once agents report a change.
+        """
+        waiting = self.wait(b"/state/nodes")
+        self.assertNoResult(waiting)
+        self.cluster_state_service.apply_changes([
+            NodeState(uuid=self.NODE_A_UUID, hostname=u"192.0.2.1")])
+        self.clock.advance(0)
+        code, body = self.successResultOf(waiting)
+        self.assertEqual(
+            (OK, [u"192.0.2.1"]),
+            (code, [node[u"host"] for node in loads(body)]))
+
+    def test_state_unchanged(self):
+        """
+        A request waiting for the cluster state is not woken by changes of
+        the configuration, and receives ``NOT MODIFIED`` once it times out.
+        """
+        waiting = self.wait(b"/state/nodes")
+        self.persistence_service.save(Deployment(
+            nodes={Node(uuid=self.NODE_A_UUID)}))
+        self.clock.advance(0)
+        self.assertNoResult(waiting)
+        self.clock.advance(30)
+        self.assertEqual(NOT_MODIFIED, self.successResultOf(waiting)[0])
+
+
+class DatasetIndexTests(SynchronousTestCase):
+    """
+    Tests for ``_DatasetIndex``.
+    """
+    DATASETS = [
+        {u"dataset_id": _dataset_id(3), u"primary": u"a", u"deleted": False,
+         u"metadata": {u"name": u"x"}},
+        {u"dataset_id": _dataset_id(1), u"primary": u"a", u"deleted": True,
+         u"metadata": {}},
+        {u"dataset_id": _dataset_id(2), u"primary": u"b", u"deleted": False,
+         u"metadata": {u"name": u"x"}},
+        {u"dataset_id": _dataset_id(4)},
+    ]
+
+    def query(self, index, *args, **kwargs):
+        """
+        Query an index of ``DATASETS``.
+
+        :return: The numbers of the datasets found.
+        """
+        return [
+            UUID(dataset[u"dataset_id"]).int
+            for dataset in index.query(
+                1, lambda: self.DATASETS, *args, **kwargs)]
+
+    def test_sorted(self):
+        """
+        Without filters all the datasets are found, sorted by ID.
+        """
+        self.assertEqual([1, 2, 3, 4], self.query(_DatasetIndex(), []))
+
+    def test_filters(self):
+        """
+        Only datasets matching all the filters are found.
+        """
+        index = _DatasetIndex()
+        self.assertEqual(
+            [[1, 3], [2, 3], [3], [4], []],
+            [self.query(index, [(u"primary", u"a")]),
+             self.query(index, [(u"deleted", False)]),
+             self.query(index, [(u"primary", u"a"), (u"deleted", False)]),
+             self.query(index, [(u"primary", None)]),
+             self.query(index, [(u"primary", u"c")])])
+
+    def test_pages(self):
+        """
+        Datasets are found after the given ID, up to the limit.
+        """
+        index = _DatasetIndex()
+        self.assertEqual(
+            [[1, 2], [3], [3, 4], []],
+            [self.query(index, [], limit=2),
+             self.query(index, [(u"deleted", False)], after=_dataset_id(2)),
+             self.query(index, [], after=_dataset_id(2), limit=5),
+             self.query(index, [], after=_dataset_id(4))])
+
+    def test_versions(self):
+        """
+        The datasets are only retrieved again once the version changes.
+        """
+        index = _DatasetIndex()
+        calls = []
+
+        def datasets(version):
+            calls.append(version)
+            return self.DATASETS[:version]
+        found = [len(index.query(version, lambda: datasets(version), []))
+                 for version in [1, 1, 2]]
+        self.assertEqual(([1, 1, 2], [1, 2]), (found, calls))
+
+
+class NodeRenderCacheTests(SynchronousTestCase):
+    """
+    Tests for ``_NodeRenderCache``.
+    """
+    def setUp(self):
+        self.rendered = []
+
+        def render(node):
+            self.rendered.append(node)
+            return [node.hostname, node.hostname]
+        self.cache = _NodeRenderCache(render)
+        self.node_a = NodeState(uuid=uuid4(), hostname=u"192.0.2.1")
+        self.node_b = NodeState(uuid=uuid4(), hostname=u"192.0.2.2")
+
+    def test_render(self):
+        """
+        ``_NodeRenderCache.render`` returns the items of all the nodes.
+        """
+        self.assertEqual(
+            [u"192.0.2.1", u"192.0.2.1", u"192.0.2.2", u"192.0.2.2"],
+            self.cache.render([self.node_a, self.node_b]))
+
+    def test_unchanged(self):
+        """
+        Nodes which were rendered last time aren't rendered again.
+        """
+        self.cache.render([self.node_a, self.node_b])
+        node_c = NodeState(uuid=uuid4(), hostname=u"192.0.2.3")
+        result = self.cache.render([self.node_a, node_c])
+        self.assertEqual(
+            ([self.node_a, self.node_b, node_c],
+             [u"192.0.2.1", u"192.0.2.1", u"192.0.2.3", u"192.0.2.3"]),
+            (self.rendered, result))
+
+    def test_changed(self):
+        """
+        A node which was replaced by a changed copy is rendered again.
+        """
+        self.cache.render([self.node_a])
+        changed = self.node_a.set(hostname=u"192.0.2.4")
+        self.assertEqual(
+            [u"192.0.2.4", u"192.0.2.4"], self.cache.render([changed]))
+
+    def test_forgets_removed(self):
+        """
+        Nodes which are no longer there are forgotten, so they are rendered
+        again if they come back.
+        """
+        self.cache.render([self.node_a])
+        self.cache.render([])
+        self.cache.render([self.node_a])
+        self.assertEqual([self.node_a, self.node_a], self.rendered)
+
+    def test_iterate_lazily(self):
+        """
+        ``_NodeRenderCache.iterate`` only renders each node once its items
+        are needed.
+        """
+        items = self.cache.iterate([self.node_a, self.node_b])
+        first = next(items)
+        self.assertEqual(
+            (u"192.0.2.1", [self.node_a]), (first, self.rendered))
+
+
 class ConfigurationComposeTestsMixin(APITestsMixin):
     """
     Tests for the container configuration endpoint at
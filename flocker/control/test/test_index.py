@@ -0,0 +1,131 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._index``.
+"""
+
+from uuid import uuid4
+
+from pyrsistent import pmap
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Dataset, Deployment, Manifestation, Node
+from .._index import MetadataIndex
+
+NODE_A = uuid4()
+NODE_B = uuid4()
+
+
+def manifestation(dataset_id, primary=True, **metadata):
+    """
+    :param unicode dataset_id: The ID of the dataset.
+    :param bool primary: Whether the manifestation is primary.
+    :param metadata: The dataset's metadata.
+
+    :return Manifestation: A manifestation of a new ``Dataset``.
+    """
+    return Manifestation(
+        dataset=Dataset(dataset_id=dataset_id, metadata=pmap(metadata)),
+        primary=primary)
+
+
+def node(uuid, *manifestations):
+    """
+    :param UUID uuid: The UUID of the node.
+    :param manifestations: The node's manifestations.
+
+    :return Node: A configured node.
+    """
+    return Node(uuid=uuid, manifestations={
+        m.dataset.dataset_id: m for m in manifestations})
+
+
+class MetadataIndexTests(SynchronousTestCase):
+    """
+    Tests for ``MetadataIndex``.
+    """
+    def lookup(self, index, key, value):
+        """
+        :return: A ``set`` of ``(dataset_id, node_uuid)`` pairs of the
+            datasets found.
+        """
+        return {(dataset.dataset_id, node_uuid)
+                for (dataset, node_uuid) in index.lookup(key, value)}
+
+    def test_lookup(self):
+        """
+        Only the datasets with the metadata item are found, along with the
+        node of their primary manifestation.
+        """
+        index = MetadataIndex()
+        index.update(Deployment(nodes={
+            node(NODE_A, manifestation(u"1", name=u"x"),
+                 manifestation(u"2", name=u"y")),
+            node(NODE_B, manifestation(u"3", name=u"x", owner=u"alice"),
+                 manifestation(u"4"))}))
+        self.assertEqual(
+            [{(u"1", NODE_A), (u"3", NODE_B)}, {(u"3", NODE_B)},
+             set(), set()],
+            [self.lookup(index, u"name", u"x"),
+             self.lookup(index, u"owner", u"alice"),
+             self.lookup(index, u"name", u"z"),
+             self.lookup(index, u"other", u"x")])
+
+    def test_not_primary(self):
+        """
+        Manifestations which aren't primary aren't indexed.
+        """
+        index = MetadataIndex()
+        index.update(Deployment(nodes={
+            node(NODE_A, manifestation(u"1", name=u"x")),
+            node(NODE_B, manifestation(u"1", primary=False, name=u"x"))}))
+        self.assertEqual(
+            {(u"1", NODE_A)}, self.lookup(index, u"name", u"x"))
+
+    def test_changes(self):
+        """
+        Updating the index with a changed configuration reflects added,
+        changed, moved and removed datasets and removed nodes.
+        """
+        index = MetadataIndex()
+        index.update(Deployment(nodes={
+            node(NODE_A, manifestation(u"1", name=u"x"),
+                 manifestation(u"2", name=u"x"),
+                 manifestation(u"3", name=u"x")),
+            node(NODE_B, manifestation(u"4", name=u"x"))}))
+        index.update(Deployment(nodes={
+            node(NODE_A, manifestation(u"2", name=u"y"),
+                 manifestation(u"5", name=u"x")),
+            node(NODE_B, manifestation(u"3", name=u"x"))}))
+        self.assertEqual(
+            [{(u"5", NODE_A), (u"3", NODE_B)}, {(u"2", NODE_A)}],
+            [self.lookup(index, u"name", u"x"),
+             self.lookup(index, u"name", u"y")])
+
+    def test_empty_entries_removed(self):
+        """
+        Metadata items no dataset has any longer take no space in the index.
+        """
+        index = MetadataIndex()
+        index.update(Deployment(nodes={
+            node(NODE_A, manifestation(u"1", name=u"x"))}))
+        index.update(Deployment(nodes={node(NODE_A)}))
+        self.assertEqual({}, index._index)
+
+    def test_unchanged_nodes_skipped(self):
+        """
+        Nodes which are the same objects as last time aren't indexed again.
+        """
+        unchanged = node(NODE_A, manifestation(u"1", name=u"x"))
+        index = MetadataIndex()
+        index.update(Deployment(nodes={unchanged}))
+        updated = []
+        original = index._update_node
+        self.patch(index, "_update_node",
+                   lambda *args: updated.append(args[0]) or original(*args))
+        index.update(Deployment(nodes={
+            unchanged, node(NODE_B, manifestation(u"2", name=u"x"))}))
+        self.assertEqual(
+            ([NODE_B], {(u"1", NODE_A), (u"2", NODE_B)}),
+            (updated, self.lookup(index, u"name", u"x")))
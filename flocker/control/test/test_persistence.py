@@ -113,6 +113,18 @@ class ConfigurationPersistenceServiceTests(TestCase):
         d.addCallback(retrieve_in_new_service)
         return d
 
+    def test_generation_changes_on_save(self):
+        """
+        ``ConfigurationPersistenceService.generation`` changes when a
+        configuration is saved.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        before = service.generation()
+        d = service.save(TEST_DEPLOYMENT)
+        d.addCallback(lambda _: self.assertNotEqual(
+            before, service.generation()))
+        return d
+
     def test_register_for_callback(self):
         """
         Callbacks can be registered that are called every time there is a
@@ -42,7 +42,8 @@ from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset, DeploymentState, NonManifestDatasets,
 )
-from .._persistence import ConfigurationPersistenceService
+from .._persistence import ConfigurationPersistenceService, wire_encode
+from .. import _protocol
 from .clusterstatetools import advance_some, advance_rest
 
 
@@ -198,6 +199,55 @@ class SerializationTests(SynchronousTestCase):
         self.assertRaises(
             TypeError, SerializableArgument(NodeState).fromString, as_bytes)
 
+    def test_encoded_once(self):
+        """
+        ``SerializableArgument`` only encodes an immutable object once, however
+        many times it is sent.
+        """
+        encoded = []
+
+        def counting_wire_encode(obj):
+            encoded.append(obj)
+            return wire_encode(obj)
+        self.patch(_protocol, "wire_encode", counting_wire_encode)
+        argument = SerializableArgument(Deployment)
+        first = argument.toString(TEST_DEPLOYMENT)
+        second = argument.toString(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (first, encoded), (second, [TEST_DEPLOYMENT]))
+
+    def test_mutable_encoded_again(self):
+        """
+        ``SerializableArgument`` encodes a mutable object each time it is
+        sent, in case it changed.
+        """
+        argument = SerializableArgument(list)
+        obj = [u"foo"]
+        argument.toString(obj)
+        obj.append(u"bar")
+        self.assertEqual(
+            [u"foo", u"bar"], argument.fromString(argument.toString(obj)))
+
+    def test_decoded_once(self):
+        """
+        ``SerializableArgument`` decodes the same bytes received again to the
+        same immutable object.
+        """
+        argument = SerializableArgument(Deployment)
+        as_bytes = argument.toString(TEST_DEPLOYMENT)
+        self.assertIs(
+            argument.fromString(as_bytes), argument.fromString(as_bytes))
+
+    def test_mutable_decoded_again(self):
+        """
+        ``SerializableArgument`` decodes mutable objects afresh each time, so
+        they are not shared.
+        """
+        argument = SerializableArgument(list)
+        as_bytes = argument.toString([u"foo"])
+        self.assertIsNot(
+            argument.fromString(as_bytes), argument.fromString(as_bytes))
+
 
 def build_control_amp_service(test, reactor=None):
     """
@@ -652,6 +652,129 @@ ConfigurationDatasetsCreateSchemaTests = build_schema_test(
     passing_instances=CONFIGURATION_DATASETS_PASSING_INSTANCES,
 )
 
+ConfigurationDatasetsBulkSchemaTests = build_schema_test(
+    name="ConfigurationDatasetsBulkSchemaTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_bulk'},
+    schema_store=SCHEMAS,
+    failing_instances=[
+        # operations is required
+        {},
+        # operations is an array
+        {u"operations": {}},
+        # action is required
+        {u"operations": [{u"primary": a_uuid}]},
+        # unknown action
+        {u"operations": [{u"action": u"resize", u"dataset_id": a_uuid}]},
+        # create needs a primary
+        {u"operations": [{u"action": u"create", u"dataset_id": a_uuid}]},
+        # update and delete need a dataset_id
+        {u"operations": [{u"action": u"update", u"primary": a_uuid}]},
+        {u"operations": [{u"action": u"delete"}]},
+        # only create takes metadata
+        {u"operations": [{u"action": u"update", u"dataset_id": a_uuid,
+                          u"metadata": {}}]},
+        # delete takes nothing else
+        {u"operations": [{u"action": u"delete", u"dataset_id": a_uuid,
+                          u"primary": a_uuid}]},
+        # failing dataset (maximum_size less than minimum allowed)
+        {u"operations": [{u"action": u"create", u"primary": a_uuid,
+                          u"maximum_size": 123}]},
+        # too many operations
+        {u"operations": [{u"action": u"delete", u"dataset_id": a_uuid}]
+         * 1001},
+    ],
+    passing_instances=[
+        {u"operations": []},
+        {u"operations": [
+            {u"action": u"create", u"primary": a_uuid},
+            {u"action": u"create", u"primary": a_uuid,
+             u"dataset_id": u"x" * 36, u"metadata": {u"name": u"x"},
+             u"maximum_size": 1024 * 1024 * 64},
+            {u"action": u"update", u"dataset_id": u"x" * 36},
+            {u"action": u"update", u"dataset_id": u"x" * 36,
+             u"primary": a_uuid},
+            {u"action": u"delete", u"dataset_id": u"x" * 36},
+        ]},
+    ],
+)
+
+ConfigurationDatasetsBulkResultsSchemaTests = build_schema_test(
+    name="ConfigurationDatasetsBulkResultsSchemaTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_bulk_results'},
+    schema_store=SCHEMAS,
+    failing_instances=[
+        # not an array
+        {},
+        # code and result are required
+        [{u"code": 200}],
+        [{u"result": {}}],
+        # code is an integer
+        [{u"code": u"200", u"result": {}}],
+    ],
+    passing_instances=[
+        [],
+        [{u"code": 201, u"result": {u"primary": a_uuid}},
+         {u"code": 404, u"result": {u"description": u"Dataset not found."}}],
+    ],
+)
+
+ConfigurationDatasetsQuerySchemaTests = build_schema_test(
+    name="ConfigurationDatasetsQuerySchemaTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets_query'},
+    schema_store=SCHEMAS,
+    failing_instances=[
+        # unknown argument
+        {u"name": u"x"},
+        # primary is a UUID
+        {u"primary": u"x"},
+        # deleted is true or false
+        {u"deleted": u"yes"},
+        # metadata_key and metadata_value go together
+        {u"metadata_key": u"name"},
+        {u"metadata_value": u"x"},
+        # limit is a whole number from 1 to 9999
+        {u"limit": u"0"},
+        {u"limit": u"10000"},
+        {u"limit": u"-1"},
+        {u"limit": u"1.5"},
+        # after is no longer than a dataset ID
+        {u"after": u"x" * 37},
+    ],
+    passing_instances=[
+        {},
+        {u"primary": a_uuid},
+        {u"deleted": u"true"},
+        {u"deleted": u"false"},
+        {u"metadata_key": u"name", u"metadata_value": u"x"},
+        {u"limit": u"1"},
+        {u"limit": u"9999"},
+        {u"after": a_uuid, u"limit": u"100", u"primary": a_uuid,
+         u"deleted": u"false", u"metadata_key": u"name",
+         u"metadata_value": u""},
+    ],
+)
+
+StateDatasetsQuerySchemaTests = build_schema_test(
+    name="StateDatasetsQuerySchemaTests",
+    schema={'$ref':
+            '/v1/endpoints.json#/definitions/state_datasets_query'},
+    schema_store=SCHEMAS,
+    failing_instances=[
+        # only the primary and paging arguments
+        {u"deleted": u"true"},
+        {u"metadata_key": u"name", u"metadata_value": u"x"},
+        {u"limit": u"0"},
+    ],
+    passing_instances=[
+        {},
+        {u"primary": a_uuid, u"after": a_uuid, u"limit": u"10"},
+    ],
+)
+
 StateDatasetsArraySchemaTests = build_schema_test(
     name="StateDatasetsArraySchemaTests",
     schema={'$ref': '/v1/endpoints.json#/definitions/state_datasets_array'},
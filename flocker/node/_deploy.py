@@ -16,7 +16,7 @@ from pyrsistent import PRecord, field
 
 from eliot import Message, write_failure, Logger, start_action
 
-from twisted.internet.defer import gatherResults, fail, succeed
+from twisted.internet.defer import gatherResults, fail, succeed, maybeDeferred
 
 from ._docker import DockerClient, PortMap, Environment, Volume as DockerVolume
 from . import IStateChange, in_parallel, sequentially
@@ -272,6 +272,18 @@ class ResizeDataset(object):
         return deployer.volume_service.set_maximum_size(volume)
 
 
+def _ssh_remote_volume_manager(hostname):
+    """
+    Create an ``IRemoteVolumeManager`` which runs ``flocker-volume`` on
+    another node over SSH.
+
+    :param bytes hostname: The node to connect to.
+
+    :return: A ``RemoteVolumeManager``.
+    """
+    return RemoteVolumeManager(standard_node(hostname))
+
+
 @implementer(IStateChange)
 @attributes(["dataset", "hostname"])
 class HandoffDataset(object):
@@ -296,10 +308,9 @@ class HandoffDataset(object):
 
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.handoff(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname))
 
 
 @implementer(IStateChange)
@@ -326,10 +337,37 @@ class PushDataset(object):
 
     def run(self, deployer):
         service = deployer.volume_service
-        destination = standard_node(self.hostname)
         return service.push(
             service.get(_to_volume_name(self.dataset.dataset_id)),
-            RemoteVolumeManager(destination))
+            deployer.remote_volume_manager(self.hostname))
+
+
+@implementer(IStateChange)
+@attributes(["dataset", "hostname"])
+class PreReplicateDataset(object):
+    """
+    Start pushing a dataset which is moving to another node but is still in
+    use on this one, so that the eventual handoff only has to send the
+    changes made since.
+
+    The push happens in the background; this change does not wait for it.
+    See ``P2PManifestationDeployer.start_replication``.
+
+    :ivar Dataset dataset: The dataset to push.
+    :ivar bytes hostname: The hostname of the node the dataset is moving to.
+    """
+
+    @property
+    def eliot_action(self):
+        return start_action(
+            _logger, _eliot_system(u"prereplicate"),
+            dataset_id=self.dataset.dataset_id,
+            hostname=self.hostname,
+        )
+
+    def run(self, deployer):
+        deployer.start_replication(self.dataset, self.hostname)
+        return succeed(None)
 
 
 @implementer(IStateChange)
@@ -369,14 +407,56 @@ class DeleteDataset(PRecord):
         return d
 
 
+def _proxy_key(proxy):
+    """
+    Compute a key identifying the rules a ``Proxy`` corresponds to.
+
+    ``INetwork.enumerate_proxies`` may report the address as an
+    ``IPv4Address`` while the desired configuration uses the node's
+    hostname as ``unicode``, so the address is compared by its text form.
+
+    :param Proxy proxy: The proxy to identify.
+
+    :return: A hashable key.
+    """
+    return (unicode(proxy.ip), proxy.port)
+
+
+def _open_port_key(open_port):
+    """
+    Compute a key identifying the rules an ``OpenPort`` corresponds to.
+
+    :param OpenPort open_port: The open port to identify.
+
+    :return: A hashable key.
+    """
+    return open_port.port
+
+
+def _by_key(key, objects):
+    """
+    Index some network objects by a key.
+
+    :param key: A one-argument callable computing the key of an object.
+    :param objects: An iterable of objects to index.
+
+    :return: A ``dict`` mapping keys to objects.
+    """
+    return {key(obj): obj for obj in objects}
+
+
 @implementer(IStateChange)
 class SetProxies(PRecord):
     """
     Set the ports which will be forwarded to other nodes.
 
     :ivar ports: A collection of ``Proxy`` objects.
+    :ivar existing: The ``Proxy`` objects configured when the changes were
+        calculated, from the ``NetworkSnapshot`` of this iteration, or
+        ``None`` to enumerate them when run.
     """
     ports = pset_field(Proxy)
+    existing = pset_field(Proxy, optional=True, initial=None)
 
     @property
     def eliot_action(self):
@@ -387,18 +467,37 @@ class SetProxies(PRecord):
 
     def run(self, deployer):
         results = []
+        # Only the difference between the existing and the desired proxies
+        # is applied so that traffic through unchanged proxies is never
+        # interrupted and unchanged rules cost nothing.
+        existing = self.existing
+        if existing is None:
+            existing = deployer.network.enumerate_proxies()
+        existing = _by_key(_proxy_key, existing)
+        desired = _by_key(_proxy_key, self.ports)
+        # The changes are collected and applied together so that the proxy
+        # configuration is updated in one step.
+        batch = deployer.network.batch()
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for proxy in deployer.network.enumerate_proxies():
+        for key, proxy in existing.items():
+            if key in desired:
+                continue
             try:
-                deployer.network.delete_proxy(proxy)
+                batch.delete_proxy(proxy)
             except:
                 results.append(fail())
-        for proxy in self.ports:
+        for key, proxy in desired.items():
+            if key in existing:
+                continue
             try:
-                deployer.network.create_proxy_to(proxy.ip, proxy.port)
+                batch.create_proxy_to(proxy.ip, proxy.port)
             except:
                 results.append(fail())
+        try:
+            batch.commit()
+        except:
+            results.append(fail())
         return gather_deferreds(results)
 
 
@@ -408,8 +507,12 @@ class OpenPorts(PRecord):
     Set the ports which will have the firewall opened.
 
     :ivar ports: A list of :class:`OpenPort`s.
+    :ivar existing: The :class:`OpenPort`s configured when the changes were
+        calculated, from the ``NetworkSnapshot`` of this iteration, or
+        ``None`` to enumerate them when run.
     """
     ports = pset_field(OpenPort)
+    existing = pset_field(OpenPort, optional=True, initial=None)
 
     @property
     def eliot_action(self):
@@ -420,18 +523,32 @@ class OpenPorts(PRecord):
 
     def run(self, deployer):
         results = []
+        existing = self.existing
+        if existing is None:
+            existing = deployer.network.enumerate_open_ports()
+        existing = _by_key(_open_port_key, existing)
+        desired = _by_key(_open_port_key, self.ports)
+        batch = deployer.network.batch()
         # XXX: The proxy manipulation operations are blocking. Convert to a
         # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for open_port in deployer.network.enumerate_open_ports():
+        for key, open_port in existing.items():
+            if key in desired:
+                continue
             try:
-                deployer.network.delete_open_port(open_port)
+                batch.delete_open_port(open_port)
             except:
                 results.append(fail())
-        for open_port in self.ports:
+        for key, open_port in desired.items():
+            if key in existing:
+                continue
             try:
-                deployer.network.open_port(open_port.port)
+                batch.open_port(open_port.port)
             except:
                 results.append(fail())
+        try:
+            batch.commit()
+        except:
+            results.append(fail())
         return gather_deferreds(results)
 
 
@@ -479,8 +596,21 @@ class P2PManifestationDeployer(object):
 
     :ivar unicode hostname: The hostname of the node that this is running on.
     :ivar VolumeService volume_service: The volume manager for this node.
+    :ivar remote_volume_manager: A callable which takes the hostname of
+        another node and returns an ``IRemoteVolumeManager`` to push datasets
+        to it with.
+    :ivar pre_replication_interval: ``None`` to only push datasets which are
+        moving to another node once they are no longer in use, or the
+        number of seconds between background pushes of such datasets while
+        they are still in use, so that their handoff sends little data.
+    :ivar _replicating: A ``dict`` mapping the ``unicode`` ids of datasets
+        being pushed in the background to the ``Deferred`` of the push.
+    :ivar _replicated: A ``dict`` mapping ``unicode`` dataset ids to the time
+        at which their last successful background push started.
     """
-    def __init__(self, hostname, volume_service, node_uuid=None):
+    def __init__(self, hostname, volume_service, node_uuid=None,
+                 remote_volume_manager=None, pre_replication_interval=None,
+                 reactor=None):
         if node_uuid is None:
             # To be removed in https://clusterhq.atlassian.net/browse/FLOC-1795
             warn("UUID is required, this is for backwards compat with existing"
@@ -490,6 +620,70 @@ class P2PManifestationDeployer(object):
         self.node_uuid = node_uuid
         self.hostname = hostname
         self.volume_service = volume_service
+        if remote_volume_manager is None:
+            remote_volume_manager = _ssh_remote_volume_manager
+        self.remote_volume_manager = remote_volume_manager
+        self.pre_replication_interval = pre_replication_interval
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._replicating = {}
+        self._replicated = {}
+
+    def start_replication(self, dataset, hostname):
+        """
+        Start pushing a dataset to another node, unless it is already being
+        pushed.
+
+        :param Dataset dataset: The dataset to push.
+        :param bytes hostname: The node to push it to.
+        """
+        dataset_id = dataset.dataset_id
+        if dataset_id in self._replicating:
+            return
+        Message.new(
+            message_type=_eliot_system(u"replication_lag"),
+            dataset_id=dataset_id,
+            replication_lag=self.replication_lag(dataset_id),
+        ).write(_logger)
+        started = self._reactor.seconds()
+        service = self.volume_service
+        volume = service.get(_to_volume_name(dataset_id))
+        destination = self.remote_volume_manager(hostname)
+        pushing = maybeDeferred(service.push, volume, destination)
+        self._replicating[dataset_id] = pushing
+
+        def pushed(_):
+            self._replicated[dataset_id] = started
+        pushing.addCallbacks(
+            pushed, write_failure,
+            errbackArgs=(_logger, u"flocker:p2pdeployer:prereplicate"))
+
+        def finished(_):
+            del self._replicating[dataset_id]
+        pushing.addCallback(finished)
+
+    def replication_lag(self, dataset_id):
+        """
+        :param unicode dataset_id: A dataset pushed in the background.
+
+        :return: The number of seconds of changes to the dataset which its
+            destination does not have yet, or ``None`` if it has never been
+            pushed in the background.
+        """
+        started = self._replicated.get(dataset_id)
+        if started is None:
+            return None
+        return self._reactor.seconds() - started
+
+    def _replication_due(self, dataset_id):
+        """
+        :return: Whether a dataset should be pushed in the background now.
+        """
+        if dataset_id in self._replicating:
+            return False
+        lag = self.replication_lag(dataset_id)
+        return lag is None or lag >= self.pre_replication_interval
 
     def discover_state(self, local_state):
         """
@@ -566,6 +760,21 @@ class P2PManifestationDeployer(object):
 
         going = not_in_use_datasets(dataset_changes.going,
                                     lambda d: d.dataset.dataset_id)
+        if self.pre_replication_interval is not None:
+            # Datasets which can't be handed off yet are pushed in the
+            # background meanwhile.  A dataset is not handed off while such
+            # a push is still running; it will only take a moment longer.
+            pre_replicating = [
+                handoff for handoff in dataset_changes.going
+                if handoff not in going
+                and self._replication_due(handoff.dataset.dataset_id)]
+            if pre_replicating:
+                phases.append(in_parallel(changes=[
+                    PreReplicateDataset(dataset=handoff.dataset,
+                                        hostname=handoff.hostname)
+                    for handoff in pre_replicating]))
+            going = [handoff for handoff in going
+                     if handoff.dataset.dataset_id not in self._replicating]
         if going:
             phases.append(in_parallel(changes=[
                 HandoffDataset(dataset=handoff.dataset,
@@ -597,6 +806,9 @@ class ApplicationNodeDeployer(object):
         deployment operations. Default ``DockerClient``.
     :ivar INetwork network: The network routing API to use in
         deployment operations. Default is iptables-based implementation.
+    :ivar _network_snapshot: The ``NetworkSnapshot`` taken by the most recent
+        ``discover_state``, to be used by the following
+        ``calculate_changes``, or ``None`` if there is no such snapshot.
     """
     def __init__(self, hostname, docker_client=None, network=None,
                  node_uuid=None):
@@ -614,6 +826,7 @@ class ApplicationNodeDeployer(object):
         if network is None:
             network = make_host_network()
         self.network = network
+        self._network_snapshot = None
 
     def _attached_volume_for_container(
             self, container, path_to_manifestations
@@ -758,11 +971,14 @@ class ApplicationNodeDeployer(object):
         :return: A ``list`` of a single ``NodeState`` representing the
             application state only of this node.
         """
+        # Keep the snapshot so that calculating changes in this same
+        # iteration doesn't need to inspect the network again.
+        self._network_snapshot = self.network.snapshot()
         return [NodeState(
             uuid=self.node_uuid,
             hostname=self.hostname,
             applications=applications,
-            used_ports=self.network.enumerate_used_ports(),
+            used_ports=self._network_snapshot.used_ports,
             manifestations=None,
             paths=None,
         )]
@@ -954,6 +1170,11 @@ class ApplicationNodeDeployer(object):
         3. Start and restart any containers that should be running
            locally, so long as their required datasets are available.
         """
+        # A snapshot taken by discover_state is only valid for the current
+        # iteration, so use it at most once.
+        network_snapshot, self._network_snapshot = (
+            self._network_snapshot, None)
+
         # We are a node-specific IDeployer:
         current_node_state = current_cluster_state.get_node(
             self.node_uuid, hostname=self.hostname)
@@ -987,11 +1208,20 @@ class ApplicationNodeDeployer(object):
                                 ip=node_states[node.uuid].hostname,
                                 port=port.external_port))
 
-        if desired_proxies != set(self.network.enumerate_proxies()):
-            phases.append(SetProxies(ports=desired_proxies))
+        if network_snapshot is None:
+            network_snapshot = self.network.snapshot()
+
+        if (_by_key(_proxy_key, desired_proxies).viewkeys() !=
+                _by_key(_proxy_key, network_snapshot.proxies).viewkeys()):
+            phases.append(SetProxies(
+                ports=desired_proxies, existing=network_snapshot.proxies))
 
-        if desired_open_ports != set(self.network.enumerate_open_ports()):
-            phases.append(OpenPorts(ports=desired_open_ports))
+        if (_by_key(_open_port_key, desired_open_ports).viewkeys() !=
+                _by_key(_open_port_key,
+                        network_snapshot.open_ports).viewkeys()):
+            phases.append(OpenPorts(
+                ports=desired_open_ports,
+                existing=network_snapshot.open_ports))
 
         all_applications = current_node_state.applications
 
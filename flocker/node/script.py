@@ -29,6 +29,8 @@ from twisted.python.reflect import namedAny
 from ..volume.filesystems import zfs
 from ..volume.service import (
     VolumeService, DEFAULT_CONFIG_PATH, FLOCKER_MOUNTPOINT, FLOCKER_POOL)
+from ..volume._daemon import volume_daemon
+from ..volume._replication import TLSRemoteVolumeManager, replication_server
 
 from ..common.script import (
     ICommandLineScript,
@@ -38,7 +40,9 @@ from ._loop import AgentLoopService
 from .agents.blockdevice import (
     LoopbackBlockDeviceAPI, BlockDeviceDeployer, ProcessLifetimeCache,
 )
-from ..ca import ControlServicePolicy, NodeCredential
+from ..ca import (
+    ControlServicePolicy, NodeCredential, replication_context_factory,
+)
 
 
 __all__ = [
@@ -348,7 +352,9 @@ def get_configuration(options):
 
 
 def _zfs_storagepool(
-        reactor, pool=FLOCKER_POOL, mount_root=None, volume_config_path=None):
+        reactor, pool=FLOCKER_POOL, mount_root=None, volume_config_path=None,
+        snapshots_kept=zfs.DEFAULT_SNAPSHOTS_KEPT,
+        snapshot_pruning_interval=zfs.DEFAULT_PRUNING_INTERVAL):
     """
     Create a ``VolumeService`` with a ``zfs.StoragePool``.
 
@@ -357,6 +363,10 @@ def _zfs_storagepool(
         will be mounted.
     :param bytes volume_config_path: The path to the volume service's
         configuration file.
+    :param snapshots_kept: The number of Flocker-created snapshots of each
+        filesystem to keep, or ``None`` to keep all of them.
+    :param snapshot_pruning_interval: The number of seconds between
+        destroying older snapshots.
 
     :return: The ``VolumeService``, started.
     """
@@ -371,6 +381,8 @@ def _zfs_storagepool(
 
     pool = zfs.StoragePool(
         reactor=reactor, name=pool, mount_root=mount_root,
+        snapshots_kept=snapshots_kept,
+        pruning_interval=snapshot_pruning_interval,
     )
     api = VolumeService(
         config_path=config_path,
@@ -407,7 +419,9 @@ class BackendDescription(PRecord):
         factory needs to have the cluster's unique identifier passed to it.
     :ivar api_factory: An object which can be called with some simple
         configuration data and which returns the API object implementing this
-        storage backend.
+        storage backend, or the fully qualified name of one as ``unicode``.
+        A name is only imported once the backend is used, so backends with
+        expensive dependencies don't slow down every agent.
     :ivar deployer_type: A constant from ``DeployerType`` indicating which kind
         of ``IDeployer`` the API object returned by ``api_factory`` is usable
         with.
@@ -425,17 +439,20 @@ class BackendDescription(PRecord):
         ),
     )
 
-from .agents.cinder import cinder_from_configuration
-from .agents.ebs import aws_from_configuration
+    def load_api_factory(self):
+        """
+        :return: The ``api_factory``, imported first if it was given by name.
+        """
+        if isinstance(self.api_factory, unicode):
+            return namedAny(self.api_factory.encode("ascii"))
+        return self.api_factory
 
 # These structures should be created dynamically to handle plug-ins
 _DEFAULT_BACKENDS = [
     # P2PManifestationDeployer doesn't currently know anything about
-    # cluster_uuid.  It probably should so that it can make sure it
-    # only talks to other nodes in the same cluster (maybe the
-    # authentication layer would mostly handle this but maybe not if
-    # you're slightly careless with credentials - also ZFS backend
-    # doesn't use TLS yet).
+    # cluster_uuid.  Nodes only push datasets to nodes with certificates
+    # from the same cluster certificate authority, though (see
+    # ``AgentService.get_replication_service``).
     BackendDescription(
         name=u"zfs", needs_reactor=True, needs_cluster_id=False,
         api_factory=_zfs_storagepool, deployer_type=DeployerType.p2p,
@@ -448,12 +465,12 @@ _DEFAULT_BACKENDS = [
     ),
     BackendDescription(
         name=u"openstack", needs_reactor=False, needs_cluster_id=True,
-        api_factory=cinder_from_configuration,
+        api_factory=u"flocker.node.agents.cinder.cinder_from_configuration",
         deployer_type=DeployerType.block,
     ),
     BackendDescription(
         name=u"aws", needs_reactor=False, needs_cluster_id=True,
-        api_factory=aws_from_configuration,
+        api_factory=u"flocker.node.agents.ebs.aws_from_configuration",
         deployer_type=DeployerType.block,
     ),
 ]
@@ -480,6 +497,16 @@ class AgentService(PRecord):
     :ivar backend_name: The name of the storage driver to instantiate.  This
         must name one of the items in ``backends``.
     :ivar api_args: Extra arguments to pass to the factory from ``backends``.
+    :ivar pre_replication_interval: ``None``, or the number of seconds
+        between background pushes of datasets which are moving to another
+        node while still in use; see ``P2PManifestationDeployer``.  Only
+        used by peer-to-peer backends.
+    :ivar replication_compression: Whether to compress the data streams of
+        datasets pushed to other nodes, see ``TLSRemoteVolumeManager``.
+        Only used by peer-to-peer backends.
+    :ivar replication_streams: The number of sessions to stripe the data
+        streams of datasets pushed to other nodes across.  Only used by
+        peer-to-peer backends.
     :ivar get_external_ip: Typically ``_get_external_ip``, but
         overrideable for tests.
     """
@@ -503,6 +530,10 @@ class AgentService(PRecord):
     backend_name = field(type=unicode, mandatory=True)
     api_args = field(type=PMap, factory=pmap, mandatory=True)
 
+    pre_replication_interval = field(mandatory=True, initial=None)
+    replication_compression = field(type=bool, mandatory=True, initial=False)
+    replication_streams = field(type=int, mandatory=True, initial=1)
+
     @classmethod
     def from_configuration(cls, configuration):
         """
@@ -523,6 +554,12 @@ class AgentService(PRecord):
 
         api_args = configuration['dataset']
         backend_name = api_args.pop('backend')
+        # Deployer settings rather than the storage driver's:
+        pre_replication_interval = api_args.pop(
+            'pre_replication_interval', None)
+        replication_compression = api_args.pop(
+            'replication_compression', False)
+        replication_streams = api_args.pop('replication_streams', 1)
 
         return cls(
             control_service_host=host,
@@ -533,6 +570,9 @@ class AgentService(PRecord):
 
             backend_name=backend_name.decode("ascii"),
             api_args=api_args,
+            pre_replication_interval=pre_replication_interval,
+            replication_compression=replication_compression,
+            replication_streams=replication_streams,
         )
 
     def get_backend(self):
@@ -588,7 +628,7 @@ class AgentService(PRecord):
         if backend.needs_reactor:
             api_args = api_args.set("reactor", self.reactor)
 
-        return backend.api_factory(**api_args)
+        return backend.load_api_factory()(**api_args)
 
     def get_deployer(self, api):
         """
@@ -607,10 +647,58 @@ class AgentService(PRecord):
             self.control_service_host, self.control_service_port,
         )
         node_uuid = self.node_credential.uuid
+        extra = {}
+        if backend.deployer_type is DeployerType.p2p:
+            context_factory = self.get_replication_context_factory()
+            compression = self.replication_compression
+            streams = self.replication_streams
+            extra["remote_volume_manager"] = (
+                lambda hostname: TLSRemoteVolumeManager(
+                    hostname, context_factory, compression=compression,
+                    streams=streams))
+            extra["pre_replication_interval"] = self.pre_replication_interval
         return deployer_factory(
-            api=api, hostname=address, node_uuid=node_uuid,
+            api=api, hostname=address, node_uuid=node_uuid, **extra
         )
 
+    def get_replication_context_factory(self):
+        """
+        Get a TLS context factory which authenticates this node to other
+        nodes and the reverse, for dataset replication.
+        """
+        return replication_context_factory(
+            self.ca_certificate, self.node_credential)
+
+    def get_replication_service(self, api):
+        """
+        Get the service which accepts datasets pushed from other nodes, if
+        the configured backend moves data between nodes directly.
+
+        :param api: The storage driver, as returned by ``get_api``.
+
+        :return: An ``IService`` provider, or ``None`` if the backend does
+            not need one.
+        """
+        if self.get_backend().deployer_type is not DeployerType.p2p:
+            return None
+        return replication_server(
+            self.reactor, api, self.get_replication_context_factory())
+
+    def get_volume_daemon_service(self, api):
+        """
+        Get the service which lets ``flocker-volume`` on this node use the
+        agent's volume manager rather than starting its own, if the
+        configured backend has one.
+
+        :param api: The storage driver, as returned by ``get_api``.
+
+        :return: An ``IService`` provider, or ``None`` if the backend does
+            not need one.
+        """
+        if self.get_backend().deployer_type is not DeployerType.p2p:
+            return None
+        return volume_daemon(self.reactor, api)
+
     def get_loop_service(self, deployer):
         """
         :param IDeployer deployer: The deployer which the loop service can use
@@ -652,4 +740,12 @@ class DatasetServiceFactory(PRecord):
 
         loop_service = agent_service.get_loop_service(deployer)
 
+        replication_service = agent_service.get_replication_service(api)
+        if replication_service is not None:
+            replication_service.setServiceParent(loop_service)
+
+        volume_daemon_service = agent_service.get_volume_daemon_service(api)
+        if volume_daemon_service is not None:
+            volume_daemon_service.setServiceParent(loop_service)
+
         return loop_service
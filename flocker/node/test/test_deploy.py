@@ -15,6 +15,7 @@ from pyrsistent import pset, pvector
 from bitmath import GiB
 
 from twisted.internet.defer import fail, FirstError, succeed, Deferred
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 from twisted.python.filepath import FilePath
 
@@ -35,7 +36,7 @@ from .._deploy import (
     StartApplication, StopApplication,
     CreateDataset, HandoffDataset, SetProxies, PushDataset,
     ResizeDataset, _link_environment, _to_volume_name,
-    DeleteDataset, OpenPorts
+    DeleteDataset, OpenPorts, PreReplicateDataset,
 )
 from ...testtools import CustomException
 from .. import _deploy
@@ -209,6 +210,11 @@ PushVolumeIStateChangeTests = make_istatechange_tests(
     dict(dataset=_DATASET_A, hostname=b"123"),
     dict(dataset=_DATASET_B, hostname=b"123")
 )
+PreReplicateDatasetIStateChangeTests = make_istatechange_tests(
+    PreReplicateDataset,
+    dict(dataset=_DATASET_A, hostname=b"123"),
+    dict(dataset=_DATASET_B, hostname=b"123")
+)
 DeleteDatasetTests = make_istatechange_tests(
     DeleteDataset,
     dict(dataset=_DATASET_A),
@@ -932,6 +938,30 @@ class ApplicationNodeDeployerDiscoverNodeConfigurationTests(
             states
         )
 
+    def test_one_network_snapshot_per_iteration(self):
+        """
+        ``ApplicationNodeDeployer.calculate_changes`` uses the
+        ``NetworkSnapshot`` taken by the preceding ``discover_state`` rather
+        than inspecting the network again, but only once.
+        """
+        snapshots = []
+        snapshot = self.network.snapshot
+        self.network.snapshot = lambda: snapshots.append(None) or snapshot()
+        api = ApplicationNodeDeployer(
+            u'example.com',
+            node_uuid=self.node_uuid,
+            docker_client=FakeDockerClient(),
+            network=self.network,
+        )
+        [state] = self.successResultOf(
+            api.discover_state(self.EMPTY_NODESTATE))
+        current = DeploymentState(nodes=[state])
+        desired = Deployment(nodes=[to_node(state)])
+        api.calculate_changes(desired, current)
+        first = len(snapshots)
+        api.calculate_changes(desired, current)
+        self.assertEqual((1, 2), (first, len(snapshots)))
+
     def test_discover_application_restart_policy(self):
         """
         An ``Application`` with the appropriate ``IRestartPolicy`` is
@@ -1402,7 +1432,8 @@ class ApplicationNodeDeployerCalculateChangesTests(SynchronousTestCase):
             ip=destination_state.hostname,
             port=port.external_port,
         )
-        expected = sequentially(changes=[SetProxies(ports=frozenset([proxy]))])
+        expected = sequentially(changes=[
+            SetProxies(ports=frozenset([proxy]), existing=frozenset())])
         assert_application_calculated_changes(
             self, local_state, local_config, set(),
             additional_node_states={destination_state},
@@ -1450,9 +1481,49 @@ class ApplicationNodeDeployerCalculateChangesTests(SynchronousTestCase):
         desired = Deployment(nodes=frozenset())
         result = api.calculate_changes(
             desired_configuration=desired, current_cluster_state=EMPTY)
-        expected = sequentially(changes=[SetProxies(ports=frozenset())])
+        # The proxies found when the changes were calculated are passed on
+        # so that they aren't enumerated again:
+        expected = sequentially(changes=[SetProxies(
+            ports=frozenset(), existing=network.enumerate_proxies())])
         self.assertEqual(expected, result)
 
+    def test_existing_proxy_with_address(self):
+        """
+        ``ApplicationNodeDeployer.calculate_changes`` does not return a
+        ``SetProxies`` if the existing proxies, whose destinations are
+        ``IPv4Address`` instances, already match the desired proxies.
+        """
+        port = Port(internal_port=3306, external_port=1001)
+        application = Application(
+            name=b'mysql-hybridcluster',
+            image=DockerImage(repository=u'clusterhq/mysql',
+                              tag=u'release-14.0'),
+            ports=frozenset([port]),
+        )
+        local_state = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.100",
+            applications=[], used_ports=[],
+            manifestations={}, devices={}, paths={},
+        )
+        destination_state = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.101",
+            applications=[application], used_ports=[],
+            manifestations={}, devices={}, paths={},
+        )
+        network = make_memory_network()
+        network.create_proxy_to(
+            ip=IPAddress(destination_state.hostname),
+            port=port.external_port)
+        api = ApplicationNodeDeployer(
+            local_state.hostname, node_uuid=local_state.uuid,
+            docker_client=FakeDockerClient(), network=network)
+        desired = Deployment(nodes={
+            to_node(local_state), to_node(destination_state)})
+        current = DeploymentState(nodes={local_state, destination_state})
+        result = api.calculate_changes(
+            desired_configuration=desired, current_cluster_state=current)
+        self.assertEqual(sequentially(changes=[]), result)
+
     def test_open_port_needs_creating(self):
         """
         ``ApplicationNodeDeployer.calculate_changes`` returns a
@@ -1489,7 +1560,8 @@ class ApplicationNodeDeployerCalculateChangesTests(SynchronousTestCase):
             desired_configuration=desired,
             current_cluster_state=DeploymentState(nodes=[node_state]))
         expected = sequentially(changes=[
-            OpenPorts(ports=[OpenPort(port=expected_destination_port)]),
+            OpenPorts(ports=[OpenPort(port=expected_destination_port)],
+                      existing=[]),
             in_parallel(changes=[
                 StartApplication(application=application,
                                  node_state=node_state)])])
@@ -1510,7 +1582,10 @@ class ApplicationNodeDeployerCalculateChangesTests(SynchronousTestCase):
         desired = Deployment(nodes=[])
         result = api.calculate_changes(
             desired_configuration=desired, current_cluster_state=EMPTY)
-        expected = sequentially(changes=[OpenPorts(ports=[])])
+        # The open ports found when the changes were calculated are passed
+        # on so that they aren't enumerated again:
+        expected = sequentially(changes=[OpenPorts(
+            ports=[], existing=network.enumerate_open_ports())])
         self.assertEqual(expected, result)
 
     def test_application_needs_stopping(self):
@@ -1816,7 +1891,8 @@ class ApplicationNodeDeployerCalculateChangesTests(SynchronousTestCase):
         )
 
         expected = sequentially(changes=[
-            OpenPorts(ports=[OpenPort(port=50433)]),
+            OpenPorts(ports=[OpenPort(port=50433)],
+                      existing=network.enumerate_open_ports()),
             in_parallel(changes=[
                 sequentially(changes=[
                     StopApplication(application=old_postgres_app),
@@ -2456,6 +2532,30 @@ class P2PManifestationDeployerCalculateChangesTests(SynchronousTestCase):
         self.assertEqual(expected, changes)
 
 
+def record_network_changes(network):
+    """
+    Record the changes made to an ``INetwork`` provider.
+
+    :param network: A ``MemoryNetwork`` whose mutating methods will be
+        wrapped.
+
+    :return: A ``list`` to which a ``(method name, arguments)`` tuple is
+        appended for every change made to ``network``.
+    """
+    changes = []
+
+    def recorder(name, method):
+        def record(*args):
+            changes.append((name, args))
+            return method(*args)
+        return record
+
+    for name in ["create_proxy_to", "delete_proxy",
+                 "open_port", "delete_open_port"]:
+        setattr(network, name, recorder(name, getattr(network, name)))
+    return changes
+
+
 class SetProxiesTests(SynchronousTestCase):
     """
     Tests for ``SetProxies``.
@@ -2585,6 +2685,125 @@ class SetProxiesTests(SynchronousTestCase):
         failures = self.flushLoggedErrors(ZeroDivisionError)
         self.assertEqual(3, len(failures))
 
+    def test_commit_errors_as_errbacks(self):
+        """
+        Exceptions raised when committing the changes to the network are
+        reported as failures in the returned deferred.
+        """
+        fake_network = make_memory_network()
+        batch = fake_network.batch()
+        batch.commit = lambda: 1/0
+        fake_network.batch = lambda: batch
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[Proxy(ip=u'192.0.2.100', port=3306)]).run(api)
+        exception = self.failureResultOf(d, FirstError)
+        self.assertIsInstance(
+            exception.value.subFailure.value,
+            ZeroDivisionError
+        )
+        self.flushLoggedErrors(ZeroDivisionError)
+
+    def test_unchanged_proxies_untouched(self):
+        """
+        Proxies which exist on the node and which are still required are
+        neither deleted nor re-created.
+        """
+        fake_network = make_memory_network()
+        required_proxy = fake_network.create_proxy_to(
+            ip=u'192.0.2.101', port=3306)
+        obsolete_proxy = fake_network.create_proxy_to(
+            ip=u'192.0.2.100', port=8080)
+        changes = record_network_changes(fake_network)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        new_proxy = Proxy(ip=u'192.0.2.102', port=5432)
+        d = SetProxies(ports=[required_proxy, new_proxy]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [("delete_proxy", (obsolete_proxy,)),
+             ("create_proxy_to", (u'192.0.2.102', 5432))],
+            changes
+        )
+
+    def test_address_compared_as_text(self):
+        """
+        An existing proxy with an ``IPv4Address`` destination is considered
+        the same as a desired proxy with the equivalent ``unicode``
+        destination.
+        """
+        fake_network = make_memory_network()
+        fake_network.create_proxy_to(ip=IPAddress(u'192.0.2.100'), port=3306)
+        changes = record_network_changes(fake_network)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[Proxy(ip=u'192.0.2.100', port=3306)]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual([], changes)
+
+    def test_one_change_among_many_proxies(self):
+        """
+        Adding one proxy to a node which already has a thousand proxies
+        configured performs exactly one network change, regardless of how
+        many proxies already exist.
+        """
+        fake_network = make_memory_network()
+        existing = [
+            fake_network.create_proxy_to(
+                ip=u'192.0.2.%d' % (i % 250 + 1,), port=10000 + i)
+            for i in range(1000)
+        ]
+        changes = record_network_changes(fake_network)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        new_proxy = Proxy(ip=u'192.0.2.1', port=20000)
+        d = SetProxies(ports=existing + [new_proxy]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [("create_proxy_to", (u'192.0.2.1', 20000))], changes)
+
+    def test_existing_not_enumerated(self):
+        """
+        If the proxies which existed when the changes were calculated are
+        given, they are compared with the desired ones instead of
+        enumerating the proxies again.
+        """
+        fake_network = make_memory_network()
+        obsolete_proxy = fake_network.create_proxy_to(
+            ip=u'192.0.2.100', port=8080)
+        changes = record_network_changes(fake_network)
+        self.patch(fake_network, "enumerate_proxies", lambda: 1 / 0)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(
+            ports=[Proxy(ip=u'192.0.2.102', port=5432)],
+            existing=[obsolete_proxy]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [("delete_proxy", (obsolete_proxy,)),
+             ("create_proxy_to", (u'192.0.2.102', 5432))],
+            changes
+        )
+
 
 class OpenPortsTests(SynchronousTestCase):
     """
@@ -2714,6 +2933,78 @@ class OpenPortsTests(SynchronousTestCase):
         failures = self.flushLoggedErrors(ZeroDivisionError)
         self.assertEqual(3, len(failures))
 
+    def test_commit_errors_as_errbacks(self):
+        """
+        Exceptions raised when committing the changes to the network are
+        reported as failures in the returned deferred.
+        """
+        fake_network = make_memory_network()
+        batch = fake_network.batch()
+        batch.commit = lambda: 1/0
+        fake_network.batch = lambda: batch
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = OpenPorts(ports=[OpenPort(port=3306)]).run(api)
+        exception = self.failureResultOf(d, FirstError)
+        self.assertIsInstance(
+            exception.value.subFailure.value,
+            ZeroDivisionError
+        )
+        self.flushLoggedErrors(ZeroDivisionError)
+
+    def test_unchanged_open_ports_untouched(self):
+        """
+        Open ports which exist on the node and which are still required are
+        neither closed nor re-opened.
+        """
+        fake_network = make_memory_network()
+        required_open_port = fake_network.open_port(port=3306)
+        obsolete_open_port = fake_network.open_port(port=8080)
+        changes = record_network_changes(fake_network)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = OpenPorts(
+            ports=[required_open_port, OpenPort(port=5432)]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [("delete_open_port", (obsolete_open_port,)),
+             ("open_port", (5432,))],
+            changes
+        )
+
+    def test_existing_not_enumerated(self):
+        """
+        If the open ports which existed when the changes were calculated are
+        given, they are compared with the desired ones instead of
+        enumerating the open ports again.
+        """
+        fake_network = make_memory_network()
+        obsolete_open_port = fake_network.open_port(port=8080)
+        changes = record_network_changes(fake_network)
+        self.patch(fake_network, "enumerate_open_ports", lambda: 1 / 0)
+
+        api = ApplicationNodeDeployer(
+            u'example.com', docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = OpenPorts(
+            ports=[OpenPort(port=5432)],
+            existing=[obsolete_open_port]).run(api)
+
+        self.successResultOf(d)
+        self.assertEqual(
+            [("delete_open_port", (obsolete_open_port,)),
+             ("open_port", (5432,))],
+            changes
+        )
+
 
 class CreateDatasetTests(SynchronousTestCase):
     """
@@ -2948,6 +3239,174 @@ class PushVolumeTests(SynchronousTestCase):
         self.assertIs(push_result, result)
 
 
+class PreReplicationTests(SynchronousTestCase):
+    """
+    Tests for background pushes of datasets which are moving to another node
+    while still in use by ``P2PManifestationDeployer``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.volume_service = create_volume_service(self)
+        self.pushes = []
+        self.patch(self.volume_service, "push", self._push)
+        self.deployer = P2PManifestationDeployer(
+            u"node1.example.com", self.volume_service,
+            remote_volume_manager=lambda hostname: hostname,
+            pre_replication_interval=60, reactor=self.clock)
+
+    def _push(self, *args):
+        result = Deferred()
+        self.pushes.append((args, result))
+        return result
+
+    def calculate_changes(self, in_use=True):
+        """
+        Calculate changes for a dataset on this node which is configured to
+        be on ``node2.example.com``.
+        """
+        node_state = NodeState(
+            uuid=self.deployer.node_uuid,
+            hostname=self.deployer.hostname,
+            manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+            paths={}, devices={}, used_ports=[],
+            applications={APPLICATION_WITH_VOLUME} if in_use else [],
+        )
+        another_node_state = NodeState(
+            hostname=u"node2.example.com", manifestations={},
+            devices={}, paths={},
+        )
+        current = DeploymentState(nodes=[node_state, another_node_state])
+        desired = Deployment(nodes={
+            Node(hostname=node_state.hostname),
+            Node(hostname=another_node_state.hostname,
+                 manifestations={MANIFESTATION.dataset_id: MANIFESTATION}),
+        })
+        return self.deployer.calculate_changes(desired, current)
+
+    def pre_replicate(self):
+        return sequentially(changes=[in_parallel(changes=[
+            PreReplicateDataset(dataset=MANIFESTATION.dataset,
+                                hostname=u"node2.example.com")])])
+
+    def handoff(self):
+        return sequentially(changes=[in_parallel(changes=[
+            HandoffDataset(dataset=MANIFESTATION.dataset,
+                           hostname=u"node2.example.com")])])
+
+    def test_in_use(self):
+        """
+        A dataset which is moving but still in use is pushed in the
+        background.
+        """
+        self.assertEqual(self.pre_replicate(), self.calculate_changes())
+
+    def test_disabled(self):
+        """
+        Without a ``pre_replication_interval`` a dataset which is moving but
+        still in use is not pushed.
+        """
+        self.deployer.pre_replication_interval = None
+        self.assertEqual(sequentially(changes=[]), self.calculate_changes())
+
+    def test_run(self):
+        """
+        ``PreReplicateDataset.run`` pushes the dataset with
+        ``VolumeService.push`` and does not wait for it.
+        """
+        result = PreReplicateDataset(
+            dataset=MANIFESTATION.dataset, hostname=u"node2.example.com",
+        ).run(self.deployer)
+        self.assertEqual(
+            (None, [(self.volume_service.get(
+                _to_volume_name(MANIFESTATION.dataset_id)),
+                u"node2.example.com")]),
+            (self.successResultOf(result),
+             [args for (args, _) in self.pushes]))
+
+    def test_one_push_at_a_time(self):
+        """
+        A dataset is not pushed again, or handed off, while a background push
+        is running.
+        """
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.assertEqual(
+            (1, sequentially(changes=[]), sequentially(changes=[])),
+            (len(self.pushes), self.calculate_changes(),
+             self.calculate_changes(in_use=False)))
+
+    def test_handoff_after_push(self):
+        """
+        Once the background push has finished and the dataset is no longer in
+        use, it is handed off.
+        """
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.pushes[0][1].callback(None)
+        self.assertEqual(self.handoff(), self.calculate_changes(in_use=False))
+
+    def test_interval(self):
+        """
+        A dataset is pushed again once ``pre_replication_interval`` seconds
+        have passed since the last push started.
+        """
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.clock.advance(10)
+        self.pushes[0][1].callback(None)
+        self.clock.advance(49)
+        too_soon = self.calculate_changes()
+        self.clock.advance(1)
+        self.assertEqual(
+            (sequentially(changes=[]), self.pre_replicate()),
+            (too_soon, self.calculate_changes()))
+
+    def test_failed_push(self):
+        """
+        A failed background push does not count as a replication, so the
+        dataset is pushed again.
+        """
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.pushes[0][1].errback(ZeroDivisionError())
+        self.assertEqual(
+            (None, self.pre_replicate()),
+            (self.deployer.replication_lag(MANIFESTATION.dataset_id),
+             self.calculate_changes()))
+
+    @validate_logging(None)
+    def test_push_raises(self, logger):
+        """
+        If ``VolumeService.push`` raises rather than returning a ``Deferred``
+        the failure is logged and the dataset is pushed again, just as for a
+        failed push.
+        """
+        def push(volume, destination):
+            raise ZeroDivisionError()
+        self.patch(self.volume_service, "push", push)
+        self.patch(_deploy, "_logger", logger)
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        logger.flushTracebacks(ZeroDivisionError)
+        self.assertEqual(self.pre_replicate(), self.calculate_changes())
+
+    def test_replication_lag(self):
+        """
+        ``P2PManifestationDeployer.replication_lag`` is the time since the
+        start of the last successful background push of the dataset.
+        """
+        self.clock.advance(100)
+        self.deployer.start_replication(
+            MANIFESTATION.dataset, u"node2.example.com")
+        self.clock.advance(5)
+        self.pushes[0][1].callback(None)
+        self.clock.advance(3)
+        self.assertEqual(
+            8, self.deployer.replication_lag(MANIFESTATION.dataset_id))
+
+
 class ControllableDeployerInterfaceTests(
         ideployer_tests_factory(
             lambda test: ControllableDeployer(
@@ -38,6 +38,9 @@ from ..agents.ebs import EBSBlockDeviceAPI
 from .._loop import AgentLoopService
 from ...testtools import MemoryCoreReactor, random_name
 from ...ca.testtools import get_credential_sets
+from ...volume._daemon import DEFAULT_SOCKET_PATH
+from ...volume.testtools import create_volume_service
+from ...volume._replication import REPLICATION_PORT, TLSRemoteVolumeManager
 
 from .dummybackend import DUMMY_API
 
@@ -115,6 +118,12 @@ class DummyAgentService(PRecord):
     def get_loop_service(self, deployer):
         return self.loop_service
 
+    def get_replication_service(self, api):
+        return None
+
+    def get_volume_daemon_service(self, api):
+        return None
+
 
 class DatasetServiceFactoryTests(SynchronousTestCase):
     """
@@ -226,6 +235,48 @@ class AgentServiceFromConfigurationTests(SynchronousTestCase):
             ),
         )
 
+    def test_pre_replication_interval(self):
+        """
+        ``AgentService.from_configuration`` takes the optional
+        ``pre_replication_interval`` of the ``dataset`` section for the
+        deployer, rather than passing it to the storage driver.
+        """
+        setup_config(self)
+        configuration = yaml.safe_load(self.config.getContent())
+        configuration[u"dataset"][u"pre_replication_interval"] = 30
+        self.config.setContent(yaml.safe_dump(configuration))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (30, False),
+            (agent_service.pre_replication_interval,
+             u"pre_replication_interval" in agent_service.api_args))
+
+    def test_replication_options(self):
+        """
+        ``AgentService.from_configuration`` takes the optional
+        ``replication_compression`` and ``replication_streams`` of the
+        ``dataset`` section for the deployer, rather than passing them to
+        the storage driver.
+        """
+        setup_config(self)
+        configuration = yaml.safe_load(self.config.getContent())
+        configuration[u"dataset"][u"replication_compression"] = True
+        configuration[u"dataset"][u"replication_streams"] = 4
+        self.config.setContent(yaml.safe_dump(configuration))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (True, 4, {}),
+            (agent_service.replication_compression,
+             agent_service.replication_streams,
+             {key: value for key, value in agent_service.api_args.items()
+              if key.startswith(u"replication_")}))
+
 
 class AgentServiceGetAPITests(SynchronousTestCase):
     """
@@ -322,6 +373,25 @@ class AgentServiceGetAPITests(SynchronousTestCase):
             api,
         )
 
+    def test_named_api_factory(self):
+        """
+        If the selected backend names its API factory rather than providing
+        it, ``AgentService.get_api`` imports the factory and calls it.
+        """
+        agent_service = self.agent_service.set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=True,
+                    api_factory=u"flocker.node.test.dummybackend.api_factory",
+                    deployer_type=DeployerType.block,
+                ),
+            ],
+        ).set(
+            "api_args", {u"custom": u"arguments!"},
+        )
+        self.assertIs(DUMMY_API, agent_service.get_api())
+
     def test_default_openstack(self):
         """
         An OpenStack backend is available by default.
@@ -425,6 +495,8 @@ class AgentServiceDeployerTests(SynchronousTestCase):
             api = field(mandatory=True)
             hostname = field(mandatory=True)
             node_uuid = field(mandatory=True)
+            remote_volume_manager = field()
+            pre_replication_interval = field()
 
         class WrongDeployer(PRecord):
             pass
@@ -456,10 +528,144 @@ class AgentServiceDeployerTests(SynchronousTestCase):
                 api=api,
                 hostname=ip,
                 node_uuid=self.ca_set.node.uuid,
+                remote_volume_manager=deployer.remote_volume_manager,
+                pre_replication_interval=None,
             ),
             deployer,
         )
 
+    def test_p2p_replication(self):
+        """
+        ``AgentService.get_deployer`` gives a peer-to-peer deployer a factory
+        of ``TLSRemoteVolumeManager`` instances for pushing datasets to other
+        nodes.
+        """
+        class Deployer(PRecord):
+            api = field(mandatory=True)
+            hostname = field(mandatory=True)
+            node_uuid = field(mandatory=True)
+            remote_volume_manager = field(mandatory=True)
+            pre_replication_interval = field(mandatory=True)
+
+        agent_service = self.agent_service.set(
+            "get_external_ip", lambda host, port: b"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.p2p,
+                ),
+            ],
+        ).set("deployers", {DeployerType.p2p: Deployer})
+
+        deployer = agent_service.get_deployer(object())
+        self.assertEqual(
+            TLSRemoteVolumeManager(b"192.0.2.8", None),
+            deployer.remote_volume_manager(b"192.0.2.8"))
+
+    def test_p2p_pre_replication(self):
+        """
+        ``AgentService.get_deployer`` gives a peer-to-peer deployer the
+        configured ``pre_replication_interval``.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service.set(
+                "get_external_ip", lambda host, port: b"192.0.2.7",
+            ).set("pre_replication_interval", 30),
+            DeployerType.p2p)
+        deployer = agent_service.get_deployer(create_volume_service(self))
+        self.assertEqual(30, deployer.pre_replication_interval)
+
+    def test_p2p_replication_options(self):
+        """
+        ``AgentService.get_deployer`` gives a peer-to-peer deployer remote
+        volume managers which compress and stripe data streams as
+        configured.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service.set(
+                "get_external_ip", lambda host, port: b"192.0.2.7",
+            ).set("replication_compression", True).set(
+                "replication_streams", 4),
+            DeployerType.p2p)
+        deployer = agent_service.get_deployer(create_volume_service(self))
+        manager = deployer.remote_volume_manager(b"192.0.2.8")
+        self.assertEqual((True, 4), (manager._compression, manager._streams))
+
+
+def with_deployer_type(agent_service, deployer_type):
+    """
+    :return: ``agent_service`` with its backend replaced by one with the
+        given deployer type.
+    """
+    return agent_service.set(
+        "backends", [
+            BackendDescription(
+                name=agent_service.backend_name,
+                needs_reactor=False, needs_cluster_id=False,
+                api_factory=None, deployer_type=deployer_type,
+            ),
+        ],
+    )
+
+
+class AgentServiceReplicationTests(SynchronousTestCase):
+    """
+    Tests for ``AgentService.get_replication_service``.
+    """
+    setUp = agent_service_setup
+
+    def test_p2p(self):
+        """
+        For a peer-to-peer backend ``AgentService.get_replication_service``
+        returns a service listening on ``REPLICATION_PORT``.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service, DeployerType.p2p)
+        service = agent_service.get_replication_service(object())
+        service.startService()
+        self.addCleanup(service.stopService)
+        self.assertEqual(
+            REPLICATION_PORT, self.reactor.sslServers[0][0])
+
+    def test_block(self):
+        """
+        For a block device backend ``AgentService.get_replication_service``
+        returns ``None``.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service, DeployerType.block)
+        self.assertIs(None, agent_service.get_replication_service(object()))
+
+
+class AgentServiceVolumeDaemonTests(SynchronousTestCase):
+    """
+    Tests for ``AgentService.get_volume_daemon_service``.
+    """
+    setUp = agent_service_setup
+
+    def test_p2p(self):
+        """
+        For a peer-to-peer backend ``AgentService.get_volume_daemon_service``
+        returns a service serving the storage driver on
+        ``DEFAULT_SOCKET_PATH``.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service, DeployerType.p2p)
+        service = agent_service.get_volume_daemon_service(object())
+        self.assertEqual(DEFAULT_SOCKET_PATH, service.socket_path)
+
+    def test_block(self):
+        """
+        For a block device backend ``AgentService.get_volume_daemon_service``
+        returns ``None``.
+        """
+        agent_service = with_deployer_type(
+            self.agent_service, DeployerType.block)
+        self.assertIs(
+            None, agent_service.get_volume_daemon_service(object()))
+
 
 class AgentServiceLoopTests(SynchronousTestCase):
     """
@@ -8,10 +8,14 @@ from ._infrastructure import (
     structured, EndpointResponse, user_documentation, private_api,
     )
 
-from ._error import makeBadRequest as make_bad_request
+from ._error import BadRequest, makeBadRequest as make_bad_request
+from ._watch import ChangeWatchers
+from ._schema import OutputValidation
+from ._stream import StreamingResponse
 
 
 __all__ = [
     "structured", "EndpointResponse", "user_documentation",
-    "make_bad_request", "private_api",
+    "make_bad_request", "BadRequest", "private_api", "ChangeWatchers",
+    "OutputValidation", "StreamingResponse",
 ]
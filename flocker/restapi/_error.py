@@ -10,7 +10,7 @@ __all__ = [
     "DECODING_ERROR_DESCRIPTION", "ILLEGAL_CONTENT_TYPE_DESCRIPTION",
 
     "DECODING_ERROR", "ILLEGAL_CONTENT_TYPE", "UNAUTHORIZED",
-    "ENTITY_NOT_FOUND",
+    "ENTITY_NOT_FOUND", "INVALID_WAIT", "TOO_MANY_WATCHERS",
 
     "NameCollision",
 
@@ -19,7 +19,9 @@ __all__ = [
 
 from inspect import cleandoc
 
-from twisted.web.http import BAD_REQUEST, FORBIDDEN, NOT_FOUND
+from twisted.web.http import (
+    BAD_REQUEST, FORBIDDEN, NOT_FOUND, SERVICE_UNAVAILABLE,
+)
 
 # HTTP response code indicating the request is syntactically correct but
 # semantically wrong, as defined in
@@ -72,6 +74,12 @@ NOT_FOUND_DESCRIPTION = cleandoc(u"""
 UNAUTHORIZED_DESCRIPTION = cleandoc("""
     The user is not authorized to do this operation.
     """)
+INVALID_WAIT_DESCRIPTION = cleandoc(u"""
+    The wait query argument must be a non-negative number of seconds.
+    """)
+TOO_MANY_WATCHERS_DESCRIPTION = cleandoc(u"""
+    Too many requests are already waiting for changes.  Try again later.
+    """)
 
 DECODING_ERROR = makeBadRequest(description=DECODING_ERROR_DESCRIPTION)
 ILLEGAL_CONTENT_TYPE = makeBadRequest(
@@ -80,6 +88,9 @@ ENTITY_NOT_FOUND = makeBadRequest(
     code=NOT_FOUND, description=NOT_FOUND_DESCRIPTION)
 UNAUTHORIZED = makeBadRequest(
     FORBIDDEN, description=UNAUTHORIZED_DESCRIPTION)
+INVALID_WAIT = makeBadRequest(description=INVALID_WAIT_DESCRIPTION)
+TOO_MANY_WATCHERS = makeBadRequest(
+    SERVICE_UNAVAILABLE, description=TOO_MANY_WATCHERS_DESCRIPTION)
 
 
 class InvalidRequestJSON(BadRequest):
@@ -10,27 +10,38 @@ __all__ = [
     ]
 
 from functools import wraps
+from hashlib import sha1
+from weakref import WeakKeyDictionary
 
 from json import loads, dumps
 
 from pyrsistent import PRecord, field, pvector
 
-from twisted.internet.defer import maybeDeferred
-from twisted.web.http import OK, INTERNAL_SERVER_ERROR
+from twisted.internet.defer import CancelledError, maybeDeferred, succeed
+from twisted.web.http import OK, INTERNAL_SERVER_ERROR, NOT_MODIFIED
 
 from eliot import Logger, writeFailure
 from eliot.twisted import DeferredContext
 
 from ._error import (
-    ILLEGAL_CONTENT_TYPE, DECODING_ERROR, BadRequest, InvalidRequestJSON)
+    ILLEGAL_CONTENT_TYPE, DECODING_ERROR, INVALID_WAIT, BadRequest,
+    InvalidRequestJSON)
 from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST
-from ._schema import getValidator
+from ._schema import OutputValidation, getValidator
+from ._stream import StreamingResponse, StreamedBody, json_chunks
 
 _ASCENDING = b"ascending"
 _DESCENDING = b"descending"
 
 _logger = Logger()
 
+# Validate every response in full, unless an object says otherwise:
+_output_validation = OutputValidation()
+
+# The most responses of a conditional endpoint remembered for each object
+# it is a method of, one for each set of query and route arguments:
+_MAXIMUM_CACHED_RESPONSES = 100
+
 
 class EndpointResponse(object):
     """
@@ -65,6 +76,18 @@ def _get_logger(self):
         return logger
 
 
+def _get_output_validation(self):
+    """
+    Find the specific or default ``OutputValidation``.
+
+    :return: An ``OutputValidation`` object.
+    """
+    output_validation = getattr(self, "output_validation", None)
+    if output_validation is None:
+        output_validation = _output_validation
+    return output_validation
+
+
 def _logging(original):
     """
     Decorate a method which implements an API endpoint to add Eliot-based
@@ -117,17 +140,28 @@ def _serialize(outputValidator):
     into a structure indicating a successful result.
 
     @param outputValidator: A L{jsonschema} validator for the returned JSON.
+        The returned JSON is validated according to the object's
+        C{output_validation} attribute, an L{OutputValidation}, or fully if
+        it has none.  The items of a L{StreamingResponse} are validated as
+        they are produced.
 
     @return: A decorator that decorates a function with the signature
         of a Klein route endpoint that may return a Deferred.
     """
     def deco(original):
-        def success(result, request):
+        def success(result, self, request):
             code = OK
+            if isinstance(result, StreamingResponse):
+                items = _get_output_validation(self).validate_items(
+                    outputValidator, result.items)
+                request.responseHeaders.setRawHeaders(
+                    b"content-type", [b"application/json"])
+                request.setResponseCode(result.code)
+                return StreamedBody(json_chunks(items), _get_logger(self))
             if isinstance(result, EndpointResponse):
                 code = result.code
                 result = result.result
-            outputValidator.validate(result)
+            _get_output_validation(self).validate(outputValidator, result)
             request.responseHeaders.setRawHeaders(
                 b"content-type", [b"application/json"])
             request.setResponseCode(code)
@@ -135,14 +169,202 @@ def _serialize(outputValidator):
 
         def doit(self, request, **routeArguments):
             result = maybeDeferred(original, self, request, **routeArguments)
-            result.addCallback(success, request)
+            result.addCallback(success, self, request)
+            return result
+
+        return doit
+    return deco
+
+
+def _entity_tags(request):
+    """
+    Find the entity tags a request's I{If-None-Match} headers list.
+
+    Weak tags are included as if they were strong, since a matching tag only
+    ever saves sending the same response again.
+
+    :param request: The request.
+
+    :return: A ``set`` of the quoted tags as ``bytes``, possibly including
+        C{b"*"}.
+    """
+    tags = set()
+    for header in request.requestHeaders.getRawHeaders(b"if-none-match", []):
+        for tag in header.split(b","):
+            tag = tag.strip()
+            if tag.startswith(b"W/"):
+                tag = tag[2:]
+            tags.add(tag)
+    return tags
+
+
+def _query_arguments(request):
+    """
+    Find the query arguments of a request, except for those handled by
+    the infrastructure itself (I{wait}).
+
+    :param request: The request.
+
+    :raise BadRequest: ``DECODING_ERROR`` if an argument is not UTF-8.
+
+    :return: A ``dict`` mapping the name of each argument to its first
+        value, both ``unicode``.
+    """
+    try:
+        return {
+            name.decode("utf-8"): values[0].decode("utf-8")
+            for (name, values) in request.args.items()
+            if name != b"wait"
+        }
+    except UnicodeDecodeError:
+        raise DECODING_ERROR
+
+
+def _wait_seconds(request):
+    """
+    Find how long a request asks to wait for a change, from its I{wait} query
+    argument.
+
+    :param request: The request.
+
+    :raise BadRequest: ``INVALID_WAIT`` if the argument is not a non-negative
+        number.
+
+    :return: The number of seconds as a ``float``.
+    """
+    try:
+        seconds = float(request.args[b"wait"][0])
+    except ValueError:
+        raise INVALID_WAIT
+    # Also rejects NaN:
+    if not seconds >= 0:
+        raise INVALID_WAIT
+    return seconds
+
+
+def _conditional(etag, watch=None):
+    """
+    Decorate a function so that I{GET} requests are answered without calling
+    the function if nothing changed since it last responded: with I{NOT
+    MODIFIED} if the client already has the current response, and otherwise
+    with the response encoded last time.
+
+    @param etag: ``None``, or a function which is passed the object the
+        endpoint is a method of and returns an entity tag (unquoted
+        ``bytes``) which changes whenever the response would.  It must be
+        cheap compared to computing the response.  Requests with different
+        query or route arguments get different tags.
+
+    @param watch: ``None``, or a function which is passed the object the
+        endpoint is a method of and returns the ``ChangeWatchers`` notified
+        whenever the entity tag changes.  Requests the client already has the
+        current response for may then include a I{wait} query argument, the
+        number of seconds to wait for a change before answering.
+
+    @return: A decorator that decorates a function with the signature
+        of a Klein route endpoint that returns a Deferred.
+    """
+    def deco(original):
+        if etag is None:
+            return original
+
+        # For each object the endpoint is a method of, the tag and body of
+        # the last successful response to each set of arguments:
+        responses = WeakKeyDictionary()
+
+        def arguments(request, routeArguments):
+            query = sorted(_query_arguments(request).items())
+            route = sorted(routeArguments.items())
+            if not query and not route:
+                return None
+            return repr((query, route))
+
+        def current_tag(self, request, routeArguments):
+            tag = etag(self)
+            key = arguments(request, routeArguments)
+            if key is not None:
+                tag += b"-" + sha1(key).hexdigest()
+            return b'"' + tag + b'"'
+
+        def remember(self, key, tag, body):
+            cached = responses.setdefault(self, {})
+            if key not in cached and len(cached) >= _MAXIMUM_CACHED_RESPONSES:
+                cached.clear()
+            cached[key] = (tag, body)
+
+        def not_modified(request, tag):
+            request.setResponseCode(NOT_MODIFIED)
+            request.responseHeaders.setRawHeaders(b"etag", [tag])
+            return b""
+
+        def respond(self, request, routeArguments, tag):
+            key = arguments(request, routeArguments)
+            last_tag, body = responses.get(self, {}).get(key, (None, None))
+            if last_tag == tag:
+                request.responseHeaders.setRawHeaders(
+                    b"content-type", [b"application/json"])
+                request.responseHeaders.setRawHeaders(b"etag", [tag])
+                return succeed(body)
+
+            def success(body):
+                if request.code == OK:
+                    request.responseHeaders.setRawHeaders(b"etag", [tag])
+                    if isinstance(body, StreamedBody):
+                        # Kept once it has all been written, to be written
+                        # again from memory:
+                        body.record().addCallback(
+                            lambda chunks: remember(
+                                self, key, tag, StreamedBody(
+                                    chunks, _get_logger(self))))
+                    else:
+                        remember(self, key, tag, body)
+                return body
+            result = original(self, request, **routeArguments)
+            result.addCallback(success)
             return result
 
+        def wait(self, request, routeArguments, tags):
+            waiting = watch(self).wait(_wait_seconds(request))
+            # Stop waiting if the client goes away:
+            request.notifyFinish().addErrback(lambda _: waiting.cancel())
+
+            def woken(_):
+                tag = current_tag(self, request, routeArguments)
+                if tag in tags:
+                    return not_modified(request, tag)
+                return respond(self, request, routeArguments, tag)
+            waiting.addCallback(woken)
+
+            def cancelled(reason):
+                reason.trap(CancelledError)
+                return b""
+            waiting.addErrback(cancelled)
+            return waiting
+
+        def conditional(self, request, routeArguments):
+            # Computed before the response, so if things change meanwhile
+            # the client just gets the newer response again next time.
+            tag = current_tag(self, request, routeArguments)
+            tags = _entity_tags(request)
+            if b"*" in tags:
+                return not_modified(request, tag)
+            if tag in tags:
+                if watch is not None and b"wait" in request.args:
+                    return wait(self, request, routeArguments, tags)
+                return not_modified(request, tag)
+            return respond(self, request, routeArguments, tag)
+
+        def doit(self, request, **routeArguments):
+            if request.method != b"GET":
+                return original(self, request, **routeArguments)
+            return maybeDeferred(conditional, self, request, routeArguments)
+
         return doit
     return deco
 
 
-def structured(inputSchema, outputSchema, schema_store=None):
+def structured(inputSchema, outputSchema, schema_store=None, etag=None,
+               watch=None, query_schema=None):
     """
     Decorate a Klein-style endpoint method so that the request body is
     automatically decoded and the response body is automatically encoded.
@@ -158,26 +380,58 @@ def structured(inputSchema, outputSchema, schema_store=None):
         original(foo="bar")
 
     The encoded form of the object returned by C{original} will define the
-    response body.
+    response body.  A list response may instead be returned as a
+    L{StreamingResponse}, to be encoded and written as its items are
+    produced.
 
     :param inputSchema: JSON Schema describing the request body.
     :param outputSchema: JSON Schema describing the response body.
     :param schema_store: A mapping between schema paths
         (e.g. ``b/v1/types.json``) and the JSON schema structure, allowing
         input/output schemas to just be references.
+    :param etag: ``None``, or a function which is passed the object the
+        endpoint is a method of and returns an entity tag (unquoted
+        ``bytes``) which changes whenever the endpoint's response would.
+        Successful I{GET} responses then carry an I{ETag} header.  While the
+        tag stays the same C{original} is not called again: requests whose
+        I{If-None-Match} header has the tag are answered with I{NOT
+        MODIFIED}, and others with the response already encoded.
+    :param watch: ``None``, or a function which is passed the object the
+        endpoint is a method of and returns the ``ChangeWatchers`` notified
+        whenever the ``etag`` tag changes.  A I{GET} request whose
+        I{If-None-Match} header has the current tag may then also have a
+        I{wait} query argument, giving the number of seconds to wait for a
+        change before answering with I{NOT MODIFIED}.
+    :param query_schema: ``None``, or JSON Schema describing the query
+        arguments of I{GET} requests, as an object mapping the name of each
+        argument to its value (both strings).  Items in that object are then
+        passed to C{original} as keyword arguments.  Query arguments are
+        otherwise ignored.
     """
     if schema_store is None:
         schema_store = {}
     inputValidator = getValidator(inputSchema, schema_store)
     outputValidator = getValidator(outputSchema, schema_store)
+    if query_schema is None:
+        queryValidator = None
+    else:
+        queryValidator = getValidator(query_schema, schema_store)
 
     def deco(original):
         @wraps(original)
         @_logging
+        @_conditional(etag, watch)
         @_serialize(outputValidator)
         def loadAndDispatch(self, request, **routeArguments):
             if request.method in (b"GET", b"DELETE"):
                 objects = {}
+                if request.method == b"GET" and queryValidator is not None:
+                    objects = _query_arguments(request)
+                    errors = [error.message for error
+                              in queryValidator.iter_errors(objects)]
+                    if errors:
+                        raise InvalidRequestJSON(
+                            errors=errors, schema=query_schema)
             else:
                 contentType = request.requestHeaders.getRawHeaders(
                     b"content-type", [None])[0]
@@ -213,6 +467,10 @@ def structured(inputSchema, outputSchema, schema_store=None):
                     if isinstance(result, EndpointResponse):
                         code = result.code
                         json = result.result
+                    elif isinstance(result, StreamingResponse):
+                        # Its items are only produced as they are written.
+                        code = result.code
+                        json = None
                     eliot_action.add_success_fields(code=code, json=json)
                     return result
                 d.addCallback(got_result)
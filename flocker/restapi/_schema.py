@@ -11,9 +11,12 @@ __all__ = [
     "LocalRefResolver",
     "getValidator",
     "resolveSchema",
+    "OutputValidation",
 ]
 
 import copy
+from json import dumps
+from time import time
 
 from jsonschema.validators import RefResolver, validator_for
 from jsonschema import draft4_format_checker
@@ -33,10 +36,49 @@ class LocalRefResolver(RefResolver):
         raise SchemaNotProvided(uri)
 
 
+# Map the encoded schema and the id of the schema store of each validator
+# created by getValidator to the store and the validator:
+_validators = {}
+
+
 def getValidator(schema, schema_store):
     """
     Get a L{jsonschema} validator for C{schema}.
 
+    References in the schema are resolved once, up front, rather than each
+    time something is validated.  Validators are shared between identical
+    schemas using the same store, so the store must not change.
+
+    @param schema: The JSON Schema to validate against.
+    @type schema: L{dict}
+
+    @param dict schema_store: A mapping between schema paths
+        (e.g. ``b/v1/types.json``) and the JSON schema structure.
+    """
+    key = (dumps(schema, sort_keys=True), id(schema_store))
+    store_and_validator = _validators.get(key)
+    if store_and_validator is not None:
+        store, validator = store_and_validator
+        # The id of a store which no longer exists may have been reused:
+        if store is schema_store:
+            return validator
+    try:
+        resolved = resolveSchema(schema, schema_store)
+    except RuntimeError:
+        # A recursive schema can't be resolved up front.
+        validator = _resolvingValidator(schema, schema_store)
+    else:
+        validator = validator_for(resolved)(
+            resolved, format_checker=draft4_format_checker)
+    _validators[key] = (schema_store, validator)
+    return validator
+
+
+def _resolvingValidator(schema, schema_store):
+    """
+    Get a L{jsonschema} validator for C{schema} which resolves references
+    as it validates.
+
     @param schema: The JSON Schema to validate against.
     @type schema: L{dict}
 
@@ -53,6 +95,91 @@ def getValidator(schema, schema_store):
         schema, resolver=resolver, format_checker=draft4_format_checker)
 
 
+class OutputValidation(object):
+    """
+    How responses are validated against the output schemas of their
+    endpoints.
+
+    Validating a large response can cost more than building it, so outside
+    of tests it may be enough to validate a sample of responses, or the
+    first few items of each.
+
+    @ivar items: The number of items of a response which is a list to
+        validate, or C{None} to validate all of them.
+    @ivar int every: Validate one response in this many.
+    @ivar int responses: The number of responses seen.
+    @ivar int validated: The number of responses validated.
+    @ivar float seconds: The time spent validating them.
+    """
+    def __init__(self, items=None, every=1, clock=time):
+        """
+        @param items: See C{items}.
+        @param every: See C{every}.
+        @param clock: A function returning the current time in seconds.
+        """
+        self.items = items
+        self.every = every
+        self._clock = clock
+        self.responses = 0
+        self.validated = 0
+        self.seconds = 0.0
+
+    def validate(self, validator, result):
+        """
+        Validate a response, or not, as configured.
+
+        @param validator: The L{jsonschema} validator for the response.
+        @param result: The JSON-encodable response.
+
+        @raise ValidationError: If the response, or the part of it that was
+            validated, is invalid.
+        """
+        self.responses += 1
+        if (self.responses - 1) % self.every:
+            return
+        if self.items is not None and isinstance(result, list):
+            result = result[:self.items]
+        start = self._clock()
+        try:
+            validator.validate(result)
+        finally:
+            self.validated += 1
+            self.seconds += self._clock() - start
+
+    def validate_items(self, validator, items):
+        """
+        Validate the items of a list response as they are produced, or not,
+        as configured.
+
+        Only the C{items} schema of the list's schema is checked, so
+        constraints on the list as a whole (e.g. C{maxItems}) are not.
+
+        @param validator: The L{jsonschema} validator for the response, whose
+            schema has an C{items} schema.
+        @param items: An iterable of the JSON-encodable items of the response.
+
+        @return: An iterator of the same items, each validated (or not)
+            before it is produced.  It raises L{ValidationError} if an item
+            which was validated is invalid.
+        """
+        self.responses += 1
+        if (self.responses - 1) % self.every:
+            return iter(items)
+        self.validated += 1
+        return self._validating(validator, items)
+
+    def _validating(self, validator, items):
+        schema = validator.schema[u"items"]
+        for index, item in enumerate(items):
+            if self.items is None or index < self.items:
+                start = self._clock()
+                try:
+                    validator.validate(item, schema)
+                finally:
+                    self.seconds += self._clock() - start
+            yield item
+
+
 def resolveSchema(schema, schemaStore):
     """
     Recursively resolve all I{$ref} JSON references in a JSON Schema.
@@ -78,6 +205,8 @@ def resolveSchema(schema, schemaStore):
         if isinstance(obj, dict):
             if "$ref" in obj:
                 with resolver.resolving(obj[u'$ref']) as resolved:
+                    # Resolve a copy, leaving the store as it was:
+                    resolved = copy.deepcopy(resolved)
                     resolve(resolved)
                     obj.clear()
                     obj.update(resolved)
@@ -0,0 +1,208 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.restapi.test.test_stream -*-
+
+"""
+Support for responses which are encoded and written a little at a time,
+rather than all at once.
+"""
+
+from json import dumps
+
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPushProducer
+from twisted.python.failure import Failure
+from twisted.web.http import OK
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from eliot import writeFailure
+
+from ._logging import LOG_SYSTEM
+
+# The number of items encoded into each chunk of a streamed response:
+CHUNK_ITEMS = 100
+
+
+class StreamingResponse(object):
+    """
+    An endpoint can return a L{StreamingResponse} instance to have a list
+    response encoded and written to the client as its items are produced,
+    rather than built, validated and encoded in full before anything is
+    written.
+
+    Each item is validated against the C{items} schema of the endpoint's
+    output schema as it is produced.  Once the response has started, any
+    error just closes the connection, leaving the response incomplete.
+    """
+    def __init__(self, items, code=OK):
+        """
+        @param items: An iterable of the JSON encodeable items of the list,
+            e.g. a generator.  It is only iterated over once.
+
+        @param code: The HTTP response code to set in the response.
+        @type code: L{int}
+        """
+        self.items = items
+        self.code = code
+
+
+def json_chunks(items, chunk_items=CHUNK_ITEMS):
+    """
+    Encode a list as JSON a few items at a time.
+
+    @param items: An iterable of the JSON encodeable items of the list.
+    @param int chunk_items: The number of items to encode into each chunk.
+
+    @return: An iterator of C{bytes} which, joined together, are the same as
+        C{dumps(list(items))}.
+    """
+    yield b"["
+    separator = b""
+    encoded = []
+    for item in items:
+        encoded.append(dumps(item))
+        if len(encoded) == chunk_items:
+            yield separator + b", ".join(encoded)
+            separator = b", "
+            encoded = []
+    if encoded:
+        yield separator + b", ".join(encoded)
+    yield b"]"
+
+
+@implementer(IPushProducer)
+class _ChunkProducer(object):
+    """
+    Write chunks to a request for as long as its transport accepts them.
+
+    @ivar finished: A L{Deferred} which fires with C{None} once every chunk
+        has been written, or fails if producing a chunk fails.  It never
+        fires if the producer is stopped.
+    """
+    def __init__(self, request, chunks):
+        """
+        @param request: The request to write to.
+        @param chunks: An iterable of C{bytes}.
+        """
+        self._request = request
+        self._chunks = iter(chunks)
+        self._paused = False
+        self._stopped = False
+        self._producing = False
+        self.finished = Deferred()
+
+    def start(self):
+        """
+        Start writing.
+
+        @return: C{finished}.
+        """
+        self._request.registerProducer(self, True)
+        self._produce()
+        return self.finished
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._produce()
+
+    def stopProducing(self):
+        self._stopped = True
+
+    def _produce(self):
+        """
+        Write chunks until the transport pauses or stops the producer, or
+        there are no more.
+        """
+        # A write may itself pause and resume the producer:
+        if self._producing:
+            return
+        self._producing = True
+        try:
+            while not (self._paused or self._stopped):
+                try:
+                    chunk = next(self._chunks)
+                except StopIteration:
+                    self._finish(None)
+                    return
+                except:
+                    self._finish(Failure())
+                    return
+                self._request.write(chunk)
+        finally:
+            self._producing = False
+
+    def _finish(self, result):
+        self._stopped = True
+        self._request.unregisterProducer()
+        self.finished.callback(result)
+
+
+class StreamedBody(Resource):
+    """
+    The body of a streamed response, rendered by writing its chunks as the
+    client reads them.
+
+    @ivar _recorders: The L{Deferred}s returned by L{record}.
+    """
+    isLeaf = True
+
+    def __init__(self, chunks, logger):
+        """
+        @param chunks: An iterable of C{bytes}.  It is only iterated over
+            once, unless it is a L{list}.
+        @param logger: The L{eliot.Logger} to log failures to.
+        """
+        Resource.__init__(self)
+        self._chunks = chunks
+        self._logger = logger
+        self._recorders = []
+
+    def record(self):
+        """
+        Keep the chunks as they are written.
+
+        @return: A L{Deferred} which fires with a L{list} of all the chunks
+            once they have all been written, or never if that fails.
+        """
+        recorder = Deferred()
+        self._recorders.append(recorder)
+        return recorder
+
+    def _recorded(self):
+        """
+        @return: The chunks, kept in a L{list} as they are produced if
+            anything is recording them.
+        """
+        if not self._recorders:
+            return self._chunks
+        chunks = []
+        recorders, self._recorders = self._recorders, []
+
+        def recording():
+            for chunk in self._chunks:
+                chunks.append(chunk)
+                yield chunk
+            for recorder in recorders:
+                recorder.callback(chunks)
+        return recording()
+
+    def render(self, request):
+        producer = _ChunkProducer(request, self._recorded())
+        # The transport stops the producer if the connection is lost.
+        writing = producer.start()
+
+        def written(_):
+            request.finish()
+
+        def failed(reason):
+            writeFailure(reason, self._logger, LOG_SYSTEM)
+            # The response can't be completed, so the client has to be told
+            # by the connection being closed:
+            request.transport.loseConnection()
+        writing.addCallbacks(written, failed)
+        return NOT_DONE_YET
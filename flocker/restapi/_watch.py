@@ -0,0 +1,87 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.restapi.test.test_watch -*-
+
+"""
+Support for requests which wait for something to change before being
+answered, i.e. long polling.
+"""
+
+from twisted.internet.defer import Deferred
+
+from ._error import TOO_MANY_WATCHERS
+
+# The longest a request may wait, in seconds:
+MAXIMUM_WAIT = 60
+
+# The default limit on the number of requests waiting at once for changes of
+# one thing:
+MAXIMUM_WATCHERS = 500
+
+
+class ChangeWatchers(object):
+    """
+    Requests waiting for changes of something, e.g. the cluster
+    configuration.
+
+    Changes made in quick succession, e.g. while handling a single update
+    from an agent, wake each request once.
+
+    :ivar set _waiting: The ``Deferred`` of each waiting request.
+    :ivar _wake_call: The ``IDelayedCall`` which will wake the waiting
+        requests, or ``None`` if there were no changes since they were last
+        woken.
+    """
+    def __init__(self, reactor, maximum=MAXIMUM_WATCHERS):
+        """
+        :param reactor: An ``IReactorTime`` provider.
+        :param int maximum: How many requests may wait at once.
+        """
+        self._reactor = reactor
+        self._maximum = maximum
+        self._waiting = set()
+        self._wake_call = None
+
+    def changed(self):
+        """
+        Note that something changed, waking all waiting requests shortly.
+        """
+        if self._wake_call is None:
+            self._wake_call = self._reactor.callLater(0, self._wake)
+
+    def _wake(self):
+        self._wake_call = None
+        waiting, self._waiting = self._waiting, set()
+        for d in waiting:
+            d.callback(None)
+
+    def wait(self, seconds):
+        """
+        Wait for the next change.
+
+        :param float seconds: The longest to wait.  It is limited to
+            ``MAXIMUM_WAIT``.
+
+        :raise BadRequest: ``TOO_MANY_WATCHERS`` if as many requests as
+            allowed are already waiting.
+
+        :return: A ``Deferred`` that fires with ``None`` after the next
+            change or once the time is up, whichever is first.  Cancelling it
+            stops the wait.
+        """
+        if len(self._waiting) >= self._maximum:
+            raise TOO_MANY_WATCHERS
+        waiting = Deferred(self._waiting.discard)
+        self._waiting.add(waiting)
+        timeout = self._reactor.callLater(
+            min(seconds, MAXIMUM_WAIT), self._time_up, waiting)
+
+        def finished(result):
+            if timeout.active():
+                timeout.cancel()
+            return result
+        waiting.addBoth(finished)
+        return waiting
+
+    def _time_up(self, waiting):
+        self._waiting.discard(waiting)
+        waiting.callback(None)
@@ -13,16 +13,21 @@ from pyrsistent import pvector
 from twisted.python.constants import Names, NamedConstant
 from twisted.python.failure import Failure
 from twisted.internet.defer import succeed, fail
+from twisted.internet.error import ConnectionDone
+from twisted.internet.task import Clock
 from twisted.web.http_headers import Headers
 from twisted.web.http import (
     BAD_REQUEST, INTERNAL_SERVER_ERROR, PAYMENT_REQUIRED, GONE,
-    NOT_ALLOWED, NOT_FOUND, OK)
+    NOT_ALLOWED, NOT_FOUND, NOT_MODIFIED, OK, ACCEPTED)
 
 from twisted.trial.unittest import SynchronousTestCase
 
 from .._infrastructure import (
     EndpointResponse, user_documentation, structured, UserDocumentation)
 from .._logging import REQUEST, JSON_REQUEST
+from .._watch import ChangeWatchers, MAXIMUM_WAIT
+from .._schema import OutputValidation
+from .._stream import StreamingResponse
 from .._error import (
     ILLEGAL_CONTENT_TYPE_DESCRIPTION, DECODING_ERROR_DESCRIPTION,
     BadRequest)
@@ -504,6 +509,27 @@ class StructuredJSONTests(SynchronousTestCase):
 
         self.assertEqual(request._code, INTERNAL_SERVER_ERROR)
 
+    @validateLogging(_assertRequestLogged(b"/foo/badresponse"))
+    def test_outputValidation(self, logger):
+        """
+        Responses are validated according to the C{output_validation}
+        attribute of the application, if it has one.
+        """
+        app = self.Application(logger, None)
+        app.output_validation = OutputValidation(every=2)
+        codes = []
+        for i in range(2):
+            request = dummyRequest(
+                b"GET", b"/foo/badresponse",
+                Headers({b"content-type": [b"application/json"]}), b"")
+            render(app.app.resource(), request)
+            codes.append(request._code)
+        # Only the first response is validated, and it is invalid:
+        logger.flushTracebacks(ValidationError)
+        self.assertEqual(
+            (codes, app.output_validation.validated),
+            ([INTERNAL_SERVER_ERROR, OK], 1))
+
     @validateLogging(_assertRequestLogged(b"/foo/bar", b"PUT"))
     def test_wrongContentTypeRequest(self, logger):
         """
@@ -579,6 +605,449 @@ class UserDocumentationTests(SynchronousTestCase):
             ))
 
 
+class ConditionalTests(SynchronousTestCase):
+    """
+    Tests for the conditional I{GET} behavior of L{structured} given an
+    C{etag} function.
+    """
+    class Application(object):
+        app = Klein()
+
+        def __init__(self):
+            self.version = b"1"
+            self.calls = 0
+
+        @app.route(b"/foo/bar", methods={b"GET", b"POST"})
+        @structured({}, {}, etag=lambda self: self.version)
+        def tagged(self):
+            self.calls += 1
+            return {u"version": self.version}
+
+        @app.route(b"/foo/broken")
+        @structured({}, {}, etag=lambda self: self.version)
+        def broken(self):
+            raise ArbitraryException("Broken")
+
+        @app.route(b"/items/<name>")
+        @structured({}, {}, etag=lambda self: self.version)
+        def item(self, name):
+            self.calls += 1
+            return {u"name": name}
+
+    def setUp(self):
+        self.app = self.Application()
+
+    def get(self, path=b"/foo/bar", if_none_match=None):
+        """
+        Issue a I{GET} request to the application.
+
+        :param if_none_match: The value of the I{If-None-Match} header, or
+            ``None`` to omit it.
+
+        :return: The rendered request.
+        """
+        headers = Headers()
+        if if_none_match is not None:
+            headers.setRawHeaders(b"if-none-match", [if_none_match])
+        request = dummyRequest(b"GET", path, headers, b"")
+        render(self.app.app.resource(), request)
+        return request
+
+    def test_etag(self):
+        """
+        The response to a I{GET} request has an I{ETag} header with the
+        quoted result of the C{etag} function.
+        """
+        request = self.get()
+        self.assertEqual(
+            (OK, [b'"1"'], {u"version": u"1"}),
+            (request._code,
+             request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)))
+
+    def test_not_modified(self):
+        """
+        A I{GET} request with the current tag in its I{If-None-Match} header
+        receives an empty I{NOT MODIFIED} response, without the decorated
+        function being called.
+        """
+        request = self.get(if_none_match=b'"0", "1"')
+        self.assertEqual(
+            (NOT_MODIFIED, [b'"1"'], b"", 0),
+            (request._code,
+             request.responseHeaders.getRawHeaders(b"etag"),
+             request._responseBody, self.app.calls))
+
+    def test_weak_tag(self):
+        """
+        A weak tag in the I{If-None-Match} header matches the current tag.
+        """
+        request = self.get(if_none_match=b'W/"1"')
+        self.assertEqual(NOT_MODIFIED, request._code)
+
+    def test_any(self):
+        """
+        C{*} in the I{If-None-Match} header matches any tag.
+        """
+        request = self.get(if_none_match=b'*')
+        self.assertEqual(NOT_MODIFIED, request._code)
+
+    def test_changed(self):
+        """
+        A I{GET} request with an old tag in its I{If-None-Match} header
+        receives the full response with the new tag.
+        """
+        self.app.version = b"2"
+        request = self.get(if_none_match=b'"1"')
+        self.assertEqual(
+            (OK, [b'"2"'], {u"version": u"2"}),
+            (request._code,
+             request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)))
+
+    def test_cached(self):
+        """
+        A I{GET} request without the current tag receives the response
+        encoded for an earlier request with the same tag, without the
+        decorated function being called again.
+        """
+        first = self.get()
+        second = self.get()
+        self.assertEqual(
+            (OK, [b"application/json"], [b'"1"'], first._responseBody, 1),
+            (second._code,
+             second.responseHeaders.getRawHeaders(b"content-type"),
+             second.responseHeaders.getRawHeaders(b"etag"),
+             second._responseBody, self.app.calls))
+
+    def test_route_arguments_tagged(self):
+        """
+        Responses to requests with different route arguments have different
+        tags.
+        """
+        tags = [self.get(path).responseHeaders.getRawHeaders(b"etag")[0]
+                for path in [b"/items/a", b"/items/b", b"/items/a"]]
+        self.assertEqual((2, tags[0]), (len(set(tags)), tags[2]))
+
+    def test_cached_per_arguments(self):
+        """
+        The response to each set of route arguments is remembered
+        separately.
+        """
+        bodies = [loads(self.get(path)._responseBody)
+                  for path in [b"/items/a", b"/items/b", b"/items/a"]]
+        self.assertEqual(
+            ([{u"name": u"a"}, {u"name": u"b"}, {u"name": u"a"}], 2),
+            (bodies, self.app.calls))
+
+    def test_cache_replaced(self):
+        """
+        Once the tag changes the decorated function is called again.
+        """
+        self.get()
+        self.app.version = b"2"
+        request = self.get()
+        self.assertEqual(
+            ({u"version": u"2"}, 2),
+            (loads(request._responseBody), self.app.calls))
+
+    def test_other_methods(self):
+        """
+        Requests using other methods are neither tagged nor answered with
+        I{NOT MODIFIED}.
+        """
+        request = dummyRequest(
+            b"POST", b"/foo/bar",
+            Headers({b"content-type": [b"application/json"],
+                     b"if-none-match": [b'"1"']}), dumps({}))
+        render(self.app.app.resource(), request)
+        self.assertEqual(
+            (OK, None),
+            (request._code, request.responseHeaders.getRawHeaders(b"etag")))
+
+    def test_error_not_tagged(self):
+        """
+        An error response has no I{ETag} header.
+        """
+        request = self.get(b"/foo/broken")
+        self.flushLoggedErrors(ArbitraryException)
+        self.assertEqual(
+            (INTERNAL_SERVER_ERROR, None),
+            (request._code, request.responseHeaders.getRawHeaders(b"etag")))
+
+
+class StreamingTests(SynchronousTestCase):
+    """
+    Tests for L{structured} endpoints returning a L{StreamingResponse}.
+    """
+    class Application(object):
+        app = Klein()
+
+        def __init__(self, logger):
+            self.logger = logger
+            self.version = b"1"
+            self.items = [1, 2, 3]
+            self.code = OK
+            self.calls = 0
+
+        @app.route(b"/foo/bar")
+        @structured({}, {u"type": u"array", u"items": {u"type": u"integer"}},
+                    etag=lambda self: self.version)
+        def stream(self):
+            self.calls += 1
+            return StreamingResponse(iter(self.items), code=self.code)
+
+    def get(self, app):
+        request = dummyRequest(b"GET", b"/foo/bar", Headers(), b"")
+        render(app.app.resource(), request)
+        return request
+
+    @validateLogging(assertJSONLogged, b"GET", b"/foo/bar", {}, None,
+                     ACCEPTED)
+    def test_streamed(self, logger):
+        """
+        The items are encoded as a JSON list with the given response code.
+        The response itself is not logged.
+        """
+        app = self.Application(logger)
+        app.code = ACCEPTED
+        request = self.get(app)
+        self.assertEqual(
+            (ACCEPTED, [b"application/json"], [1, 2, 3], True),
+            (request._code,
+             request.responseHeaders.getRawHeaders(b"content-type"),
+             loads(request._responseBody), request._finished))
+
+    @validateLogging(None)
+    def test_invalid_item(self, logger):
+        """
+        An item which doesn't match the schema's C{items} schema is logged
+        and the connection closed, leaving the response incomplete.
+        """
+        app = self.Application(logger)
+        app.items = [1, u"x"]
+        request = self.get(app)
+        logger.flushTracebacks(ValidationError)
+        self.assertEqual(
+            (b"[", False, True),
+            (request._responseBody, request._finished,
+             request.transport.disconnecting))
+
+    @validateLogging(None)
+    def test_cached(self, logger):
+        """
+        A streamed response is written again from memory while the tag stays
+        the same.
+        """
+        app = self.Application(logger)
+        first = self.get(app)
+        second = self.get(app)
+        self.assertEqual(
+            ([1, 2, 3], [b'"1"'], first._responseBody, True, 1),
+            (loads(second._responseBody),
+             second.responseHeaders.getRawHeaders(b"etag"),
+             second._responseBody, second._finished, app.calls))
+
+
+class QueryArgumentsTests(SynchronousTestCase):
+    """
+    Tests for the handling of query arguments by L{structured} given a
+    C{query_schema}.
+    """
+    class Application(object):
+        app = Klein()
+
+        def __init__(self):
+            self.version = b"1"
+
+        @app.route(b"/foo/bar")
+        @structured(
+            {}, {}, etag=lambda self: self.version,
+            query_schema={
+                u"type": u"object",
+                u"properties": {u"name": {u"type": u"string",
+                                          u"maxLength": 3}},
+                u"additionalProperties": False,
+            })
+        def query(self, name=None):
+            return {u"name": name}
+
+        @app.route(b"/foo/ignored")
+        @structured({}, {})
+        def ignored(self):
+            return {}
+
+    def setUp(self):
+        self.app = self.Application()
+
+    def get(self, path):
+        """
+        Issue a I{GET} request to the application.
+
+        :param bytes path: The path and query of the request.
+
+        :return: The rendered request.
+        """
+        request = dummyRequest(b"GET", path, Headers(), b"")
+        render(self.app.app.resource(), request)
+        return request
+
+    def test_arguments(self):
+        """
+        Query arguments matching the schema are passed to the decorated
+        function as keyword arguments.
+        """
+        request = self.get(b"/foo/bar?name=abc")
+        self.assertEqual(
+            (OK, {u"name": u"abc"}),
+            (request._code, loads(request._responseBody)))
+
+    def test_invalid(self):
+        """
+        Query arguments not matching the schema result in a I{BAD REQUEST}
+        response.
+        """
+        codes = [self.get(path)._code
+                 for path in [b"/foo/bar?name=abcd", b"/foo/bar?other=1",
+                              b"/foo/bar?name=%FF"]]
+        self.assertEqual([BAD_REQUEST] * 3, codes)
+
+    def test_no_schema(self):
+        """
+        Without a query schema query arguments are ignored.
+        """
+        request = self.get(b"/foo/ignored?name=abcd")
+        self.assertEqual(OK, request._code)
+
+    def test_tags(self):
+        """
+        Responses to requests with different query arguments have different
+        tags, which don't depend on the order of the arguments or on the
+        I{wait} argument.
+        """
+        tags = [
+            self.get(path).responseHeaders.getRawHeaders(b"etag")[0]
+            for path in [b"/foo/bar", b"/foo/bar?name=a", b"/foo/bar?name=b",
+                         b"/foo/bar?name=a&wait=5"]]
+        self.assertEqual(
+            (3, tags[1]), (len(set(tags)), tags[3]))
+
+
+class LongPollTests(SynchronousTestCase):
+    """
+    Tests for the I{wait} query argument of conditional I{GET} requests to
+    endpoints decorated by L{structured} given a C{watch} function.
+    """
+    class Application(object):
+        app = Klein()
+
+        def __init__(self, clock):
+            self.version = b"1"
+            self.watchers = ChangeWatchers(clock)
+
+        def change(self):
+            self.version = bytes(int(self.version) + 1)
+            self.watchers.changed()
+
+        @app.route(b"/foo/bar")
+        @structured({}, {}, etag=lambda self: self.version,
+                    watch=lambda self: self.watchers)
+        def tagged(self):
+            return {u"version": self.version}
+
+    def setUp(self):
+        self.clock = Clock()
+        self.app = self.Application(self.clock)
+
+    def get(self, wait, if_none_match=b'"1"'):
+        """
+        Issue a I{GET} request to the application.
+
+        :param bytes wait: The value of the I{wait} query argument.
+        :param bytes if_none_match: The value of the I{If-None-Match} header.
+
+        :return: The request, possibly not yet answered.
+        """
+        request = dummyRequest(
+            b"GET", b"/foo/bar?wait=" + wait,
+            Headers({b"if-none-match": [if_none_match]}), b"")
+        render(self.app.app.resource(), request)
+        return request
+
+    def test_waits(self):
+        """
+        A request with the current tag and a I{wait} argument is not answered
+        until something changes.
+        """
+        request = self.get(b"30")
+        self.clock.advance(29)
+        self.assertFalse(request._finished)
+
+    def test_changed(self):
+        """
+        Once something changes a waiting request receives the full response
+        with the new tag.
+        """
+        request = self.get(b"30")
+        self.app.change()
+        self.clock.advance(0)
+        self.assertEqual(
+            (OK, [b'"2"'], {u"version": u"2"}),
+            (request._code,
+             request.responseHeaders.getRawHeaders(b"etag"),
+             loads(request._responseBody)))
+
+    def test_timeout(self):
+        """
+        If nothing changes for the requested number of seconds the request
+        receives a I{NOT MODIFIED} response.
+        """
+        request = self.get(b"2.5")
+        self.clock.advance(2.5)
+        self.assertEqual(
+            (NOT_MODIFIED, [b'"1"']),
+            (request._code, request.responseHeaders.getRawHeaders(b"etag")))
+
+    def test_maximum_wait(self):
+        """
+        Requests wait no longer than L{MAXIMUM_WAIT} seconds.
+        """
+        request = self.get(b"%d" % (MAXIMUM_WAIT * 2,))
+        self.clock.advance(MAXIMUM_WAIT)
+        self.assertEqual(NOT_MODIFIED, request._code)
+
+    def test_old_tag(self):
+        """
+        A request with an old tag is answered at once despite the I{wait}
+        argument.
+        """
+        self.app.version = b"2"
+        request = self.get(b"30")
+        self.assertEqual(
+            (OK, {u"version": u"2"}),
+            (request._code, loads(request._responseBody)))
+
+    def test_invalid_wait(self):
+        """
+        A I{wait} argument which isn't a non-negative number results in a
+        I{BAD REQUEST} response.
+        """
+        codes = [self.get(wait)._code for wait in [b"soon", b"-1", b"nan"]]
+        self.assertEqual([BAD_REQUEST] * 3, codes)
+
+    def test_disconnect(self):
+        """
+        A request whose client goes away stops waiting.
+        """
+        request = dummyRequest(
+            b"GET", b"/foo/bar?wait=30",
+            Headers({b"if-none-match": [b'"1"']}), b"")
+        rendering = render(self.app.app.resource(), request)
+        request._finishedChannel.errback(Failure(ConnectionDone()))
+        self.failureResultOf(rendering, ConnectionDone)
+        self.assertEqual(0, len(self.app.watchers._waiting))
+
+
 class NotAllowedTests(SynchronousTestCase):
     """
     Tests for the HTTP method restriction functionality imposed by the routing
@@ -10,7 +10,8 @@ from twisted.trial.unittest import SynchronousTestCase
 from jsonschema.exceptions import RefResolutionError, ValidationError
 
 from .._schema import (
-    LocalRefResolver, SchemaNotProvided, getValidator, resolveSchema)
+    LocalRefResolver, SchemaNotProvided, OutputValidation, getValidator,
+    resolveSchema)
 
 
 class LocalResolverTests(SynchronousTestCase):
@@ -64,6 +65,149 @@ class GetValidatorTests(SynchronousTestCase):
                                  {'schema.json': {'type': 'string'}})
         self.assertRaises(ValidationError, validator.validate, {})
 
+    def test_resolved(self):
+        """
+        The validator returned by L{getValidator} has its references already
+        resolved.
+        """
+        validator = getValidator({u'$ref': u'schema.json'},
+                                 {'schema.json': {'type': 'string'}})
+        self.assertEqual(validator.schema[u'type'], u'string')
+
+    def test_recursive(self):
+        """
+        L{getValidator} returns a validator for a schema which refers to
+        itself, resolving references as it validates.
+        """
+        store = {
+            'schema.json': {
+                'type': 'array', 'items': {'$ref': 'schema.json'}},
+        }
+        validator = getValidator({u'$ref': u'schema.json'}, store)
+        validator.validate([[], [[]]])
+        self.assertRaises(ValidationError, validator.validate, [[1]])
+
+    def test_cached(self):
+        """
+        L{getValidator} returns the same validator for equal schemas using
+        the same store.
+        """
+        store = {'schema.json': {'type': 'string'}}
+        self.assertIs(getValidator({u'$ref': u'schema.json'}, store),
+                      getValidator({u'$ref': u'schema.json'}, store))
+
+    def test_notCachedAcrossStores(self):
+        """
+        L{getValidator} returns different validators for equal schemas using
+        different stores.
+        """
+        first = getValidator({u'$ref': u'schema.json'},
+                             {'schema.json': {'type': 'string'}})
+        second = getValidator({u'$ref': u'schema.json'},
+                              {'schema.json': {'type': 'integer'}})
+        second.validate(1)
+        self.assertRaises(ValidationError, first.validate, 1)
+
+
+class OutputValidationTests(SynchronousTestCase):
+    """
+    Tests for L{OutputValidation}.
+    """
+    validator = getValidator(
+        {u'type': u'array', u'items': {u'type': u'integer'}}, {})
+
+    def test_default(self):
+        """
+        By default L{OutputValidation.validate} validates every item of every
+        response.
+        """
+        validation = OutputValidation()
+        validation.validate(self.validator, [1, 2])
+        self.assertRaises(ValidationError, validation.validate,
+                          self.validator, [1] * 1000 + [u"x"])
+
+    def test_items(self):
+        """
+        L{OutputValidation.validate} only validates the first C{items} items
+        of a response which is a list.
+        """
+        validation = OutputValidation(items=2)
+        validation.validate(self.validator, [1, 2, u"x"])
+        self.assertRaises(ValidationError, validation.validate,
+                          self.validator, [1, u"x"])
+
+    def test_itemsNotList(self):
+        """
+        L{OutputValidation.validate} validates all of a response which is not
+        a list.
+        """
+        validation = OutputValidation(items=0)
+        self.assertRaises(ValidationError, validation.validate,
+                          self.validator, {})
+
+    def test_every(self):
+        """
+        L{OutputValidation.validate} validates the first response and then
+        one in every C{every}.
+        """
+        validation = OutputValidation(every=3)
+        failures = []
+        for i in range(7):
+            try:
+                validation.validate(self.validator, u"x")
+            except ValidationError:
+                failures.append(i)
+        self.assertEqual(
+            (failures, validation.responses, validation.validated),
+            ([0, 3, 6], 7, 3))
+
+    def test_seconds(self):
+        """
+        L{OutputValidation.seconds} is the time spent validating, including
+        failed validations.
+        """
+        times = iter([10.0, 10.5, 20.0, 22.0])
+        validation = OutputValidation(clock=lambda: next(times))
+        validation.validate(self.validator, [1])
+        self.assertRaises(ValidationError, validation.validate,
+                          self.validator, [u"x"])
+        self.assertEqual((validation.validated, validation.seconds),
+                         (2, 2.5))
+
+    def test_validate_items(self):
+        """
+        L{OutputValidation.validate_items} returns an iterator of the items
+        which raises L{ValidationError} on reaching an invalid one.
+        """
+        items = OutputValidation().validate_items(
+            self.validator, iter([1, 2, u"x", 3]))
+        produced = [next(items), next(items)]
+        self.assertRaises(ValidationError, next, items)
+        self.assertEqual(produced, [1, 2])
+
+    def test_validate_items_limited(self):
+        """
+        L{OutputValidation.validate_items} only validates the first C{items}
+        items.
+        """
+        validation = OutputValidation(items=2)
+        self.assertEqual(
+            list(validation.validate_items(self.validator, [1, 2, u"x"])),
+            [1, 2, u"x"])
+
+    def test_validate_items_every(self):
+        """
+        L{OutputValidation.validate_items} validates the items of one
+        response in every C{every}.
+        """
+        validation = OutputValidation(every=2)
+        first = validation.validate_items(self.validator, [u"x"])
+        second = validation.validate_items(self.validator, [u"x"])
+        self.assertRaises(ValidationError, list, first)
+        self.assertEqual(
+            (list(second), validation.responses, validation.validated),
+            ([u"x"], 2, 1))
+
 
 class ResolveSchemaTests(SynchronousTestCase):
     """
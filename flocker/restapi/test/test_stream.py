@@ -0,0 +1,215 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.restapi._stream``.
+"""
+
+from json import dumps, loads
+
+from eliot.testing import validateLogging
+
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.http_headers import Headers
+from twisted.web.server import NOT_DONE_YET
+
+from .._stream import StreamedBody, _ChunkProducer, json_chunks
+from ..testtools import dummyRequest
+
+
+class JSONChunksTests(SynchronousTestCase):
+    """
+    Tests for ``json_chunks``.
+    """
+    def test_same_as_dumps(self):
+        """
+        The chunks joined together are the same as the list encoded all at
+        once.
+        """
+        items = [{u"n": n} for n in range(10)]
+        self.assertEqual(
+            b"".join(json_chunks(items, chunk_items=3)), dumps(items))
+
+    def test_empty(self):
+        """
+        An empty list is encoded as such.
+        """
+        self.assertEqual(b"".join(json_chunks([])), b"[]")
+
+    def test_chunk_items(self):
+        """
+        Each chunk between the brackets encodes ``chunk_items`` items, bar
+        the last.
+        """
+        chunks = list(json_chunks(range(5), chunk_items=2))
+        self.assertEqual(chunks, [b"[", b"0, 1", b", 2, 3", b", 4", b"]"])
+
+    def test_lazy(self):
+        """
+        Items are only consumed as the chunks encoding them are needed.
+        """
+        consumed = []
+
+        def items():
+            for n in range(4):
+                consumed.append(n)
+                yield n
+        chunks = json_chunks(items(), chunk_items=2)
+        next(chunks)
+        next(chunks)
+        self.assertEqual(consumed, [0, 1])
+
+
+class ChunkRequest(object):
+    """
+    A request which a ``_ChunkProducer`` writes to, pausing the producer
+    after a number of writes.
+
+    :ivar list written: The chunks written.
+    :ivar producer: The registered producer, or ``None``.
+    """
+    def __init__(self, writes_before_pause=None):
+        self.writes_before_pause = writes_before_pause
+        self.written = []
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+        if len(self.written) == self.writes_before_pause:
+            self.producer.pauseProducing()
+
+
+class ChunkProducerTests(SynchronousTestCase):
+    """
+    Tests for ``_ChunkProducer``.
+    """
+    def test_writes_all(self):
+        """
+        If not paused, ``_ChunkProducer.start`` writes all the chunks,
+        unregisters itself and returns a ``Deferred`` that has fired.
+        """
+        request = ChunkRequest()
+        finished = _ChunkProducer(request, [b"a", b"b"]).start()
+        self.assertEqual(
+            (request.written, request.producer,
+             self.successResultOf(finished)),
+            ([b"a", b"b"], None, None))
+
+    def test_paused(self):
+        """
+        No more chunks are written once the transport pauses the producer,
+        until it resumes it.
+        """
+        request = ChunkRequest(writes_before_pause=1)
+        producer = _ChunkProducer(request, [b"a", b"b", b"c"])
+        finished = producer.start()
+        written = list(request.written)
+        request.writes_before_pause = None
+        producer.resumeProducing()
+        self.assertEqual(
+            (written, request.written, self.successResultOf(finished)),
+            ([b"a"], [b"a", b"b", b"c"], None))
+
+    def test_stopped(self):
+        """
+        No more chunks are written once the transport stops the producer.
+        """
+        request = ChunkRequest(writes_before_pause=1)
+        producer = _ChunkProducer(request, [b"a", b"b"])
+        finished = producer.start()
+        producer.stopProducing()
+        producer.resumeProducing()
+        self.assertEqual(
+            (request.written, finished.called), ([b"a"], False))
+
+    def test_failure(self):
+        """
+        If producing a chunk fails the ``Deferred`` returned by
+        ``_ChunkProducer.start`` fails and the producer is unregistered.
+        """
+        def chunks():
+            yield b"a"
+            raise ZeroDivisionError()
+        request = ChunkRequest()
+        finished = _ChunkProducer(request, chunks()).start()
+        self.failureResultOf(finished, ZeroDivisionError)
+        self.assertEqual((request.written, request.producer), ([b"a"], None))
+
+
+class StreamedBodyTests(SynchronousTestCase):
+    """
+    Tests for ``StreamedBody``.
+    """
+    def request(self):
+        return dummyRequest(b"GET", b"/", Headers())
+
+    def test_render(self):
+        """
+        Rendering a ``StreamedBody`` writes its chunks and finishes the
+        request.
+        """
+        request = self.request()
+        result = StreamedBody(iter([b"[1, ", b"2]"]), None).render(request)
+        self.assertEqual(
+            (result, loads(request._responseBody), request._finished),
+            (NOT_DONE_YET, [1, 2], True))
+
+    def test_flow_control(self):
+        """
+        ``StreamedBody`` writes no more while the request's transport is
+        paused.
+        """
+        request = self.request()
+        transport = request.transport
+        body = StreamedBody([b"[1, ", b"2]"], None)
+        original_write = request.write
+
+        def write(data):
+            original_write(data)
+            # Pause after the first chunk, as if the transport's buffer was
+            # full:
+            request.write = original_write
+            transport.producer.pauseProducing()
+        request.write = write
+        body.render(request)
+        written = request._responseBody
+        transport.producer.resumeProducing()
+        self.assertEqual(
+            (written, request._responseBody, request._finished),
+            (b"[1, ", b"[1, 2]", True))
+
+    def test_record(self):
+        """
+        ``StreamedBody.record`` returns a ``Deferred`` which fires with the
+        chunks once they are all written.
+        """
+        body = StreamedBody(iter([b"[1, ", b"2]"]), None)
+        recorded = body.record()
+        body.render(self.request())
+        self.assertEqual(self.successResultOf(recorded), [b"[1, ", b"2]"])
+
+    @validateLogging(None)
+    def test_failure(self, logger):
+        """
+        If producing a chunk fails the failure is logged and the connection
+        closed, leaving the response incomplete.
+        """
+        def chunks():
+            yield b"[1, "
+            raise ZeroDivisionError()
+        request = self.request()
+        request.transport = StringTransport()
+        body = StreamedBody(chunks(), logger)
+        recorded = body.record()
+        body.render(request)
+        logger.flushTracebacks(ZeroDivisionError)
+        self.assertEqual(
+            (request._responseBody, request._finished,
+             request.transport.disconnecting, recorded.called),
+            (b"[1, ", False, True, False))
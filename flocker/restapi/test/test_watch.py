@@ -0,0 +1,104 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.restapi._watch``.
+"""
+
+from twisted.internet.defer import CancelledError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.http import SERVICE_UNAVAILABLE
+
+from .._error import BadRequest
+from .._watch import ChangeWatchers, MAXIMUM_WAIT
+
+
+class ChangeWatchersTests(SynchronousTestCase):
+    """
+    Tests for ``ChangeWatchers``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.watchers = ChangeWatchers(self.clock, maximum=2)
+
+    def test_changed(self):
+        """
+        Waiting requests are woken once the reactor runs after a change.
+        """
+        waiting = self.watchers.wait(30)
+        self.watchers.changed()
+        self.assertNoResult(waiting)
+        self.clock.advance(0)
+        self.assertIs(None, self.successResultOf(waiting))
+
+    def test_coalesced(self):
+        """
+        Several changes before the waiting requests are woken only schedule
+        one wake up.
+        """
+        self.watchers.wait(30)
+        self.watchers.changed()
+        self.watchers.changed()
+        self.assertEqual(
+            1, len([call for call in self.clock.getDelayedCalls()
+                    if call.getTime() == 0]))
+
+    def test_later_wait(self):
+        """
+        A request which starts waiting after a change has woken the others is
+        not woken by it.
+        """
+        self.watchers.changed()
+        self.clock.advance(0)
+        waiting = self.watchers.wait(30)
+        self.assertNoResult(waiting)
+
+    def test_timeout(self):
+        """
+        A request stops waiting after the given number of seconds.
+        """
+        waiting = self.watchers.wait(5)
+        self.clock.advance(4.9)
+        self.assertNoResult(waiting)
+        self.clock.advance(0.1)
+        self.assertEqual(
+            (None, 0),
+            (self.successResultOf(waiting), len(self.watchers._waiting)))
+
+    def test_timeout_cancelled(self):
+        """
+        Once a request is woken its timeout is cancelled.
+        """
+        self.watchers.wait(5)
+        self.watchers.changed()
+        self.clock.advance(0)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_maximum_wait(self):
+        """
+        No request waits longer than ``MAXIMUM_WAIT`` seconds.
+        """
+        waiting = self.watchers.wait(MAXIMUM_WAIT * 10)
+        self.clock.advance(MAXIMUM_WAIT)
+        self.successResultOf(waiting)
+
+    def test_too_many(self):
+        """
+        Once the maximum number of requests are waiting another results in
+        ``SERVICE UNAVAILABLE``.
+        """
+        self.watchers.wait(30)
+        self.watchers.wait(30)
+        exception = self.assertRaises(BadRequest, self.watchers.wait, 30)
+        self.assertEqual(SERVICE_UNAVAILABLE, exception.code)
+
+    def test_cancel(self):
+        """
+        Cancelling a wait stops it, freeing its place and its timeout.
+        """
+        waiting = self.watchers.wait(30)
+        waiting.cancel()
+        self.failureResultOf(waiting, CancelledError)
+        self.assertEqual(
+            (0, []),
+            (len(self.watchers._waiting), self.clock.getDelayedCalls()))
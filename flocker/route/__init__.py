@@ -17,12 +17,14 @@ cooperating nodes.
 """
 
 __all__ = [
-    "INetwork", "make_host_network", "make_memory_network",
-    "Proxy", "OpenPort",
+    "INetwork", "INetworkBatch", "make_host_network", "make_ipset_network",
+    "make_memory_network",
+    "Proxy", "OpenPort", "NetworkSnapshot",
 ]
 
 
-from ._interfaces import INetwork
+from ._interfaces import INetwork, INetworkBatch
 from ._iptables import make_host_network
+from ._ipset import make_ipset_network
 from ._memory import make_memory_network
-from ._model import Proxy, OpenPort
+from ._model import Proxy, OpenPort, NetworkSnapshot
@@ -75,6 +75,14 @@ class INetwork(Interface):
             ports.
         """
 
+    def batch():
+        """
+        Create an object which collects changes to be applied to this network
+        together.
+
+        :return: An ``INetworkBatch`` provider.
+        """
+
     def enumerate_used_ports():
         """
         Retrieve information about port numbers which are in use.
@@ -85,3 +93,51 @@ class INetwork(Interface):
             proxies created by this ``INetwork`` provider and TCP ports opend
             by this ``INetworkProvider``.
         """
+
+    def snapshot():
+        """
+        Retrieve the configured proxies, the configured open ports and the
+        used ports together, inspecting the underlying system as few times
+        as possible.
+
+        :return: A ``NetworkSnapshot`` describing the network at the time of
+            the call.
+        """
+
+
+class INetworkBatch(Interface):
+    """
+    An ``INetworkBatch`` collects changes to an ``INetwork`` so that they can
+    be applied together, as cheaply and as atomically as the underlying
+    network configuration mechanism allows.
+
+    Changes made through a batch are only guaranteed to have been applied
+    once :py:meth:`commit` returns.
+    """
+    def create_proxy_to(ip, port):
+        """
+        :see: :py:meth:`INetwork.create_proxy_to`
+        """
+
+    def delete_proxy(proxy):
+        """
+        :see: :py:meth:`INetwork.delete_proxy`
+        """
+
+    def open_port(port):
+        """
+        :see: :py:meth:`INetwork.open_port`
+        """
+
+    def delete_open_port(port):
+        """
+        :see: :py:meth:`INetwork.delete_open_port`
+        """
+
+    def commit():
+        """
+        Apply all of the changes collected so far to the network.
+
+        After this returns the batch is empty and may be used to collect
+        further changes.
+        """
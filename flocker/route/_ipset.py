@@ -0,0 +1,475 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_ipset -*-
+
+"""
+Manipulate network routing behavior on a node using dedicated ``iptables``
+chains which match destination ports against ``ipset`` sets.
+
+``HostNetwork`` appends rules for every proxy and every open port directly to
+the built-in chains, so every packet is compared against every Flocker rule.
+Here the built-in chains only contain a fixed handful of rules which look up
+the destination port in a set.  Set lookups take constant time, so the
+per-packet cost no longer grows with the number of proxied ports; the
+dedicated ``FLOCKER-PROXY`` chain holds one rule per proxy destination
+(that is, per other node) rather than one per port.  Set contents are
+replaced atomically with ``ipset swap``.
+"""
+
+from __future__ import unicode_literals
+
+import shlex
+from subprocess import PIPE, CalledProcessError, Popen, check_output
+
+from zope.interface import implementer
+from ipaddr import IPAddress
+from eliot import Logger
+
+from ._logging import (
+    IPSET_RESTORE, CREATE_PROXY_TO, DELETE_PROXY, OPEN_PORT, DELETE_OPEN_PORT,
+)
+from ._interfaces import INetwork, INetworkBatch
+from ._model import Proxy, OpenPort
+from ._iptables import (
+    enable_forwarding, iptables_restore, iptables_save, network_snapshot,
+    parse_iptables_options,
+)
+
+PROXY_CHAIN = b"FLOCKER-PROXY"
+FORWARD_CHAIN = b"FLOCKER-FORWARD"
+
+PROXIED_PORTS_SET = b"flocker-proxied"
+OPEN_PORTS_SET = b"flocker-open"
+DESTINATION_SET_PREFIX = b"flocker-p-"
+TEMPORARY_SET_PREFIX = b"flocker-t-"
+
+# A bitmap covering every port number makes membership tests a single bit
+# lookup.
+_SET_TYPE = [b"bitmap:port", b"range", b"0-65535"]
+
+
+def ipset_save():
+    """
+    Retrieve the system's ipset configuration.
+
+    :return: The ``bytes`` output of ``ipset save``.
+    """
+    return check_output([b"ipset", b"save"])
+
+
+def ipset_restore(logger, commands):
+    """
+    Run some ipset commands using a single ``ipset restore`` invocation.
+
+    :param list commands: ``ipset`` argument lists.
+
+    :raise CalledProcessError: If ``ipset restore`` fails.
+    """
+    argv = [b"ipset", b"restore"]
+    with IPSET_RESTORE(logger=logger, commands=commands):
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(
+            b"".join(b" ".join(command) + b"\n" for command in commands))
+        if process.returncode:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def parse_ipset_save(output):
+    """
+    Find the Flocker-managed sets in some ``ipset save`` output.
+
+    :param bytes output: The output to parse.
+
+    :return: A ``dict`` mapping the names of Flocker-managed sets to a
+        ``set`` of the ``int`` port numbers in each.
+    """
+    sets = {}
+    for line in output.splitlines():
+        if b" flocker-" not in line:
+            continue
+        command = line.split()
+        if command[0] == b"create":
+            sets.setdefault(command[1], set())
+        elif command[0] == b"add":
+            sets.setdefault(command[1], set()).add(int(command[2]))
+    return sets
+
+
+def _destination_set(ip):
+    """
+    :param unicode ip: The address of a proxy destination.
+
+    :return: The name of the set of ports proxied to ``ip``.
+    """
+    return DESTINATION_SET_PREFIX + ip.encode("ascii")
+
+
+def _temporary_set(name):
+    """
+    :param bytes name: The name of a Flocker-managed set.
+
+    :return: The name of the set used to build replacement contents for
+        ``name``.
+    """
+    return TEMPORARY_SET_PREFIX + name[len(b"flocker-"):]
+
+
+def _proxies_from_sets(sets):
+    """
+    :param dict sets: Flocker-managed sets, as returned by
+        ``parse_ipset_save``.
+
+    :return: A ``dict`` mapping ``unicode`` proxy destinations to a ``set``
+        of the ``int`` port numbers proxied to each.
+    """
+    return {
+        name[len(DESTINATION_SET_PREFIX):].decode("ascii"): set(ports)
+        for (name, ports) in sets.items()
+        if name.startswith(DESTINATION_SET_PREFIX)
+    }
+
+
+def _destination_rules(ip, operation):
+    """
+    Build the rules which proxy traffic to one destination.
+
+    :param unicode ip: The proxy destination.
+    :param bytes operation: ``b"--append"`` or ``b"--delete"``.
+
+    :return: A ``list`` of ``iptables`` argument lists.
+    """
+    encoded_ip = ip.encode("ascii")
+    match = [
+        b"--protocol", b"tcp",
+        b"--match", b"set", b"--match-set", _destination_set(ip), b"dst",
+    ]
+    return [
+        [b"--table", b"nat", operation, PROXY_CHAIN] + match + [
+            b"--jump", b"DNAT", b"--to-destination", encoded_ip],
+        [b"--table", b"filter", operation, FORWARD_CHAIN,
+         b"--destination", encoded_ip] + match + [b"--jump", b"ACCEPT"],
+    ]
+
+
+def _nat_plumbing():
+    """
+    :return: ``iptables`` argument lists which create the ``nat`` chain and
+        the fixed rules which send proxied traffic to it.
+    """
+    proxied = [
+        b"--protocol", b"tcp",
+        b"--match", b"set", b"--match-set", PROXIED_PORTS_SET, b"dst",
+    ]
+    local = [b"--match", b"addrtype", b"--dst-type", b"LOCAL"]
+    return [
+        [b"--table", b"nat", b"--new-chain", PROXY_CHAIN],
+        # Traffic arriving from elsewhere and traffic originating on this
+        # host are both destination NATed; see ``create_proxy_to`` in
+        # ``_iptables`` for the details.
+        [b"--table", b"nat", b"--append", b"PREROUTING"] + proxied + local + [
+            b"--jump", PROXY_CHAIN],
+        [b"--table", b"nat", b"--append", b"OUTPUT"] + proxied + local + [
+            b"--jump", PROXY_CHAIN],
+        [b"--table", b"nat", b"--append", b"POSTROUTING"] + proxied + [
+            b"--jump", b"MASQUERADE"],
+    ]
+
+
+def _filter_plumbing():
+    """
+    :return: ``iptables`` argument lists which create the ``filter`` chain
+        and the fixed rules for forwarded traffic and open ports.
+    """
+    return [
+        [b"--table", b"filter", b"--new-chain", FORWARD_CHAIN],
+        [b"--table", b"filter", b"--insert", b"FORWARD",
+         b"--jump", FORWARD_CHAIN],
+        [b"--table", b"filter", b"--insert", b"INPUT",
+         b"--protocol", b"tcp",
+         b"--match", b"set", b"--match-set", OPEN_PORTS_SET, b"dst",
+         b"--jump", b"ACCEPT"],
+    ]
+
+
+def _replace_set(name, current, desired):
+    """
+    Build the ipset commands which give a set new contents.
+
+    :param bytes name: The name of the set.
+    :param current: A ``set`` of the ``int`` ports currently in the set, or
+        ``None`` if it does not exist.
+    :param set desired: The ``int`` ports the set should contain.
+
+    :return: A ``list`` of ``ipset`` argument lists.
+    """
+    if current is None:
+        return [[b"create", name] + _SET_TYPE] + [
+            [b"add", name, b"%d" % (port,)] for port in sorted(desired)]
+    if current == desired:
+        return []
+    # Fill a new set and swap it into place so that packets only ever see
+    # either the complete old contents or the complete new contents.
+    temporary = _temporary_set(name)
+    return [
+        [b"create", temporary] + _SET_TYPE + [b"-exist"],
+        [b"flush", temporary],
+    ] + [
+        [b"add", temporary, b"%d" % (port,)] for port in sorted(desired)
+    ] + [
+        [b"swap", temporary, name],
+        [b"destroy", temporary],
+    ]
+
+
+def plan_changes(sets, iptables_output, proxies, open_ports):
+    """
+    Work out how to change the system's configuration to have certain
+    proxies and open ports.
+
+    :param dict sets: The current Flocker-managed sets, as returned by
+        ``parse_ipset_save``.
+    :param bytes iptables_output: The current iptables-save(8) output.
+    :param dict proxies: A ``dict`` mapping ``unicode`` destinations to a
+        ``set`` of the ``int`` ports which should be proxied to each.
+    :param set open_ports: The ``int`` ports which should be open.
+
+    :return: A three-tuple of the ``ipset`` argument lists to run first,
+        the ``iptables`` argument lists to apply next and the ``ipset``
+        argument lists to run last.
+    """
+    rules = []
+    if b":" + PROXY_CHAIN + b" " not in iptables_output:
+        rules.extend(_nat_plumbing())
+    if b":" + FORWARD_CHAIN + b" " not in iptables_output:
+        rules.extend(_filter_plumbing())
+
+    proxied = set()
+    for ports in proxies.values():
+        proxied |= ports
+    # These are referred to by the fixed rules so they always exist.
+    before = _replace_set(
+        PROXIED_PORTS_SET, sets.get(PROXIED_PORTS_SET), proxied)
+    before.extend(_replace_set(
+        OPEN_PORTS_SET, sets.get(OPEN_PORTS_SET), open_ports))
+
+    routed = _routed_destinations(iptables_output)
+    current = _proxies_from_sets(sets)
+    after = []
+    for ip in sorted(set(current) | set(proxies)):
+        desired = proxies.get(ip, set())
+        name = _destination_set(ip)
+        if desired:
+            before.extend(_replace_set(name, current.get(ip), desired))
+            if ip not in routed:
+                rules.extend(_destination_rules(ip, b"--append"))
+        else:
+            if ip in routed:
+                rules.extend(_destination_rules(ip, b"--delete"))
+            if ip in current:
+                after.append([b"destroy", name])
+    return before, rules, after
+
+
+def _routed_destinations(iptables_output):
+    """
+    Find the destinations which have rules in the ``FLOCKER-PROXY`` chain.
+
+    :param bytes iptables_output: The iptables-save(8) output to inspect.
+
+    :return: A ``set`` of ``unicode`` destination addresses.
+    """
+    prefix = b"-A " + PROXY_CHAIN + b" "
+    return {
+        unicode(parse_iptables_options(shlex.split(line)).to_destination)
+        for line in iptables_output.splitlines()
+        if line.startswith(prefix)
+    }
+
+
+@implementer(INetwork)
+class IPSetNetwork(object):
+    """
+    An ``INetwork`` implementation based on dedicated ``iptables`` chains and
+    ``ipset`` port sets.
+    """
+    logger = Logger()
+
+    def create_proxy_to(self, ip, port):
+        """
+        Configure the system to proxy TCP traffic on the given port.
+
+        :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
+        """
+        with CREATE_PROXY_TO(logger=self.logger, target_ip=ip,
+                             target_port=port):
+            batch = self.batch()
+            proxy = batch.create_proxy_to(ip, port)
+            batch.commit()
+        return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        Remove the configuration which makes the given proxy work.
+
+        :see: :meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+        with DELETE_PROXY(logger=self.logger, target_ip=proxy.ip,
+                          target_port=proxy.port):
+            batch = self.batch()
+            batch.delete_proxy(proxy)
+            batch.commit()
+
+    def open_port(self, port):
+        """
+        Configure the system to allow TCP traffic to the given port.
+
+        :see: :meth:`INetwork.open_port` for parameter documentation.
+        """
+        with OPEN_PORT(logger=self.logger, target_port=port):
+            batch = self.batch()
+            open_port = batch.open_port(port)
+            batch.commit()
+        return open_port
+
+    def delete_open_port(self, port):
+        """
+        Stop allowing TCP traffic to the given port.
+
+        :see: :meth:`INetwork.delete_open_port` for parameter documentation.
+        """
+        with DELETE_OPEN_PORT(logger=self.logger, target_port=port.port):
+            batch = self.batch()
+            batch.delete_open_port(port)
+            batch.commit()
+
+    def batch(self):
+        """
+        Collect changes to be applied with one update of each set.
+
+        :see: :meth:`INetwork.batch` for return value documentation.
+        """
+        return IPSetNetworkBatch(logger=self.logger)
+
+    def enumerate_proxies(self):
+        return _enumerate_proxies(parse_ipset_save(ipset_save()))
+
+    def enumerate_open_ports(self):
+        return _enumerate_open_ports(parse_ipset_save(ipset_save()))
+
+    def enumerate_used_ports(self):
+        """
+        Find all ports that are in use on this node by normal TCP servers or by
+        proxies managed by this object.
+
+        :see: :meth:`INetwork.enumerate_used_ports` for parameter
+            documentation.
+        """
+        return self.snapshot().used_ports
+
+    def snapshot(self):
+        """
+        Inspect the system's ipset configuration once and find the ports in
+        use.
+
+        :see: :meth:`INetwork.snapshot` for return value documentation.
+        """
+        sets = parse_ipset_save(ipset_save())
+        return network_snapshot(
+            _enumerate_proxies(sets), _enumerate_open_ports(sets))
+
+
+def _enumerate_proxies(sets):
+    """
+    :param dict sets: Flocker-managed sets, as returned by
+        ``parse_ipset_save``.
+
+    :return: A ``list`` of ``Proxy`` instances.
+    """
+    return [
+        Proxy(ip=IPAddress(ip), port=port)
+        for (ip, ports) in _proxies_from_sets(sets).items()
+        for port in ports
+    ]
+
+
+def _enumerate_open_ports(sets):
+    """
+    :param dict sets: Flocker-managed sets, as returned by
+        ``parse_ipset_save``.
+
+    :return: A ``list`` of ``OpenPort`` instances.
+    """
+    return [
+        OpenPort(port=port) for port in sets.get(OPEN_PORTS_SET, set())]
+
+
+@implementer(INetworkBatch)
+class IPSetNetworkBatch(object):
+    """
+    An ``INetworkBatch`` for ``IPSetNetwork``.
+
+    Committing inspects the current configuration once, then rebuilds each
+    changed set with one ``ipset restore`` and adds or removes the rules for
+    new or departed proxy destinations with one ``iptables-restore``.
+
+    :ivar list _changes: Two-tuples of a ``bool`` (``True`` to add) and a
+        ``Proxy`` or ``OpenPort``, in the order they were made.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self._changes = []
+
+    def create_proxy_to(self, ip, port):
+        proxy = Proxy(ip=ip, port=port)
+        self._changes.append((True, proxy))
+        return proxy
+
+    def delete_proxy(self, proxy):
+        self._changes.append((False, proxy))
+
+    def open_port(self, port):
+        open_port = OpenPort(port=port)
+        self._changes.append((True, open_port))
+        return open_port
+
+    def delete_open_port(self, port):
+        self._changes.append((False, port))
+
+    def commit(self):
+        changes, self._changes = self._changes, []
+        if not changes:
+            return
+
+        sets = parse_ipset_save(ipset_save())
+        proxies = _proxies_from_sets(sets)
+        open_ports = set(sets.get(OPEN_PORTS_SET, set()))
+        for add, change in changes:
+            if isinstance(change, Proxy):
+                ports = proxies.setdefault(unicode(change.ip), set())
+                if add:
+                    ports.add(change.port)
+                else:
+                    ports.discard(change.port)
+            elif add:
+                open_ports.add(change.port)
+            else:
+                open_ports.discard(change.port)
+
+        before, rules, after = plan_changes(
+            sets, iptables_save(), proxies, open_ports)
+        if any(proxies.values()):
+            enable_forwarding()
+        if before:
+            ipset_restore(self.logger, before)
+        if rules:
+            iptables_restore(self.logger, rules)
+        if after:
+            ipset_restore(self.logger, after)
+
+
+def make_ipset_network():
+    """
+    Create a new ``INetwork`` provider which will interact with the underlying
+    system's network configuration using dedicated ``iptables`` chains and
+    ``ipset`` sets.
+    """
+    return IPSetNetwork()
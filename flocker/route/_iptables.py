@@ -8,28 +8,35 @@ Manipulate network routing behavior on a node using ``iptables``.
 from __future__ import unicode_literals
 
 import shlex
-from subprocess import check_call, check_output
+from collections import OrderedDict
+from socket import AF_INET, SOCK_DGRAM, error as socket_error, socket
+from subprocess import (
+    PIPE, CalledProcessError, Popen, check_call, check_output,
+)
 
 from zope.interface import implementer
 from ipaddr import IPAddress
 from characteristic import attributes
 from eliot import Logger
-from psutil import net_connections
 from twisted.python.filepath import FilePath
 
 from ._logging import (
-    IPTABLES,
+    IPTABLES, IPTABLES_RESTORE,
     CREATE_PROXY_TO, DELETE_PROXY,
     OPEN_PORT, DELETE_OPEN_PORT,
 )
-from ._interfaces import INetwork
-from ._model import Proxy, OpenPort
+from ._interfaces import INetwork, INetworkBatch
+from ._model import Proxy, OpenPort, NetworkSnapshot
+from ._netlink import AddressChangeMonitor
+from ._procnet import CachingListeningPorts, listening_ports
 
 FLOCKER_PROXY_COMMENT_MARKER = b"flocker create_proxy_to"
 FLOCKER_OPENPORT_COMMENT_MARKER = b"flocker open_port"
+FLOCKER_SNAT_COMMENT_MARKER = b"flocker snat"
 
 
-@attributes(["comment", "destination_port", "to_destination"])
+@attributes(["comment", "destination_port", "to_destination",
+             "destination", "to_source"])
 class RuleOptions(object):
     """
     :ivar bytes comment: The value of the ``comment`` *match* for this rule.
@@ -39,6 +46,12 @@ class RuleOptions(object):
 
     :ivar IPv4Address to_destination: The value of the ``to-destination``
         option for the ``DNAT`` *target* for this rule.
+
+    :ivar IPv4Address destination: The value of the ``destination`` option
+        for this rule.
+
+    :ivar IPv4Address to_source: The value of the ``to-source`` option for
+        the ``SNAT`` *target* for this rule.
     """
 
 
@@ -53,9 +66,151 @@ def iptables(logger, argv):
         check_call([b"iptables"] + argv)
 
 
-def create_proxy_to(logger, ip, port):
+def render_iptables_restore(rules):
+    """
+    Render some rule changes in the input format of iptables-restore(8).
+
+    :param list rules: ``iptables`` argument lists, as passed to
+        :py:func:`iptables`.  Each must specify its table with ``--table``.
+
+    :return: The ``bytes`` to supply to ``iptables-restore`` on its standard
+        input.  Rules are grouped by table, preserving their relative order
+        within each table.
+    """
+    tables = OrderedDict()
+    for argv in rules:
+        table_index = argv.index(b"--table")
+        table = argv[table_index + 1]
+        rule = argv[:table_index] + argv[table_index + 2:]
+        tables.setdefault(table, []).append(
+            b" ".join(_quote_iptables_restore(arg) for arg in rule))
+
+    lines = []
+    for table, table_rules in tables.items():
+        lines.append(b"*" + table)
+        lines.extend(table_rules)
+        lines.append(b"COMMIT")
+    return b"".join(line + b"\n" for line in lines)
+
+
+def _quote_iptables_restore(argument):
+    """
+    Quote one argument for an iptables-restore(8) rule line, if necessary.
+
+    :param bytes argument: The argument to quote.
+
+    :return: ``bytes`` which iptables-restore will parse as ``argument``.
+    """
+    if argument and not any(c in argument for c in b' \t"'):
+        return argument
+    return b'"' + argument.replace(b'"', b'\\"') + b'"'
+
+
+def iptables_restore(logger, rules):
+    """
+    Apply some rule changes using a single ``iptables-restore`` invocation.
+
+    Existing rules are left in place (``--noflush``).  The changes to each
+    table are committed atomically: either all of them take effect or, if
+    any of them is invalid, none do.
+
+    :param list rules: ``iptables`` argument lists, as passed to
+        :py:func:`iptables`.
+
+    :raise CalledProcessError: If ``iptables-restore`` fails.
+    """
+    argv = [b"iptables-restore", b"--noflush"]
+    with IPTABLES_RESTORE(logger=logger, rules=rules):
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(render_iptables_restore(rules))
+        if process.returncode:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def source_address_for(ip):
+    """
+    Find the address this host uses as the source of traffic to ``ip``.
+
+    :param ip: The destination address.
+
+    :return: An ``IPv4Address``, or ``None`` if there is no route to ``ip``.
+    """
+    # Connecting a UDP socket sends nothing.  It only makes the kernel pick a
+    # route, and with it a source address.
+    probe = socket(AF_INET, SOCK_DGRAM)
+    try:
+        probe.connect((unicode(ip).encode("ascii"), 9))
+        return IPAddress(probe.getsockname()[0])
+    except socket_error:
+        return None
+    finally:
+        probe.close()
+
+
+def postrouting_rule(operation, ip, port, source=None, snat=False):
+    """
+    Build the ``POSTROUTING`` rule which makes proxied traffic look like it
+    comes from this host.
+
+    :param bytes operation: ``b"--append"`` or ``b"--delete"``.
+    :param ip: The proxy destination.
+    :param int port: The proxied port.
+    :param source: The ``IPv4Address`` to rewrite the source address of
+        proxied traffic to, or ``None`` to masquerade as whatever address the
+        outgoing interface has.
+    :param bool snat: Whether the proxy is in SNAT mode.  Its rule is then
+        tagged so that it can be found again even while it masquerades
+        because there was no route to the destination, and switched to
+        ``SNAT`` once there is one (see
+        ``HostNetwork.update_source_addresses``).  Implied by ``source``.
+
+    :return: An ``iptables`` argument list.
+    """
+    rule = [
+        # All NAT stuff happens in the netfilter NAT table.
+        b"--table", b"nat",
+
+        # This transformation happens after routing decisions have been made
+        # and the packet is on its way out of the system.  Therefore, the rule
+        # belongs in the POSTROUTING chain.
+        operation, b"POSTROUTING",
+
+        # We'll stick to matching the same kinds of packets we matched in
+        # the PREROUTING stage.
+        #
+        # This omits the LOCAL addrtype check, though, because at this
+        # point the packet is definitely leaving this host.
+        b"--protocol", b"tcp",
+        b"--destination-port", unicode(port).encode("ascii"),
+    ]
+    if source is None and not snat:
+        # Do the masquerading.
+        return rule + [b"--jump", b"MASQUERADE"]
+    rule += [
+        # The source address is chosen for traffic routed towards this
+        # particular destination.
+        b"--destination", unicode(ip).encode("ascii"),
+
+        # Tag it so that it can be found again when the address changes or the
+        # proxy is deleted.
+        b"--match", b"comment", b"--comment", FLOCKER_SNAT_COMMENT_MARKER,
+    ]
+    if source is None:
+        return rule + [b"--jump", b"MASQUERADE"]
+    return rule + [
+        b"--jump", b"SNAT", b"--to-source", unicode(source).encode("ascii"),
+    ]
+
+
+def create_proxy_to(logger, ip, port, iptables=iptables, snat=False):
     """
     :see: ``HostNetwork.create_proxy_to``
+
+    :param iptables: The callable used to change each rule, taking the same
+        arguments as :py:func:`iptables`.
+
+    :param bool snat: If true, rewrite the source address of proxied traffic
+        to an address determined now instead of masquerading.
     """
     action = CREATE_PROXY_TO(
         logger=logger, target_ip=ip, target_port=port)
@@ -110,34 +265,16 @@ def create_proxy_to(logger, ip, port):
         # and by confused I mean it will be totally broken, of course) so we
         # also need to "masquerade" in the postrouting chain.  This changes
         # the source address (ip and port) of the packet to the address of
-        # the external interface the packet is exiting upon. Doing SNAT here
-        # would be a little bit more efficient because the kernel could avoid
-        # looking up the external interface's address for every single packet.
-        # But it requires this code to know that address and it requires that
-        # if it ever changes the rule gets updated and it may require some
-        # steps to do port allocation (not sure what they are yet).  So we'll
-        # just masquerade for now.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As described above, this transformation happens after routing
-            # decisions have been made and the packet is on its way out of the
-            # system.  Therefore, append the rule to the POSTROUTING chain.
-            b"--append", b"POSTROUTING",
-
-            # We'll stick to matching the same kinds of packets we matched in
-            # the earlier stage.  We might want to change the factoring of this
-            # code to avoid the duplication - particularly in case we want to
-            # change the specifics of the filter.
-            #
-            # This omits the LOCAL addrtype check, though, because at this
-            # point the packet is definitely leaving this host.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # Do the masquerading.
-            b"--jump", b"MASQUERADE",
-        ])
+        # the external interface the packet is exiting upon.  Masquerading
+        # makes the kernel look up the external interface's address for every
+        # single packet.  In SNAT mode we look the address up once, now, and
+        # rewrite the source to it explicitly instead, which is cheaper per
+        # packet; the rule must then be rewritten if the address ever changes
+        # (see ``HostNetwork.update_source_addresses``).  If there is no route
+        # to the destination yet we fall back to masquerading.
+        source = source_address_for(ip) if snat else None
+        iptables(logger, postrouting_rule(
+            b"--append", ip, port, source, snat=snat))
 
         # Secret level!!  Traffic that originates *on* the host bypasses the
         # PREROUTING chain.  Instead, it passes through the OUTPUT chain.  If
@@ -171,27 +308,40 @@ def create_proxy_to(logger, ip, port):
             b"--jump", b"ACCEPT",
         ])
 
-        # The network stack only considers forwarding traffic when certain
-        # system configuration is in place.
-        #
-        # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
-        # will explain the meaning of these in (very slightly) more detail.
-        conf = FilePath(b"/proc/sys/net/ipv4/conf")
-        descendant = conf.descendant([b"default", b"forwarding"])
-        with descendant.open("wb") as forwarding:
-            forwarding.write(b"1")
-
-        # In order to have the OUTPUT chain DNAT rule affect routing decisions,
-        # we also need to tell the system to make routing decisions about
-        # traffic from or to localhost.
-        for path in conf.children():
-            with path.child(b"route_localnet").open("wb") as route_localnet:
-                route_localnet.write(b"1")
+        enable_forwarding()
 
         return Proxy(ip=ip, port=port)
 
 
-def open_port(logger, port):
+def enable_forwarding():
+    """
+    Configure the system to forward traffic as required by proxies.
+    """
+    # The network stack only considers forwarding traffic when certain
+    # system configuration is in place.
+    #
+    # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
+    # will explain the meaning of these in (very slightly) more detail.
+    conf = FilePath(b"/proc/sys/net/ipv4/conf")
+    descendant = conf.descendant([b"default", b"forwarding"])
+    with descendant.open("wb") as forwarding:
+        forwarding.write(b"1")
+
+    # In order to have the OUTPUT chain DNAT rule affect routing decisions,
+    # we also need to tell the system to make routing decisions about
+    # traffic from or to localhost.
+    for path in conf.children():
+        with path.child(b"route_localnet").open("wb") as route_localnet:
+            route_localnet.write(b"1")
+
+
+def open_port(logger, port, iptables=iptables):
+    """
+    :see: ``HostNetwork.open_port``
+
+    :param iptables: The callable used to change each rule, taking the same
+        arguments as :py:func:`iptables`.
+    """
     with OPEN_PORT(
             logger=logger, target_port=port):
         encoded_port = unicode(port).encode("ascii")
@@ -211,12 +361,22 @@ def open_port(logger, port):
     return OpenPort(port=port)
 
 
-def delete_proxy(logger, proxy):
+def delete_proxy(logger, proxy, iptables=iptables, snat_sources=None):
     """
     :see: ``HostNetwork.delete_proxy``
+
+    :param iptables: The callable used to change each rule, taking the same
+        arguments as :py:func:`iptables`.
+
+    :param dict snat_sources: The result of :py:func:`snat_sources`, if the
+        proxy might have been created in SNAT mode.  Otherwise ``None``.
     """
     ip = unicode(proxy.ip).encode("ascii")
     port = unicode(proxy.port).encode("ascii")
+    if snat_sources is None:
+        snat_sources = {}
+    snat = proxy.port in snat_sources
+    source = snat_sources.get(proxy.port)
 
     commands = [
         [b"--table", b"nat",
@@ -225,10 +385,8 @@ def delete_proxy(logger, proxy):
          b"--match", b"addrtype", b"--dst-type", b"LOCAL",
          b"--match", b"comment", b"--comment", FLOCKER_PROXY_COMMENT_MARKER,
          b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"nat",
-         b"--delete", b"POSTROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"MASQUERADE"],
+        postrouting_rule(
+            b"--delete", proxy.ip, proxy.port, source, snat=snat),
         [b"--table", b"nat",
          b"--delete", b"OUTPUT",
          b"--protocol", b"tcp", b"--destination-port", port,
@@ -246,9 +404,12 @@ def delete_proxy(logger, proxy):
             iptables(logger, argv)
 
 
-def delete_open_port(logger, port):
+def delete_open_port(logger, port, iptables=iptables):
     """
     :see: ``HostNetwork.delete_open_port``
+
+    :param iptables: The callable used to change each rule, taking the same
+        arguments as :py:func:`iptables`.
     """
     action = DELETE_OPEN_PORT(
         logger=logger, target_port=port.port)
@@ -269,51 +430,94 @@ def delete_open_port(logger, port):
         ])
 
 
-def enumerate_proxies():
+def iptables_save():
+    """
+    Retrieve the system's iptables configuration.
+
+    :return: The ``bytes`` output of iptables-save(8).
+    """
+    return check_output([b"iptables-save"])
+
+
+def enumerate_proxies(output=None):
     """
     Inspect the system's iptables configuration to determine what proxies
     currently exist.
 
-    :see: :py:meth:`INetwork.enumerate_proxies` for parameter documentation.
+    :param bytes output: The iptables-save(8) output to inspect, or ``None``
+        to run ``iptables-save`` to retrieve it.
+
+    :see: :py:meth:`INetwork.enumerate_proxies` for return value
+        documentation.
     """
     proxies = []
     for rule in get_flocker_rules(
             comment_marker=FLOCKER_PROXY_COMMENT_MARKER,
-            table=b'nat'):
+            table=b'nat', output=output):
         proxies.append(
             Proxy(ip=rule.to_destination, port=rule.destination_port))
 
     return proxies
 
 
-def enumerate_open_ports():
+def enumerate_open_ports(output=None):
     """
     Inspect the system's iptables configuration to determine which ports
     are currently open.
 
-    :see: :py:meth:`INetwork.enumerate_open_ports` for parameter documentation.
+    :param bytes output: The iptables-save(8) output to inspect, or ``None``
+        to run ``iptables-save`` to retrieve it.
+
+    :see: :py:meth:`INetwork.enumerate_open_ports` for return value
+        documentation.
     """
     ports = []
     for rule in get_flocker_rules(
             comment_marker=FLOCKER_OPENPORT_COMMENT_MARKER,
-            table=b'filter'):
+            table=b'filter', output=output):
         ports.append(
             OpenPort(port=rule.destination_port))
 
     return ports
 
 
-def get_flocker_rules(comment_marker, table):
+def snat_sources(output=None):
+    """
+    Find the source addresses used by the SNAT rules of proxies.
+
+    :param bytes output: The iptables-save(8) output to inspect, or ``None``
+        to run ``iptables-save`` to retrieve it.
+
+    :return: A ``dict`` mapping ``int`` proxied ports to the
+        ``IPv4Address`` their traffic's source address is rewritten to, or
+        ``None`` for those which masquerade because there was no route to
+        their destination.
+    """
+    return {
+        rule.destination_port: rule.to_source
+        for rule in get_flocker_rules(
+            comment_marker=FLOCKER_SNAT_COMMENT_MARKER,
+            table=b'nat', output=output)
+    }
+
+
+def get_flocker_rules(comment_marker, table, output=None):
     """
     Look up all of the iptables rules created/managed by flocker.
 
+    :param bytes comment_marker: The comment identifying the rules to find.
+    :param bytes table: The name of the table containing the rules.
+    :param bytes output: The iptables-save(8) output to inspect, or ``None``
+        to run ``iptables-save`` to retrieve it.
+
     :return: An iterator of :py:class:`Options` instances, one for each rule
         found.
     """
     # Life is horrible.
     # https://stackoverflow.com/questions/109553/how-can-i-programmatically-manage-iptables-rules-on-the-fly
     # At least we know all the rules we need to inspect are in the NAT table.
-    output = check_output([b"iptables-save"])
+    if output is None:
+        output = iptables_save()
 
     # Find the beginning of the NAT table
     header = b"*%s\n" % (table,)
@@ -327,8 +531,10 @@ def get_flocker_rules(comment_marker, table):
     nat = output[begin:end]
 
     for line in nat.splitlines():
-        if line.startswith(b":"):
-            # Skip these lines describing a chain or the table overall.
+        if comment_marker not in line:
+            # Skip lines describing a chain or the table overall, as well as
+            # any rules which were not created by us, without paying for
+            # tokenizing them.
             continue
 
         options = parse_iptables_options(shlex.split(line))
@@ -363,6 +569,8 @@ def parse_iptables_options(argv):
     comment = None
     destination_port = None
     to_destination = None
+    destination = None
+    to_source = None
 
     try:
         destination_port_index = argv.index(b"--dport")
@@ -376,6 +584,20 @@ def parse_iptables_options(argv):
     except (IndexError, ValueError):
         to_destination = None
 
+    try:
+        destination_index = argv.index(b"-d")
+        # iptables-save writes the destination with a prefix length.
+        destination = IPAddress(
+            argv[destination_index + 1].split(b"/")[0])
+    except (IndexError, ValueError):
+        destination = None
+
+    try:
+        to_source_index = argv.index(b"--to-source")
+        to_source = IPAddress(argv[to_source_index + 1])
+    except (IndexError, ValueError):
+        to_source = None
+
     try:
         comment_index = argv.index(b"--comment")
         comment = argv[comment_index + 1]
@@ -385,23 +607,69 @@ def parse_iptables_options(argv):
     return RuleOptions(
         comment=comment,
         destination_port=destination_port,
-        to_destination=to_destination)
+        to_destination=to_destination,
+        destination=destination,
+        to_source=to_source)
+
+
+def network_snapshot(proxies, open_ports, listening_ports=listening_ports):
+    """
+    Create a ``NetworkSnapshot`` of the system's network.
+
+    :param list proxies: The ``Proxy`` instances currently configured.
+    :param list open_ports: The ``OpenPort`` instances currently configured.
+    :param listening_ports: A no-argument callable returning the ``frozenset``
+        of ports used by normal TCP servers.
+
+    :return: A ``NetworkSnapshot`` including ``proxies``, ``open_ports`` and
+        all of the ports in use by them or by normal TCP servers.
+    """
+    proxied = set(proxy.port for proxy in proxies)
+    opened = set(open_port.port for open_port in open_ports)
+    return NetworkSnapshot(
+        proxies=proxies,
+        open_ports=open_ports,
+        used_ports=listening_ports() | proxied | opened,
+    )
 
 
 @implementer(INetwork)
 class HostNetwork(object):
     """
     An ``INetwork`` implementation based on ``iptables``.
+
+    :ivar bool snat: If true, proxied traffic has its source address
+        rewritten to an explicitly configured address (SNAT) rather than
+        masqueraded, so the kernel does not look up the outgoing interface's
+        address for every packet.  This is opt-in (see
+        ``make_host_network``); the container agent still masquerades.
+
+    :ivar AddressChangeMonitor _monitor: If not ``None``, the monitor which
+        reports changes to this host's addresses and routes.  Until one is
+        running the SNAT source addresses are checked on every
+        ``snapshot``.
+
+    :ivar bool _source_addresses_stale: Whether the SNAT source addresses
+        need checking.
+
+    :ivar _listening_ports: A no-argument callable returning the
+        ``frozenset`` of ports used by normal TCP servers.
     """
     logger = Logger()
 
+    def __init__(self, snat=False, listening_ports=listening_ports):
+        self.snat = snat
+        self._listening_ports = listening_ports
+        self._monitor = None
+        self._source_addresses_stale = True
+
     def create_proxy_to(self, ip, port):
         """
         Configure iptables to proxy TCP traffic on the given port.
 
         :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
         """
-        return create_proxy_to(self.logger, ip, port)
+        return create_proxy_to(self.logger, ip, port, snat=self.snat)
 
     def delete_proxy(self, proxy):
         """
@@ -409,7 +677,9 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.delete_proxy` for parameter documentation.
         """
-        return delete_proxy(self.logger, proxy)
+        return delete_proxy(
+            self.logger, proxy,
+            snat_sources=snat_sources() if self.snat else None)
 
     def open_port(self, port):
         """
@@ -420,9 +690,19 @@ class HostNetwork(object):
     def delete_open_port(self, port):
         return delete_open_port(self.logger, port)
 
-    enumerate_proxies = staticmethod(enumerate_proxies)
+    def batch(self):
+        """
+        Collect changes to be applied with a single ``iptables-restore``.
+
+        :see: :meth:`INetwork.batch` for return value documentation.
+        """
+        return HostNetworkBatch(logger=self.logger, snat=self.snat)
+
+    def enumerate_proxies(self):
+        return enumerate_proxies()
 
-    enumerate_open_ports = staticmethod(enumerate_open_ports)
+    def enumerate_open_ports(self):
+        return enumerate_open_ports()
 
     def enumerate_used_ports(self):
         """
@@ -432,27 +712,138 @@ class HostNetwork(object):
         :see: :meth:`INetwork.enumerate_used_ports` for parameter
             documentation.
         """
-        listening = set(
-            conn.laddr[1]
-            for conn
-            in net_connections(kind='tcp')
-        )
-        proxied = set(
-            proxy.port
-            for proxy in self.enumerate_proxies()
-        )
-        open_ports = set(
-            open_port.port
-            for open_port in self.enumerate_open_ports()
-        )
-        # net_connections won't tell us about ports bound by sockets that
-        # haven't entered the TCP state graph yet.
-        return frozenset(listening | proxied | open_ports)
-
-
-def make_host_network():
+        return self.snapshot().used_ports
+
+    def snapshot(self):
+        """
+        Inspect the system's iptables configuration with a single
+        ``iptables-save`` and find the ports in use.
+
+        :see: :meth:`INetwork.snapshot` for return value documentation.
+        """
+        output = iptables_save()
+        if self.snat and self._source_addresses_stale:
+            if self._monitor is not None:
+                self._source_addresses_stale = False
+            # Only SNAT rules are rewritten, so ``output`` remains accurate
+            # for the proxies and open ports.
+            self.update_source_addresses(output)
+        return network_snapshot(
+            enumerate_proxies(output), enumerate_open_ports(output),
+            self._listening_ports)
+
+    def update_source_addresses(self, output=None):
+        """
+        Rewrite the SNAT rules whose source address is no longer the address
+        this host uses for traffic to the proxy's destination.  A proxy whose
+        destination has become unroutable falls back to masquerading, and
+        goes back to SNAT once there is a route again.
+
+        :param bytes output: The iptables-save(8) output to inspect, or
+            ``None`` to run ``iptables-save`` to retrieve it.
+        """
+        rules = []
+        for rule in get_flocker_rules(
+                comment_marker=FLOCKER_SNAT_COMMENT_MARKER,
+                table=b'nat', output=output):
+            source = source_address_for(rule.destination)
+            if source != rule.to_source:
+                rules.append(postrouting_rule(
+                    b"--delete", rule.destination, rule.destination_port,
+                    rule.to_source, snat=True))
+                rules.append(postrouting_rule(
+                    b"--append", rule.destination, rule.destination_port,
+                    source, snat=True))
+        if rules:
+            iptables_restore(self.logger, rules)
+
+    def watch_source_addresses(self, reactor):
+        """
+        Only check the SNAT source addresses after this host's addresses or
+        routes have changed, rather than on every ``snapshot``.
+
+        :param reactor: The reactor to watch for changes with.
+
+        :return: The started ``AddressChangeMonitor``.
+        """
+        def changed():
+            self._source_addresses_stale = True
+        self._monitor = AddressChangeMonitor(reactor, changed)
+        self._monitor.startWatching()
+        return self._monitor
+
+
+@implementer(INetworkBatch)
+class HostNetworkBatch(object):
+    """
+    An ``INetworkBatch`` which collects ``iptables`` rule changes and
+    applies them all in one ``iptables-restore`` transaction, rather than
+    running ``iptables`` once per rule.
+
+    :ivar bool snat: See ``HostNetwork.snat``.
+
+    :ivar list _rules: The ``iptables`` argument lists of the rule changes
+        collected so far.
+
+    :ivar dict _snat_sources: The result of :py:func:`snat_sources`, found
+        once for all proxies deleted by the batch, or ``None`` if not yet
+        needed.
+    """
+    def __init__(self, logger, snat=False):
+        self.logger = logger
+        self.snat = snat
+        self._rules = []
+        self._snat_sources = None
+
+    def _collect(self, logger, argv):
+        """
+        Collect a rule change instead of running ``iptables``.
+
+        :see: :py:func:`iptables` for parameter documentation.
+        """
+        self._rules.append(argv)
+
+    def create_proxy_to(self, ip, port):
+        return create_proxy_to(
+            self.logger, ip, port, iptables=self._collect, snat=self.snat)
+
+    def delete_proxy(self, proxy):
+        if self.snat and self._snat_sources is None:
+            self._snat_sources = snat_sources()
+        return delete_proxy(
+            self.logger, proxy, iptables=self._collect,
+            snat_sources=self._snat_sources)
+
+    def open_port(self, port):
+        return open_port(self.logger, port, iptables=self._collect)
+
+    def delete_open_port(self, port):
+        return delete_open_port(self.logger, port, iptables=self._collect)
+
+    def commit(self):
+        rules, self._rules = self._rules, []
+        self._snat_sources = None
+        if rules:
+            iptables_restore(self.logger, rules)
+
+
+def make_host_network(snat=False, listening_ports_max_age=None):
     """
     Create a new ``INetwork`` provider which will interact with the underlying
     system's network configuration.
+
+    :param bool snat: If true, rewrite the source address of proxied traffic
+        with SNAT rather than masquerading.  See ``HostNetwork.snat``.  A
+        caller with a running reactor should then also call
+        ``HostNetwork.watch_source_addresses``, or every snapshot checks
+        the source addresses again.
+
+    :param float listening_ports_max_age: If not ``None``, the number of
+        seconds for which the ports found listening may be reused by later
+        snapshots rather than looked up again.
     """
-    return HostNetwork()
+    if listening_ports_max_age is None:
+        return HostNetwork(snat=snat)
+    return HostNetwork(
+        snat=snat,
+        listening_ports=CachingListeningPorts(listening_ports_max_age))
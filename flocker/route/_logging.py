@@ -39,6 +39,16 @@ ARGV = Field.forTypes(
     u"The argument list of a child process being executed.")
 
 
+RULES = Field.forTypes(
+    u"rules", [list],
+    u"The iptables argument lists of some rules being changed together.")
+
+
+COMMANDS = Field.forTypes(
+    u"commands", [list],
+    u"The argument lists of some ipset commands being run together.")
+
+
 IPTABLES = ActionType(
     _system(u"iptables"),
     [ARGV],
@@ -46,6 +56,22 @@ IPTABLES = ActionType(
     u"An iptables command which Flocker is executing against the system.")
 
 
+IPTABLES_RESTORE = ActionType(
+    _system(u"iptables_restore"),
+    [RULES],
+    [],
+    u"A batch of iptables rule changes which Flocker is applying to the "
+    u"system in a single iptables-restore transaction.")
+
+
+IPSET_RESTORE = ActionType(
+    _system(u"ipset_restore"),
+    [COMMANDS],
+    [],
+    u"A batch of ipset commands which Flocker is applying to the system "
+    u"with a single ipset restore.")
+
+
 CREATE_PROXY_TO = ActionType(
     _system(u"create_proxy_to"),
     [TARGET_IP, TARGET_PORT],
@@ -7,8 +7,8 @@ Objects related to an in-memory implementation of ``INetwork``.
 from zope.interface import implementer
 from eliot import Logger
 
-from ._interfaces import INetwork
-from ._model import Proxy, OpenPort
+from ._interfaces import INetwork, INetworkBatch
+from ._model import Proxy, OpenPort, NetworkSnapshot
 
 
 @implementer(INetwork)
@@ -42,6 +42,9 @@ class MemoryNetwork(object):
     def delete_open_port(self, open_port):
         self._open_ports.remove(open_port)
 
+    def batch(self):
+        return MemoryNetworkBatch(network=self)
+
     def enumerate_proxies(self):
         return list(self._proxies)
 
@@ -54,6 +57,43 @@ class MemoryNetwork(object):
                                for open_port in self._open_ports)
         return proxy_ports | open_ports | self._used_ports
 
+    def snapshot(self):
+        return NetworkSnapshot(
+            proxies=self._proxies,
+            open_ports=self._open_ports,
+            used_ports=self.enumerate_used_ports(),
+        )
+
+
+@implementer(INetworkBatch)
+class MemoryNetworkBatch(object):
+    """
+    An ``INetworkBatch`` for ``MemoryNetwork``.
+
+    Changes are applied to the network as soon as they are made.  Nothing
+    else can observe the network in between, so this is as atomic as
+    deferring them to ``commit`` would be.
+
+    :ivar MemoryNetwork _network: The network to change.
+    """
+    def __init__(self, network):
+        self._network = network
+
+    def create_proxy_to(self, ip, port):
+        return self._network.create_proxy_to(ip, port)
+
+    def delete_proxy(self, proxy):
+        self._network.delete_proxy(proxy)
+
+    def open_port(self, port):
+        return self._network.open_port(port)
+
+    def delete_open_port(self, open_port):
+        self._network.delete_open_port(open_port)
+
+    def commit(self):
+        pass
+
 
 def make_memory_network(used_ports=frozenset()):
     """
@@ -5,7 +5,7 @@
 Objects related to the representation of Flocker-controlled network state.
 """
 
-from pyrsistent import PRecord, field
+from pyrsistent import PRecord, field, pset
 
 
 class Proxy(PRecord):
@@ -24,3 +24,20 @@ class OpenPort(PRecord):
     :ivar int port: The TCP port which is opened.
     """
     port = field(type=int, mandatory=True)
+
+
+class NetworkSnapshot(PRecord):
+    """
+    The configuration of an ``INetwork`` as observed at one point in time.
+
+    :ivar PSet proxies: ``Proxy`` instances describing all configured proxies.
+
+    :ivar PSet open_ports: ``OpenPort`` instances describing all configured
+        open ports.
+
+    :ivar frozenset used_ports: ``int`` port numbers in use, as described by
+        ``INetwork.enumerate_used_ports``.
+    """
+    proxies = field(mandatory=True, factory=pset)
+    open_ports = field(mandatory=True, factory=pset)
+    used_ports = field(mandatory=True, factory=frozenset)
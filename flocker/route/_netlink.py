@@ -0,0 +1,79 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Notification of changes to this host's addresses and routes, using the
+Linux ``rtnetlink`` interface.
+"""
+
+from socket import SOCK_RAW, socket, error as socket_error
+
+from zope.interface import implementer
+
+from twisted.internet.interfaces import IReadDescriptor
+
+# From linux/netlink.h and linux/rtnetlink.h; the ``socket`` module only
+# exposes ``AF_NETLINK`` on some versions.
+AF_NETLINK = 16
+NETLINK_ROUTE = 0
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+
+@implementer(IReadDescriptor)
+class AddressChangeMonitor(object):
+    """
+    Call a function whenever an IPv4 address or route of this host is added,
+    changed or removed.
+
+    :ivar _reactor: An ``IReactorFDSet`` provider to watch the netlink socket
+        with.
+    :ivar _changed: A no-argument callable to call after changes.
+    :ivar _socket: The netlink socket, or ``None`` when not watching.
+    """
+    def __init__(self, reactor, changed):
+        self._reactor = reactor
+        self._changed = changed
+        self._socket = None
+
+    def startWatching(self):
+        """
+        Subscribe to address and route changes and start reading them.
+        """
+        self._socket = socket(AF_NETLINK, SOCK_RAW, NETLINK_ROUTE)
+        self._socket.setblocking(False)
+        self._socket.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+        self._reactor.addReader(self)
+
+    def stopWatching(self):
+        """
+        Stop reading changes and close the netlink socket.
+        """
+        if self._socket is not None:
+            self._reactor.removeReader(self)
+            self._socket.close()
+            self._socket = None
+
+    def fileno(self):
+        if self._socket is None:
+            return -1
+        return self._socket.fileno()
+
+    def doRead(self):
+        """
+        Drain all pending notifications, then report that something changed.
+        The contents of the notifications are not interesting since the
+        interested party is going to look at the current state anyway.
+        """
+        while True:
+            try:
+                if not self._socket.recv(65536):
+                    break
+            except socket_error:
+                break
+        self._changed()
+
+    def connectionLost(self, reason):
+        self._socket = None
+
+    def logPrefix(self):
+        return self.__class__.__name__
@@ -0,0 +1,80 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_procnet -*-
+
+"""
+Find listening TCP ports by reading ``/proc/net/tcp`` and ``/proc/net/tcp6``.
+
+This is much cheaper than ``psutil.net_connections``, which also walks the
+file descriptors of every process to find the owner of each socket.
+"""
+
+from time import time
+
+from twisted.python.filepath import FilePath
+
+# The ``st`` column value of a socket in the ``TCP_LISTEN`` state.
+_TCP_LISTEN = b"0A"
+
+
+def parse_proc_net_tcp(content):
+    """
+    Find the listening ports in the contents of ``/proc/net/tcp`` or
+    ``/proc/net/tcp6``.
+
+    :param bytes content: The file contents.
+
+    :return: A ``set`` of ``int`` port numbers.
+    """
+    ports = set()
+    # The first line is a header.
+    for line in content.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) > 3 and fields[3] == _TCP_LISTEN:
+            # The local address is ``<hex address>:<hex port>``.
+            ports.add(int(fields[1].rsplit(b":", 1)[1], 16))
+    return ports
+
+
+def listening_ports(proc_net=FilePath(b"/proc/net")):
+    """
+    Find the TCP ports in use on this node by normal TCP servers.
+
+    :param FilePath proc_net: The ``/proc/net`` directory to read.
+
+    :return: A ``frozenset`` of ``int`` port numbers.
+    """
+    ports = set()
+    for name in [b"tcp", b"tcp6"]:
+        path = proc_net.child(name)
+        # ``tcp6`` is missing when IPv6 is disabled.
+        if path.exists():
+            ports |= parse_proc_net_tcp(path.getContent())
+    return frozenset(ports)
+
+
+class CachingListeningPorts(object):
+    """
+    A replacement for ``listening_ports`` which reuses its result for a
+    while, for callers which can tolerate slightly stale results.
+
+    :ivar float max_age: The number of seconds for which a result is reused.
+    :ivar _now: A no-argument callable returning the current time in seconds.
+    :ivar _listening_ports: The ``listening_ports`` callable to cache.
+    """
+    def __init__(self, max_age, now=time, listening_ports=listening_ports):
+        self.max_age = max_age
+        self._now = now
+        self._listening_ports = listening_ports
+        self._result = None
+        self._when = None
+
+    def __call__(self):
+        """
+        :return: The cached result of ``listening_ports``, refreshed if it
+            is older than ``max_age``.
+        """
+        now = self._now()
+        if self._result is None or now - self._when >= self.max_age:
+            self._result = self._listening_ports()
+            self._when = now
+        return self._result
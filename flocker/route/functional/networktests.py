@@ -8,7 +8,7 @@ from zope.interface.verify import verifyObject
 from ipaddr import IPAddress
 from twisted.trial.unittest import SynchronousTestCase
 
-from .. import INetwork, OpenPort
+from .. import INetwork, INetworkBatch, OpenPort
 
 
 def make_network_tests(make_network):
@@ -186,4 +186,48 @@ def make_network_tests(make_network):
             self.network.open_port(port_number)
             self.assertIn(port_number, self.network.enumerate_used_ports())
 
+        def test_batch_interface(self):
+            """
+            :py:meth:`INetwork.batch` returns an ``INetworkBatch`` provider.
+            """
+            self.assertTrue(
+                verifyObject(INetworkBatch, self.network.batch()))
+
+        def test_batch_changes_committed(self):
+            """
+            Changes made through an ``INetworkBatch`` are reflected by the
+            network after :py:meth:`INetworkBatch.commit` is called.
+            """
+            obsolete_proxy = self.network.create_proxy_to(
+                IPAddress("10.0.0.1"), 1)
+            obsolete_port = self.network.open_port(2)
+
+            batch = self.network.batch()
+            batch.delete_proxy(obsolete_proxy)
+            batch.delete_open_port(obsolete_port)
+            proxy = batch.create_proxy_to(IPAddress("10.0.0.2"), 3)
+            open_port = batch.open_port(4)
+            batch.commit()
+
+            self.assertEqual(
+                ([proxy], [open_port]),
+                (self.network.enumerate_proxies(),
+                 self.network.enumerate_open_ports()))
+
+        def test_snapshot(self):
+            """
+            :py:meth:`INetwork.snapshot` returns a ``NetworkSnapshot``
+            describing the same proxies, open ports and used ports as the
+            corresponding ``enumerate_*`` methods.
+            """
+            self.network.create_proxy_to(IPAddress("10.0.0.1"), 18173)
+            self.network.open_port(18174)
+            snapshot = self.network.snapshot()
+            self.assertEqual(
+                (set(self.network.enumerate_proxies()),
+                 set(self.network.enumerate_open_ports()),
+                 True),
+                (set(snapshot.proxies), set(snapshot.open_ports),
+                 {18173, 18174}.issubset(snapshot.used_ports)))
+
     return NetworkTests
@@ -0,0 +1,39 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Functional tests for :py:mod:`flocker.route._ipset`.
+"""
+
+from unittest import skipUnless
+
+from twisted.python.procutils import which
+
+from .. import make_ipset_network
+from .networktests import make_network_tests
+from .test_iptables_create import _dependency_skip, _environment_skip
+
+try:
+    from .iptables import create_network_namespace
+except ImportError:
+    pass
+
+_ipset_skip = skipUnless(
+    which(b"ipset"),
+    "Cannot test ipset-based proxies without ipset.")
+
+
+class IPSetNetworkTests(make_network_tests(make_ipset_network)):
+    """
+    Apply the generic ``INetwork`` test suite to the implementation which
+    manipulates the actual system configuration using ``ipset``.
+    """
+    @_dependency_skip
+    @_environment_skip
+    @_ipset_skip
+    def setUp(self):
+        """
+        Arrange for the tests to not corrupt the system network configuration.
+        """
+        self.namespace = create_network_namespace()
+        self.addCleanup(self.namespace.restore)
+        super(IPSetNetworkTests, self).setUp()
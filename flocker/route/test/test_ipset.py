@@ -0,0 +1,140 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._ipset`.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._ipset import parse_ipset_save, plan_changes
+
+
+IPSET_SAVE_OUTPUT = b"""\
+create unrelated hash:ip family inet hashsize 1024 maxelem 65536
+add unrelated 10.0.0.1
+create flocker-proxied bitmap:port range 0-65535
+add flocker-proxied 4567
+add flocker-proxied 4568
+create flocker-open bitmap:port range 0-65535
+create flocker-p-10.1.2.3 bitmap:port range 0-65535
+add flocker-p-10.1.2.3 4567
+add flocker-p-10.1.2.3 4568
+"""
+
+# iptables-save(8) output once the dedicated chains exist and traffic is
+# being proxied to 10.1.2.3.
+IPTABLES_SAVE_OUTPUT = b"""\
+*nat
+:PREROUTING ACCEPT [0:0]
+:FLOCKER-PROXY - [0:0]
+-A FLOCKER-PROXY -p tcp -m set --match-set flocker-p-10.1.2.3 dst \
+-j DNAT --to-destination 10.1.2.3
+COMMIT
+*filter
+:FORWARD ACCEPT [0:0]
+:FLOCKER-FORWARD - [0:0]
+COMMIT
+"""
+
+
+class ParseIPSetSaveTests(SynchronousTestCase):
+    """
+    Tests for ``parse_ipset_save``.
+    """
+    def test_flocker_sets(self):
+        """
+        ``parse_ipset_save`` returns the contents of each Flocker-managed set,
+        ignoring any other sets.
+        """
+        self.assertEqual(
+            {b"flocker-proxied": {4567, 4568},
+             b"flocker-open": set(),
+             b"flocker-p-10.1.2.3": {4567, 4568}},
+            parse_ipset_save(IPSET_SAVE_OUTPUT))
+
+
+class PlanChangesTests(SynchronousTestCase):
+    """
+    Tests for ``plan_changes``.
+    """
+    def test_initial(self):
+        """
+        When nothing has been configured yet the sets, the dedicated chains
+        and the rules jumping to them are all created.
+        """
+        before, rules, after = plan_changes(
+            {}, b"*nat\nCOMMIT\n*filter\nCOMMIT\n",
+            {u"10.1.2.3": {4567}}, {3306})
+        self.assertEqual(
+            ([[b"create", b"flocker-proxied",
+               b"bitmap:port", b"range", b"0-65535"],
+              [b"add", b"flocker-proxied", b"4567"],
+              [b"create", b"flocker-open",
+               b"bitmap:port", b"range", b"0-65535"],
+              [b"add", b"flocker-open", b"3306"],
+              [b"create", b"flocker-p-10.1.2.3",
+               b"bitmap:port", b"range", b"0-65535"],
+              [b"add", b"flocker-p-10.1.2.3", b"4567"]],
+             [(b"nat", b"--new-chain", b"FLOCKER-PROXY"),
+              (b"nat", b"--append", b"PREROUTING"),
+              (b"nat", b"--append", b"OUTPUT"),
+              (b"nat", b"--append", b"POSTROUTING"),
+              (b"filter", b"--new-chain", b"FLOCKER-FORWARD"),
+              (b"filter", b"--insert", b"FORWARD"),
+              (b"filter", b"--insert", b"INPUT"),
+              (b"nat", b"--append", b"FLOCKER-PROXY"),
+              (b"filter", b"--append", b"FLOCKER-FORWARD")],
+             []),
+            (before, [tuple(rule[1:4]) for rule in rules], after))
+
+    def test_port_added(self):
+        """
+        Adding a port for an existing destination swaps in new set contents
+        and leaves the rules alone.
+        """
+        before, rules, after = plan_changes(
+            parse_ipset_save(IPSET_SAVE_OUTPUT), IPTABLES_SAVE_OUTPUT,
+            {u"10.1.2.3": {4567, 4568, 4569}}, set())
+        self.assertEqual(
+            ([[b"create", b"flocker-t-proxied",
+               b"bitmap:port", b"range", b"0-65535", b"-exist"],
+              [b"flush", b"flocker-t-proxied"],
+              [b"add", b"flocker-t-proxied", b"4567"],
+              [b"add", b"flocker-t-proxied", b"4568"],
+              [b"add", b"flocker-t-proxied", b"4569"],
+              [b"swap", b"flocker-t-proxied", b"flocker-proxied"],
+              [b"destroy", b"flocker-t-proxied"],
+              [b"create", b"flocker-t-p-10.1.2.3",
+               b"bitmap:port", b"range", b"0-65535", b"-exist"],
+              [b"flush", b"flocker-t-p-10.1.2.3"],
+              [b"add", b"flocker-t-p-10.1.2.3", b"4567"],
+              [b"add", b"flocker-t-p-10.1.2.3", b"4568"],
+              [b"add", b"flocker-t-p-10.1.2.3", b"4569"],
+              [b"swap", b"flocker-t-p-10.1.2.3", b"flocker-p-10.1.2.3"],
+              [b"destroy", b"flocker-t-p-10.1.2.3"]],
+             [], []),
+            (before, rules, after))
+
+    def test_destination_removed(self):
+        """
+        When no ports are proxied to a destination any more its rules are
+        deleted and then its set is destroyed.
+        """
+        before, rules, after = plan_changes(
+            parse_ipset_save(IPSET_SAVE_OUTPUT), IPTABLES_SAVE_OUTPUT,
+            {u"10.1.2.3": set()}, set())
+        self.assertEqual(
+            ([(b"nat", b"--delete", b"FLOCKER-PROXY"),
+              (b"filter", b"--delete", b"FLOCKER-FORWARD")],
+             [[b"destroy", b"flocker-p-10.1.2.3"]]),
+            ([tuple(rule[1:4]) for rule in rules], after))
+
+    def test_unchanged(self):
+        """
+        No changes are planned if the configuration already matches.
+        """
+        self.assertEqual(
+            ([], [], []),
+            plan_changes(
+                parse_ipset_save(IPSET_SAVE_OUTPUT), IPTABLES_SAVE_OUTPUT,
+                {u"10.1.2.3": {4567, 4568}}, set()))
@@ -0,0 +1,423 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._iptables`.
+"""
+
+from ipaddr import IPAddress
+
+from eliot import Logger
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import OpenPort, Proxy
+from .. import _iptables
+from .._iptables import (
+    HostNetwork, HostNetworkBatch, FLOCKER_OPENPORT_COMMENT_MARKER,
+    FLOCKER_SNAT_COMMENT_MARKER, create_proxy_to, delete_proxy,
+    enumerate_open_ports, enumerate_proxies, postrouting_rule,
+    render_iptables_restore, snat_sources, source_address_for,
+)
+
+
+# Some iptables-save(8) output including two Flocker proxies (one of them in
+# SNAT mode), one Flocker open port and some rules belonging to someone
+# else.  One of those is deliberately not something ``shlex.split`` can
+# tokenize.
+IPTABLES_SAVE_OUTPUT = b"""\
+# Generated by iptables-save v1.4.21
+*nat
+:PREROUTING ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A PREROUTING -p tcp -m tcp --dport 12345 -m addrtype --dst-type LOCAL \
+-j DNAT --to-destination 10.7.8.9
+-A PREROUTING -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL \
+-m comment --comment "flocker create_proxy_to" -j DNAT \
+--to-destination 10.1.2.3
+-A PREROUTING -p tcp -m tcp --dport 4568 -m addrtype --dst-type LOCAL \
+-m comment --comment "flocker create_proxy_to" -j DNAT \
+--to-destination 10.1.2.4
+-A OUTPUT -p tcp -m tcp --dport 4567 -m addrtype --dst-type LOCAL \
+-j DNAT --to-destination 10.1.2.3
+-A POSTROUTING -p tcp -m tcp --dport 4567 -j MASQUERADE
+-A POSTROUTING -d 10.1.2.4/32 -p tcp -m tcp --dport 4568 \
+-m comment --comment "flocker snat" -j SNAT --to-source 10.0.0.5
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+-A INPUT -m comment --comment "unbalanced ' quote" -j ACCEPT
+-A INPUT -p tcp -m tcp --dport 3306 -m comment \
+--comment "flocker open_port" -j ACCEPT
+-A FORWARD -d 10.1.2.3/32 -p tcp -m tcp --dport 4567 -j ACCEPT
+COMMIT
+"""
+
+# The same, with the second proxy masquerading because there was no route to
+# its destination when its rule was written.
+UNROUTABLE_IPTABLES_SAVE_OUTPUT = IPTABLES_SAVE_OUTPUT.replace(
+    b"-j SNAT --to-source 10.0.0.5", b"-j MASQUERADE")
+
+
+class RenderIPTablesRestoreTests(SynchronousTestCase):
+    """
+    Tests for ``render_iptables_restore``.
+    """
+    def test_grouped_by_table(self):
+        """
+        Rules are grouped into one section per table, each followed by
+        ``COMMIT``, preserving the order of the rules within a table.
+        """
+        rules = [
+            [b"--table", b"nat", b"--append", b"OUTPUT", b"--jump", b"A"],
+            [b"--table", b"filter", b"--insert", b"INPUT", b"--jump", b"B"],
+            [b"--table", b"nat", b"--delete", b"OUTPUT", b"--jump", b"C"],
+        ]
+        self.assertEqual(
+            b"*nat\n"
+            b"--append OUTPUT --jump A\n"
+            b"--delete OUTPUT --jump C\n"
+            b"COMMIT\n"
+            b"*filter\n"
+            b"--insert INPUT --jump B\n"
+            b"COMMIT\n",
+            render_iptables_restore(rules))
+
+    def test_quoting(self):
+        """
+        Arguments containing whitespace or quotes are quoted.
+        """
+        rules = [[
+            b"--table", b"filter", b"--append", b"INPUT",
+            b"--match", b"comment", b"--comment", b'a "quoted" comment',
+        ]]
+        self.assertEqual(
+            b"*filter\n"
+            b'--append INPUT --match comment --comment '
+            b'"a \\"quoted\\" comment"\n'
+            b"COMMIT\n",
+            render_iptables_restore(rules))
+
+    def test_empty(self):
+        """
+        No rules render to no input.
+        """
+        self.assertEqual(b"", render_iptables_restore([]))
+
+
+class HostNetworkBatchTests(SynchronousTestCase):
+    """
+    Tests for ``HostNetworkBatch``.
+    """
+    def setUp(self):
+        self.iptables = []
+        self.restores = []
+        self.patch(_iptables, "iptables",
+                   lambda logger, argv: self.iptables.append(argv))
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules: self.restores.append(rules))
+        self.batch = HostNetworkBatch(logger=Logger())
+
+    def test_commit_restores_once(self):
+        """
+        ``HostNetworkBatch.commit`` applies all of the rule changes collected
+        by the batch with a single ``iptables_restore`` call, without running
+        ``iptables`` for any of them.
+        """
+        self.batch.delete_open_port(OpenPort(port=1234))
+        self.batch.open_port(5678)
+        self.batch.commit()
+        self.assertEqual(
+            ([], [[
+                [b"--table", b"filter", b"--delete", b"INPUT",
+                 b"--protocol", b"tcp", b"--destination-port", b"1234",
+                 b"--match", b"comment",
+                 b"--comment", FLOCKER_OPENPORT_COMMENT_MARKER,
+                 b"--jump", b"ACCEPT"],
+                [b"--table", b"filter", b"--insert", b"INPUT",
+                 b"--protocol", b"tcp", b"--destination-port", b"5678",
+                 b"--match", b"comment",
+                 b"--comment", FLOCKER_OPENPORT_COMMENT_MARKER,
+                 b"--jump", b"ACCEPT"],
+            ]]),
+            (self.iptables, self.restores))
+
+    def test_nothing_until_commit(self):
+        """
+        No changes are applied before ``HostNetworkBatch.commit`` is called.
+        """
+        self.batch.open_port(5678)
+        self.assertEqual(([], []), (self.iptables, self.restores))
+
+    def test_empty_commit(self):
+        """
+        Committing a batch with no changes does not run ``iptables-restore``.
+        """
+        self.batch.commit()
+        self.assertEqual([], self.restores)
+
+    def test_commit_empties(self):
+        """
+        After ``HostNetworkBatch.commit`` the batch holds no changes.
+        """
+        self.batch.open_port(5678)
+        self.batch.commit()
+        self.batch.commit()
+        self.assertEqual(1, len(self.restores))
+
+
+class EnumerateTests(SynchronousTestCase):
+    """
+    Tests for ``enumerate_proxies`` and ``enumerate_open_ports`` given
+    iptables-save(8) output.
+    """
+    def test_proxies(self):
+        """
+        ``enumerate_proxies`` finds only the proxies created by Flocker.
+        """
+        self.assertEqual(
+            {Proxy(ip=IPAddress(u"10.1.2.3"), port=4567),
+             Proxy(ip=IPAddress(u"10.1.2.4"), port=4568)},
+            set(enumerate_proxies(IPTABLES_SAVE_OUTPUT)))
+
+    def test_open_ports(self):
+        """
+        ``enumerate_open_ports`` finds only the ports opened by Flocker,
+        without tokenizing any of the other rules.
+        """
+        self.assertEqual(
+            [OpenPort(port=3306)],
+            enumerate_open_ports(IPTABLES_SAVE_OUTPUT))
+
+
+class SNATTests(SynchronousTestCase):
+    """
+    Tests for proxies whose traffic has its source address rewritten with
+    SNAT rather than masqueraded.
+    """
+    def setUp(self):
+        self.source = IPAddress(u"10.0.0.5")
+        self.patch(_iptables, "source_address_for", lambda ip: self.source)
+        self.rules = []
+        self.restores = []
+        self.patch(_iptables, "iptables_restore",
+                   lambda logger, rules: self.restores.append(rules))
+
+    def collect(self, logger, argv):
+        self.rules.append(argv)
+
+    def test_snat_rule(self):
+        """
+        ``postrouting_rule`` given a source address builds a ``SNAT`` rule
+        for traffic to the proxy destination, tagged so it can be found
+        again.
+        """
+        self.assertEqual(
+            [b"--table", b"nat", b"--append", b"POSTROUTING",
+             b"--protocol", b"tcp", b"--destination-port", b"4568",
+             b"--destination", b"10.1.2.4",
+             b"--match", b"comment", b"--comment", FLOCKER_SNAT_COMMENT_MARKER,
+             b"--jump", b"SNAT", b"--to-source", b"10.0.0.5"],
+            postrouting_rule(
+                b"--append", IPAddress(u"10.1.2.4"), 4568, self.source))
+
+    def test_masquerade_rule(self):
+        """
+        ``postrouting_rule`` without a source address builds a
+        ``MASQUERADE`` rule.
+        """
+        self.assertEqual(
+            [b"--table", b"nat", b"--delete", b"POSTROUTING",
+             b"--protocol", b"tcp", b"--destination-port", b"4567",
+             b"--jump", b"MASQUERADE"],
+            postrouting_rule(b"--delete", IPAddress(u"10.1.2.3"), 4567))
+
+    def test_create_proxy_snat(self):
+        """
+        ``create_proxy_to`` in SNAT mode rewrites the source address of
+        proxied traffic to the address this host uses to reach the
+        destination.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        create_proxy_to(Logger(), ip, 4568, iptables=self.collect, snat=True)
+        self.assertIn(
+            postrouting_rule(b"--append", ip, 4568, self.source), self.rules)
+
+    def test_unroutable_rule(self):
+        """
+        ``postrouting_rule`` in SNAT mode without a source address builds a
+        ``MASQUERADE`` rule for traffic to the proxy destination, tagged so
+        it can be found again.
+        """
+        self.assertEqual(
+            [b"--table", b"nat", b"--append", b"POSTROUTING",
+             b"--protocol", b"tcp", b"--destination-port", b"4568",
+             b"--destination", b"10.1.2.4",
+             b"--match", b"comment", b"--comment", FLOCKER_SNAT_COMMENT_MARKER,
+             b"--jump", b"MASQUERADE"],
+            postrouting_rule(
+                b"--append", IPAddress(u"10.1.2.4"), 4568, snat=True))
+
+    def test_create_proxy_unroutable(self):
+        """
+        ``create_proxy_to`` in SNAT mode masquerades if this host has no
+        route to the destination, with a rule that can be found again.
+        """
+        self.source = None
+        ip = IPAddress(u"10.1.2.4")
+        create_proxy_to(Logger(), ip, 4568, iptables=self.collect, snat=True)
+        self.assertIn(
+            postrouting_rule(b"--append", ip, 4568, snat=True), self.rules)
+
+    def test_snat_sources(self):
+        """
+        ``snat_sources`` maps the ports of proxies in SNAT mode to their
+        source addresses.
+        """
+        self.assertEqual(
+            {4568: IPAddress(u"10.0.0.5")},
+            snat_sources(IPTABLES_SAVE_OUTPUT))
+
+    def test_delete_proxy_snat(self):
+        """
+        ``delete_proxy`` deletes the ``SNAT`` rule of a proxy found in the
+        given SNAT sources.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        delete_proxy(
+            Logger(), Proxy(ip=ip, port=4568), iptables=self.collect,
+            snat_sources=snat_sources(IPTABLES_SAVE_OUTPUT))
+        self.assertIn(
+            postrouting_rule(b"--delete", ip, 4568, self.source), self.rules)
+
+    def test_snat_sources_unroutable(self):
+        """
+        ``snat_sources`` maps the port of a proxy in SNAT mode which
+        masquerades because it had no route to ``None``.
+        """
+        self.assertEqual(
+            {4568: None}, snat_sources(UNROUTABLE_IPTABLES_SAVE_OUTPUT))
+
+    def test_delete_proxy_unroutable(self):
+        """
+        ``delete_proxy`` deletes the tagged ``MASQUERADE`` rule of a proxy in
+        SNAT mode which had no route.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        delete_proxy(
+            Logger(), Proxy(ip=ip, port=4568), iptables=self.collect,
+            snat_sources=snat_sources(UNROUTABLE_IPTABLES_SAVE_OUTPUT))
+        self.assertIn(
+            postrouting_rule(b"--delete", ip, 4568, snat=True), self.rules)
+
+    def test_delete_proxy_masquerade(self):
+        """
+        ``delete_proxy`` deletes the ``MASQUERADE`` rule of a proxy which is
+        not in the given SNAT sources.
+        """
+        ip = IPAddress(u"10.1.2.3")
+        delete_proxy(
+            Logger(), Proxy(ip=ip, port=4567), iptables=self.collect,
+            snat_sources=snat_sources(IPTABLES_SAVE_OUTPUT))
+        self.assertIn(postrouting_rule(b"--delete", ip, 4567), self.rules)
+
+    def test_update_source_addresses(self):
+        """
+        ``HostNetwork.update_source_addresses`` replaces a ``SNAT`` rule whose
+        source address has changed, in one ``iptables_restore`` call.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        old = self.source
+        self.source = IPAddress(u"10.0.0.6")
+        HostNetwork(snat=True).update_source_addresses(IPTABLES_SAVE_OUTPUT)
+        self.assertEqual(
+            [[postrouting_rule(b"--delete", ip, 4568, old),
+              postrouting_rule(b"--append", ip, 4568, self.source)]],
+            self.restores)
+
+    def test_update_source_addresses_routable(self):
+        """
+        ``HostNetwork.update_source_addresses`` switches a proxy which
+        masquerades because it had no route back to ``SNAT`` once there is a
+        route to its destination.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        HostNetwork(snat=True).update_source_addresses(
+            UNROUTABLE_IPTABLES_SAVE_OUTPUT)
+        self.assertEqual(
+            [[postrouting_rule(b"--delete", ip, 4568, snat=True),
+              postrouting_rule(b"--append", ip, 4568, self.source)]],
+            self.restores)
+
+    def test_update_source_addresses_unroutable(self):
+        """
+        ``HostNetwork.update_source_addresses`` makes a proxy whose
+        destination has become unroutable masquerade with a rule that can
+        still be found again.
+        """
+        ip = IPAddress(u"10.1.2.4")
+        old = self.source
+        self.source = None
+        HostNetwork(snat=True).update_source_addresses(IPTABLES_SAVE_OUTPUT)
+        self.assertEqual(
+            [[postrouting_rule(b"--delete", ip, 4568, old),
+              postrouting_rule(b"--append", ip, 4568, snat=True)]],
+            self.restores)
+
+    def test_source_addresses_unchanged(self):
+        """
+        ``HostNetwork.update_source_addresses`` changes nothing if the source
+        addresses are still correct.
+        """
+        HostNetwork(snat=True).update_source_addresses(IPTABLES_SAVE_OUTPUT)
+        self.assertEqual([], self.restores)
+
+    def snapshots(self, network):
+        """
+        Take two snapshots of ``network``, which finds a changed source
+        address every time it looks.
+
+        :return: The number of times the source addresses were updated.
+        """
+        self.source = IPAddress(u"10.0.0.6")
+        self.patch(_iptables, "iptables_save", lambda: IPTABLES_SAVE_OUTPUT)
+        network.snapshot()
+        network.snapshot()
+        return len(self.restores)
+
+    def test_snapshot_updates_source_addresses(self):
+        """
+        Without an address monitor, ``HostNetwork.snapshot`` updates the
+        source addresses every time.
+        """
+        self.assertEqual(2, self.snapshots(HostNetwork(snat=True)))
+
+    def test_snapshot_monitored(self):
+        """
+        With an address monitor, ``HostNetwork.snapshot`` only updates the
+        source addresses after the monitor reports a change.
+        """
+        network = HostNetwork(snat=True)
+        network._monitor = object()
+        self.assertEqual(1, self.snapshots(network))
+
+    def test_snapshot_masquerade(self):
+        """
+        ``HostNetwork.snapshot`` never updates source addresses when not in
+        SNAT mode.
+        """
+        self.assertEqual(0, self.snapshots(HostNetwork()))
+
+
+class SourceAddressForTests(SynchronousTestCase):
+    """
+    Tests for ``source_address_for``.
+    """
+    def test_loopback(self):
+        """
+        Traffic to the loopback address comes from the loopback address.
+        """
+        self.assertEqual(
+            IPAddress(u"127.0.0.1"),
+            source_address_for(IPAddress(u"127.0.0.1")))
@@ -0,0 +1,64 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._netlink`.
+"""
+
+from sys import platform
+
+from zope.interface.verify import verifyObject
+
+from twisted.internet.interfaces import IReadDescriptor
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.trial.unittest import SynchronousTestCase, SkipTest
+
+from .._netlink import AddressChangeMonitor
+
+
+class AddressChangeMonitorTests(SynchronousTestCase):
+    """
+    Tests for ``AddressChangeMonitor``.
+    """
+    def setUp(self):
+        if not platform.startswith("linux"):
+            raise SkipTest("netlink is only available on Linux.")
+        self.reactor = MemoryReactor()
+        self.changes = []
+        self.monitor = AddressChangeMonitor(
+            self.reactor, lambda: self.changes.append(None))
+
+    def test_interface(self):
+        """
+        ``AddressChangeMonitor`` provides ``IReadDescriptor``.
+        """
+        self.assertTrue(verifyObject(IReadDescriptor, self.monitor))
+
+    def test_start_watching(self):
+        """
+        ``AddressChangeMonitor.startWatching`` adds the monitor as a reader.
+        """
+        self.monitor.startWatching()
+        self.addCleanup(self.monitor.stopWatching)
+        self.assertIn(self.monitor, self.reactor.getReaders())
+
+    def test_stop_watching(self):
+        """
+        ``AddressChangeMonitor.stopWatching`` removes the monitor as a reader
+        and closes its socket.
+        """
+        self.monitor.startWatching()
+        self.monitor.stopWatching()
+        self.assertEqual(
+            (False, -1),
+            (self.monitor in self.reactor.getReaders(),
+             self.monitor.fileno()))
+
+    def test_read_reports_change(self):
+        """
+        ``AddressChangeMonitor.doRead`` drains the socket and calls the change
+        callback once.
+        """
+        self.monitor.startWatching()
+        self.addCleanup(self.monitor.stopWatching)
+        self.monitor.doRead()
+        self.assertEqual([None], self.changes)
@@ -0,0 +1,128 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._procnet`.
+"""
+
+from socket import socket
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._procnet import (
+    CachingListeningPorts, listening_ports, parse_proc_net_tcp,
+)
+
+# /proc/net/tcp with a server listening on port 22 on all addresses, one on
+# port 631 on localhost only and an established connection to port 22.
+PROC_NET_TCP = b"""\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt\
+   uid  timeout inode
+   0: 00000000:0016 00000000:0000 0A 00000000:00000000 00:00000000 00000000\
+     0        0 12345 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:0277 00000000:0000 0A 00000000:00000000 00:00000000 00000000\
+     0        0 12346 1 0000000000000000 100 0 0 10 0
+   2: 0F02000A:0016 0202000A:C350 01 00000000:00000000 02:00097B5C 00000000\
+     0        0 12347 4 0000000000000000 20 4 29 10 -1
+"""
+
+# /proc/net/tcp6 with a server listening on port 8080 on all addresses.
+PROC_NET_TCP6 = b"""\
+  sl  local_address                         remote_address                \
+        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000000000000:1F90 \
+00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 \
+00000000     0        0 12348 1 0000000000000000 100 0 0 10 0
+"""
+
+
+class ParseProcNetTCPTests(SynchronousTestCase):
+    """
+    Tests for ``parse_proc_net_tcp``.
+    """
+    def test_listening(self):
+        """
+        The ports of listening sockets are found and other sockets are
+        ignored.
+        """
+        self.assertEqual({22, 631}, parse_proc_net_tcp(PROC_NET_TCP))
+
+    def test_ipv6(self):
+        """
+        The ports of listening IPv6 sockets are found.
+        """
+        self.assertEqual({8080}, parse_proc_net_tcp(PROC_NET_TCP6))
+
+    def test_empty(self):
+        """
+        A file containing only the header has no listening ports.
+        """
+        self.assertEqual(
+            set(), parse_proc_net_tcp(PROC_NET_TCP.splitlines()[0]))
+
+
+class ListeningPortsTests(SynchronousTestCase):
+    """
+    Tests for ``listening_ports``.
+    """
+    def setUp(self):
+        self.proc_net = FilePath(self.mktemp())
+        self.proc_net.makedirs()
+        self.proc_net.child(b"tcp").setContent(PROC_NET_TCP)
+
+    def test_ipv4_and_ipv6(self):
+        """
+        ``listening_ports`` returns a ``frozenset`` of the listening ports
+        from both ``tcp`` and ``tcp6``.
+        """
+        self.proc_net.child(b"tcp6").setContent(PROC_NET_TCP6)
+        self.assertEqual(
+            frozenset({22, 631, 8080}), listening_ports(self.proc_net))
+
+    def test_no_ipv6(self):
+        """
+        ``listening_ports`` ignores a missing ``tcp6``.
+        """
+        self.assertEqual(frozenset({22, 631}), listening_ports(self.proc_net))
+
+    def test_real(self):
+        """
+        ``listening_ports`` finds a port listening on this host.
+        """
+        listener = socket()
+        self.addCleanup(listener.close)
+        listener.bind((b"127.0.0.1", 0))
+        listener.listen(1)
+        self.assertIn(listener.getsockname()[1], listening_ports())
+
+
+class CachingListeningPortsTests(SynchronousTestCase):
+    """
+    Tests for ``CachingListeningPorts``.
+    """
+    def setUp(self):
+        self.now = 0
+        self.calls = 0
+        self.cache = CachingListeningPorts(
+            max_age=5, now=lambda: self.now,
+            listening_ports=self.listening_ports)
+
+    def listening_ports(self):
+        self.calls += 1
+        return frozenset({self.calls})
+
+    def test_reused(self):
+        """
+        A result younger than ``max_age`` is reused.
+        """
+        first = self.cache()
+        self.now = 4
+        self.assertEqual((first, 1), (self.cache(), self.calls))
+
+    def test_refreshed(self):
+        """
+        A result as old as ``max_age`` is looked up again.
+        """
+        self.cache()
+        self.now = 5
+        self.assertEqual((frozenset({2}), 2), (self.cache(), self.calls))
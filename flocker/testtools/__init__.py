@@ -61,17 +61,45 @@ REALISTIC_BLOCKDEVICE_SIZE = int(GiB(100).to_Byte().value)
 @implementer(IProcessTransport)
 class FakeProcessTransport(object):
     """
-    Mock process transport to observe signals sent to a process.
+    Mock process transport to observe signals sent to a process, data
+    written to its standard input and flow control.
 
     @ivar signals: L{list} of signals sent to process.
+    @ivar data: L{bytes} written to the standard input of the process.
+    @ivar stdin_closed: Whether the standard input of the process is closed.
+    @ivar producer: The producer registered for the standard input of the
+        process, or L{None}.
+    @ivar paused: Whether reading from the process is paused.
     """
 
     def __init__(self):
         self.signals = []
+        self.data = b""
+        self.stdin_closed = False
+        self.producer = None
+        self.paused = False
 
     def signalProcess(self, signal):
         self.signals.append(signal)
 
+    def write(self, data):
+        self.data += data
+
+    def closeStdin(self):
+        self.stdin_closed = True
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
 
 class SpawnProcessArguments(namedtuple(
                             'ProcessData',
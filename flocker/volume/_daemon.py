@@ -0,0 +1,435 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_daemon,flocker.volume.functional.test_daemon -*- # noqa
+
+"""
+Access to a node's running volume manager over a local UNIX socket.
+
+Pushing a volume over SSH runs ``flocker-volume`` on the destination for
+each step of the push (see ``RemoteVolumeManager``), and each run pays for
+starting a ``VolumeService``: reading its configuration and checking the
+ZFS pool.  The dataset agent already runs a ``VolumeService``, so it also
+serves it over AMP on a UNIX socket and ``flocker-volume`` forwards its
+subcommands there when it can (see ``flocker.volume.script``).  Other nodes
+reach the same operations directly over the TLS replication protocol (see
+``flocker.volume._replication``).
+
+The data stream of a ``receive`` is not copied over the socket: the file
+descriptor it is read from is passed to the volume manager, which reads it
+without blocking.
+"""
+
+import os
+from stat import S_ISFIFO, S_ISSOCK
+
+from twisted.application.internet import StreamServerEndpointService
+from twisted.internet.abstract import FileDescriptor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.endpoints import (
+    UNIXClientEndpoint, UNIXServerEndpoint, connectProtocol,
+)
+from twisted.internet.error import (
+    ConnectError, ConnectionAborted, ConnectionDone,
+)
+from twisted.internet.fdesc import readFromFD, setNonBlocking
+from twisted.internet.protocol import Factory
+from twisted.protocols.amp import (
+    AMP, Boolean, Command, Descriptor, ListOf, String, Unicode,
+)
+from twisted.protocols.basic import FileSender
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+
+from .service import Volume, VolumeName
+
+# The socket on which the dataset agent serves its volume manager.
+DEFAULT_SOCKET_PATH = FilePath(b"/var/run/flocker/volume.sock")
+
+
+class Identify(Command):
+    """
+    Get the node ID of the volume manager.
+    """
+    arguments = []
+    response = [("node_id", Unicode())]
+
+
+class Snapshots(Command):
+    """
+    List the snapshots of a volume, oldest first.
+    """
+    arguments = [("node_id", Unicode()), ("name", String())]
+    response = [("snapshots", ListOf(String()))]
+
+
+class ResumeToken(Command):
+    """
+    Get the token from which an interrupted receive of a volume can be
+    resumed, if there is one.
+    """
+    arguments = [("node_id", Unicode()), ("name", String())]
+    response = [("resume_token", String(optional=True))]
+
+
+class Receive(Command):
+    """
+    Receive a volume's data stream from a file descriptor, until it is
+    closed.
+    """
+    arguments = [("node_id", Unicode()), ("name", String()),
+                 ("resume", Boolean()), ("stream", Descriptor())]
+    response = []
+    errors = {ValueError: "VALUE_ERROR"}
+
+
+class Acquire(Command):
+    """
+    Take ownership of a volume previously owned by another volume manager.
+    """
+    arguments = [("node_id", Unicode()), ("name", String())]
+    response = [("node_id", Unicode())]
+    errors = {ValueError: "VALUE_ERROR"}
+
+
+class CloneTo(Command):
+    """
+    Clone a volume, creating a new one.
+    """
+    arguments = [("parent_node_id", Unicode()), ("parent_name", String()),
+                 ("name", String())]
+    response = []
+
+
+class _DescriptorReader(FileDescriptor):
+    """
+    Read a file descriptor into an ``IStreamReceiver`` until the end of the
+    file, without blocking.
+
+    The reader is registered as the receiver's producer, so it stops
+    reading while the receiver can't keep up.
+
+    :ivar result: A ``Deferred`` that fires with ``None`` once the whole
+        file was read and the receiver finished, or fails if reading or
+        finishing failed, in which case the receiver was aborted.
+    """
+    def __init__(self, reactor, fd, receiver):
+        """
+        :param reactor: The reactor to read with.
+        :param int fd: The file descriptor, which is closed afterwards.
+        :param IStreamReceiver receiver: Where to write what was read.
+        """
+        FileDescriptor.__init__(self, reactor)
+        self._fd = fd
+        self._receiver = receiver
+        self.result = Deferred()
+        setNonBlocking(fd)
+        receiver.registerProducer(self, True)
+        self.startReading()
+
+    def fileno(self):
+        return self._fd
+
+    def doRead(self):
+        return readFromFD(self._fd, self._receiver.write)
+
+    def stopProducing(self):
+        if not self.disconnected:
+            # What was read so far is not the whole stream.
+            self.stopReading()
+            self.connectionLost(Failure(ConnectionAborted()))
+
+    def connectionLost(self, reason):
+        FileDescriptor.connectionLost(self, reason)
+        os.close(self._fd)
+        self._receiver.unregisterProducer()
+        if reason.check(ConnectionDone):
+            finishing = self._receiver.finish()
+        else:
+            finishing = self._receiver.abort()
+            finishing.addCallback(lambda _: reason)
+        finishing.chainDeferred(self.result)
+
+
+def _pollable(fd):
+    """
+    Determine whether the reactor can wait for a file descriptor to become
+    readable.  Only pipes and sockets are relied on; ``epoll`` refuses
+    regular files, for example, which standard input may be redirected
+    from.
+
+    :param int fd: The file descriptor.
+
+    :return: ``True`` or ``False``.
+    """
+    mode = os.fstat(fd).st_mode
+    return S_ISFIFO(mode) or S_ISSOCK(mode)
+
+
+def _read_file(fd, receiver):
+    """
+    Read a file descriptor which can't be polled into an
+    ``IStreamReceiver`` until the end of the file.
+
+    Reading such a file doesn't wait for data to arrive, so it is read a
+    chunk at a time whenever the receiver asks for more.
+
+    :param int fd: The file descriptor, which is closed afterwards.
+    :param IStreamReceiver receiver: Where to write what was read.
+
+    :return: A ``Deferred`` like ``_DescriptorReader.result``.
+    """
+    stream = os.fdopen(fd, "rb")
+    reading = FileSender().beginFileTransfer(stream, receiver)
+
+    def read(_):
+        stream.close()
+        return receiver.finish()
+
+    def failed(reason):
+        stream.close()
+        aborting = receiver.abort()
+        aborting.addCallback(lambda _: reason)
+        return aborting
+    reading.addCallbacks(read, failed)
+    return reading
+
+
+class VolumeDaemonProtocol(AMP):
+    """
+    The server side of the protocol, serving a ``VolumeService``.
+
+    The responders are defined on the protocol rather than on a separate
+    locator since AMP can only receive ``Descriptor`` arguments that way.
+    """
+    def __init__(self, reactor, volume_service):
+        """
+        :param reactor: The reactor to read received data streams with.
+        :param VolumeService volume_service: The volume manager to serve.
+        """
+        AMP.__init__(self)
+        self._reactor = reactor
+        self._volume_service = volume_service
+
+    def _volume(self, node_id, name):
+        return Volume(node_id=node_id, name=VolumeName.from_bytes(name),
+                      service=self._volume_service)
+
+    @Identify.responder
+    def identify(self):
+        return {"node_id": self._volume_service.node_id}
+
+    @Snapshots.responder
+    def snapshots(self, node_id, name):
+        snapshots = self._volume(node_id, name).get_filesystem().snapshots()
+        snapshots.addCallback(lambda snapshots: {
+            "snapshots": [snapshot.name for snapshot in snapshots]})
+        return snapshots
+
+    @ResumeToken.responder
+    def resume_token(self, node_id, name):
+        resume_token = self._volume(
+            node_id, name).get_filesystem().resume_token()
+        resume_token.addCallback(
+            lambda resume_token: {"resume_token": resume_token})
+        return resume_token
+
+    @Receive.responder
+    def receive(self, node_id, name, resume, stream):
+        receiving = self._volume_service.receiver(
+            node_id, VolumeName.from_bytes(name), resume=resume)
+
+        def failed(reason):
+            os.close(stream)
+            return reason
+
+        def got_receiver(receiver):
+            try:
+                if _pollable(stream):
+                    return _DescriptorReader(
+                        self._reactor, stream, receiver).result
+                return _read_file(stream, receiver)
+            except Exception:
+                # Nothing is reading the stream, so nothing else will close
+                # it or abort the receiver.
+                reason = Failure()
+                try:
+                    os.close(stream)
+                except OSError:
+                    pass
+                aborting = receiver.abort()
+                aborting.addCallback(lambda _: reason)
+                return aborting
+        receiving.addCallbacks(got_receiver, failed)
+        receiving.addCallback(lambda _: {})
+        return receiving
+
+    @Acquire.responder
+    def acquire(self, node_id, name):
+        acquiring = self._volume_service.acquire(
+            node_id, VolumeName.from_bytes(name))
+        acquiring.addCallback(
+            lambda _: {"node_id": self._volume_service.node_id})
+        return acquiring
+
+    @CloneTo.responder
+    def clone_to(self, parent_node_id, parent_name, name):
+        cloning = self._volume_service.clone_to(
+            self._volume(parent_node_id, parent_name),
+            VolumeName.from_bytes(name))
+        cloning.addCallback(lambda _: {})
+        return cloning
+
+
+class _VolumeDaemonService(StreamServerEndpointService):
+    """
+    A ``StreamServerEndpointService`` which creates the directory of its
+    UNIX socket.
+
+    :ivar FilePath socket_path: The UNIX socket listened on.
+    """
+    def __init__(self, socket_path, endpoint, factory):
+        StreamServerEndpointService.__init__(self, endpoint, factory)
+        self.socket_path = socket_path
+
+    def startService(self):
+        parent = self.socket_path.parent()
+        if not parent.exists():
+            parent.makedirs()
+        StreamServerEndpointService.startService(self)
+
+
+def volume_daemon(reactor, volume_service, socket_path=DEFAULT_SOCKET_PATH):
+    """
+    Create a service which serves a volume manager on a UNIX socket.
+
+    :param reactor: The reactor to use.
+    :param VolumeService volume_service: The volume manager to serve.
+    :param FilePath socket_path: The UNIX socket to listen on.  Only its
+        owner can connect to it.
+
+    :return: An ``IService`` provider which listens while it is running.
+    """
+    endpoint = UNIXServerEndpoint(
+        reactor, socket_path.path, mode=0o600, wantPID=True)
+    factory = Factory.forProtocol(
+        lambda: VolumeDaemonProtocol(reactor, volume_service))
+    return _VolumeDaemonService(socket_path, endpoint, factory)
+
+
+class VolumeDaemonClient(object):
+    """
+    A connection to the volume manager served by ``volume_daemon``.
+    """
+    def __init__(self, protocol):
+        """
+        :param AMP protocol: The connected protocol.
+        """
+        self._protocol = protocol
+
+    def identify(self):
+        """
+        :return: A ``Deferred`` that fires with the ``unicode`` node ID of
+            the volume manager.
+        """
+        d = self._protocol.callRemote(Identify)
+        d.addCallback(lambda response: response["node_id"])
+        return d
+
+    def snapshots(self, node_id, name):
+        """
+        :param unicode node_id: The node ID of the volume's owner.
+        :param VolumeName name: The name of the volume.
+
+        :return: A ``Deferred`` that fires with a ``list`` of ``bytes``
+            snapshot names, oldest first.
+        """
+        d = self._protocol.callRemote(
+            Snapshots, node_id=node_id, name=name.to_bytes())
+        d.addCallback(lambda response: response["snapshots"])
+        return d
+
+    def resume_token(self, node_id, name):
+        """
+        :param unicode node_id: The node ID of the volume's owner.
+        :param VolumeName name: The name of the volume.
+
+        :return: A ``Deferred`` that fires with the resume token as
+            ``bytes``, or ``None``.
+        """
+        d = self._protocol.callRemote(
+            ResumeToken, node_id=node_id, name=name.to_bytes())
+        d.addCallback(lambda response: response.get("resume_token"))
+        return d
+
+    def receive(self, node_id, name, input_file, resume=False):
+        """
+        :param unicode node_id: The node ID of the volume's owner.
+        :param VolumeName name: The name of the volume.
+        :param input_file: A file-like object with a ``fileno`` from which
+            the volume manager reads the data stream.
+        :param bool resume: See ``VolumeService.receive``.
+
+        :return: A ``Deferred`` that fires when the whole stream was
+            received.
+        """
+        d = self._protocol.callRemote(
+            Receive, node_id=node_id, name=name.to_bytes(), resume=resume,
+            stream=input_file.fileno())
+        d.addCallback(lambda _: None)
+        return d
+
+    def acquire(self, node_id, name):
+        """
+        :param unicode node_id: The node ID of the volume's owner.
+        :param VolumeName name: The name of the volume.
+
+        :return: A ``Deferred`` that fires with the ``unicode`` node ID of
+            the volume manager once it owns the volume.
+        """
+        d = self._protocol.callRemote(
+            Acquire, node_id=node_id, name=name.to_bytes())
+        d.addCallback(lambda response: response["node_id"])
+        return d
+
+    def clone_to(self, parent_node_id, parent_name, name):
+        """
+        :param unicode parent_node_id: The node ID of the parent volume's
+            owner.
+        :param VolumeName parent_name: The name of the parent volume.
+        :param VolumeName name: The name of the new volume.
+
+        :return: A ``Deferred`` that fires when the clone exists.
+        """
+        d = self._protocol.callRemote(
+            CloneTo, parent_node_id=parent_node_id,
+            parent_name=parent_name.to_bytes(), name=name.to_bytes())
+        d.addCallback(lambda _: None)
+        return d
+
+    def close(self):
+        """
+        Disconnect.
+        """
+        self._protocol.transport.loseConnection()
+
+
+def connect_to_daemon(reactor, socket_path=DEFAULT_SOCKET_PATH):
+    """
+    Connect to the volume manager served by ``volume_daemon``, if it is
+    running.
+
+    :param reactor: The reactor to connect with.
+    :param FilePath socket_path: The UNIX socket it listens on.
+
+    :return: A ``Deferred`` that fires with a ``VolumeDaemonClient``, or
+        with ``None`` if nothing is listening.
+    """
+    if not socket_path.exists():
+        return succeed(None)
+    connecting = connectProtocol(
+        UNIXClientEndpoint(reactor, socket_path.path), AMP())
+
+    def failed(reason):
+        reason.trap(ConnectError)
+        return None
+    connecting.addCallbacks(VolumeDaemonClient, failed)
+    return connecting
@@ -10,18 +10,18 @@ well-specified communication protocol between daemon processes using
 Twisted's event loop (https://clusterhq.atlassian.net/browse/FLOC-154).
 """
 
-from contextlib import contextmanager
-from io import BytesIO
-
 from characteristic import with_cmp
 
 from zope.interface import Interface, implementer
 
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import ProcessProtocol
 from twisted.python.filepath import FilePath
 
 from ..common._ipc import ProcessNode
-from .service import DEFAULT_CONFIG_PATH
+from .service import DEFAULT_CONFIG_PATH, Volume
+from .filesystems.interfaces import IStreamReceiver
 from .filesystems.zfs import Snapshot
 
 
@@ -60,16 +60,32 @@ class IRemoteVolumeManager(Interface):
             ordered from oldest to newest.
         """
 
-    def receive(volume):
+    def resume_token(volume):
+        """
+        Retrieve the token from which an interrupted push of the given volume
+        can be resumed.
+
+        :param Volume volume: The volume being pushed.
+
+        :return: A ``Deferred`` that fires with the token as ``bytes``, or
+            with ``None`` if there is no interrupted push to resume.
+        """
+
+    def receiver(volume, resume=False):
         """
-        Context manager that returns a file-like object to which a volume's
-        contents can be written.
+        Prepare the remote volume manager to receive a volume's contents.
 
         :param Volume volume: The volume which will be pushed to the
             remote volume manager.
 
-        :return: A file-like object that can be written to, which will
-             update the volume on the remote volume manager.
+        :param bool resume: ``True`` if the data written is the rest of an
+            interrupted push, generated from the token returned by
+            ``resume_token``.
+
+        :return: A ``Deferred`` that fires with an ``IStreamReceiver``
+             provider which, when written to with the output of
+             ``IFilesystem.send`` and finished, updates the volume on the
+             remote volume manager.
         """
 
     def acquire(volume):
@@ -79,7 +95,8 @@ class IRemoteVolumeManager(Interface):
         :param Volume volume: The volume which will be acquired by the
             remote volume manager.
 
-        :return: The node ID of the remote volume manager (as ``unicode``).
+        :return: A ``Deferred`` that fires with the node ID of the remote
+            volume manager (as ``unicode``).
         """
 
     def clone_to(parent, name):
@@ -94,21 +111,81 @@ class IRemoteVolumeManager(Interface):
         """
 
 
+@implementer(IStreamReceiver)
+class _ProcessReceiver(ProcessProtocol):
+    """
+    Write a data stream to the standard input of a remote
+    ``flocker-volume receive`` without blocking.
+
+    Producers registered with this consumer are registered with the standard
+    input of the process, which pauses them while the pipe is full.
+
+    :ivar _remote_command: The command, to report if it fails.
+    :ivar _ended: A ``Deferred`` that fires when the process ends.
+    """
+    # The remote ``flocker-volume`` may not accept compressed streams.
+    compressed = False
+
+    def __init__(self, remote_command):
+        self._remote_command = remote_command
+        self._ended = Deferred()
+
+    def processEnded(self, reason):
+        if reason.check(ProcessDone):
+            self._ended.callback(None)
+        else:
+            # Like ``ProcessNode.run``:
+            self._ended.errback(IOError(
+                "Bad exit", self._remote_command,
+                getattr(reason.value, "exitCode", None)))
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def registerProducer(self, producer, streaming):
+        self.transport.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self.transport.unregisterProducer()
+
+    def finish(self):
+        self.transport.closeStdin()
+        return self._ended
+
+    def abort(self):
+        # A truncated stream makes the remote ``flocker-volume receive``
+        # fail, keeping what it received so far if it can.
+        self.transport.closeStdin()
+        d = self._ended
+        d.addErrback(lambda reason: reason.trap(IOError))
+        d.addCallback(lambda _: None)
+        return d
+
+
 @implementer(IRemoteVolumeManager)
 @with_cmp(["_destination", "_config_path"])
 class RemoteVolumeManager(object):
     """
     ``INode``\-based communication with a remote volume manager.
+
+    Data streams are written to the remote ``flocker-volume`` through the
+    reactor.  The other commands are short and still run synchronously.
     """
 
-    def __init__(self, destination, config_path=DEFAULT_CONFIG_PATH):
+    def __init__(self, destination, config_path=DEFAULT_CONFIG_PATH,
+                 reactor=None):
         """
         :param Node destination: The node to push to.
         :param FilePath config_path: Path to configuration file for the
             remote ``flocker-volume``.
+        :param reactor: The ``IReactorProcess`` provider to run
+            ``flocker-volume receive`` with.
         """
         self._destination = destination
         self._config_path = config_path
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
 
     def snapshots(self, volume):
         """
@@ -128,20 +205,49 @@ class RemoteVolumeManager(object):
             in data.splitlines()
         ])
 
-    def receive(self, volume):
-        return self._destination.run([b"flocker-volume",
-                                      b"--config", self._config_path.path,
-                                      b"receive",
-                                      volume.node_id.encode(b"ascii"),
-                                      volume.name.to_bytes()])
+    def resume_token(self, volume):
+        """
+        Run ``flocker-volume resume_token`` on the destination.
+
+        If that fails, for example because the destination's
+        ``flocker-volume`` predates the sub-command, there is no interrupted
+        push to resume as far as this node can tell, so a complete push is
+        made as before.
+        """
+        try:
+            data = self._destination.get_output(
+                [b"flocker-volume",
+                 b"--config", self._config_path.path,
+                 b"resume_token",
+                 volume.node_id.encode("ascii"),
+                 volume.name.to_bytes()]
+            )
+        except IOError:
+            return succeed(None)
+        return succeed(data.strip() or None)
+
+    def receiver(self, volume, resume=False):
+        """
+        Run ``flocker-volume receive`` on the destination, writing to it
+        without blocking.
+        """
+        remote_command = ([b"flocker-volume",
+                           b"--config", self._config_path.path,
+                           b"receive"] +
+                          ([b"--resume"] if resume else []) +
+                          [volume.node_id.encode(b"ascii"),
+                           volume.name.to_bytes()])
+        protocol = _ProcessReceiver(remote_command)
+        self._destination.spawn(self._reactor, protocol, remote_command)
+        return succeed(protocol)
 
     def acquire(self, volume):
-        return self._destination.get_output(
+        return succeed(self._destination.get_output(
             [b"flocker-volume",
              b"--config", self._config_path.path,
              b"acquire",
              volume.node_id.encode(b"ascii"),
-             volume.name.to_bytes()]).decode("ascii")
+             volume.name.to_bytes()]).decode("ascii"))
 
     def clone_to(self, parent, name):
         return self._destination.get_output(
@@ -171,16 +277,22 @@ class LocalVolumeManager(object):
         """
         return volume.get_filesystem().snapshots()
 
-    @contextmanager
-    def receive(self, volume):
-        input_file = BytesIO()
-        yield input_file
-        input_file.seek(0, 0)
-        self._service.receive(volume.node_id, volume.name, input_file)
+    def resume_token(self, volume):
+        """
+        Interrogate the service's copy of the volume for its resume token.
+        """
+        copy = Volume(
+            node_id=volume.node_id, name=volume.name, service=self._service)
+        return copy.get_filesystem().resume_token()
+
+    def receiver(self, volume, resume=False):
+        return self._service.receiver(
+            volume.node_id, volume.name, resume=resume)
 
     def acquire(self, volume):
-        self._service.acquire(volume.node_id, volume.name)
-        return self._service.node_id
+        acquiring = self._service.acquire(volume.node_id, volume.name)
+        acquiring.addCallback(lambda _: self._service.node_id)
+        return acquiring
 
     def clone_to(self, parent, name):
         return self._service.clone_to(parent, name)
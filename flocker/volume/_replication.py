@@ -0,0 +1,1047 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_replication,flocker.volume.functional.test_replication -*- # noqa
+
+"""
+Dataset replication between node agents over TLS.
+
+This replaces running ``flocker-volume`` over SSH on the destination node
+for each step of a push (see ``RemoteVolumeManager``).  Instead each dataset
+agent runs a long-lived replication server, authenticated with the cluster
+certificate authority, and a pushing node holds a single session with it
+for snapshot negotiation, the ``zfs send`` stream and the ownership
+transfer.
+
+Each message on a session is a frame: a four byte big-endian length followed
+by that many bytes.  A request is a frame containing a JSON object with a
+``command`` key.  The server answers each request with a single frame
+containing a JSON object, which has an ``error`` key if the request failed.
+A ``receive`` request is followed by frames containing the data stream,
+terminated by an empty frame, before the server answers it.  If the session
+breaks before then, the data received so far is kept so that the next push
+can resume from it (see ``IRemoteVolumeManager.resume_token``).
+
+A client can ask which optional features the server supports with a
+``hello`` request; servers which predate it answer with an error.  Three
+features affect ``receive``:
+
+* ``zlib``: the data frames may be compressed.  Each frame then starts with
+  a byte saying whether the rest of it is zlib compressed or not, so that
+  frames which do not compress well can be sent as they are.
+* ``stripes``: the stream may be split across several sessions, to make
+  better use of links on which a single TCP connection can't.  The other
+  sessions each send a ``join`` request for the transfer and then their
+  share of the data frames (see ``_Transfer``).
+* ``zfs-compressed``: the server's storage pool accepts ZFS streams whose
+  blocks are sent compressed as they are stored (``zfs send -c``).  Older
+  versions of ZFS can't receive those, so it is only advertised if the
+  server's can.
+
+Neither end blocks: the stream is passed between the ``zfs`` processes and
+the connection by the reactor, and each side stops reading while the other
+can't keep up.
+"""
+
+from json import dumps, loads
+from uuid import uuid4
+from zlib import compress, decompress
+
+from characteristic import with_cmp
+
+from eliot import Field, Logger, MessageType
+
+from zope.interface import implementer
+
+from twisted.application.internet import SSLServer
+from twisted.internet.defer import Deferred, gatherResults, succeed
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.endpoints import SSL4ClientEndpoint, connectProtocol
+from twisted.internet.protocol import ServerFactory
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.protocols.policies import TimeoutMixin
+
+from ._ipc import IRemoteVolumeManager
+from .filesystems.interfaces import IStreamReceiver
+from .filesystems.zfs import Snapshot
+from .service import Volume, VolumeName
+
+# The port on which dataset agents listen for replication sessions.
+REPLICATION_PORT = 4525
+
+# The largest frame of the data stream.  Frames are decrypted into memory
+# anyway so there is nothing to gain from larger ones.
+_CHUNK_SIZE = 1024 * 1024
+
+# The number of seconds a client keeps an idle session open, in case it is
+# about to be used again.
+_IDLE_TIMEOUT = 30
+
+# The optional features every server supports, see ``hello``.
+_FEATURES = [u"zlib", u"stripes"]
+
+# The largest number of stripes a transfer can be split across.
+_MAX_STRIPES = 16
+
+# The number of data frames a stripe can get ahead of the others by before
+# the server stops reading it.
+_MAX_QUEUED_CHUNKS = 4
+
+# The first byte of a data frame of a compressed stream.
+_ZLIB_FRAME = b"z"
+_RAW_FRAME = b"r"
+
+# zlib's fastest level; anything slower would limit the transfer rate.
+_COMPRESSION_LEVEL = 1
+
+# A frame is only sent compressed if that makes it at least this much
+# smaller, and after one which isn't this many frames are sent as they are
+# before trying again.  Streams of ``zfs send -c`` are mostly already
+# compressed.
+_WORTHWHILE_RATIO = 0.9
+_INCOMPRESSIBLE_SKIP = 16
+
+_logger = Logger()
+
+TRANSFER = MessageType(
+    u"volume:replication:transfer",
+    [Field.forTypes(u"name", [unicode], u"The name of the volume."),
+     Field.forTypes(u"streams", [int], u"The number of stripes."),
+     Field.forTypes(u"compression", [unicode, None],
+                    u"The compression of the data frames, if any."),
+     Field.forTypes(u"raw_bytes", [int, long],
+                    u"The size of the data stream."),
+     Field.forTypes(u"wire_bytes", [int, long],
+                    u"The size of the data frames which were sent."),
+     Field.forTypes(u"seconds", [float],
+                    u"The time from the start of the transfer until the "
+                    u"destination finished receiving it."),
+     Field.forTypes(u"throughput", [float],
+                    u"The size of the data stream divided by the time."),
+     Field.forTypes(u"compression_ratio", [float],
+                    u"The size of the data stream divided by the size of "
+                    u"the data frames.")],
+    u"A data stream was sent to another node.")
+
+
+class ReplicationError(Exception):
+    """
+    The replication server failed to carry out a request.
+    """
+
+
+def _decode_chunk(chunk, compression):
+    """
+    Decode a data frame of a stream.
+
+    :param bytes chunk: The frame.
+    :param compression: ``None`` if the stream is not compressed, otherwise
+        ``u"zlib"``.
+
+    :return bytes: The data.
+    """
+    if compression is None:
+        return chunk
+    kind, data = chunk[:1], chunk[1:]
+    if kind == _ZLIB_FRAME:
+        return decompress(data)
+    if kind == _RAW_FRAME:
+        return data
+    raise ValueError("Unknown frame type", kind)
+
+
+@implementer(IPushProducer)
+class _Transfer(object):
+    """
+    The receiving side of a data stream, which may be striped across
+    several sessions.
+
+    Data frame ``k`` of the stream is sent on stripe ``k % stripes``, where
+    stripe 0 is the session of the ``receive`` request and the others are
+    sessions which sent a ``join`` request for the transfer.  The stream is
+    reassembled by taking the next frame from each stripe in turn.  A stripe
+    which gets ahead of the others stops being read until they catch up.
+    The stream ends once every stripe has sent an empty frame, and then the
+    request on each stripe is answered.
+
+    The transfer is the producer of its ``IStreamReceiver``, so all stripes
+    stop being read while the receiver can't keep up.
+
+    :ivar _protocols: A ``dict`` mapping stripe indexes to the
+        ``ReplicationProtocol`` of each stripe which is still connected and
+        waiting for its answer.
+    :ivar _queues: A ``dict`` mapping stripe indexes to ``list`` of frames
+        which arrived before they could be written.
+    :ivar _ended: The ``set`` of indexes of stripes which sent their empty
+        frame.
+    :ivar _stripes: ``None`` until the ``receive`` request arrives, then the
+        number of stripes.
+    :ivar _receiver: The ``IStreamReceiver``, once it is ready.
+    :ivar _result: ``None``, or the answer if the receiver could not be
+        created, in which case the stream is read and discarded.
+    :ivar _next: The index of the stripe with the next frame.
+    :ivar bool _receiver_paused: Whether the receiver paused the transfer.
+    :ivar bool _finishing: Whether the stream ended and the receiver is
+        finishing.
+    :ivar bool _done: Whether the transfer is over, successfully or not.
+    """
+    def __init__(self, transfers, key):
+        """
+        :param dict transfers: The transfers in progress on the server, by
+            key.
+        :param key: The key of this transfer in ``transfers``.
+        """
+        self._transfers = transfers
+        self._key = key
+        self._protocols = {}
+        self._queues = {}
+        self._ended = set()
+        self._stripes = None
+        self._compression = None
+        self._receiver = None
+        self._result = None
+        self._next = 0
+        self._receiver_paused = False
+        self._finishing = False
+        self._done = False
+
+    def start(self, receiving, stripes, compression):
+        """
+        Start writing the stream to a receiver.
+
+        :param Deferred receiving: Fires with the ``IStreamReceiver``.
+        :param int stripes: The number of stripes.
+        :param compression: ``None`` or ``u"zlib"``, see ``_decode_chunk``.
+        """
+        self._stripes = stripes
+        self._compression = compression
+        receiving.addCallbacks(
+            self._receiver_ready,
+            lambda reason: self._receive_failed(
+                {u"error": repr(reason.value)}))
+
+    def join(self, index, protocol):
+        """
+        Add a stripe to the transfer.
+
+        :param int index: The index of the stripe.
+        :param ReplicationProtocol protocol: The stripe's session.
+        """
+        self._protocols[index] = protocol
+        self._queues.setdefault(index, [])
+        self._update(index)
+
+    def _receiver_ready(self, receiver):
+        if self._done:
+            receiver.abort()
+            return
+        self._receiver = receiver
+        receiver.registerProducer(self, True)
+        self._drain()
+
+    def _receive_failed(self, result):
+        if self._done:
+            return
+        self._result = result
+        for index in list(self._protocols):
+            self._queues[index] = []
+            self._update(index)
+            if index in self._ended:
+                self._answer(index, result)
+
+    def chunk_received(self, index, chunk):
+        """
+        A frame arrived on a stripe.
+
+        :param int index: The index of the stripe.
+        :param bytes chunk: The frame.
+        """
+        if not chunk:
+            self._ended.add(index)
+            if self._result is not None:
+                self._answer(index, self._result)
+                return
+        elif self._result is None:
+            self._queues[index].append(chunk)
+        self._drain()
+
+    def _drain(self):
+        """
+        Write the frames which arrived to the receiver, in stream order, and
+        then pause or resume reading the stripes accordingly.
+        """
+        if self._receiver is not None and not self._finishing:
+            while True:
+                queue = self._queues.get(self._next)
+                if not queue:
+                    break
+                self._receiver.write(
+                    _decode_chunk(queue.pop(0), self._compression))
+                self._next = (self._next + 1) % self._stripes
+            if len(self._ended) == self._stripes:
+                self._finish()
+        self._update_all()
+
+    def _finish(self):
+        self._finishing = True
+        self._receiver.unregisterProducer()
+        finishing = self._receiver.finish()
+        finishing.addCallbacks(
+            lambda _: {}, lambda reason: {u"error": repr(reason.value)})
+        finishing.addCallback(self._finished)
+
+    @property
+    def started(self):
+        """
+        Whether the ``receive`` request of the transfer arrived.
+        """
+        return self._stripes is not None
+
+    def _finished(self, result):
+        self._done = True
+        self._transfers.pop(self._key, None)
+        for index in list(self._protocols):
+            self._answer(index, result)
+
+    def _answer(self, index, result):
+        """
+        Answer the request of a stripe which sent its empty frame.
+        """
+        protocol = self._protocols.pop(index)
+        if len(self._ended) == self._stripes and not self._protocols:
+            self._done = True
+            self._transfers.pop(self._key, None)
+        protocol.transfer_finished(result)
+
+    def _update(self, index):
+        """
+        Pause or resume reading a stripe as appropriate.
+        """
+        protocol = self._protocols.get(index)
+        if protocol is None:
+            return
+        if self._result is not None:
+            paused = False
+        else:
+            paused = (
+                self._receiver is None or self._receiver_paused
+                or self._finishing or index in self._ended
+                or len(self._queues[index]) >= _MAX_QUEUED_CHUNKS)
+        if paused:
+            protocol.pause()
+        else:
+            protocol.resume()
+
+    def _update_all(self):
+        for index in list(self._protocols):
+            self._update(index)
+
+    def stripe_lost(self, index):
+        """
+        The session of a stripe was lost.
+
+        Unless the stream already ended the transfer fails: the receiver is
+        aborted, keeping what was received so far so that the push can be
+        resumed, and the other stripes are disconnected.
+
+        :param int index: The index of the stripe.
+        """
+        self._protocols.pop(index, None)
+        if self._done or self._finishing:
+            return
+        self._done = True
+        self._transfers.pop(self._key, None)
+        if self._receiver is not None:
+            self._receiver.unregisterProducer()
+            self._receiver.abort()
+        for protocol in self._protocols.values():
+            protocol.transport.loseConnection()
+        self._protocols.clear()
+
+    def pauseProducing(self):
+        self._receiver_paused = True
+        self._update_all()
+
+    def resumeProducing(self):
+        self._receiver_paused = False
+        self._update_all()
+
+    def stopProducing(self):
+        for protocol in self._protocols.values():
+            protocol.transport.loseConnection()
+
+
+class ReplicationProtocol(Int32StringReceiver):
+    """
+    The server side of a replication session.
+
+    :ivar _transfers: The ``dict`` of ``_Transfer`` instances in progress on
+        the server, shared by its sessions so that stripes can find the
+        transfer they belong to.
+    :ivar _transfer: ``None``, or while a ``receive`` or ``join`` request is
+        in progress the ``_Transfer`` data frames belong to.
+    :ivar _stripe: The index of this session's stripe of ``_transfer``.
+    """
+    MAX_LENGTH = _CHUNK_SIZE + 1024
+
+    def __init__(self, reactor, volume_service, transfers=None):
+        self._reactor = reactor
+        self._volume_service = volume_service
+        if transfers is None:
+            transfers = {}
+        self._transfers = transfers
+        self._transfer = None
+        self._stripe = None
+        self._paused = False
+
+    def stringReceived(self, string):
+        if self._transfer is not None:
+            self._transfer.chunk_received(self._stripe, string)
+            return
+        try:
+            request = loads(string)
+            handler = getattr(self, "_command_" + request.pop("command"))
+            result = handler(**request)
+        except Exception as e:
+            self._respond({u"error": repr(e)})
+            return
+        if result is not None:
+            result.addCallbacks(
+                self._respond,
+                lambda reason: self._respond(
+                    {u"error": repr(reason.value)}))
+
+    def _respond(self, response):
+        self.sendString(dumps(response))
+
+    def _volume(self, node_id, name):
+        return Volume(
+            node_id=node_id, name=VolumeName.from_bytes(name.encode("ascii")),
+            service=self._volume_service)
+
+    def _command_hello(self):
+        d = self._volume_service.pool.compressed_streams()
+        d.addCallback(lambda compressed: {
+            u"features": _FEATURES + ([u"zfs-compressed"] if compressed
+                                      else [])})
+        return d
+
+    def _command_snapshots(self, node_id, name):
+        snapshots = self._volume(node_id, name).get_filesystem().snapshots()
+        snapshots.addCallback(
+            lambda snapshots: {u"snapshots": [
+                snapshot.name.decode("ascii") for snapshot in snapshots]})
+        return snapshots
+
+    def _command_resume_token(self, node_id, name):
+        resume_token = self._volume(
+            node_id, name).get_filesystem().resume_token()
+        resume_token.addCallback(
+            lambda resume_token: {u"resume_token": (
+                None if resume_token is None
+                else resume_token.decode("ascii"))})
+        return resume_token
+
+    def _command_acquire(self, node_id, name):
+        acquiring = self._volume_service.acquire(
+            node_id, VolumeName.from_bytes(name.encode("ascii")))
+        acquiring.addCallback(
+            lambda _: {u"node_id": self._volume_service.node_id})
+        return acquiring
+
+    def _command_clone_to(self, parent_node_id, parent_name, name):
+        cloning = self._volume_service.clone_to(
+            self._volume(parent_node_id, parent_name),
+            VolumeName.from_bytes(name.encode("ascii")))
+        cloning.addCallback(lambda _: {})
+        return cloning
+
+    def _command_receive(self, node_id, name, resume=False,
+                         compression=None, stripes=1, transfer=None):
+        if compression not in (None, u"zlib"):
+            raise ValueError("Unsupported compression", compression)
+        if not 1 <= stripes <= _MAX_STRIPES:
+            raise ValueError("Unsupported number of stripes", stripes)
+        if stripes > 1 and transfer is None:
+            raise ValueError("Striped transfers must be identified")
+        if transfer is None:
+            # Nothing else will look for it.
+            transfer = object()
+        if transfer in self._transfers and self._transfers[transfer].started:
+            raise ValueError("Transfer already started", transfer)
+        self._join(transfer, 0)
+        self._transfer.start(
+            self._volume_service.receiver(
+                node_id, VolumeName.from_bytes(name.encode("ascii")),
+                resume=resume),
+            stripes, compression)
+        return None
+
+    def _command_join(self, transfer, index):
+        if not 1 <= index < _MAX_STRIPES:
+            raise ValueError("Invalid stripe", index)
+        self._join(transfer, index)
+        return None
+
+    def _join(self, key, index):
+        transfer = self._transfers.get(key)
+        if transfer is None:
+            transfer = self._transfers[key] = _Transfer(self._transfers, key)
+        self._transfer = transfer
+        self._stripe = index
+        transfer.join(index, self)
+
+    def transfer_finished(self, result):
+        """
+        Answer the ``receive`` or ``join`` request once the transfer is
+        over.
+
+        :param dict result: The answer.
+        """
+        self._transfer = None
+        self._stripe = None
+        self._respond(result)
+        self.resume()
+
+    def pause(self):
+        """
+        Stop reading from the session.
+        """
+        if not self._paused:
+            self._paused = True
+            self.transport.pauseProducing()
+
+    def resume(self):
+        """
+        Resume reading from the session.
+        """
+        if self._paused:
+            self._paused = False
+            self.transport.resumeProducing()
+
+    def connectionLost(self, reason):
+        transfer, self._transfer = self._transfer, None
+        if transfer is not None:
+            transfer.stripe_lost(self._stripe)
+
+
+class ReplicationServerFactory(ServerFactory):
+    """
+    Create ``ReplicationProtocol`` instances serving a ``VolumeService``.
+    """
+    def __init__(self, reactor, volume_service):
+        self._reactor = reactor
+        self._volume_service = volume_service
+        self._transfers = {}
+
+    def buildProtocol(self, addr):
+        return ReplicationProtocol(
+            self._reactor, self._volume_service, self._transfers)
+
+
+def replication_server(reactor, volume_service, context_factory,
+                       port=REPLICATION_PORT):
+    """
+    Create a service which accepts replication sessions from other nodes.
+
+    :param reactor: The reactor to use.
+    :param VolumeService volume_service: The volume manager for this node.
+    :param context_factory: The TLS context factory which authenticates
+        other nodes, see ``flocker.ca.replication_context_factory``.
+    :param int port: The TCP port to listen on.
+
+    :return: An ``IService`` provider which listens while it is running.
+    """
+    return SSLServer(
+        port, ReplicationServerFactory(reactor, volume_service),
+        context_factory, reactor=reactor)
+
+
+class ReplicationClientProtocol(Int32StringReceiver, TimeoutMixin):
+    """
+    The client side of a replication session.
+
+    The server answers requests in the order they were made.  The session
+    is closed once it has been idle for ``_IDLE_TIMEOUT`` seconds.
+
+    :ivar _waiting: The ``Deferred`` instances of the requests which have
+        not been answered yet, oldest first.
+    :ivar _closed: ``Deferred`` instances waiting for the connection to be
+        lost.
+    """
+    MAX_LENGTH = _CHUNK_SIZE + 1024
+
+    def __init__(self, reactor):
+        self.callLater = reactor.callLater
+        self._waiting = []
+        self._closed = []
+
+    def connectionMade(self):
+        self.setTimeout(_IDLE_TIMEOUT)
+
+    def request(self, command, **arguments):
+        """
+        Make a request.
+
+        :param unicode command: The request's command.
+        :param arguments: The request's arguments.
+
+        :return: A ``Deferred`` that fires with the decoded response, or
+            errbacks with ``ReplicationError`` if the request failed.
+        """
+        self.setTimeout(None)
+        arguments[u"command"] = command
+        self.sendString(dumps(arguments))
+        result = Deferred()
+        self._waiting.append(result)
+        return result
+
+    def stringReceived(self, string):
+        response = loads(string)
+        result = self._waiting.pop(0)
+        if not self._waiting:
+            self.setTimeout(_IDLE_TIMEOUT)
+        if u"error" in response:
+            result.errback(ReplicationError(response[u"error"]))
+        else:
+            result.callback(response)
+
+    def timeoutConnection(self):
+        self.transport.loseConnection()
+
+    def when_closed(self):
+        """
+        :return: A ``Deferred`` that fires when the connection is lost.
+        """
+        result = Deferred()
+        self._closed.append(result)
+        return result
+
+    def connectionLost(self, reason):
+        self.setTimeout(None)
+        waiting, self._waiting = self._waiting, []
+        for result in waiting:
+            result.errback(ReplicationError(repr(reason.value)))
+        closed, self._closed = self._closed, []
+        for result in closed:
+            result.callback(None)
+
+
+class _Compressor(object):
+    """
+    Encode the data frames of a ``zlib`` compressed stream.
+
+    Each frame is compressed on its own, so that frames can be decoded in
+    any order.
+
+    :ivar _skip: The number of frames to send uncompressed before trying to
+        compress one again.
+    """
+    def __init__(self):
+        self._skip = 0
+
+    def encode(self, chunk):
+        """
+        :param bytes chunk: Some data.
+
+        :return bytes: A data frame, see ``_decode_chunk``.
+        """
+        if self._skip:
+            self._skip -= 1
+            return _RAW_FRAME + chunk
+        compressed = compress(chunk, _COMPRESSION_LEVEL)
+        if len(compressed) > len(chunk) * _WORTHWHILE_RATIO:
+            self._skip = _INCOMPRESSIBLE_SKIP
+            return _RAW_FRAME + chunk
+        return _ZLIB_FRAME + compressed
+
+
+@implementer(IPushProducer)
+class _StripeFlowControl(object):
+    """
+    Pause a streaming producer while any of the stripes it writes to can't
+    keep up.
+
+    :ivar _producer: The producer.
+    :ivar _paused: The ``set`` of indexes of the stripes which paused it.
+    """
+    def __init__(self, producer, transports):
+        """
+        :param producer: The streaming producer.
+        :param list transports: The transports of the stripes.  A
+            ``_StripeProducer`` is registered with each of them.
+        """
+        self._producer = producer
+        self._paused = set()
+        for index, transport in enumerate(transports):
+            transport.registerProducer(_StripeProducer(self, index), True)
+
+    def pause(self, index):
+        if not self._paused:
+            self._producer.pauseProducing()
+        self._paused.add(index)
+
+    def resume(self, index):
+        self._paused.discard(index)
+        if not self._paused:
+            self._producer.resumeProducing()
+
+    def stop(self):
+        self._producer.stopProducing()
+
+
+@implementer(IPushProducer)
+class _StripeProducer(object):
+    """
+    The producer registered with the transport of one stripe on behalf of a
+    ``_StripeFlowControl``.
+    """
+    def __init__(self, flow_control, index):
+        self._flow_control = flow_control
+        self._index = index
+
+    def pauseProducing(self):
+        self._flow_control.pause(self._index)
+
+    def resumeProducing(self):
+        self._flow_control.resume(self._index)
+
+    def stopProducing(self):
+        self._flow_control.stop()
+
+
+@implementer(IStreamReceiver)
+class _StreamSender(object):
+    """
+    An ``IStreamReceiver`` which sends everything written to it as the data
+    frames of a ``receive`` request, striped across the given sessions.
+
+    Writes are collected into frames of ``_CHUNK_SIZE``, which is much
+    larger than the writes of a process's output, so that there are fewer
+    frames to send and compress.
+
+    :ivar _manager: The ``TLSRemoteVolumeManager`` whose session is used.
+    :ivar _protocols: The ``ReplicationClientProtocol`` of each stripe; the
+        first is the manager's session and the others are closed when the
+        stream is over.
+    :ivar _responses: The ``Deferred`` answer of each stripe's request.
+    :ivar _compressor: ``None`` or the ``_Compressor`` for the data frames.
+    :ivar compressed: Whether the server accepts compressed ZFS streams.
+    :ivar _registered: The transports the producer is registered with.
+    :ivar _buffer: A ``list`` of ``bytes`` written but not sent yet.
+    :ivar _sent: The number of data frames sent.
+    """
+    def __init__(self, manager, protocols, responses, compression=None,
+                 name=u"", compressed=False):
+        """
+        :param TLSRemoteVolumeManager manager: See ``_manager``.
+        :param list protocols: See ``_protocols``.
+        :param list responses: See ``_responses``.
+        :param compression: ``None`` or ``u"zlib"``, as negotiated.
+        :param unicode name: The name of the volume, for logging.
+        :param bool compressed: See ``compressed``, as negotiated.
+        """
+        self.compressed = compressed
+        self._manager = manager
+        self._protocols = protocols
+        self._responses = responses
+        self._compression = compression
+        if compression is None:
+            self._compressor = None
+        else:
+            self._compressor = _Compressor()
+        self._name = name
+        self._registered = []
+        self._buffer = []
+        self._buffered = 0
+        self._sent = 0
+        self._raw_bytes = 0
+        self._wire_bytes = 0
+        self._started = manager._reactor.seconds()
+
+    def registerProducer(self, producer, streaming):
+        transports = [protocol.transport for protocol in self._protocols]
+        if len(transports) == 1 or not streaming:
+            self._registered = transports[:1]
+            transports[0].registerProducer(producer, streaming)
+        else:
+            self._registered = transports
+            _StripeFlowControl(producer, transports)
+
+    def unregisterProducer(self):
+        registered, self._registered = self._registered, []
+        for transport in registered:
+            transport.unregisterProducer()
+
+    def write(self, data):
+        self._raw_bytes += len(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= _CHUNK_SIZE:
+            self._flush(_CHUNK_SIZE)
+
+    def _flush(self, size):
+        """
+        Send the buffered data in frames of ``size`` bytes, keeping any
+        smaller remainder buffered.
+        """
+        data = b"".join(self._buffer)
+        end = len(data) - len(data) % size
+        for offset in range(0, end, size):
+            self._send_chunk(data[offset:offset + size])
+        self._buffer = [data[end:]]
+        self._buffered = len(data) - end
+
+    def _send_chunk(self, chunk):
+        if self._compressor is not None:
+            chunk = self._compressor.encode(chunk)
+        protocol = self._protocols[self._sent % len(self._protocols)]
+        protocol.sendString(chunk)
+        self._sent += 1
+        self._wire_bytes += len(chunk)
+
+    def finish(self):
+        if self._buffered:
+            self._flush(self._buffered)
+        for protocol in self._protocols:
+            protocol.sendString(b"")
+        finishing = gatherResults(self._responses, consumeErrors=True)
+        finishing.addCallbacks(
+            self._finished,
+            lambda reason: self._failed(reason.value.subFailure))
+        return finishing
+
+    def _finished(self, _):
+        self._close_stripes()
+        seconds = self._manager._reactor.seconds() - self._started
+        TRANSFER(
+            name=self._name,
+            streams=len(self._protocols),
+            compression=self._compression,
+            raw_bytes=self._raw_bytes,
+            wire_bytes=self._wire_bytes,
+            seconds=seconds,
+            throughput=self._raw_bytes / seconds if seconds else 0.0,
+            compression_ratio=(
+                float(self._raw_bytes) / self._wire_bytes
+                if self._wire_bytes else 1.0),
+        ).write(_logger)
+        return None
+
+    def _failed(self, reason):
+        self._close_stripes()
+        return self._manager._close_and_fail(reason)
+
+    def _close_stripes(self):
+        for protocol in self._protocols[1:]:
+            protocol.transport.loseConnection()
+
+    def abort(self):
+        # The server can't tell a truncated stream from a complete one in
+        # any other way.
+        for response in self._responses:
+            response.addErrback(lambda _: None)
+        self._close_stripes()
+        return self._manager.close()
+
+
+@implementer(IRemoteVolumeManager)
+@with_cmp(["_host", "_port"])
+class TLSRemoteVolumeManager(object):
+    """
+    Communication with the replication server of a remote dataset agent.
+
+    All requests made through one instance share a single TLS session, which
+    is opened on first use.  Requests must be made one at a time, waiting
+    for each to finish (and for any stream to be finished) before the next.
+
+    Compression and striping of data streams are used if they were asked for
+    and the server supports them.  Compression pays off on slow links for
+    datasets which are not compressed by ZFS already; striping on links with
+    a high bandwidth-delay product, on which a single TCP connection can't
+    keep up.
+
+    ZFS streams are sent with their blocks compressed as stored whenever both
+    ends support that, since it only makes them smaller.
+    """
+    def __init__(self, host, context_factory, port=REPLICATION_PORT,
+                 reactor=None, compression=False, streams=1):
+        """
+        :param bytes host: The address of the destination node.
+        :param context_factory: The TLS context factory which authenticates
+            the destination node, see
+            ``flocker.ca.replication_context_factory``.  It only checks
+            that the destination is some node of the cluster, since
+            ``host`` is not tied to a node identity; see there for why
+            that is enough.
+        :param int port: The port the destination's replication server
+            listens on.
+        :param reactor: The reactor to connect with.
+        :param bool compression: Whether to compress data streams.
+        :param int streams: The number of sessions to stripe each data
+            stream across.
+        """
+        self._host = host
+        self._port = port
+        self._context_factory = context_factory
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._compression = compression
+        self._streams = streams
+        self._protocol = None
+        self._features = None
+
+    def _open(self):
+        """
+        :return: A ``Deferred`` that fires with the
+            ``ReplicationClientProtocol`` of a new session.
+        """
+        endpoint = SSL4ClientEndpoint(
+            self._reactor, self._host, self._port, self._context_factory)
+        return connectProtocol(
+            endpoint, ReplicationClientProtocol(self._reactor))
+
+    def _connect(self):
+        """
+        :return: A ``Deferred`` that fires with the session's
+            ``ReplicationClientProtocol``, opening one if necessary.
+        """
+        if self._protocol is not None:
+            return succeed(self._protocol)
+        connecting = self._open()
+
+        def connected(protocol):
+            self._protocol = protocol
+            protocol.when_closed().addCallback(
+                lambda _: self._forget(protocol))
+            return protocol
+        connecting.addCallback(connected)
+        return connecting
+
+    def _forget(self, protocol):
+        if self._protocol is protocol:
+            self._protocol = None
+
+    def _request(self, command, **arguments):
+        requesting = self._connect()
+        requesting.addCallback(
+            lambda protocol: protocol.request(command, **arguments))
+        requesting.addErrback(self._close_and_fail)
+        return requesting
+
+    def _close_and_fail(self, reason):
+        closing = self.close()
+        closing.addCallback(lambda _: reason)
+        return closing
+
+    def close(self):
+        """
+        Close the session, if one is open.  A later request opens a new one.
+
+        :return: A ``Deferred`` that fires when the session is closed.
+        """
+        protocol, self._protocol = self._protocol, None
+        if protocol is None:
+            return succeed(None)
+        closed = protocol.when_closed()
+        protocol.transport.loseConnection()
+        return closed
+
+    def snapshots(self, volume):
+        requesting = self._request(
+            u"snapshots", node_id=volume.node_id,
+            name=volume.name.to_bytes().decode("ascii"))
+        requesting.addCallback(lambda response: [
+            Snapshot(name=name.encode("ascii"))
+            for name in response[u"snapshots"]
+        ])
+        return requesting
+
+    def resume_token(self, volume):
+        requesting = self._request(
+            u"resume_token", node_id=volume.node_id,
+            name=volume.name.to_bytes().decode("ascii"))
+
+        def got_response(response):
+            resume_token = response[u"resume_token"]
+            if resume_token is not None:
+                resume_token = resume_token.encode("ascii")
+            return resume_token
+        requesting.addCallback(got_response)
+        return requesting
+
+    def _negotiate(self):
+        """
+        Find out which optional features the server supports, the first
+        time they are needed.
+
+        :return: A ``Deferred`` that fires with a ``list`` of the names of
+            the features.
+        """
+        if self._features is not None:
+            return succeed(self._features)
+        negotiating = self._connect()
+        negotiating.addCallback(lambda protocol: protocol.request(u"hello"))
+
+        def failed(reason):
+            # The server predates ``hello``.
+            reason.trap(ReplicationError)
+            return {u"features": []}
+        negotiating.addCallbacks(
+            lambda response: response[u"features"], failed)
+
+        def negotiated(features):
+            self._features = features
+            return features
+        negotiating.addCallback(negotiated)
+        return negotiating
+
+    def receiver(self, volume, resume=False):
+        name = volume.name.to_bytes().decode("ascii")
+        negotiating = self._negotiate()
+
+        def negotiated(features):
+            arguments = dict(node_id=volume.node_id, name=name, resume=resume)
+            compression = None
+            if self._compression and u"zlib" in features:
+                compression = arguments[u"compression"] = u"zlib"
+            stripes = self._streams if u"stripes" in features else 1
+            connecting = gatherResults(
+                [self._connect()] + [self._open() for i in range(stripes - 1)],
+                consumeErrors=True)
+            connecting.addErrback(lambda reason: reason.value.subFailure)
+
+            def connected(protocols):
+                responses = []
+                if stripes > 1:
+                    transfer = arguments[u"transfer"] = unicode(uuid4())
+                    arguments[u"stripes"] = stripes
+                    responses = [
+                        protocol.request(
+                            u"join", transfer=transfer, index=index)
+                        for index, protocol in enumerate(protocols[1:], 1)]
+                responses.insert(
+                    0, protocols[0].request(u"receive", **arguments))
+                return _StreamSender(
+                    self, protocols, responses, compression, name,
+                    compressed=u"zfs-compressed" in features)
+            connecting.addCallback(connected)
+            return connecting
+        negotiating.addCallback(negotiated)
+        negotiating.addErrback(self._close_and_fail)
+        return negotiating
+
+    def acquire(self, volume):
+        requesting = self._request(
+            u"acquire", node_id=volume.node_id,
+            name=volume.name.to_bytes().decode("ascii"))
+        requesting.addCallback(lambda response: response[u"node_id"])
+        return requesting
+
+    def clone_to(self, parent, name):
+        requesting = self._request(
+            u"clone_to",
+            parent_node_id=parent.node_id,
+            parent_name=parent.name.to_bytes().decode("ascii"),
+            name=name.to_bytes().decode("ascii"))
+        requesting.addCallback(lambda _: None)
+        return requesting
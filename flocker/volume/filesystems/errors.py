@@ -10,3 +10,10 @@ class MaximumSizeTooSmall(Exception):
     A maximum size was specified for a filesystem which is smaller than the
     smallest allowed value.
     """
+
+
+class InvalidResumeToken(Exception):
+    """
+    A stream can't be resumed from the given resume token, e.g. because the
+    snapshot it was generated from no longer exists.
+    """
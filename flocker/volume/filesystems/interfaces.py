@@ -6,6 +6,8 @@ from __future__ import absolute_import
 
 from zope.interface import Attribute, Interface
 
+from twisted.internet.interfaces import IConsumer
+
 
 class FilesystemAlreadyExists(Exception):
     """
@@ -70,7 +72,16 @@ class IFilesystem(Interface):
             which exist of this filesystem.
         """
 
-    def reader(remote_snapshots=None):
+    def resume_token():
+        """
+        Retrieve the token describing the partially received state left
+        behind by an interrupted :meth:`IFilesystem.writer`, if any.
+
+        :return: A ``Deferred`` that fires with the token as ``bytes``, or
+            with ``None`` if there is no partially received state.
+        """
+
+    def reader(remote_snapshots=None, resume_token=None):
         """
         Context manager that allows reading the contents of the filesystem.
 
@@ -84,11 +95,19 @@ class IFilesystem(Interface):
             possible.  If no value is passed then a complete data stream will
             be generated.
 
+        :param bytes resume_token: A token from the writer's
+            :meth:`IFilesystem.resume_token`.  If given, the rest of the
+            interrupted stream is generated instead and ``remote_snapshots``
+            is ignored.
+
+        :raise InvalidResumeToken: If the interrupted stream can't be
+            resumed.
+
         :return: A file-like object from whom the filesystem's data can be
             read as ``bytes``.
         """
 
-    def writer():
+    def writer(resume=False):
         """Context manager that allows writing new contents to the filesystem.
 
         This receiver is a blocking API, for now.
@@ -99,13 +118,73 @@ class IFilesystem(Interface):
         the data is the owner of the volume. As such, whatever new data is
         being received will overwrite the filesystem's existing data.
 
-        :param Volume volume: A volume that is being pushed to us.
+        If writing is interrupted the data received so far may be kept, so
+        that a reader can resume the stream later (see
+        :meth:`IFilesystem.resume_token`).
+
+        :param bool resume: ``True`` if the data is the rest of an
+            interrupted stream, generated by :meth:`IFilesystem.reader` with
+            a ``resume_token``.  Otherwise any partially received state is
+            discarded first.
 
         :return: A file-like object which when written to with output of
             :meth:`IFilesystem.reader` will populate the volume's
             filesystem.
         """
 
+    def send(consumer, remote_snapshots=None, resume_token=None,
+             compressed=False):
+        """
+        Write the contents of the filesystem to a consumer, without blocking.
+
+        This is the non-blocking equivalent of :meth:`IFilesystem.reader`.
+        The consumer's flow control is honoured: the stream is generated no
+        faster than the consumer accepts it.
+
+        :param IConsumer consumer: The consumer to write the stream to.  A
+            producer is registered with it while the stream is being
+            written.
+
+        :param remote_snapshots: See :meth:`IFilesystem.reader`.
+
+        :param bytes resume_token: See :meth:`IFilesystem.reader`.
+
+        :param bool compressed: Whether the receiving end accepts streams
+            in which blocks are sent compressed as they are stored, see
+            :attr:`IStreamReceiver.compressed`.  Implementations use them
+            only if they support them as well.
+
+        :return: A ``Deferred`` that fires with ``None`` once the whole
+            stream has been written, or errbacks with ``InvalidResumeToken``
+            if the interrupted stream can't be resumed or with an
+            implementation-specific exception for other problems.
+        """
+
+    def receiver(resume=False):
+        """
+        Prepare to write new contents to the filesystem, without blocking.
+
+        This is the non-blocking equivalent of :meth:`IFilesystem.writer`.
+
+        :param bool resume: See :meth:`IFilesystem.writer`.
+
+        :return: A ``Deferred`` that fires with an ``IStreamReceiver``
+            provider to write the output of :meth:`IFilesystem.send` to.
+        """
+
+    def replicated(peer, snapshots):
+        """
+        Note which snapshots a peer has of this filesystem after a push to
+        it.  The newest of them is the basis of the next incremental push to
+        that peer, so implementations which discard old snapshots keep it.
+
+        :param peer: A hashable object identifying the peer, e.g. its
+            ``IRemoteVolumeManager``.
+
+        :param list snapshots: The ``Snapshot`` instances the peer has,
+            ordered from oldest to newest.
+        """
+
     def __eq__(other):
         """True if and only if underlying OS filesystem is the same."""
 
@@ -116,6 +195,35 @@ class IFilesystem(Interface):
         """Equal objects should have the same hash."""
 
 
+class IStreamReceiver(IConsumer):
+    """
+    A consumer of the data stream of a filesystem, which updates a filesystem
+    with it.  See :meth:`IFilesystem.receiver`.
+    """
+    compressed = Attribute(
+        "Whether the stream may have blocks compressed as they are stored, "
+        "see :meth:`IFilesystem.send`.")
+
+    def finish():
+        """
+        Indicate that the whole stream has been written.
+
+        :return: A ``Deferred`` that fires with ``None`` once the filesystem
+            has been updated, or errbacks if the stream could not be applied
+            to it.
+        """
+
+    def abort():
+        """
+        Indicate that the stream was interrupted.  The data written so far
+        may be kept so that the stream can be resumed later (see
+        :meth:`IFilesystem.resume_token`).
+
+        :return: A ``Deferred`` that fires with ``None`` once the interrupted
+            stream has been dealt with.
+        """
+
+
 class IStoragePool(Interface):
     """
     Pool of on-disk storage where filesystems are stored.
@@ -198,6 +306,14 @@ class IStoragePool(Interface):
             exists.
         """
 
+    def compressed_streams():
+        """
+        Determine whether filesystems in this pool can receive streams in
+        which blocks are sent compressed as they are stored.
+
+        :return: A ``Deferred`` that fires with a ``bool``.
+        """
+
     def enumerate():
         """Get a listing of all filesystems in this pool.
 
@@ -13,12 +13,14 @@ from zope.interface import implementer
 
 from characteristic import with_init, with_cmp, with_repr
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import maybeDeferred, succeed, fail
 from twisted.application.service import Service
 
 from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
     FilesystemAlreadyExists)
+from .errors import InvalidResumeToken
+from .streams import WriterReceiver
 from .zfs import Snapshot
 
 from .._model import VolumeSize
@@ -58,6 +60,11 @@ class DirectoryFilesystem(object):
     taken.  No other state related to snapshots is tracked (eg, the state of
     the directory at the time of those snapshots is not recorded).
 
+    Resumable writes are supported in a similar way.  If writing is
+    interrupted the bytes received so far are kept in a file next to the
+    directory and the resume token is their number.  A reader resumes by
+    skipping that many bytes of the stream it would otherwise generate.
+
     :ivar FilePath path: The directory where data for this "filesystem" is
         stored.
     """
@@ -100,8 +107,21 @@ class DirectoryFilesystem(object):
                 snapshot.name for snapshot in self._snapshots()] + [name])
         )
 
+    def _partial(self):
+        """
+        :return: The ``FilePath`` where data from an interrupted write is
+            kept.
+        """
+        return self.path.siblingExtension(b".partial")
+
+    def resume_token(self):
+        partial = self._partial()
+        if not partial.exists():
+            return succeed(None)
+        return succeed(b"%d" % (partial.getsize(),))
+
     @contextmanager
-    def reader(self, remote_snapshots=None):
+    def reader(self, remote_snapshots=None, resume_token=None):
         """
         Package up filesystem contents as a tarball.
         """
@@ -123,13 +143,52 @@ class DirectoryFilesystem(object):
                 ).encode("ascii")
             )
         result.seek(0, 0)
+        if resume_token is not None:
+            try:
+                offset = int(resume_token)
+            except ValueError:
+                raise InvalidResumeToken()
+            if offset > len(result.getvalue()):
+                raise InvalidResumeToken()
+            result.seek(offset, 0)
         yield result
 
+    def send(self, consumer, remote_snapshots=None, resume_token=None,
+             compressed=False):
+        """
+        Write the tarball generated by ``reader`` to the consumer all at once.
+        Tarballs are never compressed, so ``compressed`` is ignored.
+        """
+        def write():
+            with self.reader(remote_snapshots, resume_token) as reader:
+                consumer.write(reader.read())
+        return maybeDeferred(write)
+
+    def receiver(self, resume=False):
+        """
+        Write the received tarball to a ``writer`` as it arrives.
+        """
+        return succeed(WriterReceiver(self.writer(resume=resume)))
+
+    def replicated(self, peer, snapshots):
+        """
+        Snapshots are never discarded, so there is nothing to keep.
+        """
+
     @contextmanager
-    def writer(self):
+    def writer(self, resume=False):
         """Expect written bytes to be a tarball."""
+        partial = self._partial()
         result = BytesIO()
-        yield result
+        if partial.exists():
+            if resume:
+                result.write(partial.getContent())
+            partial.remove()
+        try:
+            yield result
+        except:
+            partial.setContent(result.getvalue())
+            raise
         result.seek(0, 0)
         try:
             tarball = TarFile(fileobj=result, mode="r")
@@ -172,6 +231,9 @@ class FilesystemStoragePool(Service):
         filesystem = self.get(volume)
         root = filesystem.get_path()
         root.remove()
+        partial = filesystem._partial()
+        if partial.exists():
+            partial.remove()
         return succeed(None)
 
     def set_maximum_size(self, volume):
@@ -217,10 +279,16 @@ class FilesystemStoragePool(Service):
                 volume.node_id.encode("ascii"), volume.name.to_bytes())),
             size=volume.size)
 
+    def compressed_streams(self):
+        return succeed(False)
+
     def enumerate(self):
         filesystems = set()
         if self._root.isdir():
             for path in self._root.children():
+                if not path.isdir():
+                    # Data kept from an interrupted write.
+                    continue
                 if path.child(b".size").exists():
                     maximum_size = int(
                         path.child(b".size").getContent().decode("ascii"))
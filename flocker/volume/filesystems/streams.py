@@ -0,0 +1,72 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_streams -*-
+
+"""
+Helpers for implementing the non-blocking stream APIs of ``IFilesystem``.
+"""
+
+from __future__ import absolute_import
+
+from zope.interface import implementer
+
+from twisted.internet.defer import maybeDeferred
+
+from .interfaces import IStreamReceiver
+
+
+class StreamAborted(Exception):
+    """
+    A stream written to a ``WriterReceiver`` was interrupted.
+    """
+
+
+@implementer(IStreamReceiver)
+class WriterReceiver(object):
+    """
+    An ``IStreamReceiver`` which writes to a blocking file-like object, such
+    as the one provided by ``IFilesystem.writer``.
+
+    Writes happen immediately, so this is only suitable for file-like objects
+    which block briefly if at all, e.g. in-memory ones.
+
+    :ivar _writer: The context manager providing the file-like object.
+    :ivar _file: The file-like object.
+    :ivar _producer: The registered producer, or ``None``.
+    """
+    # Streams are written to file-like objects as they are, so the writer
+    # decides what it accepts; those of ``IFilesystem.writer`` expect plain
+    # streams.
+    compressed = False
+
+    def __init__(self, writer):
+        """
+        :param writer: A context manager providing the file-like object,
+            e.g. the result of ``IFilesystem.writer``.  It is entered
+            immediately.
+        """
+        self._writer = writer
+        self._file = writer.__enter__()
+        self._producer = None
+
+    def registerProducer(self, producer, streaming):
+        self._producer = producer
+        if not streaming:
+            # Everything written is accepted immediately so a pull producer
+            # can be asked for more until it is done.
+            while self._producer is producer:
+                producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self._producer = None
+
+    def write(self, data):
+        self._file.write(data)
+
+    def finish(self):
+        return maybeDeferred(self._writer.__exit__, None, None, None)
+
+    def abort(self):
+        d = maybeDeferred(
+            self._writer.__exit__, StreamAborted, StreamAborted(), None)
+        d.addCallback(lambda _: None)
+        return d
@@ -0,0 +1,127 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Functional tests for ``flocker.volume._daemon``.
+"""
+
+import os
+from tempfile import mkdtemp
+
+from twisted.internet import reactor
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from .._daemon import connect_to_daemon, volume_daemon
+from ..service import Volume, VolumeName
+from ..testtools import create_volume_service
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+
+
+def short_directory(test):
+    """
+    Create a temporary directory with a path short enough for UNIX sockets,
+    unlike the ones from ``TestCase.mktemp``.
+    """
+    directory = FilePath(mkdtemp())
+    test.addCleanup(directory.remove)
+    return directory
+
+
+class VolumeDaemonTests(TestCase):
+    """
+    Tests for ``VolumeDaemonClient`` talking to a ``volume_daemon`` over a
+    real UNIX socket.
+    """
+    def setUp(self):
+        self.service = create_volume_service(self)
+        self.socket_path = short_directory(self).child(
+            b"run").child(b"volume.sock")
+        daemon = volume_daemon(reactor, self.service, self.socket_path)
+        daemon.startService()
+        self.addCleanup(daemon.stopService)
+        connecting = connect_to_daemon(reactor, self.socket_path)
+
+        def connected(client):
+            self.client = client
+            self.addCleanup(client.close)
+        return connecting.addCallback(connected)
+
+    def test_socket_mode(self):
+        """
+        Only the owner of the socket can connect to it.
+        """
+        self.socket_path.restat()
+        self.assertEqual(0o600, self.socket_path.statinfo.st_mode & 0o777)
+
+    def test_identify(self):
+        """
+        ``VolumeDaemonClient.identify`` fires with the node ID of the volume
+        manager.
+        """
+        identifying = self.client.identify()
+        identifying.addCallback(self.assertEqual, self.service.node_id)
+        return identifying
+
+    def test_receive_acquire(self):
+        """
+        ``VolumeDaemonClient.receive`` has the volume manager receive a data
+        stream from a file descriptor, and ``VolumeDaemonClient.acquire``
+        makes it the owner of the received volume.
+        """
+        origin = create_volume_service(self)
+        volume = self.successResultOf(origin.create(origin.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"afile").setContent(
+            b"WORKS!")
+        with volume.get_filesystem().reader() as reader:
+            data = reader.read()
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd)
+        self.addCleanup(stream.close)
+        # Small enough to fit in the pipe's buffer:
+        os.write(write_fd, data)
+        os.close(write_fd)
+
+        receiving = self.client.receive(
+            origin.node_id, MY_VOLUME, stream)
+        receiving.addCallback(
+            lambda _: self.client.acquire(origin.node_id, MY_VOLUME))
+
+        def acquired(node_id):
+            copy = Volume(node_id=node_id, name=MY_VOLUME,
+                          service=self.service)
+            self.assertEqual(
+                (self.service.node_id, b"WORKS!"),
+                (node_id, copy.get_filesystem().get_path().child(
+                    b"afile").getContent()))
+        receiving.addCallback(acquired)
+        return receiving
+
+    def test_receive_error(self):
+        """
+        ``VolumeDaemonClient.receive`` fails with ``ValueError`` if the volume
+        manager refuses the volume.
+        """
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd)
+        self.addCleanup(stream.close)
+        self.addCleanup(os.close, write_fd)
+        return self.assertFailure(
+            self.client.receive(self.service.node_id, MY_VOLUME, stream),
+            ValueError)
+
+
+class ConnectToDaemonTests(TestCase):
+    """
+    Functional tests for ``connect_to_daemon``.
+    """
+    def test_not_listening(self):
+        """
+        If nothing listens on the socket, ``connect_to_daemon`` fires with
+        ``None``.
+        """
+        socket_path = short_directory(self).child(b"volume.sock")
+        socket_path.setContent(b"")
+        connecting = connect_to_daemon(reactor, socket_path)
+        connecting.addCallback(self.assertIs, None)
+        return connecting
@@ -14,6 +14,7 @@ import subprocess
 import errno
 
 from twisted.internet import reactor
+from twisted.internet.defer import succeed
 from twisted.internet.task import cooperate
 from twisted.trial.unittest import TestCase
 from twisted.python.filepath import FilePath
@@ -25,9 +26,10 @@ from ..test.filesystemtests import (
 from ..filesystems.errors import MaximumSizeTooSmall
 from ..filesystems.zfs import (
     Snapshot, ZFSSnapshots, Filesystem, StoragePool, volume_to_dataset,
-    zfs_command,
+    zfs_command, SnapshotPruner,
 )
 from ..service import Volume, VolumeName
+from .._ipc import LocalVolumeManager
 from .._model import VolumeSize
 from ..testtools import create_zfs_pool, service_for_pool
 
@@ -457,6 +459,88 @@ class IncrementalPushTests(TestCase):
         return loading
 
 
+class CopyVolumeManager(LocalVolumeManager):
+    """
+    A ``LocalVolumeManager`` which reports the snapshots of its service's copy
+    of a volume, like a remote volume manager does.
+    """
+    def snapshots(self, volume):
+        copy = Volume(
+            node_id=volume.node_id, name=volume.name, service=self._service)
+        return copy.get_filesystem().snapshots()
+
+
+class SnapshotPrunerTests(TestCase):
+    """
+    Functional tests for ``SnapshotPruner``.
+    """
+    def test_prune(self):
+        """
+        ``SnapshotPruner.prune`` destroys all but the most recent snapshots
+        created by pushes, and leaves other snapshots alone.
+        """
+        pool = build_pool(self)
+        service = service_for_pool(self, pool)
+        volume = service.get(MY_VOLUME)
+        creating = pool.create(volume)
+
+        def created(filesystem):
+            self.filesystem = filesystem
+            for i in range(3):
+                with filesystem.reader():
+                    pass
+            return zfs_command(
+                reactor, [b"snapshot", filesystem.name + b"@backup"])
+        pruning = creating.addCallback(created)
+        pruning.addCallback(
+            lambda _: SnapshotPruner(reactor, pool, keep=2).prune())
+        pruning.addCallback(lambda _: self.filesystem.snapshots())
+
+        def pruned(snapshots):
+            self.assertEqual(
+                [3, Snapshot(name=b"backup")],
+                [len(snapshots), snapshots[-1]])
+        pruning.addCallback(pruned)
+        return pruning
+
+    def test_peer_basis_kept(self):
+        """
+        ``SnapshotPruner.prune`` keeps the snapshot a peer was last pushed
+        even after more than ``keep`` pushes to another peer, so the next
+        push to the first peer is still incremental.
+        """
+        pool = build_pool(self)
+        service = service_for_pool(self, pool)
+        peer_b = CopyVolumeManager(service_for_pool(self, build_pool(self)))
+        peer_c = CopyVolumeManager(service_for_pool(self, build_pool(self)))
+        creating = service.create(service.get(MY_VOLUME))
+
+        def created(volume):
+            self.volume = volume
+            pushing = service.push(volume, peer_b)
+            pushing.addCallback(lambda _: peer_b.snapshots(volume))
+
+            def pushed_to_b(snapshots):
+                self.basis = snapshots[-1]
+                pushing_to_c = succeed(None)
+                for i in range(3):
+                    pushing_to_c.addCallback(
+                        lambda _: service.push(volume, peer_c))
+                return pushing_to_c
+            pushing.addCallback(pushed_to_b)
+            return pushing
+        pruning = creating.addCallback(created)
+        pruning.addCallback(
+            lambda _: SnapshotPruner(reactor, pool, keep=2).prune())
+        pruning.addCallback(lambda _: self.volume.get_filesystem().snapshots())
+
+        def pruned(snapshots):
+            self.assertEqual(
+                [3, self.basis], [len(snapshots), snapshots[0]])
+        pruning.addCallback(pruned)
+        return pruning
+
+
 class FilesystemTests(TestCase):
     """
     ZFS-specific tests for ``Filesystem``.
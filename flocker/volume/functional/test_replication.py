@@ -0,0 +1,121 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Functional tests for ``flocker.volume._replication``.
+"""
+
+from os import urandom
+
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+
+from ...ca import replication_context_factory
+from ...ca.testtools import get_credential_sets
+from ...testtools import find_free_port
+from .._replication import (
+    ReplicationError, TLSRemoteVolumeManager, replication_server,
+)
+from ..service import Volume, VolumeName
+from ..testtools import create_volume_service
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+
+
+class ReplicationTests(TestCase):
+    """
+    Tests for pushing volumes with ``TLSRemoteVolumeManager`` to a server
+    created by ``replication_server``.
+    """
+    def setUp(self):
+        self.good_ca, self.another_ca = get_credential_sets()
+        good_ca = self.good_ca
+        self.from_service = create_volume_service(self)
+        self.to_service = create_volume_service(self)
+        self.port = find_free_port()[1]
+        server = replication_server(
+            reactor, self.to_service,
+            replication_context_factory(
+                good_ca.root.credential.certificate, good_ca.node),
+            port=self.port)
+        server.startService()
+        self.addCleanup(server.stopService)
+        self.remote = self.remote_volume_manager(good_ca)
+
+    def remote_volume_manager(self, ca_set, **kwargs):
+        remote = TLSRemoteVolumeManager(
+            b"127.0.0.1",
+            replication_context_factory(
+                ca_set.root.credential.certificate, ca_set.node),
+            port=self.port, **kwargs)
+        self.addCleanup(remote.close)
+        return remote
+
+    def create_volume(self):
+        """
+        Create ``MY_VOLUME`` with one file in it on the origin service.
+        """
+        volume = self.from_service.get(MY_VOLUME)
+        self.successResultOf(self.from_service.create(volume))
+        volume.get_filesystem().get_path().child(b"afile.txt").setContent(
+            b"WORKS!")
+        return volume
+
+    def test_handoff(self):
+        """
+        Handing off a volume copies its data to the destination and makes
+        the destination its owner.
+        """
+        volume = self.create_volume()
+        handing_off = self.from_service.handoff(volume, self.remote)
+
+        def handed_off(new_volume):
+            copy = Volume(node_id=self.to_service.node_id, name=MY_VOLUME,
+                          service=self.to_service)
+            self.assertEqual(
+                (self.to_service.node_id, b"WORKS!"),
+                (new_volume.node_id,
+                 copy.get_filesystem().get_path().child(
+                     b"afile.txt").getContent()))
+        handing_off.addCallback(handed_off)
+        return handing_off
+
+    def test_handoff_compressed_striped(self):
+        """
+        A volume can be handed off with its data stream compressed and
+        striped across several sessions.
+        """
+        remote = self.remote_volume_manager(
+            self.good_ca, compression=True, streams=3)
+        volume = self.create_volume()
+        path = volume.get_filesystem().get_path()
+        path.child(b"compressible").setContent(b"x" * 5000000)
+        path.child(b"random").setContent(urandom(3000000))
+        names = [b"afile.txt", b"compressible", b"random"]
+        expected = [path.child(name).getContent() for name in names]
+        handing_off = self.from_service.handoff(volume, remote)
+
+        def handed_off(new_volume):
+            copy = Volume(node_id=self.to_service.node_id, name=MY_VOLUME,
+                          service=self.to_service).get_filesystem().get_path()
+            self.assertEqual(
+                expected, [copy.child(name).getContent() for name in names])
+        handing_off.addCallback(handed_off)
+        return handing_off
+
+    def test_error(self):
+        """
+        A request the server refuses raises ``ReplicationError``.
+        """
+        volume = self.to_service.get(MY_VOLUME)
+        return self.assertFailure(
+            self.remote.acquire(volume), ReplicationError)
+
+    def test_other_cluster_rejected(self):
+        """
+        A node with a certificate from another cluster's certificate
+        authority can't push to the server.
+        """
+        remote = self.remote_volume_manager(self.another_ca)
+        volume = self.create_volume()
+        return self.assertFailure(
+            remote.snapshots(volume), Exception)
@@ -2,6 +2,7 @@
 
 """The command-line ``flocker-volume`` tool."""
 
+import json
 import sys
 
 from twisted.python.usage import Options
@@ -14,8 +15,9 @@ from .service import (
     DEFAULT_CONFIG_PATH, FLOCKER_MOUNTPOINT, FLOCKER_POOL,
     Volume, VolumeScript, ICommandLineVolumeScript, VolumeName,
     )
+from ._daemon import DEFAULT_SOCKET_PATH, connect_to_daemon
 from ..common.script import (
-    flocker_standard_options, FlockerScriptRunner
+    flocker_standard_options, FlockerScriptRunner, ICommandLineScript,
     )
 
 
@@ -24,6 +26,7 @@ __all__ = [
     'flocker_volume_options',
     'VolumeOptions',
     'VolumeManagerScript',
+    'ForwardingVolumeScript',
 ]
 
 
@@ -84,14 +87,69 @@ class _SnapshotsSubcommandOptions(Options):
                         service=service)
         filesystem = volume.get_filesystem()
         snapshots = filesystem.snapshots()
+        snapshots.addCallback(
+            lambda snapshots: [snapshot.name for snapshot in snapshots])
+        snapshots.addCallback(self._write)
+        return snapshots
 
-        def got_snapshots(snapshots):
-            for snapshot in snapshots:
-                sys.stdout.write(snapshot.name + b"\n")
+    def forward(self, client):
+        """
+        Run the action for this sub-command in the volume manager daemon.
 
-        snapshots.addCallback(got_snapshots)
+        :param VolumeDaemonClient client: The connection to the daemon.
+        """
+        snapshots = client.snapshots(
+            self["node_id"], VolumeName.from_bytes(self["name"]))
+        snapshots.addCallback(self._write)
         return snapshots
 
+    def _write(self, names):
+        for name in names:
+            sys.stdout.write(name + b"\n")
+
+
+class _ResumeTokenSubcommandOptions(Options):
+    """
+    Command line options for ``flocker-volume resume_token``.
+    """
+
+    longdesc = """Print the token from which an interrupted receive of a
+    particular volume can be resumed, if there is one.
+
+    Parameters:
+
+    * owner-node-id: The node ID of the volume manager that owns the volume.
+
+    * name: The name of the volume.
+    """
+
+    def parseArgs(self, node_id, name):
+        self["node_id"] = node_id.decode("ascii")
+        self["name"] = name
+
+    def run(self, service):
+        volume = Volume(node_id=self["node_id"],
+                        name=VolumeName.from_bytes(self["name"]),
+                        service=service)
+        resume_token = volume.get_filesystem().resume_token()
+        resume_token.addCallback(self._write)
+        return resume_token
+
+    def forward(self, client):
+        """
+        Run the action for this sub-command in the volume manager daemon.
+
+        :param VolumeDaemonClient client: The connection to the daemon.
+        """
+        resume_token = client.resume_token(
+            self["node_id"], VolumeName.from_bytes(self["name"]))
+        resume_token.addCallback(self._write)
+        return resume_token
+
+    def _write(self, resume_token):
+        if resume_token is not None:
+            sys.stdout.write(resume_token + b"\n")
+
 
 class _ReceiveSubcommandOptions(Options):
     """Command line options for ``flocker-volume receive``."""
@@ -108,7 +166,12 @@ class _ReceiveSubcommandOptions(Options):
     * name: The name of the volume.
     """
 
-    synopsis = "<owner-node-id> <name>"
+    synopsis = "[--resume] <owner-node-id> <name>"
+
+    optFlags = [
+        ["resume", None,
+         "The input is the rest of an interrupted push."],
+    ]
 
     def parseArgs(self, node_id, name):
         self["node_id"] = node_id.decode("ascii")
@@ -120,7 +183,18 @@ class _ReceiveSubcommandOptions(Options):
         :param VolumeService service: The volume manager service to utilize.
         """
         service.receive(self["node_id"], VolumeName.from_bytes(self["name"]),
-                        sys.stdin)
+                        sys.stdin, resume=self["resume"])
+
+    def forward(self, client):
+        """
+        Run the action for this sub-command in the volume manager daemon,
+        which reads standard in itself.
+
+        :param VolumeDaemonClient client: The connection to the daemon.
+        """
+        return client.receive(
+            self["node_id"], VolumeName.from_bytes(self["name"]), sys.stdin,
+            resume=self["resume"])
 
 
 class _AcquireSubcommandOptions(Options):
@@ -155,13 +229,24 @@ class _AcquireSubcommandOptions(Options):
         """
         d = service.acquire(self["node_id"],
                             VolumeName.from_bytes(self["name"]))
+        d.addCallback(lambda _: self._write(service.node_id))
+        return d
+
+    def forward(self, client):
+        """
+        Run the action for this sub-command in the volume manager daemon.
 
-        def acquired(_):
-            sys.stdout.write(service.node_id.encode("ascii"))
-            sys.stdout.flush()
-        d.addCallback(acquired)
+        :param VolumeDaemonClient client: The connection to the daemon.
+        """
+        d = client.acquire(
+            self["node_id"], VolumeName.from_bytes(self["name"]))
+        d.addCallback(self._write)
         return d
 
+    def _write(self, node_id):
+        sys.stdout.write(node_id.encode("ascii"))
+        sys.stdout.flush()
+
 
 class _CloneToSubcommandOptions(Options):
     """
@@ -200,6 +285,16 @@ class _CloneToSubcommandOptions(Options):
         return service.clone_to(
             parent, VolumeName.from_bytes(self["child_name"]))
 
+    def forward(self, client):
+        """
+        Run the action for this sub-command in the volume manager daemon.
+
+        :param VolumeDaemonClient client: The connection to the daemon.
+        """
+        return client.clone_to(
+            self["node_id"], VolumeName.from_bytes(self["parent_name"]),
+            VolumeName.from_bytes(self["child_name"]))
+
 
 @flocker_standard_options
 @flocker_volume_options
@@ -212,9 +307,19 @@ class VolumeOptions(Options):
     """
     synopsis = "Usage: flocker-volume [OPTIONS]"
 
+    optParameters = [
+        ["socket", None, DEFAULT_SOCKET_PATH.path,
+         "The UNIX socket of the volume manager daemon run by the dataset "
+         "agent.  If it is serving the volume manager configured by "
+         "--config, subcommands are run there instead of starting a "
+         "volume manager for each one."],
+    ]
+
     subCommands = [
         ["snapshots", None, _SnapshotsSubcommandOptions,
          "List snapshots for a volume."],
+        ["resume_token", None, _ResumeTokenSubcommandOptions,
+         "Print the resume token of an interrupted receive."],
         ["receive", None, _ReceiveSubcommandOptions,
          "Receive a remotely pushed volume."],
         ["acquire", None, _AcquireSubcommandOptions,
@@ -245,9 +350,66 @@ class VolumeManagerScript(object):
             return succeed(None)
 
 
+def _configured_node_id(config_path):
+    """
+    Read the node ID from a volume manager configuration file.
+
+    :param FilePath config_path: The configuration file.
+
+    :return: The ``unicode`` node ID, or ``None`` if the file does not exist
+        or can't be read.
+    """
+    try:
+        return json.loads(config_path.getContent())[u"uuid"]
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+@implementer(ICommandLineScript)
+class ForwardingVolumeScript(object):
+    """
+    Run ``flocker-volume`` subcommands in the volume manager daemon, if it is
+    running and serves the configured volume manager, and otherwise with a
+    volume manager started for the purpose.
+
+    :ivar _local_script: The ``ICommandLineScript`` which starts a volume
+        manager.
+    :ivar _connect: ``connect_to_daemon`` by default but can be overridden
+        for testing purposes.
+    """
+    _connect = staticmethod(connect_to_daemon)
+
+    def __init__(self, local_script):
+        self._local_script = local_script
+
+    def main(self, reactor, options):
+        node_id = _configured_node_id(options["config"])
+        if options.subCommand is None or node_id is None:
+            return self._local_script.main(reactor, options)
+        connecting = self._connect(reactor, FilePath(options["socket"]))
+
+        def connected(client):
+            if client is None:
+                return self._local_script.main(reactor, options)
+            identifying = client.identify()
+
+            def identified(daemon_node_id):
+                if daemon_node_id != node_id:
+                    client.close()
+                    return self._local_script.main(reactor, options)
+                running = maybeDeferred(options.subOptions.forward, client)
+
+                def ran(result):
+                    client.close()
+                    return result
+                return running.addBoth(ran)
+            return identifying.addCallback(identified)
+        return connecting.addCallback(connected)
+
+
 def flocker_volume_main():
     return FlockerScriptRunner(
-        script=VolumeScript(VolumeManagerScript()),
+        script=ForwardingVolumeScript(VolumeScript(VolumeManagerScript())),
         options=VolumeOptions(),
         logging=False,
     ).main()
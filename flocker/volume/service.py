@@ -21,6 +21,8 @@ from twisted.python.filepath import FilePath
 from twisted.application.service import Service
 from twisted.internet.defer import fail
 
+from .filesystems.errors import InvalidResumeToken
+
 # We might want to make these utilities shared, rather than in zfs
 # module... but in this case the usage is temporary and should go away as
 # part of https://clusterhq.atlassian.net/browse/FLOC-64
@@ -128,6 +130,10 @@ class VolumeService(Service):
         self.node_id = config[u"uuid"]
         self.pool.startService()
 
+    def stopService(self):
+        Service.stopService(self)
+        self.pool.stopService()
+
     def create(self, volume):
         """
         Create a new volume.
@@ -256,7 +262,8 @@ class VolumeService(Service):
         """
         Push the latest data in the volume to a remote destination.
 
-        This is a blocking API for now.
+        The data is streamed without blocking, so any number of pushes can
+        proceed at once.
 
         Only locally owned volumes (i.e. volumes whose ``uuid`` matches
         this service's) can be pushed.
@@ -268,22 +275,38 @@ class VolumeService(Service):
 
         :raises ValueError: If the uuid of the volume is different than
             our own; only locally-owned volumes can be pushed.
+
+        :return: A ``Deferred`` that fires when the push has finished.
         """
         if volume.node_id != self.node_id:
             raise ValueError()
         fs = volume.get_filesystem()
-        getting_snapshots = destination.snapshots(volume)
-
-        def got_snapshots(snapshots):
-            with destination.receive(volume) as receiver:
-                with fs.reader(snapshots) as contents:
-                    for chunk in iter(lambda: contents.read(1024 * 1024), b""):
-                        receiver.write(chunk)
-
-        pushing = getting_snapshots.addCallback(got_snapshots)
+        getting_resume_token = destination.resume_token(volume)
+
+        def got_resume_token(resume_token):
+            # An earlier push was interrupted.  Finish it first so that the
+            # data it already transferred needn't be sent again.
+            if resume_token is None:
+                return None
+            resuming = _send(
+                fs, destination.receiver(volume, resume=True),
+                resume_token=resume_token)
+            # If it can't be resumed the complete stream sent below replaces
+            # whatever was partially received.
+            resuming.addErrback(lambda reason: reason.trap(InvalidResumeToken))
+            return resuming
+
+        pushing = getting_resume_token.addCallback(got_resume_token)
+        pushing.addCallback(lambda _: destination.snapshots(volume))
+        pushing.addCallback(lambda snapshots: _send(
+            fs, destination.receiver(volume), remote_snapshots=snapshots))
+        # So that the basis of the next push to the destination is kept:
+        pushing.addCallback(lambda _: destination.snapshots(volume))
+        pushing.addCallback(
+            lambda snapshots: fs.replicated(destination, snapshots))
         return pushing
 
-    def receive(self, volume_node_id, volume_name, input_file):
+    def receive(self, volume_node_id, volume_name, input_file, resume=False):
         """
         Process a volume's data that can be read from a file-like object.
 
@@ -296,6 +319,8 @@ class VolumeService(Service):
         :param VolumeName volume_name: The volume's name.
         :param input_file: A file-like object, typically ``sys.stdin``, from
             which to read the data.
+        :param bool resume: Whether the data is the rest of an interrupted
+            push, see ``IFilesystem.writer``.
 
         :raises ValueError: If the uuid of the volume matches our own;
             remote nodes can't overwrite locally-owned volumes.
@@ -303,9 +328,26 @@ class VolumeService(Service):
         if volume_node_id == self.node_id:
             raise ValueError()
         volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
-        with volume.get_filesystem().writer() as writer:
-            for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
-                writer.write(chunk)
+        with volume.get_filesystem().writer(resume=resume) as writer:
+            _copy(input_file, writer)
+
+    def receiver(self, volume_node_id, volume_name, resume=False):
+        """
+        Prepare to process a volume's data as it arrives, without blocking.
+        This is the non-blocking equivalent of ``receive``.
+
+        :param unicode volume_node_id: The volume's owner's node ID.
+        :param VolumeName volume_name: The volume's name.
+        :param bool resume: See ``receive``.
+
+        :return: A ``Deferred`` that fires with an ``IStreamReceiver``
+            provider to write the data to, or errbacks with ``ValueError`` if
+            the uuid of the volume matches our own.
+        """
+        if volume_node_id == self.node_id:
+            return fail(ValueError())
+        volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
+        return volume.get_filesystem().receiver(resume=resume)
 
     def acquire(self, volume_node_id, volume_name):
         """
@@ -333,9 +375,6 @@ class VolumeService(Service):
 
         The remote destination will be the new owner of the volume.
 
-        This is a blocking API for now (but it does return a ``Deferred``
-        for success/failure).
-
         :param Volume volume: The volume to handoff.
         :param IRemoteVolumeManager destination: The remote volume manager
             to handoff to.
@@ -347,12 +386,46 @@ class VolumeService(Service):
         pushing = maybeDeferred(self.push, volume, destination)
 
         def pushed(ignored):
-            remote_uuid = destination.acquire(volume)
-            return volume.change_owner(remote_uuid)
+            acquiring = destination.acquire(volume)
+            acquiring.addCallback(volume.change_owner)
+            return acquiring
         changing_owner = pushing.addCallback(pushed)
         return changing_owner
 
 
+def _send(filesystem, receiving, **kwargs):
+    """
+    Send a filesystem's data to an ``IStreamReceiver``, finishing the receiver
+    if the whole stream was sent and aborting it otherwise.  Blocks are sent
+    compressed as they are stored if the receiver accepts that.
+
+    :param IFilesystem filesystem: The filesystem to send.
+    :param Deferred receiving: Fires with the ``IStreamReceiver``.
+    :param kwargs: Additional arguments for ``IFilesystem.send``.
+
+    :return: A ``Deferred`` that fires when the receiver has finished.
+    """
+    def got_receiver(receiver):
+        sending = filesystem.send(
+            receiver, compressed=receiver.compressed, **kwargs)
+
+        def failed(reason):
+            aborting = receiver.abort()
+            aborting.addBoth(lambda _: reason)
+            return aborting
+        sending.addCallbacks(lambda _: receiver.finish(), failed)
+        return sending
+    return receiving.addCallback(got_receiver)
+
+
+def _copy(input_file, output_file):
+    """
+    Copy the contents of one file-like object to another, a chunk at a time.
+    """
+    for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
+        output_file.write(chunk)
+
+
 @attributes(["node_id", "name", "service", "size"],
             defaults=dict(size=VolumeSize(maximum_size=None)))
 class Volume(object):
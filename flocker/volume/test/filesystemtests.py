@@ -83,6 +83,33 @@ def copy(from_volume, to_volume):
     return getting_snapshots
 
 
+def stream(from_volume, to_volume):
+    """
+    Copy contents of one volume to another using the non-blocking
+    ``IFilesystem.send`` and ``IFilesystem.receiver``.
+
+    :param Volume from_volume: Volume to send.
+    :param Volume to_volume: Volume to receive into.
+
+    :return: ``Deferred`` that fires when the copy is complete.
+    """
+    to_filesystem = to_volume.get_filesystem()
+    getting_snapshots = to_filesystem.snapshots()
+
+    def got_snapshots(snapshots):
+        receiving = to_filesystem.receiver()
+
+        def got_receiver(receiver):
+            sending = from_volume.get_filesystem().send(
+                receiver, remote_snapshots=snapshots)
+            sending.addCallback(lambda _: receiver.finish())
+            return sending
+        receiving.addCallback(got_receiver)
+        return receiving
+    getting_snapshots.addCallback(got_snapshots)
+    return getting_snapshots
+
+
 @attributes(["from_volume", "to_volume"])
 class CopyVolumes(object):
     """A pair of volumes that had data copied from one to the other.
@@ -136,6 +163,49 @@ def create_and_copy(test, fixture):
     return d
 
 
+def create_and_interrupt_copy(test, fixture):
+    """
+    Create a volume's filesystem on one pool, start copying it to another
+    pool and give up halfway through.
+
+    :param TestCase test: A ``TestCase`` that will be the context for this
+        operation.
+    :param fixture: Callable that takes ``TestCase`` and returns a
+        ``IStoragePool`` provider.
+
+    :return: ``Deferred`` that fires with the two volumes in a
+        ``CopyVolumes``.
+    """
+    pool = fixture(test)
+    service = service_for_pool(test, pool)
+    volume = service.get(MY_VOLUME)
+    pool2 = fixture(test)
+    service2 = service_for_pool(test, pool2)
+    volume2 = Volume(
+        node_id=service.node_id,
+        name=MY_VOLUME,
+        service=service2,
+    )
+
+    d = pool.create(volume)
+
+    def created_filesystem(filesystem):
+        path = filesystem.get_path()
+        path.child(b"file").setContent(b"some bytes" * 1024)
+        path.child(b"directory").makedirs()
+        try:
+            with filesystem.reader() as reader:
+                with volume2.get_filesystem().writer() as writer:
+                    data = reader.read()
+                    writer.write(data[:len(data) // 2])
+                    raise ZeroDivisionError()
+        except ZeroDivisionError:
+            pass
+        return CopyVolumes(from_volume=volume, to_volume=volume2)
+    d.addCallback(created_filesystem)
+    return d
+
+
 def assertVolumesEqual(test, first, second):
     """
     Assert that two filesystems have the same contents.
@@ -643,6 +713,144 @@ def make_istoragepool_tests(fixture, snapshot_factory):
             d.addCallback(got_volumes)
             return d
 
+        def test_no_resume_token(self):
+            """
+            A filesystem which was not written to has no resume token.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+            d = pool.create(volume)
+            d.addCallback(lambda filesystem: filesystem.resume_token())
+            d.addCallback(self.assertIs, None)
+            return d
+
+        def test_resume_interrupted_write(self):
+            """
+            After a write is interrupted the writer has a resume token from
+            which the reader generates the rest of the stream.  Writing that
+            with ``resume=True`` completes the copy.
+            """
+            d = create_and_interrupt_copy(self, fixture)
+
+            def interrupted(copied):
+                volume, volume2 = copied.from_volume, copied.to_volume
+                to_filesystem = volume2.get_filesystem()
+                getting_token = to_filesystem.resume_token()
+
+                def got_token(resume_token):
+                    self.assertIsNot(None, resume_token)
+                    with volume.get_filesystem().reader(
+                            resume_token=resume_token) as reader:
+                        with to_filesystem.writer(resume=True) as writer:
+                            writer.write(reader.read())
+                    assertVolumesEqual(self, volume, volume2)
+                    return to_filesystem.resume_token()
+                getting_token.addCallback(got_token)
+                getting_token.addCallback(self.assertIs, None)
+                return getting_token
+            d.addCallback(interrupted)
+            return d
+
+        def test_write_discards_interrupted_write(self):
+            """
+            A complete stream written without ``resume=True`` after an
+            interrupted write replaces the partially written data.
+            """
+            d = create_and_interrupt_copy(self, fixture)
+
+            def interrupted(copied):
+                volume, volume2 = copied.from_volume, copied.to_volume
+                copying = copy(volume, volume2)
+
+                def copied(ignored):
+                    assertVolumesEqual(self, volume, volume2)
+                    return volume2.get_filesystem().resume_token()
+                copying.addCallback(copied)
+                copying.addCallback(self.assertIs, None)
+                return copying
+            d.addCallback(interrupted)
+            return d
+
+        def test_stream_new_filesystem(self):
+            """
+            Sending the contents of one pool's filesystem to a receiver for
+            another pool's filesystem creates that filesystem with the given
+            contents.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                volume = Volume(
+                    node_id=copied.to_volume.node_id, name=MY_VOLUME2,
+                    service=copied.to_volume.service)
+                streaming = stream(copied.from_volume, volume)
+                streaming.addCallback(
+                    lambda _: assertVolumesEqual(
+                        self, copied.from_volume, volume))
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_stream_update(self):
+            """
+            Sending an update of the contents of one pool's filesystem to a
+            receiver for a copy of it updates the copy.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                path = copied.from_volume.get_filesystem().get_path()
+                path.child(b"anotherfile").setContent(b"hello")
+                path.child(b"file").remove()
+                streaming = stream(copied.from_volume, copied.to_volume)
+                streaming.addCallback(
+                    lambda _: assertVolumesEqual(
+                        self, copied.from_volume, copied.to_volume))
+                return streaming
+            d.addCallback(got_volumes)
+            return d
+
+        def test_receiver_abort(self):
+            """
+            After ``IStreamReceiver.abort`` the filesystem has a resume token
+            from which the rest of the stream can be sent.
+            """
+            d = create_and_copy(self, fixture)
+
+            def got_volumes(copied):
+                volume, volume2 = copied.from_volume, copied.to_volume
+                volume.get_filesystem().get_path().child(
+                    b"anotherfile").setContent(b"hello" * 1024)
+                with volume.get_filesystem().reader() as reader:
+                    data = reader.read()
+                receiving = volume2.get_filesystem().receiver()
+
+                def got_receiver(receiver):
+                    receiver.write(data[:len(data) // 2])
+                    return receiver.abort()
+                receiving.addCallback(got_receiver)
+                receiving.addCallback(
+                    lambda _: volume2.get_filesystem().resume_token())
+
+                def got_token(resume_token):
+                    self.assertIsNot(None, resume_token)
+                    resuming = volume2.get_filesystem().receiver(resume=True)
+
+                    def got_receiver(receiver):
+                        sending = volume.get_filesystem().send(
+                            receiver, resume_token=resume_token)
+                        sending.addCallback(lambda _: receiver.finish())
+                        return sending
+                    resuming.addCallback(got_receiver)
+                    return resuming
+                receiving.addCallback(got_token)
+                receiving.addCallback(
+                    lambda _: assertVolumesEqual(self, volume, volume2))
+                return receiving
+            d.addCallback(got_volumes)
+            return d
+
         def test_enumerate_no_filesystems(self):
             """
             Lacking any filesystems, ``enumerate()`` returns an empty result.
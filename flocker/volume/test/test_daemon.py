@@ -0,0 +1,176 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Unit tests for ``flocker.volume._daemon``.
+"""
+
+import os
+
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
+
+from .. import _daemon
+from .._daemon import VolumeDaemonProtocol, connect_to_daemon
+from ..filesystems.streams import WriterReceiver
+from ..service import Volume, VolumeName
+from ..testtools import create_volume_service
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+MY_VOLUME2 = VolumeName(namespace=u"myns", dataset_id=u"myvol2")
+
+
+class VolumeDaemonProtocolTests(TestCase):
+    """
+    Tests for the responders of ``VolumeDaemonProtocol``.
+    """
+    def setUp(self):
+        self.service = create_volume_service(self)
+        self.protocol = VolumeDaemonProtocol(Clock(), self.service)
+
+    def remote_volume(self, name=MY_VOLUME):
+        """
+        Create a volume owned by another node.
+        """
+        volume = Volume(node_id=u"other", name=name, service=self.service)
+        self.successResultOf(self.service.pool.create(volume))
+        return volume
+
+    def test_identify(self):
+        """
+        ``identify`` responds with the node ID of the volume manager.
+        """
+        self.assertEqual({"node_id": self.service.node_id},
+                         self.protocol.identify())
+
+    def test_snapshots(self):
+        """
+        ``snapshots`` responds with the names of the volume's snapshots.
+        """
+        volume = self.remote_volume()
+        filesystem = volume.get_filesystem()
+        filesystem.snapshot(b"first")
+        filesystem.snapshot(b"second")
+        self.assertEqual(
+            {"snapshots": [b"first", b"second"]},
+            self.successResultOf(
+                self.protocol.snapshots(u"other", MY_VOLUME.to_bytes())))
+
+    def test_no_resume_token(self):
+        """
+        ``resume_token`` responds with ``None`` for a volume without an
+        interrupted receive.
+        """
+        self.remote_volume()
+        self.assertEqual(
+            {"resume_token": None},
+            self.successResultOf(
+                self.protocol.resume_token(u"other", MY_VOLUME.to_bytes())))
+
+    def test_acquire(self):
+        """
+        ``acquire`` makes the volume manager the owner of the volume and
+        responds with its node ID.
+        """
+        self.remote_volume()
+        response = self.successResultOf(
+            self.protocol.acquire(u"other", MY_VOLUME.to_bytes()))
+        self.assertEqual(
+            ({"node_id": self.service.node_id}, True),
+            (response, self.service.get(MY_VOLUME).get_filesystem(
+            ).get_path().exists()))
+
+    def test_acquire_owned(self):
+        """
+        ``acquire`` fails with ``ValueError`` for a volume the volume manager
+        already owns.
+        """
+        self.failureResultOf(
+            self.protocol.acquire(self.service.node_id, MY_VOLUME.to_bytes()),
+            ValueError)
+
+    def test_receive_owned(self):
+        """
+        ``receive`` fails with ``ValueError`` for a volume the volume manager
+        already owns, and closes the file descriptor it was passed.
+        """
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, write_fd)
+        self.failureResultOf(
+            self.protocol.receive(
+                self.service.node_id, MY_VOLUME.to_bytes(), False, read_fd),
+            ValueError)
+        self.assertRaises(OSError, os.fstat, read_fd)
+
+    def stream_file(self):
+        """
+        Write the data stream of a volume with a file in it to a regular
+        file.
+
+        :return: The node ID of the volume's owner and a file descriptor
+            open for reading the file.
+        """
+        source = create_volume_service(self)
+        volume = self.successResultOf(source.create(source.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"file").setContent(b"x")
+        path = FilePath(self.mktemp())
+        with volume.get_filesystem().reader() as reader:
+            path.setContent(reader.read())
+        return source.node_id, os.open(path.path, os.O_RDONLY)
+
+    def test_receive_regular_file(self):
+        """
+        ``receive`` reads a data stream from a regular file, which the
+        reactor can't wait on, and closes the file descriptor afterwards.
+        """
+        node_id, fd = self.stream_file()
+        self.successResultOf(
+            self.protocol.receive(node_id, MY_VOLUME.to_bytes(), False, fd))
+        volume = Volume(node_id=node_id, name=MY_VOLUME, service=self.service)
+        self.assertEqual(
+            b"x",
+            volume.get_filesystem().get_path().child(b"file").getContent())
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_receive_reader_fails(self):
+        """
+        If reading the file descriptor can't start, ``receive`` fails, closes
+        the file descriptor and aborts the receiver.
+        """
+        aborted = []
+        self.patch(_daemon, "_read_file", lambda fd, receiver: 1 / 0)
+        self.patch(WriterReceiver, "abort",
+                   lambda receiver: succeed(aborted.append(receiver)))
+        node_id, fd = self.stream_file()
+        self.failureResultOf(
+            self.protocol.receive(node_id, MY_VOLUME.to_bytes(), False, fd),
+            ZeroDivisionError)
+        self.assertEqual(1, len(aborted))
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_clone_to(self):
+        """
+        ``clone_to`` creates a locally owned clone of the volume.
+        """
+        volume = self.remote_volume()
+        volume.get_filesystem().get_path().child(b"file").setContent(b"x")
+        self.successResultOf(
+            self.protocol.clone_to(
+                u"other", MY_VOLUME.to_bytes(), MY_VOLUME2.to_bytes()))
+        clone = self.service.get(MY_VOLUME2).get_filesystem().get_path()
+        self.assertEqual(b"x", clone.child(b"file").getContent())
+
+
+class ConnectToDaemonTests(TestCase):
+    """
+    Tests for ``connect_to_daemon``.
+    """
+    def test_no_socket(self):
+        """
+        If the socket does not exist, ``connect_to_daemon`` fires with
+        ``None`` without trying to connect.
+        """
+        self.assertIs(
+            None, self.successResultOf(
+                connect_to_daemon(object(), FilePath(self.mktemp()))))
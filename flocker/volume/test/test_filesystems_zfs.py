@@ -7,6 +7,9 @@ Further coverage is provided in
 """
 
 import os
+from uuid import uuid4
+
+from zope.interface.verify import verifyObject
 
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.internet.error import ProcessDone, ProcessTerminated
@@ -26,8 +29,14 @@ from ..filesystems.zfs import (
     _DatasetInfo,
     zfs_command, CommandFailed, BadArguments, Filesystem, ZFSSnapshots,
     _sync_command_error_squashed, _latest_common_snapshot, ZFS_ERROR,
-    Snapshot,
+    Snapshot, _parse_resume_token, _snapshots_to_prune, SnapshotPruner,
+    StoragePool, _Inventory, _parse_inventory, _receive_command,
+    _stream_identifier, _supports_compressed_send, _SnapshotRetention,
 )
+from ..filesystems import zfs
+from ..filesystems.errors import InvalidResumeToken
+from ..filesystems.interfaces import IStreamReceiver
+from ..service import Volume, VolumeName
 
 
 class FilesystemTests(SynchronousTestCase):
@@ -324,6 +333,1055 @@ class ZFSSnapshotsTests(SynchronousTestCase):
         self.assertEqual(self.successResultOf(d), [b"name2"])
 
 
+def assume_resumable_receive(test, supported=True):
+    """
+    Make ``Filesystem`` assume that ZFS does or doesn't support resumable
+    receives for ``mypool``, rather than checking first.
+
+    :param test: The ``TestCase``.
+    :param supported: Whether it does, or ``None`` to have it check.
+    """
+    test.patch(zfs, "_resumable_receive",
+               {} if supported is None else {b"mypool": supported})
+
+
+def assume_compressed_send(test, supported=True):
+    """
+    Make ``Filesystem`` assume that ZFS does or doesn't support compressed
+    streams, rather than checking first.
+
+    :param test: The ``TestCase``.
+    :param supported: Whether it does, or ``None`` to have it check.
+    """
+    test.patch(zfs, "_compressed_send", supported)
+
+
+class SupportsCompressedSendTests(SynchronousTestCase):
+    """
+    Tests for ``_supports_compressed_send``.
+    """
+    def setUp(self):
+        assume_compressed_send(self, None)
+        self.reactor = FakeProcessReactor()
+
+    def test_supported(self):
+        """
+        ZFS supports compressed streams if ``zfs send`` lists ``-c`` among
+        its options.
+        """
+        checking = _supports_compressed_send(self.reactor)
+        [process] = self.reactor.processes
+        finish_process(
+            process, b"usage:\n\tsend [-DnPpRvLec] [-[i|I] snapshot] "
+            b"<snapshot>\n", exit_code=2)
+        self.assertEqual(
+            (True, [b"zfs", b"send"]),
+            (self.successResultOf(checking), list(process.args)))
+
+    def test_unsupported(self):
+        """
+        ZFS doesn't support compressed streams if ``zfs send`` doesn't list
+        ``-c`` among its options.
+        """
+        checking = _supports_compressed_send(self.reactor)
+        finish_process(
+            self.reactor.processes[0],
+            b"usage:\n\tsend [-DnPpRve] [-[iI] snapshot] <snapshot>\n",
+            exit_code=2)
+        self.assertFalse(self.successResultOf(checking))
+
+    def test_checks_once(self):
+        """
+        ``zfs`` is only run the first time.
+        """
+        _supports_compressed_send(self.reactor)
+        finish_process(
+            self.reactor.processes[0],
+            b"usage:\n\tsend [-DnPpRve] [-[iI] snapshot] <snapshot>\n",
+            exit_code=2)
+        checking = _supports_compressed_send(self.reactor)
+        self.assertEqual(
+            (False, 1),
+            (self.successResultOf(checking), len(self.reactor.processes)))
+
+
+class ResumeTokenTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.resume_token``.
+    """
+    def setUp(self):
+        assume_resumable_receive(self)
+
+    def resume_token(self, exit_code, output=b""):
+        """
+        Get the resume token of a filesystem, faking ``zfs`` with the given
+        result.
+
+        :return: The ``Deferred`` result and the arguments ``zfs`` was run
+            with.
+        """
+        reactor = FakeProcessReactor()
+        d = Filesystem(b"mypool", b"myfs", reactor=reactor).resume_token()
+        process = reactor.processes[0]
+        process.processProtocol.childDataReceived(1, output)
+        if exit_code:
+            reason = ProcessTerminated(exit_code)
+        else:
+            reason = ProcessDone(0)
+        process.processProtocol.processEnded(Failure(reason))
+        return d, process.args
+
+    def test_command(self):
+        """
+        ``Filesystem.resume_token`` gets the ``receive_resume_token``
+        property of the filesystem.
+        """
+        d, args = self.resume_token(0, b"-\n")
+        self.assertEqual(
+            [b"zfs", b"get", b"-H", b"-o", b"value",
+             b"receive_resume_token", b"mypool/myfs"], args)
+
+    def test_token(self):
+        """
+        ``Filesystem.resume_token`` fires with the property's value.
+        """
+        d, args = self.resume_token(0, b"1-abcd-ef\n")
+        self.assertEqual(b"1-abcd-ef", self.successResultOf(d))
+
+    def test_no_token(self):
+        """
+        ``Filesystem.resume_token`` fires with ``None`` if the property is
+        unset.
+        """
+        d, args = self.resume_token(0, b"-\n")
+        self.assertIs(None, self.successResultOf(d))
+
+    def test_no_filesystem(self):
+        """
+        ``Filesystem.resume_token`` fires with ``None`` if the filesystem
+        doesn't exist.
+        """
+        d, args = self.resume_token(1)
+        self.assertIs(None, self.successResultOf(d))
+
+    def test_unsupported(self):
+        """
+        ``Filesystem.resume_token`` fires with ``None`` if ZFS doesn't know
+        about the property.
+        """
+        d, args = self.resume_token(2)
+        self.assertIs(None, self.successResultOf(d))
+
+    def test_checks_support_once(self):
+        """
+        ``Filesystem.resume_token`` first checks whether ZFS supports
+        resumable receives at all, only the first time.
+        """
+        assume_resumable_receive(self, None)
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        first = filesystem.resume_token()
+        check = reactor.processes[0]
+        finish_process(check)
+        finish_process(reactor.processes[1], b"-\n")
+        second = filesystem.resume_token()
+        self.assertEqual(
+            ([b"zfs", b"get", b"-H", b"-o", b"value",
+              b"receive_resume_token", b"mypool"], None, 3),
+            (check.args, self.successResultOf(first),
+             len(reactor.processes)))
+        self.assertNoResult(second)
+
+    def test_support_unknown(self):
+        """
+        If ZFS doesn't support resumable receives ``Filesystem.resume_token``
+        fires with ``None`` without asking for the token, then or later.
+        """
+        assume_resumable_receive(self, None)
+        reactor = FakeProcessReactor()
+        filesystem = Filesystem(b"mypool", b"myfs", reactor=reactor)
+        first = filesystem.resume_token()
+        finish_process(reactor.processes[0], exit_code=2)
+        second = filesystem.resume_token()
+        self.assertEqual(
+            (None, None, 1),
+            (self.successResultOf(first), self.successResultOf(second),
+             len(reactor.processes)))
+
+    def test_parse_empty(self):
+        """
+        ``_parse_resume_token`` returns ``None`` for empty output.
+        """
+        self.assertIs(None, _parse_resume_token(b""))
+
+
+UUIDS = [b"%s" % (uuid4(),) for i in range(4)]
+
+# ``zfs list`` output for ``_inventory_command(b"mypool")``.  The snapshots
+# of ``mypool/myfs`` are listed out of order.
+INVENTORY = b"".join([
+    b"mypool\t/flocker\t0\t1\n",
+    b"mypool/myfs\t/flocker/myfs\t1048576\t5\n",
+    b"mypool/myfs@%s\t-\t-\t11\n" % (UUIDS[1],),
+    b"mypool/myfs@%s\t-\t-\t10\n" % (UUIDS[0],),
+    b"mypool/myfs@%s\t-\t-\t12\n" % (UUIDS[2],),
+    b"mypool/myfs@%s\t-\t-\t13\n" % (UUIDS[3],),
+    b"mypool/other\t/flocker/other\t0\t20\n",
+    b"mypool/other/nested\t/flocker/other/nested\t0\t21\n",
+])
+
+
+class SnapshotsToPruneTests(SynchronousTestCase):
+    """
+    Tests for ``_snapshots_to_prune``.
+    """
+    def test_oldest(self):
+        """
+        All but the most recent ``keep`` snapshots are pruned.
+        """
+        snapshots = [Snapshot(name=name) for name in UUIDS]
+        self.assertEqual(snapshots[:2], _snapshots_to_prune(snapshots, 2))
+
+    def test_too_few(self):
+        """
+        Nothing is pruned if there are no more than ``keep`` snapshots.
+        """
+        snapshots = [Snapshot(name=name) for name in UUIDS[:2]]
+        self.assertEqual([], _snapshots_to_prune(snapshots, 2))
+
+    def test_not_created_by_flocker(self):
+        """
+        Snapshots which Flocker did not create are neither pruned nor
+        counted towards ``keep``.
+        """
+        snapshots = [
+            Snapshot(name=b"backup"), Snapshot(name=UUIDS[0]),
+            Snapshot(name=UUIDS[1]), Snapshot(name=b"another"),
+            Snapshot(name=UUIDS[2]),
+        ]
+        self.assertEqual(
+            [Snapshot(name=UUIDS[0])], _snapshots_to_prune(snapshots, 2))
+
+    def test_replicated(self):
+        """
+        The latest snapshots peers were pushed are not pruned, however old
+        they are.
+        """
+        snapshots = [Snapshot(name=name) for name in UUIDS]
+        self.assertEqual(
+            [Snapshot(name=UUIDS[1])],
+            _snapshots_to_prune(snapshots, 2, frozenset([UUIDS[0]])))
+
+
+def finish_process(process, output=b"", exit_code=0):
+    """
+    Make a fake process produce some output and exit.
+
+    :param SpawnProcessArguments process: The process.
+    :param bytes output: Its standard output.
+    :param int exit_code: Its exit status.
+    """
+    process.processProtocol.childDataReceived(1, output)
+    if exit_code:
+        reason = ProcessTerminated(exit_code)
+    else:
+        reason = ProcessDone(0)
+    process.processProtocol.processEnded(Failure(reason))
+
+
+class StreamIdentifierTests(SynchronousTestCase):
+    """
+    Tests for ``_stream_identifier``.
+    """
+    def setUp(self):
+        self.filesystem = Filesystem(b"mypool", b"myfs")
+
+    def test_full(self):
+        """
+        The whole of the new snapshot is sent if the writer has no snapshots.
+        """
+        self.assertEqual(
+            [b"mypool/myfs@new"],
+            _stream_identifier(
+                self.filesystem, b"mypool/myfs@new",
+                [Snapshot(name=b"a"), Snapshot(name=b"new")], None))
+
+    def test_incremental(self):
+        """
+        An incremental stream from the latest common snapshot is sent if
+        there is one.
+        """
+        self.assertEqual(
+            [b"-i", b"mypool/myfs@b", b"mypool/myfs@new"],
+            _stream_identifier(
+                self.filesystem, b"mypool/myfs@new",
+                [Snapshot(name=b"a"), Snapshot(name=b"b"),
+                 Snapshot(name=b"new")],
+                [Snapshot(name=b"a"), Snapshot(name=b"b")]))
+
+
+class ReceiveCommandTests(SynchronousTestCase):
+    """
+    Tests for ``_receive_command``.
+    """
+    def test_force(self):
+        """
+        ``-F`` is passed if ``force`` is true.
+        """
+        self.assertEqual(
+            [b"receive", b"-F", b"-s", b"mypool/myfs"],
+            _receive_command(Filesystem(b"mypool", b"myfs"), True, True))
+
+    def test_no_force(self):
+        """
+        ``-F`` is not passed if ``force`` is false.
+        """
+        self.assertEqual(
+            [b"receive", b"-s", b"mypool/myfs"],
+            _receive_command(Filesystem(b"mypool", b"myfs"), False, True))
+
+    def test_not_resumable(self):
+        """
+        ``-s`` is not passed if ``resumable`` is false.
+        """
+        self.assertEqual(
+            ([b"receive", b"-F", b"mypool/myfs"],
+             [b"receive", b"mypool/myfs"]),
+            (_receive_command(Filesystem(b"mypool", b"myfs"), True, False),
+             _receive_command(Filesystem(b"mypool", b"myfs"), False, False)))
+
+
+class RecordingConsumer(object):
+    """
+    An ``IConsumer`` which records what is done to it.
+
+    :ivar producer: The registered producer, or ``None``.
+    :ivar bytes data: Everything written so far.
+    """
+    def __init__(self):
+        self.producer = None
+        self.data = b""
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.data += data
+
+
+class SendTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.send``.
+    """
+    def setUp(self):
+        assume_compressed_send(self)
+        self.reactor = FakeProcessReactor()
+        self.retention = _SnapshotRetention()
+        self.filesystem = Filesystem(
+            b"mypool", b"myfs", reactor=self.reactor,
+            retention=self.retention)
+        self.consumer = RecordingConsumer()
+
+    def start_send(self, compression=None):
+        """
+        Send a full stream, completing the commands which run before
+        ``zfs send``.
+
+        :param compression: ``None`` to send to a receiver which doesn't
+            accept compressed streams, otherwise the output of the command
+            which gets the compression of the filesystem.
+
+        :return: The ``Deferred`` result of ``send`` and the
+            ``SpawnProcessArguments`` of ``zfs send``.
+        """
+        sending = self.filesystem.send(
+            self.consumer, compressed=compression is not None)
+        [snapshot] = self.reactor.processes
+        finish_process(snapshot)
+        finish_process(self.reactor.processes[1])
+        if compression is not None:
+            finish_process(self.reactor.processes[2], compression)
+        return sending, self.reactor.processes[-1]
+
+    def test_command(self):
+        """
+        ``Filesystem.send`` snapshots the filesystem and runs ``zfs send`` for
+        the new snapshot.
+        """
+        sending, process = self.start_send()
+        snapshot = self.reactor.processes[0].args[-1]
+        self.assertEqual(
+            ([b"zfs", b"snapshot"], [b"zfs", b"send", snapshot]),
+            (self.reactor.processes[0].args[:2], process.args))
+
+    def test_compressed(self):
+        """
+        The blocks of a filesystem which ZFS compresses are sent compressed
+        if the receiver accepts compressed streams.
+        """
+        sending, process = self.start_send(b"lz4\n")
+        self.assertEqual(
+            ([b"zfs", b"get", b"-H", b"-o", b"value", b"compression",
+              b"mypool/myfs"], [b"zfs", b"send", b"-c"]),
+            (self.reactor.processes[2].args, process.args[:3]))
+
+    def test_not_compressed(self):
+        """
+        The blocks of a filesystem which ZFS doesn't compress are sent as
+        they are.
+        """
+        sending, process = self.start_send(b"off\n")
+        self.assertEqual(
+            (4, [b"zfs", b"send"]),
+            (len(self.reactor.processes), process.args[:2]))
+        self.assertNotIn(b"-c", process.args)
+
+    def test_not_accepted(self):
+        """
+        If the receiver doesn't accept compressed streams the blocks are
+        sent uncompressed, without checking the filesystem's compression.
+        """
+        sending, process = self.start_send()
+        self.assertEqual(
+            (3, [b"zfs", b"send"]),
+            (len(self.reactor.processes), process.args[:2]))
+        self.assertNotIn(b"-c", process.args)
+
+    def test_not_supported(self):
+        """
+        If the ZFS here doesn't support compressed streams the blocks are
+        sent uncompressed even if the receiver accepts them.
+        """
+        assume_compressed_send(self, False)
+        self.filesystem.send(self.consumer, compressed=True)
+        finish_process(self.reactor.processes[0])
+        finish_process(self.reactor.processes[1])
+        [snapshot, listing, process] = self.reactor.processes
+        self.assertNotIn(b"-c", process.args)
+
+    def test_writes_output(self):
+        """
+        The output of ``zfs send`` is written to the consumer and the result
+        fires once the process exits successfully.
+        """
+        sending, process = self.start_send()
+        process.processProtocol.childDataReceived(1, b"stream")
+        self.assertNoResult(sending)
+        finish_process(process, b"more")
+        self.assertEqual(
+            (None, b"streammore"),
+            (self.successResultOf(sending), self.consumer.data))
+
+    def test_flow_control(self):
+        """
+        The process is registered as the consumer's streaming producer until
+        it exits, so the consumer can pause reading from it.
+        """
+        sending, process = self.start_send()
+        producer = self.consumer.producer
+        producer.pauseProducing()
+        paused = process.transport.paused
+        producer.resumeProducing()
+        resumed = process.transport.paused
+        finish_process(process)
+        self.assertEqual(
+            (True, False, True, None),
+            (paused, resumed, process.transport.stdin_closed,
+             self.consumer.producer))
+
+    def test_stop_producing(self):
+        """
+        If the consumer stops the producer, ``zfs send`` is terminated.
+        """
+        sending, process = self.start_send()
+        self.consumer.producer.stopProducing()
+        self.assertEqual(["TERM"], process.transport.signals)
+
+    def test_failed(self):
+        """
+        If ``zfs send`` fails the result fails with ``CommandFailed``.
+        """
+        sending, process = self.start_send()
+        finish_process(process, exit_code=1)
+        self.failureResultOf(sending, CommandFailed)
+
+    def test_held(self):
+        """
+        The filesystem's snapshots are held from the start of
+        ``Filesystem.send`` until ``zfs send`` exits, so that the one the
+        stream is based on isn't pruned meanwhile.
+        """
+        sending, process = self.start_send()
+        held = self.retention.held(b"mypool/myfs")
+        finish_process(process)
+        self.assertEqual(
+            (True, False), (held, self.retention.held(b"mypool/myfs")))
+
+    def test_resume_token(self):
+        """
+        With a resume token ``Filesystem.send`` checks the token and then
+        resumes the stream it identifies.
+        """
+        self.filesystem.send(self.consumer, resume_token=b"1-abc")
+        [check] = self.reactor.processes
+        finish_process(check)
+        self.assertEqual(
+            ([b"zfs", b"send", b"-n", b"-t", b"1-abc"],
+             [b"zfs", b"send", b"-t", b"1-abc"]),
+            (check.args, self.reactor.processes[1].args))
+
+    def test_invalid_resume_token(self):
+        """
+        ``Filesystem.send`` fails with ``InvalidResumeToken`` if ``zfs``
+        rejects the resume token.
+        """
+        sending = self.filesystem.send(self.consumer, resume_token=b"1-abc")
+        finish_process(self.reactor.processes[0], exit_code=1)
+        self.failureResultOf(sending, InvalidResumeToken)
+        self.assertEqual(
+            (1, False), (len(self.reactor.processes),
+                         self.retention.held(b"mypool/myfs")))
+
+
+class ReceiverTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.receiver``.
+    """
+    def setUp(self):
+        assume_resumable_receive(self)
+        assume_compressed_send(self)
+        self.reactor = FakeProcessReactor()
+        self.retention = _SnapshotRetention()
+        self.filesystem = Filesystem(
+            b"mypool", b"myfs", mountpoint=FilePath(b"/flocker/myfs"),
+            reactor=self.reactor, retention=self.retention)
+
+    def start_receiver(self, resume_token=b"-\n", exists=True):
+        """
+        Get a receiver for a fresh stream, completing the commands which run
+        before ``zfs receive``.
+
+        :return: The receiver and the ``SpawnProcessArguments`` of
+            ``zfs receive``.
+        """
+        receiving = self.filesystem.receiver()
+        finish_process(self.reactor.processes[0], resume_token)
+        if resume_token != b"-\n":
+            finish_process(self.reactor.processes[-1])
+        finish_process(self.reactor.processes[-1], exit_code=int(not exists))
+        return (self.successResultOf(receiving),
+                self.reactor.processes[-1])
+
+    def test_interface(self):
+        """
+        ``Filesystem.receiver`` fires with an ``IStreamReceiver`` provider.
+        """
+        receiver, process = self.start_receiver()
+        self.assertTrue(verifyObject(IStreamReceiver, receiver))
+
+    def test_compressed(self):
+        """
+        The receiver accepts compressed streams if ZFS supports them.
+        """
+        receiver, process = self.start_receiver()
+        self.assertTrue(receiver.compressed)
+
+    def test_not_compressed(self):
+        """
+        The receiver doesn't accept compressed streams if ZFS doesn't
+        support them.
+        """
+        assume_compressed_send(self, False)
+        receiver, process = self.start_receiver()
+        self.assertFalse(receiver.compressed)
+
+    def test_command_exists(self):
+        """
+        If the filesystem exists the stream is received with ``-F``.
+        """
+        receiver, process = self.start_receiver()
+        self.assertEqual(
+            [b"zfs", b"receive", b"-F", b"-s", b"mypool/myfs"], process.args)
+
+    def test_command_missing(self):
+        """
+        If the filesystem does not exist the stream is received without
+        ``-F``.
+        """
+        receiver, process = self.start_receiver(exists=False)
+        self.assertEqual(
+            [b"zfs", b"receive", b"-s", b"mypool/myfs"], process.args)
+
+    def test_command_not_resumable(self):
+        """
+        If ZFS doesn't support resumable receives the stream is received
+        without ``-s``.
+        """
+        assume_resumable_receive(self, None)
+        receiving = self.filesystem.receiver()
+        finish_process(self.reactor.processes[0], exit_code=2)
+        finish_process(self.reactor.processes[1])
+        self.successResultOf(receiving)
+        self.assertEqual(
+            [b"zfs", b"receive", b"-F", b"mypool/myfs"],
+            self.reactor.processes[2].args)
+
+    def test_discards_partial_state(self):
+        """
+        A fresh stream discards the partially received state of an earlier
+        one.
+        """
+        self.start_receiver(resume_token=b"1-abc\n")
+        self.assertEqual(
+            [b"zfs", b"receive", b"-A", b"mypool/myfs"],
+            self.reactor.processes[1].args)
+
+    def test_resume(self):
+        """
+        A resumed stream keeps the partially received state and is received
+        with ``-F``, without checking whether the filesystem exists.
+        """
+        receiving = self.filesystem.receiver(resume=True)
+        finish_process(self.reactor.processes[0], b"1-abc\n")
+        self.successResultOf(receiving)
+        self.assertEqual(
+            [b"zfs", b"receive", b"-F", b"-s", b"mypool/myfs"],
+            self.reactor.processes[1].args)
+
+    def test_writes(self):
+        """
+        Data and producers given to the receiver go to the standard input of
+        ``zfs receive``.
+        """
+        receiver, process = self.start_receiver()
+        producer = object()
+        receiver.registerProducer(producer, True)
+        receiver.write(b"stream")
+        self.assertEqual(
+            (producer, b"stream"),
+            (process.transport.producer, process.transport.data))
+
+    def test_finish(self):
+        """
+        ``IStreamReceiver.finish`` closes the standard input of
+        ``zfs receive`` and once it exits sets the mountpoint of the
+        filesystem.
+        """
+        receiver, process = self.start_receiver()
+        finishing = receiver.finish()
+        closed = process.transport.stdin_closed
+        finish_process(process)
+        set_mountpoint = self.reactor.processes[-1]
+        finish_process(set_mountpoint)
+        self.assertEqual(
+            (True, [b"zfs", b"set", b"mountpoint=/flocker/myfs",
+                    b"mypool/myfs"], None),
+            (closed, set_mountpoint.args, self.successResultOf(finishing)))
+
+    def test_finish_failed(self):
+        """
+        ``IStreamReceiver.finish`` fails if ``zfs receive`` fails.
+        """
+        receiver, process = self.start_receiver()
+        finishing = receiver.finish()
+        finish_process(process, exit_code=1)
+        self.failureResultOf(finishing, CommandFailed)
+
+    def test_abort(self):
+        """
+        ``IStreamReceiver.abort`` closes the standard input of
+        ``zfs receive`` and succeeds when it fails because of the truncated
+        stream.
+        """
+        receiver, process = self.start_receiver()
+        aborting = receiver.abort()
+        finish_process(process, exit_code=1)
+        self.assertEqual(
+            (True, None),
+            (process.transport.stdin_closed, self.successResultOf(aborting)))
+
+    def test_held(self):
+        """
+        The filesystem's snapshots are held from the start of
+        ``Filesystem.receiver`` until ``zfs receive`` exits, so that the one
+        an incremental stream is based on isn't pruned meanwhile.
+        """
+        receiving = self.filesystem.receiver()
+        starting = self.retention.held(b"mypool/myfs")
+        finish_process(self.reactor.processes[0], b"-\n")
+        finish_process(self.reactor.processes[1])
+        receiver = self.successResultOf(receiving)
+        [process] = self.reactor.processes[2:]
+        receiving = self.retention.held(b"mypool/myfs")
+        receiver.finish()
+        finish_process(process)
+        self.assertEqual(
+            (True, True, False),
+            (starting, receiving, self.retention.held(b"mypool/myfs")))
+
+    def test_held_failed(self):
+        """
+        If ``zfs receive`` can't be started the filesystem's snapshots are
+        no longer held.
+        """
+        receiving = self.filesystem.receiver()
+        finish_process(self.reactor.processes[0], b"-\n")
+        finish_process(self.reactor.processes[1], exit_code=2)
+        self.failureResultOf(receiving, BadArguments)
+        self.assertFalse(self.retention.held(b"mypool/myfs"))
+
+
+class SnapshotPrunerTests(SynchronousTestCase):
+    """
+    Tests for ``SnapshotPruner``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"mypool", FilePath(self.mktemp()))
+        self.pruner = SnapshotPruner(self.reactor, self.pool, keep=2)
+
+    def list_inventory(self):
+        """
+        Finish the listing of the pool's inventory, which has one filesystem
+        with a snapshot for each of ``UUIDS``.
+        """
+        finish_process(self.reactor.processes[0], INVENTORY)
+
+    def test_too_few_kept(self):
+        """
+        ``SnapshotPruner`` refuses to keep fewer than two snapshots, since
+        that could destroy the basis of a push in progress.
+        """
+        self.assertRaises(
+            ValueError, SnapshotPruner, self.reactor, self.pool, keep=1)
+
+    def test_prune(self):
+        """
+        ``SnapshotPruner.prune`` destroys the older snapshots of each
+        filesystem, one at a time.
+        """
+        d = self.pruner.prune()
+        self.list_inventory()
+        finish_process(self.reactor.processes[1])
+        finish_process(self.reactor.processes[2])
+        self.assertEqual(
+            (None,
+             [[b"zfs", b"destroy", b"mypool/myfs@%s" % (name,)]
+              for name in UUIDS[:2]]),
+            (self.successResultOf(d),
+             [process.args for process in self.reactor.processes[1:]]))
+
+    def test_destroy_fails(self):
+        """
+        If a snapshot can't be destroyed, the error is logged and pruning
+        continues.
+        """
+        d = self.pruner.prune()
+        self.list_inventory()
+        finish_process(self.reactor.processes[1], exit_code=1)
+        finish_process(self.reactor.processes[2])
+        self.flushLoggedErrors(CommandFailed)
+        self.assertEqual(
+            (None, 3), (self.successResultOf(d), len(self.reactor.processes)))
+
+    def test_replicated_kept(self):
+        """
+        The latest snapshot a peer was pushed is kept even after pushes to
+        another peer made it older than the ``keep`` most recent ones.
+        """
+        filesystem = Filesystem(
+            b"mypool", b"myfs", reactor=self.reactor,
+            retention=self.pool._retention)
+        filesystem.replicated(
+            b"peer-b", [Snapshot(name=name) for name in UUIDS[:1]])
+        filesystem.replicated(
+            b"peer-c", [Snapshot(name=name) for name in UUIDS])
+        d = self.pruner.prune()
+        self.list_inventory()
+        finish_process(self.reactor.processes[1])
+        self.assertEqual(
+            (None, [[b"zfs", b"destroy", b"mypool/myfs@%s" % (UUIDS[1],)]]),
+            (self.successResultOf(d),
+             [process.args for process in self.reactor.processes[1:]]))
+
+    def test_held_skipped(self):
+        """
+        Snapshots of a filesystem which is being sent or received are not
+        destroyed, even if the stream started after the inventory was
+        taken.
+        """
+        d = self.pruner.prune()
+        self.pool._retention.hold(b"mypool/myfs")
+        self.list_inventory()
+        self.assertEqual(
+            (None, 1), (self.successResultOf(d), len(self.reactor.processes)))
+
+    def test_schedule(self):
+        """
+        While it is running ``SnapshotPruner`` prunes every ``interval``
+        seconds.
+        """
+        self.pruner.interval = 10
+        self.pruner.startService()
+        self.reactor.advance(9)
+        not_yet = len(self.reactor.processes)
+        self.reactor.advance(1)
+        self.list_inventory()
+        finish_process(self.reactor.processes[1])
+        finish_process(self.reactor.processes[2])
+        self.pruner.stopService()
+        self.reactor.advance(10)
+        self.assertEqual(
+            (0, 3, []), (not_yet, len(self.reactor.processes),
+                         self.reactor.getDelayedCalls()))
+
+
+class ParseInventoryTests(SynchronousTestCase):
+    """
+    Tests for ``_parse_inventory``.
+    """
+    def setUp(self):
+        self.inventory = _parse_inventory(INVENTORY, b"mypool")
+
+    def test_filesystems(self):
+        """
+        Every filesystem in the pool is in ``filesystems``.
+        """
+        self.assertEqual(
+            {b"mypool": _DatasetInfo(
+                dataset=b"", mountpoint=b"/flocker", refquota=None),
+             b"mypool/myfs": _DatasetInfo(
+                 dataset=b"myfs", mountpoint=b"/flocker/myfs",
+                 refquota=1048576),
+             b"mypool/other": _DatasetInfo(
+                 dataset=b"other", mountpoint=b"/flocker/other",
+                 refquota=None),
+             b"mypool/other/nested": _DatasetInfo(
+                 dataset=b"other/nested",
+                 mountpoint=b"/flocker/other/nested", refquota=None)},
+            self.inventory.filesystems)
+
+    def test_children(self):
+        """
+        ``_PoolInventory.children`` returns only the direct children of the
+        pool's root filesystem.
+        """
+        self.assertEqual(
+            [b"myfs", b"other"],
+            sorted(info.dataset for info in self.inventory.children()))
+
+    def test_snapshots(self):
+        """
+        The snapshots of each filesystem are ordered by the transaction group
+        they were created in.
+        """
+        self.assertEqual({b"mypool/myfs": UUIDS}, self.inventory.snapshots)
+
+
+class InventoryTests(SynchronousTestCase):
+    """
+    Tests for ``_Inventory``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.inventory = _Inventory(self.reactor, b"mypool", max_age=10)
+
+    def test_command(self):
+        """
+        ``_Inventory.get`` lists the whole pool with a single ``zfs list``.
+        """
+        d = self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.assertEqual(
+            ([b"zfs", b"list", b"-H", b"-p", b"-t", b"filesystem,snapshot",
+              b"-o", b"name,mountpoint,refquota,createtxg", b"-r",
+              b"mypool"],
+             _parse_inventory(INVENTORY, b"mypool")),
+            (self.reactor.processes[0].args, self.successResultOf(d)))
+
+    def test_cached(self):
+        """
+        ``_Inventory.get`` reuses the result of an earlier listing.
+        """
+        self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        d = self.inventory.get()
+        self.assertEqual(
+            (_parse_inventory(INVENTORY, b"mypool"), 1),
+            (self.successResultOf(d), len(self.reactor.processes)))
+
+    def test_shared_listing(self):
+        """
+        Calls to ``_Inventory.get`` while a listing is in progress wait for
+        its result.
+        """
+        first = self.inventory.get()
+        second = self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.assertEqual(
+            (self.successResultOf(first), 1),
+            (self.successResultOf(second), len(self.reactor.processes)))
+
+    def test_max_age(self):
+        """
+        A listing is repeated once it is ``max_age`` seconds old.
+        """
+        self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.reactor.advance(10)
+        self.inventory.get()
+        self.assertEqual(2, len(self.reactor.processes))
+
+    def test_invalidate(self):
+        """
+        ``_Inventory.invalidate`` discards the cached listing.
+        """
+        self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.inventory.invalidate()
+        self.inventory.get()
+        self.assertEqual(2, len(self.reactor.processes))
+
+    def test_invalidate_during_listing(self):
+        """
+        If the inventory is invalidated while a listing is in progress, a
+        later call to ``_Inventory.get`` starts another listing and the
+        result of the first one is not cached.
+        """
+        first = self.inventory.get()
+        self.inventory.invalidate()
+        second = self.inventory.get()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        finish_process(self.reactor.processes[1], b"mypool\t-\t0\t1\n")
+        self.inventory.get()
+        self.assertEqual(
+            ({b"mypool/myfs": UUIDS}, {}, 2),
+            (self.successResultOf(first).snapshots,
+             self.successResultOf(second).snapshots,
+             len(self.reactor.processes)))
+
+    def test_error(self):
+        """
+        If the listing fails, every waiting call to ``_Inventory.get`` fails
+        and the next one lists the pool again.
+        """
+        first = self.inventory.get()
+        second = self.inventory.get()
+        finish_process(self.reactor.processes[0], exit_code=1)
+        self.failureResultOf(first, CommandFailed)
+        self.failureResultOf(second, CommandFailed)
+        self.inventory.get()
+        self.assertEqual(2, len(self.reactor.processes))
+
+
+class StoragePoolInventoryTests(SynchronousTestCase):
+    """
+    Tests for the use of the inventory by ``StoragePool`` and its
+    ``Filesystem`` instances.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(
+            self.reactor, b"mypool", FilePath(b"/flocker"))
+
+    def test_enumerate(self):
+        """
+        ``StoragePool.enumerate`` returns the direct children of the pool's
+        root filesystem, from the inventory.
+        """
+        d = self.pool.enumerate()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.assertEqual(
+            {Filesystem(b"mypool", b"myfs"), Filesystem(b"mypool", b"other")},
+            self.successResultOf(d))
+
+    def test_snapshots(self):
+        """
+        ``Filesystem.snapshots`` of a filesystem from the pool answers from
+        the same inventory as ``StoragePool.enumerate``.
+        """
+        d = self.pool.enumerate()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        [filesystem] = [fs for fs in self.successResultOf(d)
+                        if fs.dataset == b"myfs"]
+        self.assertEqual(
+            ([Snapshot(name=name) for name in UUIDS], 1),
+            (self.successResultOf(filesystem.snapshots()),
+             len(self.reactor.processes)))
+
+    def test_no_snapshots(self):
+        """
+        ``Filesystem.snapshots`` of a filesystem which does not exist is an
+        empty list.
+        """
+        filesystem = Filesystem(
+            b"mypool", b"missing", reactor=self.reactor,
+            inventory=self.pool._inventory)
+        d = filesystem.snapshots()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.assertEqual([], self.successResultOf(d))
+
+    def test_exists(self):
+        """
+        ``Filesystem._exists`` answers from the inventory if it is current.
+        """
+        self.pool.enumerate()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.assertEqual(
+            (True, False),
+            (Filesystem(b"mypool", b"myfs",
+                        inventory=self.pool._inventory)._exists(),
+             Filesystem(b"mypool", b"missing",
+                        inventory=self.pool._inventory)._exists()))
+
+    def test_receiver_checks_existence(self):
+        """
+        ``Filesystem.receiver`` asks ZFS whether the filesystem exists,
+        rather than trusting a current inventory which may be out of date,
+        before deciding to receive with ``-F``.
+        """
+        assume_resumable_receive(self)
+        assume_compressed_send(self)
+        self.pool.enumerate()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        filesystem = Filesystem(
+            b"mypool", b"myfs", mountpoint=FilePath(b"/flocker/myfs"),
+            reactor=self.reactor, inventory=self.pool._inventory)
+        receiving = filesystem.receiver()
+        finish_process(self.reactor.processes[1], b"-\n")
+        finish_process(self.reactor.processes[2], exit_code=1)
+        self.successResultOf(receiving)
+        self.assertEqual(
+            ([b"zfs", b"list", b"mypool/myfs"],
+             [b"zfs", b"receive", b"-s", b"mypool/myfs"]),
+            (list(self.reactor.processes[2].args),
+             self.reactor.processes[3].args))
+
+    def test_mutation_invalidates(self):
+        """
+        Changing the pool through ``StoragePool`` invalidates the inventory
+        once the change is finished.
+        """
+        self.pool.enumerate()
+        finish_process(self.reactor.processes[0], INVENTORY)
+        self.pool.destroy(Volume(
+            node_id=u"abc", name=VolumeName(namespace=u"ns", dataset_id=u"x"),
+            service=None))
+        # ``destroy`` lists the filesystem's snapshots using the inventory and
+        # then destroys the filesystem.
+        before = self.pool._inventory.cached()
+        finish_process(self.reactor.processes[1])
+        after = self.pool._inventory.cached()
+        self.pool.enumerate()
+        self.assertEqual(
+            (_parse_inventory(INVENTORY, b"mypool"), None, 3),
+            (before, after, len(self.reactor.processes)))
+
+
 class LatestCommonSnapshotTests(SynchronousTestCase):
     """
     Tests for ``_latest_common_snapshot``.
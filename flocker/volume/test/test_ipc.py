@@ -8,12 +8,15 @@ from __future__ import absolute_import
 
 from zope.interface.verify import verifyObject
 
+from twisted.internet.error import ProcessDone, ProcessTerminated
 from twisted.internet.task import Clock
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
 from ..service import VolumeService, Volume, DEFAULT_CONFIG_PATH, VolumeName
 from ..filesystems.zfs import Snapshot
+from ..filesystems.interfaces import IStreamReceiver
 from ..filesystems.memory import FilesystemStoragePool
 from .._ipc import (
     IRemoteVolumeManager, RemoteVolumeManager, LocalVolumeManager,
@@ -21,6 +24,7 @@ from .._ipc import (
 from ..testtools import ServicePair
 from ...common import FakeNode
 from ...common._ipc import ProcessNode
+from ...testtools import FakeProcessReactor
 
 
 MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
@@ -64,25 +68,59 @@ def make_iremote_volume_manager(fixture):
             getting_snapshots.addCallback(got_snapshots)
             return getting_snapshots
 
-        def test_receive_exceptions_pass_through(self):
+        def test_resume_token_no_filesystem(self):
             """
-            Exceptions raised in the ``receive()`` context manager are not
-            swallowed.
+            If the filesystem does not exist on the remote manager there is
+            no push to resume.
+            """
+            service_pair = fixture(self)
+            creating = service_pair.from_service.create(
+                service_pair.from_service.get(MY_VOLUME)
+            )
+
+            def created(volume):
+                return service_pair.remote.resume_token(volume)
+            getting_resume_token = creating.addCallback(created)
+            getting_resume_token.addCallback(self.assertIs, None)
+            return getting_resume_token
+
+        def send(self, volume, remote):
+            """
+            Send the contents of a volume to a remote volume manager with
+            ``receiver``.
+
+            :return: A ``Deferred`` that fires when the receiver has
+                finished.
+            """
+            receiving = remote.receiver(volume)
+
+            def got_receiver(receiver):
+                sending = volume.get_filesystem().send(receiver)
+                sending.addCallback(lambda _: receiver.finish())
+                return sending
+            receiving.addCallback(got_receiver)
+            return receiving
+
+        def test_receiver_provides(self):
+            """
+            ``receiver`` returns a ``Deferred`` that fires with an
+            ``IStreamReceiver`` provider.
             """
             service_pair = fixture(self)
             created = service_pair.from_service.create(
                 service_pair.from_service.get(MY_VOLUME)
             )
+            created.addCallback(service_pair.remote.receiver)
 
-            def got_volume(volume):
-                with service_pair.remote.receive(volume):
-                    raise RuntimeError()
-            created.addCallback(got_volume)
-            return self.assertFailure(created, RuntimeError)
+            def got_receiver(receiver):
+                self.assertTrue(verifyObject(IStreamReceiver, receiver))
+                return receiver.abort()
+            created.addCallback(got_receiver)
+            return created
 
         def test_receive_creates_volume(self):
             """
-            ``receive`` creates a volume.
+            ``receiver`` creates a volume.
             """
             service_pair = fixture(self)
             created = service_pair.from_service.create(
@@ -90,9 +128,7 @@ def make_iremote_volume_manager(fixture):
             )
 
             def do_push(volume):
-                with volume.get_filesystem().reader() as reader:
-                    with service_pair.remote.receive(volume) as receiver:
-                        receiver.write(reader.read())
+                return self.send(volume, service_pair.remote)
             created.addCallback(do_push)
 
             def pushed(_):
@@ -110,7 +146,7 @@ def make_iremote_volume_manager(fixture):
             return created
 
         def test_creates_files(self):
-            """``receive`` recreates files pushed from origin."""
+            """``receiver`` recreates files pushed from origin."""
             service_pair = fixture(self)
             created = service_pair.from_service.create(
                 service_pair.from_service.get(MY_VOLUME)
@@ -119,10 +155,7 @@ def make_iremote_volume_manager(fixture):
             def do_push(volume):
                 root = volume.get_filesystem().get_path()
                 root.child(b"afile.txt").setContent(b"WORKS!")
-
-                with volume.get_filesystem().reader() as reader:
-                    with service_pair.remote.receive(volume) as receiver:
-                        receiver.write(reader.read())
+                return self.send(volume, service_pair.remote)
             created.addCallback(do_push)
 
             def pushed(_):
@@ -167,8 +200,8 @@ def make_iremote_volume_manager(fixture):
             created = self.remotely_owned_volume(service_pair)
 
             def got_volume(pushed_volume):
-                service_pair.remote.acquire(pushed_volume)
-                d = to_service.enumerate()
+                d = service_pair.remote.acquire(pushed_volume)
+                d.addCallback(lambda _: to_service.enumerate())
                 d.addCallback(lambda results: self.assertEqual(
                     list(results),
                     [Volume(node_id=to_service.node_id,
@@ -195,15 +228,17 @@ def make_iremote_volume_manager(fixture):
                     pushed_volume, service_pair.remote)
 
                 def pushed(ignored):
-                    service_pair.remote.acquire(pushed_volume)
+                    return service_pair.remote.acquire(pushed_volume)
+                pushing.addCallback(pushed)
 
+                def acquired(ignored):
                     filesystem = Volume(node_id=to_service.node_id,
                                         name=pushed_volume.name,
                                         service=to_service).get_filesystem()
                     new_root = filesystem.get_path()
                     self.assertEqual(new_root.child(b"test").getContent(),
                                      b"some data")
-                pushing.addCallback(pushed)
+                pushing.addCallback(acquired)
                 return pushing
 
             created.addCallback(got_volume)
@@ -217,10 +252,8 @@ def make_iremote_volume_manager(fixture):
             to_service = service_pair.to_service
             created = self.remotely_owned_volume(service_pair)
 
-            def got_volume(pushed_volume):
-                result = service_pair.remote.acquire(pushed_volume)
-                self.assertEqual(result, to_service.node_id)
-            created.addCallback(got_volume)
+            created.addCallback(service_pair.remote.acquire)
+            created.addCallback(self.assertEqual, to_service.node_id)
             return created
 
         def test_clone_to(self):
@@ -332,13 +365,68 @@ class RemoteVolumeManagerTests(TestCase):
         node = FakeNode()
 
         remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
-        with remote.receive(self.volume):
-            pass
+        self.successResultOf(
+            self.successResultOf(remote.receiver(self.volume)).finish())
         self.assertEqual(node.remote_command,
                          [b"flocker-volume", b"--config", b"/path/to/json",
                           b"receive", self.volume.node_id.encode("ascii"),
                           b"myns.myvol"])
 
+    def test_receive_resume_destination_run(self):
+        """
+        Receiving the rest of an interrupted push calls ``flocker-volume``
+        remotely with ``receive --resume``.
+        """
+        node = FakeNode()
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        self.successResultOf(self.successResultOf(
+            remote.receiver(self.volume, resume=True)).finish())
+        self.assertEqual(node.remote_command,
+                         [b"flocker-volume", b"--config", b"/path/to/json",
+                          b"receive", b"--resume",
+                          self.volume.node_id.encode("ascii"),
+                          b"myns.myvol"])
+
+    def test_resume_token_destination_run(self):
+        """
+        ``RemoteVolumeManager.resume_token`` calls ``flocker-volume`` remotely
+        with the ``resume_token`` sub-command and returns its output.
+        """
+        node = FakeNode([b"1-abc-def\n"])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        resume_token = self.successResultOf(remote.resume_token(self.volume))
+        self.assertEqual(
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"resume_token", self.volume.node_id.encode("ascii"),
+              b"myns.myvol"], b"1-abc-def"),
+            (node.remote_command, resume_token))
+
+    def test_no_resume_token(self):
+        """
+        ``RemoteVolumeManager.resume_token`` returns ``None`` if
+        ``flocker-volume resume_token`` has no output.
+        """
+        node = FakeNode([b""])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        self.assertIs(
+            None, self.successResultOf(remote.resume_token(self.volume)))
+
+    def test_resume_token_unsupported(self):
+        """
+        ``RemoteVolumeManager.resume_token`` returns ``None`` if
+        ``flocker-volume resume_token`` fails, e.g. because the destination's
+        ``flocker-volume`` has no such sub-command, so that pushing falls
+        back to sending a complete stream.
+        """
+        node = FakeNode([IOError("Bad exit", [b"flocker-volume"], 2)])
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        self.assertIs(
+            None, self.successResultOf(remote.resume_token(self.volume)))
+
     def test_receive_default_config(self):
         """
         ``RemoteVolumeManager`` by default calls ``flocker-volume`` with
@@ -347,14 +435,82 @@ class RemoteVolumeManagerTests(TestCase):
         node = FakeNode()
 
         remote = RemoteVolumeManager(node)
-        with remote.receive(self.volume):
-            pass
+        self.successResultOf(
+            self.successResultOf(remote.receiver(self.volume)).finish())
         self.assertEqual(node.remote_command,
                          [b"flocker-volume", b"--config",
                           DEFAULT_CONFIG_PATH.path,
                           b"receive", self.volume.node_id.encode("ascii"),
                           b"myns.myvol"])
 
+    def test_receive_writes(self):
+        """
+        Data written to the receiver is written to the standard input of the
+        remote ``flocker-volume receive``.
+        """
+        node = FakeNode()
+
+        remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
+        receiver = self.successResultOf(remote.receiver(self.volume))
+        receiver.write(b"some data")
+        self.successResultOf(receiver.finish())
+        self.assertEqual(b"some data", node.stdin.read())
+
+    def test_receive_spawns(self):
+        """
+        ``RemoteVolumeManager.receiver`` starts ``flocker-volume receive``
+        with the reactor rather than writing to it synchronously, and its
+        result fires once the process exits.
+        """
+        reactor = FakeProcessReactor()
+        remote = RemoteVolumeManager(
+            ProcessNode(initial_command_arguments=[]),
+            FilePath(b"/path/to/json"), reactor=reactor)
+        receiver = self.successResultOf(remote.receiver(self.volume))
+        [process] = reactor.processes
+        receiver.write(b"some data")
+        finishing = receiver.finish()
+        self.assertNoResult(finishing)
+        process.processProtocol.processEnded(Failure(ProcessDone(0)))
+        self.assertEqual(
+            (b"flocker-volume", b"some data", True, None),
+            (process.executable, process.transport.data,
+             process.transport.stdin_closed,
+             self.successResultOf(finishing)))
+
+    def test_receive_failed(self):
+        """
+        If ``flocker-volume receive`` fails, finishing the receiver fails
+        with ``IOError``.
+        """
+        reactor = FakeProcessReactor()
+        remote = RemoteVolumeManager(
+            ProcessNode(initial_command_arguments=[]),
+            FilePath(b"/path/to/json"), reactor=reactor)
+        receiver = self.successResultOf(remote.receiver(self.volume))
+        finishing = receiver.finish()
+        reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.failureResultOf(finishing, IOError)
+
+    def test_receive_abort(self):
+        """
+        Aborting the receiver closes the standard input of
+        ``flocker-volume receive`` and succeeds when it fails because of the
+        truncated stream.
+        """
+        reactor = FakeProcessReactor()
+        remote = RemoteVolumeManager(
+            ProcessNode(initial_command_arguments=[]),
+            FilePath(b"/path/to/json"), reactor=reactor)
+        receiver = self.successResultOf(remote.receiver(self.volume))
+        aborting = receiver.abort()
+        reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        self.assertEqual(
+            (True, None), (reactor.processes[0].transport.stdin_closed,
+                           self.successResultOf(aborting)))
+
     def test_acquire_destination_run(self):
         """
         ``RemoteVolumeManager.acquire()`` calls ``flocker-volume`` remotely
@@ -363,12 +519,13 @@ class RemoteVolumeManagerTests(TestCase):
         node = FakeNode([b"remoteuuid"])
 
         remote = RemoteVolumeManager(node, FilePath(b"/path/to/json"))
-        remote.acquire(self.volume)
+        acquired = remote.acquire(self.volume)
 
-        self.assertEqual(node.remote_command,
-                         [b"flocker-volume", b"--config", b"/path/to/json",
-                          b"acquire", self.volume.node_id.encode("ascii"),
-                          b"myns.myvol"])
+        self.assertEqual(
+            ([b"flocker-volume", b"--config", b"/path/to/json",
+              b"acquire", self.volume.node_id.encode("ascii"),
+              b"myns.myvol"], u"remoteuuid"),
+            (node.remote_command, self.successResultOf(acquired)))
 
 
 class StandardNodeTests(TestCase):
@@ -0,0 +1,1053 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Unit tests for ``flocker.volume._replication``.
+"""
+
+from json import dumps, loads
+from os import urandom
+from struct import pack, unpack
+
+from eliot.testing import assertHasMessage, validate_logging
+
+from zope.interface import implementer
+from zope.interface.verify import verifyObject
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import MemoryReactorClock, StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import _replication
+from .._ipc import IRemoteVolumeManager
+from .._replication import (
+    ReplicationClientProtocol, ReplicationError, ReplicationProtocol,
+    TLSRemoteVolumeManager, TRANSFER, _CHUNK_SIZE, _Compressor,
+    _IDLE_TIMEOUT, _INCOMPRESSIBLE_SKIP, _MAX_QUEUED_CHUNKS, _RAW_FRAME,
+    _StreamSender, _StripeFlowControl, _ZLIB_FRAME, _decode_chunk,
+)
+from ..filesystems.interfaces import IStreamReceiver
+from ..service import Volume, VolumeName
+from ..testtools import create_volume_service
+
+MY_VOLUME = VolumeName(namespace=u"myns", dataset_id=u"myvol")
+OTHER_NODE = u"5a5e1ea9-1d1f-4b9c-8a4f-6c2e1d1e1c0b"
+
+
+def frame(data):
+    """
+    Encode a frame of a replication session.
+    """
+    return pack(b">I", len(data)) + data
+
+
+def request(command, **arguments):
+    """
+    Encode a replication request frame.
+    """
+    arguments[u"command"] = command
+    return frame(dumps(arguments))
+
+
+def decode_frames(data):
+    """
+    Decode all of the frames in some bytes.
+    """
+    frames = []
+    while data:
+        (size,) = unpack(b">I", data[:4])
+        frames.append(data[4:4 + size])
+        data = data[4 + size:]
+    return frames
+
+
+@implementer(IStreamReceiver)
+class FakeReceiver(object):
+    """
+    An ``IStreamReceiver`` which records what is done to it.
+
+    :ivar producer: The registered producer, or ``None``.
+    :ivar bytes data: Everything written so far.
+    :ivar finished: ``None``, or once ``finish`` was called the ``Deferred``
+        it returned.
+    :ivar bool aborted: Whether ``abort`` was called.
+    """
+    compressed = False
+
+    def __init__(self):
+        self.producer = None
+        self.data = b""
+        self.finished = None
+        self.aborted = False
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def write(self, data):
+        self.data += data
+
+    def finish(self):
+        self.finished = Deferred()
+        return self.finished
+
+    def abort(self):
+        self.aborted = True
+        return succeed(None)
+
+
+class ReplicationProtocolTests(SynchronousTestCase):
+    """
+    Tests for ``ReplicationProtocol``.
+    """
+    def setUp(self):
+        self.service = create_volume_service(self)
+        self.protocol = ReplicationProtocol(Clock(), self.service)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def responses(self):
+        return [loads(response)
+                for response in decode_frames(self.transport.value())]
+
+    def fake_receivers(self):
+        """
+        Make the service's ``receiver`` return a ``Deferred`` which the test
+        fires.
+
+        :return: A ``list`` to which a tuple of the arguments, keyword
+            arguments and ``Deferred`` of each call is appended.
+        """
+        calls = []
+
+        def receiver(*args, **kwargs):
+            result = Deferred()
+            calls.append((args, kwargs, result))
+            return result
+        self.patch(self.service, "receiver", receiver)
+        return calls
+
+    def pushed_stream(self):
+        """
+        :return: The stream of a volume with one file in it, owned by
+            another node.
+        """
+        other = create_volume_service(self)
+        volume = other.get(MY_VOLUME)
+        self.successResultOf(other.create(volume))
+        filesystem = volume.get_filesystem()
+        filesystem.get_path().child(b"afile.txt").setContent(b"WORKS!")
+        with filesystem.reader() as reader:
+            return other.node_id, reader.read()
+
+    def test_snapshots_no_filesystem(self):
+        """
+        A ``snapshots`` request for a volume which does not exist gets an
+        empty list of snapshots.
+        """
+        self.protocol.dataReceived(request(
+            u"snapshots", node_id=OTHER_NODE, name=u"myns.myvol"))
+        self.assertEqual([{u"snapshots": []}], self.responses())
+
+    def test_resume_token_no_filesystem(self):
+        """
+        A ``resume_token`` request for a volume which does not exist gets no
+        resume token.
+        """
+        self.protocol.dataReceived(request(
+            u"resume_token", node_id=OTHER_NODE, name=u"myns.myvol"))
+        self.assertEqual([{u"resume_token": None}], self.responses())
+
+    def test_resume_token(self):
+        """
+        A ``resume_token`` request gets the token left by an interrupted
+        receive.
+        """
+        node_id, stream = self.pushed_stream()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=node_id, name=u"myns.myvol"))
+        self.protocol.dataReceived(frame(stream[:100]))
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        protocol = ReplicationProtocol(Clock(), self.service)
+        protocol.makeConnection(self.transport)
+        protocol.dataReceived(request(
+            u"resume_token", node_id=node_id, name=u"myns.myvol"))
+        self.assertEqual([{u"resume_token": u"100"}], self.responses())
+
+    def test_receive_resume(self):
+        """
+        The ``resume`` argument of a ``receive`` request is passed on to
+        ``VolumeService.receiver``.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol", resume=True))
+        [(args, kwargs, result)] = calls
+        self.assertEqual({"resume": True}, kwargs)
+
+    def test_unknown_command(self):
+        """
+        A request with an unknown command gets an error.
+        """
+        self.protocol.dataReceived(request(u"explode"))
+        [response] = self.responses()
+        self.assertIn(u"error", response)
+
+    def test_acquire_owned(self):
+        """
+        An ``acquire`` request for a volume this node already owns gets an
+        error.
+        """
+        self.protocol.dataReceived(request(
+            u"acquire", node_id=self.service.node_id, name=u"myns.myvol"))
+        [response] = self.responses()
+        self.assertIn(u"error", response)
+
+    def test_receive(self):
+        """
+        A ``receive`` request followed by data frames and an empty frame
+        updates the volume and then gets an empty response.
+        """
+        node_id, stream = self.pushed_stream()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=node_id, name=u"myns.myvol"))
+        self.protocol.dataReceived(frame(stream[:100]))
+        self.protocol.dataReceived(frame(stream[100:]))
+        self.protocol.dataReceived(frame(b""))
+        volume = Volume(node_id=node_id, name=MY_VOLUME, service=self.service)
+        self.assertEqual(
+            ([{}], b"WORKS!"),
+            (self.responses(), volume.get_filesystem().get_path().child(
+                b"afile.txt").getContent()))
+
+    def test_receive_failed(self):
+        """
+        If a receiver can't be created the rest of its stream is discarded
+        and the error is reported once the stream ends.
+        """
+        self.protocol.dataReceived(request(
+            u"receive", node_id=self.service.node_id, name=u"myns.myvol"))
+        self.protocol.dataReceived(frame(b"x" * 100))
+        no_response = self.responses()
+        self.protocol.dataReceived(frame(b""))
+        [response] = self.responses()
+        self.assertEqual(
+            ([], True, u"producing"),
+            (no_response, u"error" in response, self.transport.producerState))
+
+    def test_finish_failed(self):
+        """
+        If the receiver fails to finish, the ``receive`` request gets an
+        error.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.protocol.dataReceived(frame(b""))
+        receiver.finished.errback(ZeroDivisionError())
+        [response] = self.responses()
+        self.assertIn(u"error", response)
+
+    def test_next_request_after_receive(self):
+        """
+        After a receive finishes the session accepts another request.
+        """
+        node_id, stream = self.pushed_stream()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=node_id, name=u"myns.myvol"))
+        self.protocol.dataReceived(frame(stream) + frame(b""))
+        self.protocol.dataReceived(request(
+            u"acquire", node_id=node_id, name=u"myns.myvol"))
+        self.assertEqual(
+            [{}, {u"node_id": self.service.node_id}], self.responses())
+
+    def test_paused_until_receiver_ready(self):
+        """
+        The protocol stops reading until the receiver is ready, and then
+        writes the frames which arrived in the meantime to it.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        self.protocol.dataReceived(frame(b"x") + frame(b"y"))
+        paused = self.transport.producerState
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.assertEqual(
+            (u"paused", u"producing", b"xy"),
+            (paused, self.transport.producerState, receiver.data))
+
+    def test_flow_control(self):
+        """
+        While the stream is being received the receiver can stop the
+        protocol reading from the connection.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        producer = receiver.producer
+        producer.pauseProducing()
+        paused = self.transport.producerState
+        producer.resumeProducing()
+        resumed = self.transport.producerState
+        self.protocol.dataReceived(frame(b"x") + frame(b""))
+        self.assertEqual(
+            (u"paused", u"producing", None),
+            (paused, resumed, receiver.producer))
+
+    def test_paused_while_finishing(self):
+        """
+        The protocol stops reading once the stream has ended, until the
+        receiver has finished and the request has been answered.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.protocol.dataReceived(frame(b""))
+        paused = (self.transport.producerState, self.responses())
+        receiver.finished.callback(None)
+        self.assertEqual(
+            ((u"paused", []), (u"producing", [{}])),
+            (paused, (self.transport.producerState, self.responses())))
+
+    def test_connection_lost(self):
+        """
+        If the connection is lost during a receive the receiver is aborted.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.protocol.dataReceived(frame(b"x"))
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual((True, None), (receiver.aborted, receiver.producer))
+
+    def test_connection_lost_before_receiver(self):
+        """
+        If the connection is lost before the receiver is ready, the receiver
+        is aborted once it is.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.assertEqual((True, b""), (receiver.aborted, receiver.data))
+
+    def test_connection_lost_while_finishing(self):
+        """
+        If the connection is lost after the whole stream has arrived the
+        receiver is not aborted.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.protocol.dataReceived(frame(b""))
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        receiver.finished.callback(None)
+        self.assertEqual((False, []), (receiver.aborted, self.responses()))
+
+    def test_hello(self):
+        """
+        A ``hello`` request gets the optional features the server supports.
+        """
+        self.protocol.dataReceived(request(u"hello"))
+        self.assertEqual(
+            [{u"features": [u"zlib", u"stripes"]}], self.responses())
+
+    def test_hello_compressed_streams(self):
+        """
+        A ``hello`` response includes ``zfs-compressed`` if the server's
+        storage pool accepts compressed ZFS streams.
+        """
+        self.patch(self.service.pool, "compressed_streams",
+                   lambda: succeed(True))
+        self.protocol.dataReceived(request(u"hello"))
+        self.assertEqual(
+            [{u"features": [u"zlib", u"stripes", u"zfs-compressed"]}],
+            self.responses())
+
+    def test_compressed(self):
+        """
+        The data frames of a ``receive`` request with ``zlib`` compression
+        are decoded before they are written to the receiver.
+        """
+        calls = self.fake_receivers()
+        self.protocol.dataReceived(request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol",
+            compression=u"zlib"))
+        receiver = FakeReceiver()
+        calls[0][2].callback(receiver)
+        self.protocol.dataReceived(
+            frame(_Compressor().encode(b"x" * 1000)) +
+            frame(_RAW_FRAME + b"y"))
+        self.assertEqual(b"x" * 1000 + b"y", receiver.data)
+
+    def test_unsupported_receive(self):
+        """
+        A ``receive`` request with an unknown compression, an unsupported
+        number of stripes or stripes but no transfer identifier gets an
+        error.
+        """
+        for arguments in [dict(compression=u"lzma"), dict(stripes=100),
+                          dict(stripes=2)]:
+            self.protocol.dataReceived(request(
+                u"receive", node_id=OTHER_NODE, name=u"myns.myvol",
+                **arguments))
+        self.assertEqual(
+            [True, True, True],
+            [u"error" in response for response in self.responses()])
+
+
+class StripedTransferTests(SynchronousTestCase):
+    """
+    Tests for ``ReplicationProtocol`` receiving a stream striped across
+    several sessions.
+    """
+    def setUp(self):
+        self.service = create_volume_service(self)
+        self.receivers = []
+
+        def receiver(*args, **kwargs):
+            receiver = FakeReceiver()
+            self.receivers.append(receiver)
+            return succeed(receiver)
+        self.patch(self.service, "receiver", receiver)
+        transfers = {}
+        self.stripes = []
+        for i in range(2):
+            protocol = ReplicationProtocol(Clock(), self.service, transfers)
+            transport = StringTransport()
+            protocol.makeConnection(transport)
+            self.stripes.append((protocol, transport))
+
+    def send(self, index, data):
+        self.stripes[index][0].dataReceived(data)
+
+    def responses(self, index):
+        return [loads(response) for response in
+                decode_frames(self.stripes[index][1].value())]
+
+    def start(self):
+        """
+        Start a transfer striped across both sessions.
+        """
+        self.send(0, request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol", stripes=2,
+            transfer=u"abc"))
+        self.send(1, request(u"join", transfer=u"abc", index=1))
+
+    def test_reassembled(self):
+        """
+        Frames are taken from each stripe in turn, whichever order they
+        arrive in.
+        """
+        self.start()
+        self.send(1, frame(b"b"))
+        self.send(0, frame(b"a") + frame(b"c"))
+        self.assertEqual(b"abc", self.receivers[0].data)
+
+    def test_join_first(self):
+        """
+        A stripe can join before the ``receive`` request arrives.
+        """
+        self.send(1, request(u"join", transfer=u"abc", index=1))
+        self.send(1, frame(b"b"))
+        self.send(0, request(
+            u"receive", node_id=OTHER_NODE, name=u"myns.myvol", stripes=2,
+            transfer=u"abc"))
+        self.send(0, frame(b"a"))
+        self.assertEqual(b"ab", self.receivers[0].data)
+
+    def test_answered_once_all_stripes_end(self):
+        """
+        The requests of the stripes are answered once every stripe has sent
+        its empty frame and the receiver has finished.
+        """
+        self.start()
+        self.send(0, frame(b"a") + frame(b""))
+        first = (self.responses(0), self.receivers[0].finished)
+        self.send(1, frame(b"b") + frame(b""))
+        self.receivers[0].finished.callback(None)
+        self.assertEqual(
+            (([], None), [{}], [{}], b"ab"),
+            (first, self.responses(0), self.responses(1),
+             self.receivers[0].data))
+
+    def test_stripe_ahead_paused(self):
+        """
+        A stripe which gets ``_MAX_QUEUED_CHUNKS`` frames ahead of the others
+        stops being read until they catch up.
+        """
+        self.start()
+        self.send(1, frame(b"b") * _MAX_QUEUED_CHUNKS)
+        paused = self.stripes[1][1].producerState
+        self.send(0, frame(b"a"))
+        self.assertEqual(
+            (u"paused", u"producing"),
+            (paused, self.stripes[1][1].producerState))
+
+    def test_stripe_lost(self):
+        """
+        If one stripe's session is lost the receiver is aborted and the
+        other stripes are disconnected.
+        """
+        self.start()
+        self.send(0, frame(b"a"))
+        self.stripes[1][0].connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(
+            (True, True),
+            (self.receivers[0].aborted, self.stripes[0][1].disconnecting))
+
+
+class ReplicationClientProtocolTests(SynchronousTestCase):
+    """
+    Tests for ``ReplicationClientProtocol``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.protocol = ReplicationClientProtocol(self.clock)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def test_request(self):
+        """
+        ``ReplicationClientProtocol.request`` sends a request frame and
+        returns a ``Deferred`` that fires with the decoded response.
+        """
+        response = self.protocol.request(u"acquire", name=u"x")
+        sent = [loads(f) for f in decode_frames(self.transport.value())]
+        self.protocol.dataReceived(frame(dumps({u"node_id": u"abc"})))
+        self.assertEqual(
+            ({u"node_id": u"abc"},
+             [{u"command": u"acquire", u"name": u"x"}]),
+            (self.successResultOf(response), sent))
+
+    def test_responses_in_order(self):
+        """
+        Responses answer requests in the order they were made.
+        """
+        first = self.protocol.request(u"snapshots")
+        second = self.protocol.request(u"resume_token")
+        self.protocol.dataReceived(
+            frame(dumps({u"first": 1})) + frame(dumps({u"second": 2})))
+        self.assertEqual(
+            ({u"first": 1}, {u"second": 2}),
+            (self.successResultOf(first), self.successResultOf(second)))
+
+    def test_error(self):
+        """
+        A request fails with ``ReplicationError`` for an error response.
+        """
+        response = self.protocol.request(u"acquire")
+        self.protocol.dataReceived(frame(dumps({u"error": u"bad"})))
+        self.failureResultOf(response, ReplicationError)
+
+    def test_connection_lost(self):
+        """
+        Unanswered requests fail with ``ReplicationError`` if the connection
+        is lost, and ``when_closed`` fires.
+        """
+        response = self.protocol.request(u"acquire")
+        closed = self.protocol.when_closed()
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(response, ReplicationError)
+        self.assertIs(None, self.successResultOf(closed))
+
+    def test_idle_timeout(self):
+        """
+        The session is closed after it has been idle for ``_IDLE_TIMEOUT``
+        seconds.
+        """
+        self.clock.advance(_IDLE_TIMEOUT - 1)
+        not_yet = self.transport.disconnecting
+        self.clock.advance(1)
+        self.assertEqual(
+            (False, True), (not_yet, self.transport.disconnecting))
+
+    def test_no_timeout_while_waiting(self):
+        """
+        The session is not closed while a request is waiting for its
+        response, however long it takes.
+        """
+        response = self.protocol.request(u"acquire")
+        self.clock.advance(_IDLE_TIMEOUT * 2)
+        waiting = self.transport.disconnecting
+        self.protocol.dataReceived(frame(dumps({})))
+        self.clock.advance(_IDLE_TIMEOUT)
+        self.assertEqual(
+            ({}, False, True),
+            (self.successResultOf(response), waiting,
+             self.transport.disconnecting))
+
+
+class CompressorTests(SynchronousTestCase):
+    """
+    Tests for ``_Compressor`` and ``_decode_chunk``.
+    """
+    def test_compressed(self):
+        """
+        Data which compresses well is sent compressed.
+        """
+        chunk = _Compressor().encode(b"x" * 1000)
+        self.assertEqual(
+            (_ZLIB_FRAME, b"x" * 1000),
+            (chunk[:1], _decode_chunk(chunk, u"zlib")))
+
+    def test_incompressible(self):
+        """
+        Data which does not compress well is sent as it is, and so are the
+        next ``_INCOMPRESSIBLE_SKIP`` frames.
+        """
+        compressor = _Compressor()
+        data = urandom(1000)
+        chunks = [compressor.encode(data)] + [
+            compressor.encode(b"x" * 1000)
+            for i in range(_INCOMPRESSIBLE_SKIP + 1)]
+        self.assertEqual(
+            ([_RAW_FRAME] * (_INCOMPRESSIBLE_SKIP + 1) + [_ZLIB_FRAME],
+             data),
+            ([chunk[:1] for chunk in chunks],
+             _decode_chunk(chunks[0], u"zlib")))
+
+    def test_uncompressed_stream(self):
+        """
+        The frames of a stream without compression are the data.
+        """
+        self.assertEqual(b"zzz", _decode_chunk(b"zzz", None))
+
+    def test_unknown_frame(self):
+        """
+        ``_decode_chunk`` raises ``ValueError`` for an unknown frame type.
+        """
+        self.assertRaises(ValueError, _decode_chunk, b"qzzz", u"zlib")
+
+
+class RecordingProducer(object):
+    """
+    A streaming producer which records whether it is paused.
+    """
+    paused = False
+    stopped = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+class StripeFlowControlTests(SynchronousTestCase):
+    """
+    Tests for ``_StripeFlowControl``.
+    """
+    def test_paused_while_any_paused(self):
+        """
+        The producer is paused while any of the transports has paused it.
+        """
+        producer = RecordingProducer()
+        transports = [StringTransport(), StringTransport()]
+        _StripeFlowControl(producer, transports)
+        transports[0].producer.pauseProducing()
+        transports[1].producer.pauseProducing()
+        transports[0].producer.resumeProducing()
+        both = producer.paused
+        transports[1].producer.resumeProducing()
+        self.assertEqual((True, False), (both, producer.paused))
+
+    def test_stop(self):
+        """
+        The producer is stopped if any transport stops it.
+        """
+        producer = RecordingProducer()
+        transports = [StringTransport(), StringTransport()]
+        _StripeFlowControl(producer, transports)
+        transports[1].producer.stopProducing()
+        self.assertTrue(producer.stopped)
+
+
+class StreamSenderTests(SynchronousTestCase):
+    """
+    Tests for ``_StreamSender``.
+    """
+    def setUp(self):
+        self.protocol = ReplicationClientProtocol(Clock())
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+        self.reactor = MemoryReactorClock()
+        self.manager = TLSRemoteVolumeManager(
+            b"127.0.0.1", None, reactor=self.reactor)
+        self.manager._protocol = self.protocol
+        self.response = Deferred()
+        self.sender = _StreamSender(
+            self.manager, [self.protocol], [self.response])
+
+    def test_interface(self):
+        """
+        ``_StreamSender`` provides ``IStreamReceiver``.
+        """
+        self.assertTrue(verifyObject(IStreamReceiver, self.sender))
+
+    def test_frames(self):
+        """
+        ``_StreamSender`` collects writes into frames of ``_CHUNK_SIZE``, and
+        sends the remainder when it is finished.
+        """
+        self.sender.write(b"x" * (_CHUNK_SIZE - 1))
+        nothing = self.transport.value()
+        self.sender.write(b"x" * (_CHUNK_SIZE + 2))
+        sent = [len(f) for f in decode_frames(self.transport.value())]
+        self.sender.finish()
+        self.assertEqual(
+            (b"", [_CHUNK_SIZE] * 2, [_CHUNK_SIZE] * 2 + [1, 0]),
+            (nothing, sent,
+             [len(f) for f in decode_frames(self.transport.value())]))
+
+    def test_compressed(self):
+        """
+        With compression each frame is encoded by a ``_Compressor``.
+        """
+        sender = _StreamSender(
+            self.manager, [self.protocol], [self.response], u"zlib")
+        sender.write(b"x" * 1000)
+        sender.finish()
+        [chunk, end] = decode_frames(self.transport.value())
+        self.assertEqual(
+            (b"x" * 1000, b""), (_decode_chunk(chunk, u"zlib"), end))
+
+    def test_producer(self):
+        """
+        Producers are registered with the connection, so they are paused
+        while it can't keep up.
+        """
+        producer = object()
+        self.sender.registerProducer(producer, True)
+        self.assertIs(producer, self.transport.producer)
+
+    def test_finish(self):
+        """
+        ``_StreamSender.finish`` sends an empty frame and returns a
+        ``Deferred`` that fires with the response to the ``receive`` request.
+        """
+        finishing = self.sender.finish()
+        sent = decode_frames(self.transport.value())
+        self.response.callback({})
+        self.assertEqual(
+            (None, [b""]), (self.successResultOf(finishing), sent))
+
+    @validate_logging(
+        assertHasMessage, TRANSFER, {
+            u"name": u"myns.myvol", u"streams": 1, u"compression": u"zlib",
+            u"raw_bytes": 2000, u"seconds": 4.0, u"throughput": 500.0})
+    def test_metrics(self, logger):
+        """
+        The size of the stream, of the frames which were sent and the time
+        the transfer took are logged when it finishes.
+        """
+        self.patch(_replication, "_logger", logger)
+        sender = _StreamSender(
+            self.manager, [self.protocol], [self.response], u"zlib",
+            u"myns.myvol")
+        sender.write(b"x" * 2000)
+        self.reactor.advance(4)
+        sender.finish()
+        self.response.callback({})
+        [message] = logger.messages
+        self.assertEqual(
+            float(2000) / message[u"wire_bytes"],
+            message[u"compression_ratio"])
+
+    def test_finish_failed(self):
+        """
+        If the ``receive`` request fails, ``_StreamSender.finish`` fails and
+        the session is closed.
+        """
+        finishing = self.sender.finish()
+        self.response.errback(ReplicationError())
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(finishing, ReplicationError)
+        self.assertEqual(
+            (True, None),
+            (self.transport.disconnecting, self.manager._protocol))
+
+    def test_abort(self):
+        """
+        ``_StreamSender.abort`` closes the session, so that the server knows
+        the stream was not finished.
+        """
+        aborting = self.sender.abort()
+        self.response.errback(ReplicationError())
+        self.protocol.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(
+            (None, True, []),
+            (self.successResultOf(aborting), self.transport.disconnecting,
+             decode_frames(self.transport.value())))
+
+
+class StripedStreamSenderTests(SynchronousTestCase):
+    """
+    Tests for ``_StreamSender`` with more than one stripe.
+    """
+    def setUp(self):
+        self.manager = TLSRemoteVolumeManager(
+            b"127.0.0.1", None, reactor=MemoryReactorClock())
+        self.protocols = []
+        for i in range(2):
+            protocol = ReplicationClientProtocol(Clock())
+            protocol.makeConnection(StringTransport())
+            self.protocols.append(protocol)
+        self.manager._protocol = self.protocols[0]
+        self.responses = [Deferred(), Deferred()]
+        self.sender = _StreamSender(
+            self.manager, self.protocols, self.responses)
+
+    def sent(self, index):
+        return decode_frames(self.protocols[index].transport.value())
+
+    def test_round_robin(self):
+        """
+        Frames are sent on each stripe in turn.
+        """
+        self.sender.write(b"a" * _CHUNK_SIZE + b"b" * _CHUNK_SIZE + b"c")
+        self.sender.finish()
+        self.assertEqual(
+            ([b"a" * _CHUNK_SIZE, b"c", b""], [b"b" * _CHUNK_SIZE, b""]),
+            (self.sent(0), self.sent(1)))
+
+    def test_producer(self):
+        """
+        A streaming producer is paused while any stripe can't keep up, and is
+        unregistered from all of them.
+        """
+        producer = RecordingProducer()
+        self.sender.registerProducer(producer, True)
+        self.protocols[1].transport.producer.pauseProducing()
+        paused = producer.paused
+        self.sender.unregisterProducer()
+        self.assertEqual(
+            (True, [None, None]),
+            (paused, [protocol.transport.producer
+                      for protocol in self.protocols]))
+
+    def test_finish(self):
+        """
+        ``_StreamSender.finish`` fires once every stripe's request was
+        answered, and closes the extra stripes' sessions.
+        """
+        finishing = self.sender.finish()
+        self.responses[0].callback({})
+        self.assertNoResult(finishing)
+        self.responses[1].callback({})
+        self.assertEqual(
+            (None, False, True),
+            (self.successResultOf(finishing),
+             self.protocols[0].transport.disconnecting,
+             self.protocols[1].transport.disconnecting))
+
+    def test_finish_failed(self):
+        """
+        If any stripe's request fails, ``_StreamSender.finish`` fails with
+        its error.
+        """
+        finishing = self.sender.finish()
+        self.responses[0].callback({})
+        self.responses[1].errback(ReplicationError())
+        self.protocols[0].connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(finishing, ReplicationError)
+
+
+class TLSRemoteVolumeManagerTests(SynchronousTestCase):
+    """
+    Tests for ``TLSRemoteVolumeManager``.
+    """
+    def setUp(self):
+        self.reactor = MemoryReactorClock()
+        self.manager = TLSRemoteVolumeManager(
+            b"192.0.2.1", object(), port=1234, reactor=self.reactor)
+        self.volume = Volume(node_id=OTHER_NODE, name=MY_VOLUME, service=None)
+        self.transports = []
+
+    def connect(self):
+        """
+        Complete the latest connection attempt.
+
+        :return: The ``StringTransport`` it is connected to.
+        """
+        factory = self.reactor.sslClients[-1][2]
+        protocol = factory.buildProtocol(None)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        self.transports.append((protocol, transport))
+        return transport
+
+    def test_interface(self):
+        """
+        ``TLSRemoteVolumeManager`` provides ``IRemoteVolumeManager``.
+        """
+        self.assertTrue(verifyObject(IRemoteVolumeManager, self.manager))
+
+    def test_connect(self):
+        """
+        The first request connects to the destination with the context
+        factory.
+        """
+        self.manager.snapshots(self.volume)
+        [(host, port, factory, context_factory, timeout, bind)] = (
+            self.reactor.sslClients)
+        self.assertEqual(
+            (b"192.0.2.1", 1234, self.manager._context_factory),
+            (host, port, context_factory))
+
+    def test_snapshots(self):
+        """
+        ``TLSRemoteVolumeManager.snapshots`` makes a ``snapshots`` request and
+        returns the snapshots in the response.
+        """
+        snapshots = self.manager.snapshots(self.volume)
+        transport = self.connect()
+        [sent] = [loads(f) for f in decode_frames(transport.value())]
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"snapshots": [u"a", u"b"]})))
+        self.assertEqual(
+            ({u"command": u"snapshots", u"node_id": OTHER_NODE,
+              u"name": u"myns.myvol"}, [b"a", b"b"]),
+            (sent, [s.name for s in self.successResultOf(snapshots)]))
+
+    def test_session_shared(self):
+        """
+        Requests share one session.
+        """
+        self.manager.acquire(self.volume)
+        self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"node_id": u"abc"})))
+        acquired = self.manager.acquire(self.volume)
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"node_id": u"def"})))
+        self.assertEqual(
+            (u"def", 1),
+            (self.successResultOf(acquired), len(self.reactor.sslClients)))
+
+    def test_failure_closes_session(self):
+        """
+        A failed request closes the session and a later request opens a new
+        one.
+        """
+        acquired = self.manager.acquire(self.volume)
+        transport = self.connect()
+        protocol = self.transports[0][0]
+        protocol.dataReceived(frame(dumps({u"error": u"bad"})))
+        protocol.connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(acquired, ReplicationError)
+        self.manager.acquire(self.volume)
+        self.assertEqual(
+            (True, 2), (transport.disconnecting, len(self.reactor.sslClients)))
+
+    def test_receiver(self):
+        """
+        ``TLSRemoteVolumeManager.receiver`` makes a ``receive`` request and
+        returns a ``_StreamSender`` for its stream.
+        """
+        receiving = self.manager.receiver(self.volume, resume=True)
+        transport = self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"features": [u"zlib", u"stripes"]})))
+        sender = self.successResultOf(receiving)
+        self.assertEqual(
+            (_StreamSender, False,
+             [{u"command": u"hello"},
+              {u"command": u"receive", u"node_id": OTHER_NODE,
+               u"name": u"myns.myvol", u"resume": True}]),
+            (type(sender), sender.compressed,
+             [loads(f) for f in decode_frames(transport.value())]))
+
+    def test_compressed_streams(self):
+        """
+        If the server accepts compressed ZFS streams the ``_StreamSender``
+        says so, whether or not compression was asked for.
+        """
+        receiving = self.manager.receiver(self.volume)
+        self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"features": [u"zfs-compressed"]})))
+        self.assertTrue(self.successResultOf(receiving).compressed)
+
+    def test_negotiated_once(self):
+        """
+        The server is only asked for its features once.
+        """
+        self.manager.receiver(self.volume)
+        transport = self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"features": []})))
+        self.manager.receiver(self.volume)
+        self.assertEqual(
+            [u"hello", u"receive", u"receive"],
+            [loads(f)[u"command"]
+             for f in decode_frames(transport.value())])
+
+    def test_negotiated(self):
+        """
+        If compression and striping were asked for and the server supports
+        them, the ``receive`` request asks for them too and the extra
+        stripes' sessions join the transfer.
+        """
+        self.manager = TLSRemoteVolumeManager(
+            b"192.0.2.1", object(), port=1234, reactor=self.reactor,
+            compression=True, streams=2)
+        receiving = self.manager.receiver(self.volume)
+        transport = self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"features": [u"zlib", u"stripes"]})))
+        stripe = self.connect()
+        [hello, receive] = [loads(f) for f in decode_frames(transport.value())]
+        [join] = [loads(f) for f in decode_frames(stripe.value())]
+        sender = self.successResultOf(receiving)
+        self.assertEqual(
+            ({u"command": u"hello"},
+             {u"command": u"receive", u"node_id": OTHER_NODE,
+              u"name": u"myns.myvol", u"resume": False,
+              u"compression": u"zlib", u"stripes": 2,
+              u"transfer": receive[u"transfer"]},
+             {u"command": u"join", u"transfer": receive[u"transfer"],
+              u"index": 1},
+             2),
+            (hello, receive, join, len(sender._protocols)))
+
+    def test_old_server(self):
+        """
+        If the server doesn't understand ``hello`` the data stream is sent
+        on the same session without compression or striping.
+        """
+        self.manager = TLSRemoteVolumeManager(
+            b"192.0.2.1", object(), port=1234, reactor=self.reactor,
+            compression=True, streams=2)
+        receiving = self.manager.receiver(self.volume)
+        transport = self.connect()
+        self.transports[0][0].dataReceived(
+            frame(dumps({u"error": u"AttributeError()"})))
+        [hello, receive] = [loads(f) for f in decode_frames(transport.value())]
+        sender = self.successResultOf(receiving)
+        self.assertEqual(
+            ({u"command": u"receive", u"node_id": OTHER_NODE,
+              u"name": u"myns.myvol", u"resume": False},
+             False, 1, False),
+            (receive, transport.disconnecting, len(self.reactor.sslClients),
+             sender.compressed))
@@ -4,6 +4,10 @@
 Tests for :module:`flocker.volume.script`.
 """
 
+import json
+from io import BytesIO
+
+from twisted.internet.defer import succeed
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
@@ -15,8 +19,11 @@ from ...testtools import (
 from ..testtools import (
     make_volume_options_tests
 )
+from ..service import VolumeName
+from .. import script as script_module
 from ..script import (
-    VolumeOptions, VolumeManagerScript, flocker_volume_options
+    VolumeOptions, VolumeManagerScript, ForwardingVolumeScript,
+    flocker_volume_options,
 )
 
 
@@ -61,3 +68,113 @@ class StandardVolumeOptionsTests(make_volume_options_tests(VolumeOptions)):
     """
     Tests for ``VolumeService`` specific arguments of ``VolumeOptions``.
     """
+
+
+class FakeDaemonClient(object):
+    """
+    A ``VolumeDaemonClient`` stand-in which acquires any volume.
+
+    :ivar list calls: The names and arguments of the methods called.
+    """
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.calls = []
+
+    def identify(self):
+        return succeed(self.node_id)
+
+    def acquire(self, node_id, name):
+        self.calls.append(("acquire", node_id, name))
+        return succeed(self.node_id)
+
+    def close(self):
+        self.calls.append(("close",))
+
+
+class FakeLocalScript(object):
+    """
+    An ``ICommandLineScript`` which records that it ran.
+    """
+    def __init__(self):
+        self.ran = []
+
+    def main(self, reactor, options):
+        self.ran.append(options)
+        return succeed(None)
+
+
+class ForwardingVolumeScriptTests(SynchronousTestCase):
+    """
+    Tests for ``ForwardingVolumeScript``.
+    """
+    def setUp(self):
+        self.config = FilePath(self.mktemp())
+        self.config.setContent(json.dumps({u"uuid": u"mynode"}))
+        self.local = FakeLocalScript()
+        self.script = ForwardingVolumeScript(self.local)
+        self.connections = []
+        self.stdout = BytesIO()
+        self.patch(script_module.sys, "stdout", self.stdout)
+
+    def connect_to(self, client):
+        """
+        Have the script connect to the given client.
+        """
+        def connect(reactor, socket_path):
+            self.connections.append(socket_path)
+            return succeed(client)
+        self.script._connect = connect
+
+    def run_acquire(self):
+        options = VolumeOptions()
+        options.parseOptions([
+            b"--config", self.config.path, b"--socket", b"/tmp/v.sock",
+            b"acquire", b"othernode", b"myns.myvol"])
+        self.successResultOf(self.script.main(object(), options))
+        return options
+
+    def test_forwarded(self):
+        """
+        If the daemon serves the configured volume manager the subcommand is
+        run there, and the connection is closed afterwards.
+        """
+        client = FakeDaemonClient(u"mynode")
+        self.connect_to(client)
+        self.run_acquire()
+        self.assertEqual(
+            ([FilePath(b"/tmp/v.sock")],
+             [("acquire", u"othernode",
+               VolumeName(namespace=u"myns", dataset_id=u"myvol")),
+              ("close",)],
+             [], b"mynode"),
+            (self.connections, client.calls, self.local.ran,
+             self.stdout.getvalue()))
+
+    def test_no_daemon(self):
+        """
+        If the daemon isn't running the subcommand is run locally.
+        """
+        self.connect_to(None)
+        options = self.run_acquire()
+        self.assertEqual([options], self.local.ran)
+
+    def test_other_node(self):
+        """
+        If the daemon serves another volume manager the subcommand is run
+        locally.
+        """
+        client = FakeDaemonClient(u"othernode")
+        self.connect_to(client)
+        options = self.run_acquire()
+        self.assertEqual(
+            ([("close",)], [options]), (client.calls, self.local.ran))
+
+    def test_no_configuration(self):
+        """
+        If the volume manager hasn't been configured yet the subcommand is run
+        locally without connecting to the daemon.
+        """
+        self.config.remove()
+        self.connect_to(FakeDaemonClient(u"mynode"))
+        options = self.run_acquire()
+        self.assertEqual(([], [options]), (self.connections, self.local.ran))
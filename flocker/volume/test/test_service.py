@@ -16,6 +16,7 @@ from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
 from twisted.application.service import IService, Service
+from twisted.internet.defer import fail, succeed
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath, Permissions
 from twisted.trial.unittest import SynchronousTestCase, TestCase
@@ -28,7 +29,8 @@ from ..service import (
 from ..script import VolumeOptions
 
 from ..filesystems.memory import FilesystemStoragePool
-from ..filesystems.zfs import StoragePool
+from ..filesystems.streams import WriterReceiver
+from ..filesystems.zfs import Snapshot, StoragePool
 from .._ipc import RemoteVolumeManager, LocalVolumeManager
 from ..testtools import create_volume_service
 from ...common import FakeNode
@@ -38,6 +40,28 @@ from ...testtools import (
     )
 
 
+class ResumeRecordingVolumeManager(LocalVolumeManager):
+    """
+    A ``LocalVolumeManager`` which records the ``resume`` argument of each
+    ``receiver`` and optionally overrides the resume token.
+
+    :ivar list resumes: The ``resume`` arguments of ``receiver`` calls.
+    """
+    def __init__(self, service, resume_token=None):
+        LocalVolumeManager.__init__(self, service)
+        self._resume_token = resume_token
+        self.resumes = []
+
+    def resume_token(self, volume):
+        if self._resume_token is not None:
+            return succeed(self._resume_token)
+        return LocalVolumeManager.resume_token(self, volume)
+
+    def receiver(self, volume, resume=False):
+        self.resumes.append(resume)
+        return LocalVolumeManager.receiver(self, volume, resume=resume)
+
+
 class VolumeNameInitializationTests(make_with_init_tests(
         VolumeName, {"namespace": u"x", "dataset_id": u"y"})):
     """
@@ -437,9 +461,12 @@ class VolumeServiceAPITests(TestCase):
         with filesystem.reader() as reader:
             data = reader.read()
         node = FakeNode([
-            # Hard-code the knowledge that first `flocker-volume snapshots` is
-            # run.  It doesn't need to produce any particular output for this
-            # test, it just needs to not fail.
+            # Hard-code the knowledge that first `flocker-volume resume_token`
+            # and then `flocker-volume snapshots` are run, the latter again
+            # after the data was written.  They don't need to produce any
+            # particular output for this test, they just need to not fail.
+            b"",
+            b"",
             b"",
         ])
 
@@ -461,8 +488,14 @@ class VolumeServiceAPITests(TestCase):
             def snapshots(self, volume):
                 return volume.get_filesystem().snapshots()
 
+            def resume_token(self, volume):
+                return succeed(None)
+
+            def receiver(self, volume, resume=False):
+                return succeed(WriterReceiver(self._receive()))
+
             @contextmanager
-            def receive(self, volume):
+            def _receive(self):
                 writer = BytesIO()
                 yield writer
                 self.written.append(writer)
@@ -483,6 +516,157 @@ class VolumeServiceAPITests(TestCase):
             [b"incremental stream based on", b"stuff"],
             writer.getvalue().splitlines()[-2:])
 
+    def test_push_resumes_interrupted_push(self):
+        """
+        If the destination has a resume token for the volume then pushing
+        first sends the rest of the interrupted stream and then the latest
+        data.
+        """
+        service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.get_path().child(b"foo").setContent(b"blah")
+        copy = Volume(node_id=volume.node_id, name=MY_VOLUME,
+                      service=to_service)
+        try:
+            with filesystem.reader() as reader:
+                with copy.get_filesystem().writer() as writer:
+                    writer.write(reader.read(100))
+                    raise ZeroDivisionError()
+        except ZeroDivisionError:
+            pass
+        remote_manager = ResumeRecordingVolumeManager(to_service)
+
+        self.successResultOf(service.push(volume, remote_manager))
+
+        self.assertEqual(
+            ([True, False], None, b"blah"),
+            (remote_manager.resumes,
+             self.successResultOf(copy.get_filesystem().resume_token()),
+             copy.get_filesystem().get_path().child(b"foo").getContent()))
+
+    def test_push_invalid_resume_token(self):
+        """
+        If the rest of an interrupted stream can't be generated from the
+        destination's resume token, pushing sends the latest data anyway.
+        """
+        service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume.get_filesystem().get_path().child(b"foo").setContent(b"blah")
+        remote_manager = ResumeRecordingVolumeManager(
+            to_service, resume_token=b"garbage")
+
+        self.successResultOf(service.push(volume, remote_manager))
+
+        copy = Volume(node_id=volume.node_id, name=MY_VOLUME,
+                      service=to_service)
+        # The receiver for the rest of the interrupted stream is aborted
+        # once the token turns out to be invalid.
+        self.assertEqual(
+            ([True, False], b"blah"),
+            (remote_manager.resumes,
+             copy.get_filesystem().get_path().child(b"foo").getContent()))
+
+    def test_push_failed(self):
+        """
+        If the volume's data can't be sent, pushing aborts the destination's
+        receiver, which keeps the partially received data, and fails.
+        """
+        service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        self.patch(filesystem, "send",
+                   lambda consumer, **kwargs: fail(ZeroDivisionError()))
+        self.patch(volume, "get_filesystem", lambda: filesystem)
+
+        pushing = service.push(volume, LocalVolumeManager(to_service))
+
+        copy = Volume(node_id=volume.node_id, name=MY_VOLUME,
+                      service=to_service)
+        self.failureResultOf(pushing, ZeroDivisionError)
+        self.assertEqual(
+            b"0", self.successResultOf(copy.get_filesystem().resume_token()))
+
+    def test_push_records_replicated_snapshots(self):
+        """
+        Once the data was sent, pushing notes the snapshots the destination
+        has with ``IFilesystem.replicated``, so that the basis of the next
+        push to it is kept.
+        """
+        service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        replicated = []
+        self.patch(filesystem, "replicated",
+                   lambda peer, snapshots: replicated.append(
+                       (peer, snapshots)))
+        self.patch(volume, "get_filesystem", lambda: filesystem)
+        destination = LocalVolumeManager(to_service)
+        self.patch(destination, "snapshots",
+                   lambda volume: succeed([Snapshot(name=b"latest")]))
+
+        self.successResultOf(service.push(volume, destination))
+
+        self.assertEqual(
+            [(destination, [Snapshot(name=b"latest")])], replicated)
+
+    def test_push_compressed(self):
+        """
+        Pushing sends the volume's data compressed as stored if the
+        destination's receiver accepts that.
+        """
+        service = create_volume_service(self)
+        to_service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        sends = []
+
+        def send(consumer, **kwargs):
+            sends.append(kwargs[u"compressed"])
+            return fail(ZeroDivisionError())
+        self.patch(filesystem, "send", send)
+        self.patch(volume, "get_filesystem", lambda: filesystem)
+        self.patch(WriterReceiver, "compressed", True)
+
+        pushing = service.push(volume, LocalVolumeManager(to_service))
+
+        self.failureResultOf(pushing, ZeroDivisionError)
+        self.assertEqual([True], sends)
+
+    def test_receiver_local_node_id(self):
+        """
+        ``VolumeService.receiver`` fails with ``ValueError`` for a volume with
+        the same node ID as the service.
+        """
+        service = create_volume_service(self)
+        self.failureResultOf(
+            service.receiver(service.node_id, MY_VOLUME), ValueError)
+
+    def test_receiver_creates_files(self):
+        """
+        ``VolumeService.receiver`` returns an ``IStreamReceiver`` which
+        creates a filesystem with the data written to it once finished.
+        """
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        filesystem = volume.get_filesystem()
+        filesystem.get_path().child(b"afile").setContent(b"lalala")
+        manager_node_id = unicode(uuid4())
+
+        receiver = self.successResultOf(
+            service.receiver(manager_node_id, MY_VOLUME))
+        self.successResultOf(filesystem.send(receiver))
+        self.successResultOf(receiver.finish())
+
+        new_volume = Volume(node_id=manager_node_id, name=MY_VOLUME,
+                            service=service)
+        root = new_volume.get_filesystem().get_path()
+        self.assertEqual(b"lalala", root.child(b"afile").getContent())
+
     def test_receive_local_node_id(self):
         """
         If a volume with the same node ID as the service is received,
@@ -0,0 +1,87 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.volume.filesystems.streams``.
+"""
+
+from io import BytesIO
+from contextlib import contextmanager
+
+from zope.interface.verify import verifyObject
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from ..filesystems.interfaces import IStreamReceiver
+from ..filesystems.streams import StreamAborted, WriterReceiver
+
+
+class PullProducer(object):
+    """
+    A pull producer which produces some chunks and then unregisters itself.
+    """
+    def __init__(self, consumer, chunks):
+        self._consumer = consumer
+        self._chunks = list(chunks)
+
+    def resumeProducing(self):
+        if self._chunks:
+            self._consumer.write(self._chunks.pop(0))
+        else:
+            self._consumer.unregisterProducer()
+
+
+class WriterReceiverTests(SynchronousTestCase):
+    """
+    Tests for ``WriterReceiver``.
+    """
+    def setUp(self):
+        self.file = BytesIO()
+        self.exits = []
+
+        @contextmanager
+        def writer():
+            try:
+                yield self.file
+            except Exception as e:
+                self.exits.append(e)
+                raise
+            else:
+                self.exits.append(None)
+        self.receiver = WriterReceiver(writer())
+
+    def test_interface(self):
+        """
+        ``WriterReceiver`` provides ``IStreamReceiver``.
+        """
+        self.assertTrue(verifyObject(IStreamReceiver, self.receiver))
+
+    def test_write(self):
+        """
+        Data written to the receiver is written to the file.
+        """
+        self.receiver.write(b"abc")
+        self.receiver.write(b"def")
+        self.assertEqual(b"abcdef", self.file.getvalue())
+
+    def test_pull_producer(self):
+        """
+        A registered pull producer is asked for data until it unregisters.
+        """
+        producer = PullProducer(self.receiver, [b"abc", b"def"])
+        self.receiver.registerProducer(producer, False)
+        self.assertEqual(b"abcdef", self.file.getvalue())
+
+    def test_finish(self):
+        """
+        ``WriterReceiver.finish`` exits the writer normally.
+        """
+        self.assertIs(None, self.successResultOf(self.receiver.finish()))
+        self.assertEqual([None], self.exits)
+
+    def test_abort(self):
+        """
+        ``WriterReceiver.abort`` exits the writer with ``StreamAborted``.
+        """
+        self.assertIs(None, self.successResultOf(self.receiver.abort()))
+        [exception] = self.exits
+        self.assertIsInstance(exception, StreamAborted)
@@ -113,6 +113,10 @@ class MutatingProcessNode(ProcessNode):
     def get_output(self, remote_command):
         return ProcessNode.get_output(self, self._mutate(remote_command))
 
+    def spawn(self, reactor, protocol, remote_command):
+        return ProcessNode.spawn(
+            self, reactor, protocol, self._mutate(remote_command))
+
 
 @attributes(["from_service", "to_service", "remote"])
 class ServicePair(object):